@@ -10,6 +10,8 @@ class ParkPassesConfig(AppConfig):
 
     def ready(self):
         if not self.run_once:
+            import parkpasses.components.parks.signals  # noqa: F401
+            import parkpasses.components.passes.signals  # noqa: F401
             from parkpasses.components.users import signals  # noqa: F401
 
         self.run_once = True
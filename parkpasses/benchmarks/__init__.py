@@ -0,0 +1,20 @@
+"""
+    The benchmarks time the hot paths of park passes (checkout, the cron jobs and the internal
+    admin lists) against datasets generated by the parkpasses_generate_dataset command.
+
+    Each benchmark runs with the ledger api client mocked and records (in the extra info of the
+    pytest-benchmark json) the number of queries run and the peak memory allocated as well as
+    the wall time. The benchmarks are not collected by the normal test run.
+
+    Usage: poetry run pytest parkpasses/benchmarks -o python_files="bench_*.py"
+           PARKPASSES_BENCHMARK_DATASET_SIZES=1000,100000,1000000 \\
+               poetry run pytest parkpasses/benchmarks -o python_files="bench_*.py" --reuse-db
+            (the datasets are topped up from the smallest to the largest so --reuse-db saves
+             generating them again)
+
+    To store a baseline and compare a later commit against it:
+
+           poetry run pytest parkpasses/benchmarks -o python_files="bench_*.py" --benchmark-autosave
+           poetry run pytest parkpasses/benchmarks -o python_files="bench_*.py" \\
+               --benchmark-compare --benchmark-compare-fail=mean:10%
+"""
@@ -0,0 +1,42 @@
+import pytest
+from django.contrib.auth.models import AnonymousUser
+from django.db.models import Count
+from django.test import RequestFactory
+
+from parkpasses.benchmarks.utils import run_benchmark
+from parkpasses.components.cart.models import Cart
+from parkpasses.components.cart.utils import CartUtils
+
+
+@pytest.fixture
+def cart(dataset):
+    """The open cart with the most items"""
+    return (
+        Cart.objects.annotate(item_count=Count("items"))
+        .filter(item_count__gt=0)
+        .order_by("-item_count", "id")
+        .first()
+    )
+
+
+@pytest.mark.django_db
+def test_create_order(benchmark, cart):
+    run_benchmark(benchmark, cart.create_order)
+
+
+@pytest.mark.django_db
+def test_create_order_and_save(benchmark, cart):
+    run_benchmark(
+        benchmark,
+        lambda: cart.create_order(
+            save_order_to_db_and_delete_cart=True, invoice_reference="BENCHMARK"
+        ),
+    )
+
+
+@pytest.mark.django_db
+def test_get_ledger_order_lines(benchmark, cart):
+    request = RequestFactory().get("/")
+    request.user = AnonymousUser()
+    request.session = {}
+    run_benchmark(benchmark, lambda: CartUtils.get_ledger_order_lines(request, cart))
@@ -0,0 +1,40 @@
+import io
+from unittest import mock
+
+import pytest
+from django.core.management import call_command
+
+from parkpasses.benchmarks.utils import InternalUser, run_benchmark
+from parkpasses.management.commands.retailers_generate_monthly_invoices import (
+    Command as GenerateMonthlyInvoicesCommand,
+)
+
+
+@pytest.mark.django_db
+def test_process_autorenew_payments(benchmark, dataset):
+    run_benchmark(
+        benchmark,
+        lambda: call_command("pass_process_autorenew_payments", stdout=io.StringIO()),
+        rounds=3,
+    )
+
+
+@pytest.mark.django_db
+def test_generate_monthly_invoices(benchmark, dataset):
+    # The retailer group admin users are ledger email users
+    def get_admin_users(self, retailer_groups):
+        return {
+            retailer_group.id: mock.Mock(emailuser=InternalUser())
+            for retailer_group in retailer_groups
+        }
+
+    with mock.patch.object(
+        GenerateMonthlyInvoicesCommand, "get_admin_users", get_admin_users
+    ):
+        run_benchmark(
+            benchmark,
+            lambda: call_command(
+                "retailers_generate_monthly_invoices", stdout=io.StringIO()
+            ),
+            rounds=3,
+        )
@@ -0,0 +1,21 @@
+import pytest
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from parkpasses.benchmarks.utils import InternalUser, run_benchmark
+from parkpasses.components.passes.api import InternalPassViewSet
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("page_size", [10, 100])
+def test_internal_pass_list(benchmark, dataset, page_size):
+    view = InternalPassViewSet.as_view({"get": "list"})
+
+    def list_passes():
+        request = APIRequestFactory().get(
+            "/api/passes/internal/passes/",
+            {"format": "datatables", "draw": 1, "start": 0, "length": page_size},
+        )
+        force_authenticate(request, user=InternalUser())
+        return view(request).render()
+
+    run_benchmark(benchmark, list_passes)
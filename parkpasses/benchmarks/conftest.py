@@ -0,0 +1,175 @@
+import io
+import itertools
+import os
+import tempfile
+from contextlib import ExitStack
+from decimal import Decimal
+from unittest import mock
+
+import pytest
+from django.conf import settings
+from django.core.management import call_command
+from django.test.utils import override_settings
+from django.utils import timezone
+from ledger_api_client.ledger_models import EmailUserRO as EmailUser
+
+from parkpasses.benchmarks.utils import InlineExecutor
+from parkpasses.components.passes.models import (
+    Pass,
+    PassType,
+    PassTypePricingWindow,
+    PassTypePricingWindowOption,
+)
+from parkpasses.components.retailers.models import RetailerGroup
+
+DATASET_SIZES = [
+    int(size)
+    for size in os.environ.get("PARKPASSES_BENCHMARK_DATASET_SIZES", "1000").split(",")
+]
+
+FIXTURES = [
+    "parkpasses/components/passes/fixtures/pass-types.json",
+    "parkpasses/components/concessions/fixtures/concessions.json",
+    "parkpasses/components/retailers/fixtures/districts.json",
+    "parkpasses/components/parks/fixtures/postcodes.json",
+    "parkpasses/components/parks/fixtures/lgas.json",
+    "parkpasses/components/parks/fixtures/parks.json",
+    "parkpasses/components/parks/fixtures/park-groups.json",
+    "parkpasses/components/parks/fixtures/members.json",
+]
+
+# The durations (in days) and prices of the options created for each pass type
+PASS_TYPE_OPTIONS = {
+    settings.DAY_ENTRY_PASS: [(1, Decimal("15.00"))],
+    settings.HOLIDAY_PASS: [
+        (5, Decimal("25.00")),
+        (14, Decimal("40.00")),
+        (28, Decimal("60.00")),
+    ],
+    settings.ANNUAL_LOCAL_PASS: [(365, Decimal("75.00"))],
+    settings.ALL_PARKS_PASS: [(365, Decimal("120.00"))],
+    settings.GOLD_STAR_PASS: [(365, Decimal("220.00"))],
+    settings.PINJAR_OFF_ROAD_VEHICLE_AREA_ANNUAL_PASS: [(365, Decimal("100.00"))],
+}
+
+
+def get_organisation(organisation_id):
+    return {
+        "status": 200,
+        "data": {
+            "organisation_id": organisation_id,
+            "organisation_name": f"Organisation {organisation_id}",
+            "organisation_abn": f"{organisation_id:011d}",
+        },
+    }
+
+
+def get_email_users(user_ids):
+    return {
+        user_id: EmailUser(
+            id=user_id,
+            email=f"user.{user_id}@example.com",
+            first_name="User",
+            last_name=str(user_id),
+        )
+        for user_id in user_ids
+    }
+
+
+def get_ledger_api_client():
+    invoice_numbers = itertools.count(1)
+    ledger_api_client = mock.MagicMock()
+    ledger_api_client.get_primary_card_token_for_user.return_value = {"primary_card": 1}
+    ledger_api_client.create_basket_session.return_value = "basket-hash|1"
+    ledger_api_client.process_payment_with_token.return_value = {"status": 200}
+    ledger_api_client.process_create_future_invoice.side_effect = lambda *args: {
+        "status": 200,
+        "data": {
+            "order": "1",
+            "basket_id": 1,
+            "invoice": f"BENCHMARK-{next(invoice_numbers)}",
+        },
+    }
+    return ledger_api_client
+
+
+@pytest.fixture(scope="session", autouse=True)
+def mocked_ledger():
+    """Nothing the benchmarks run calls ledger (or libreoffice)"""
+    email_user = mock.MagicMock(DoesNotExist=EmailUser.DoesNotExist)
+    email_user.objects.in_bulk.side_effect = get_email_users
+    autorenew = "parkpasses.management.commands.pass_process_autorenew_payments"
+    invoices = "parkpasses.management.commands.retailers_generate_monthly_invoices"
+    with ExitStack() as stack, tempfile.TemporaryDirectory() as report_root:
+        stack.enter_context(
+            override_settings(
+                CACHES={
+                    "default": {
+                        "BACKEND": "django.core.cache.backends.locmem.LocMemCache"
+                    }
+                },
+                RETAILER_GROUP_REPORT_ROOT=report_root,
+            )
+        )
+        stack.enter_context(
+            mock.patch(
+                "parkpasses.components.retailers.models.get_organisation",
+                get_organisation,
+            )
+        )
+        for module in [autorenew, invoices]:
+            stack.enter_context(
+                mock.patch(f"{module}.ThreadPoolExecutor", InlineExecutor)
+            )
+            stack.enter_context(mock.patch(f"{module}.connection"))
+        stack.enter_context(
+            mock.patch(f"{autorenew}.utils_ledger_api_client", get_ledger_api_client())
+        )
+        stack.enter_context(mock.patch(f"{autorenew}.EmailUser", email_user))
+        stack.enter_context(
+            mock.patch(f"{invoices}.ledger_api_client_utils", get_ledger_api_client())
+        )
+        stack.enter_context(mock.patch(f"{invoices}.convert_to_pdf"))
+        yield
+
+
+def create_reference_data():
+    call_command("loaddata", *FIXTURES, verbosity=0)
+    RetailerGroup.objects.get_or_create(
+        ledger_organisation=settings.PARKPASSES_DEFAULT_SOLD_VIA_ORGANISATION_ID
+    )
+    for pass_type in PassType.objects.all():
+        pricing_window, created = PassTypePricingWindow.objects.get_or_create(
+            name="Default",
+            pass_type=pass_type,
+            defaults={"date_start": timezone.now() - timezone.timedelta(days=1000)},
+        )
+        for duration, price in PASS_TYPE_OPTIONS.get(pass_type.name, []):
+            PassTypePricingWindowOption.objects.get_or_create(
+                pricing_window=pricing_window,
+                duration=duration,
+                defaults={"name": f"{duration} Days", "price": price},
+            )
+
+
+@pytest.fixture(
+    scope="session", params=DATASET_SIZES, ids=lambda size: f"{size}-passes"
+)
+def dataset(request, django_db_setup, django_db_blocker, mocked_ledger):
+    """Tops the database up to the number of purchased passes (the smallest dataset first)"""
+    size = request.param
+    with django_db_blocker.unblock():
+        create_reference_data()
+        passes = Pass.objects.filter(in_cart=False).count()
+        if passes < size:
+            call_command(
+                "parkpasses_generate_dataset",
+                seed=size,
+                passes=size - passes,
+                vouchers=max((size - passes) // 20, 1),
+                carts=max((size - passes) // 100, 10),
+                users=max(size // 4, 100),
+                force=True,
+                stdout=io.StringIO(),
+            )
+    return size
@@ -0,0 +1,63 @@
+import tracemalloc
+from concurrent.futures import Future
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+
+class InlineExecutor:
+    """Runs the work submitted to it straight away (instead of in a thread pool) so that it
+    uses the benchmark's database connection and transaction"""
+
+    def __init__(self, max_workers=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def submit(self, function, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(function(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class InternalUser:
+    """Stands in for a ledger email user who is a superuser"""
+
+    id = 1
+    email = "internal.user@example.com"
+    first_name = "Internal"
+    last_name = "User"
+    is_authenticated = True
+    is_superuser = True
+    is_staff = True
+
+
+def run_benchmark(benchmark, function, rounds=5):
+    """Times the function and records the number of queries it runs and the peak memory it
+    allocates (measured in a separate run so they don't skew the timings).
+
+    Each run is rolled back so every round starts from the same data."""
+
+    def run():
+        with transaction.atomic():
+            result = function()
+            transaction.set_rollback(True)
+        return result
+
+    with CaptureQueriesContext(connection) as queries:
+        tracemalloc.start()
+        try:
+            run()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    benchmark.extra_info["queries"] = len(queries)
+    benchmark.extra_info["peak_memory_kib"] = round(peak / 1024, 1)
+    return benchmark.pedantic(run, rounds=rounds, iterations=1)
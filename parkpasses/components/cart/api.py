@@ -13,6 +13,7 @@ from rest_framework.views import APIView
 from parkpasses.components.cart.models import Cart, CartItem
 from parkpasses.components.cart.serializers import CartItemSerializer, CartSerializer
 from parkpasses.components.cart.utils import CartUtils
+from parkpasses.components.orders.models import Order
 from parkpasses.components.passes.models import Pass
 from parkpasses.components.retailers.models import RetailerGroup
 from parkpasses.helpers import is_customer, is_internal, is_retailer
@@ -87,14 +88,7 @@ class CartView(APIView):
         cart = Cart.get_or_create_cart(request)
         logger.info(f"{cart} retrieved")
 
-        cart_items = []
-        for cart_item in cart.items.all():
-            item = CartUtils.get_serialized_object_by_id_and_content_type(
-                cart_item.object_id, cart_item.content_type.id
-            )
-            item["cart_item_id"] = cart_item.id
-            item["cart_id"] = cart.id
-            cart_items.append(item)
+        cart_items = CartUtils.get_serialized_cart_items(cart)
 
         logger.info(f"Cart items in {cart}: {cart_items}")
 
@@ -234,6 +228,11 @@ class SuccessView(APIView):
                 f"Invoice reference: {invoice_reference} and uuid: {uuid}.",
             )
             if not Cart.objects.filter(uuid=uuid).exists():
+                if Order.objects.filter(uuid=uuid, payment_confirmed=True).exists():
+                    logger.info(
+                        f"Order with uuid: {uuid} has already been created. Returning status.HTTP_200_OK.",
+                    )
+                    return Response(status=status.HTTP_200_OK)
                 return redirect(reverse("user-cart"))
 
             cart = Cart.objects.get(uuid=uuid)
@@ -8,14 +8,14 @@ from decimal import Decimal
 
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 
 from parkpasses.components.cart.utils import CartUtils
 from parkpasses.components.concessions.models import ConcessionUsage
 from parkpasses.components.discount_codes.models import DiscountCodeUsage
 from parkpasses.components.orders.models import Order, OrderItem
-from parkpasses.components.passes.models import Pass, RACDiscountUsage
+from parkpasses.components.passes.models import Pass, PassPdfJob, RACDiscountUsage
 from parkpasses.components.retailers.models import RetailerGroup
 from parkpasses.components.vouchers.models import Voucher, VoucherTransaction
 from parkpasses.ledger_api_utils import retrieve_email_user
@@ -200,23 +200,37 @@ class Cart(models.Model):
         self,
         save_order_to_db_and_delete_cart=False,
         invoice_reference=None,
+        hydrated_items=None,
     ):
         """This method can create an order and order items from a cart (and cart items)
         By default it doesn't add this order to the database. This is so we can use the
         order to submit to leger and wait until that order is confirmed before we add
         the order to the park passes database.
+
+        Saving the order to the database happens in one transaction that locks the cart first
+        so if ledger calls the success callback more than once for the same cart the later calls
+        wait for the first one and then return the order it saved.
+
+        The cart items along with their vouchers and passes can be passed in as hydrated_items
+        if they have already been loaded (see get_hydrated_items). They are always loaded again
+        after the cart is locked when the order is saved.
         """
         logger.info(f"Creating order from cart: {self}")
         logger.info(
             f"Saving order to database = {str(save_order_to_db_and_delete_cart)}"
         )
-        if Order.objects.filter(uuid=self.uuid).exists():
-            logger.info(
-                f"Order with uuid {self.uuid} already exists.",
-            )
-            order = Order.objects.get(uuid=self.uuid)
+        if save_order_to_db_and_delete_cart:
+            if not self.uuid or not invoice_reference:
+                raise ValueError(
+                    "If save_order_to_db_and_delete_cart is True then \
+                    the cart must have a uuid and an invoice_reference must be passed in."
+                )
+            return self.save_order(invoice_reference)
+
+        order = Order.objects.filter(uuid=self.uuid).first()
+        if order:
             logger.info(
-                f"Order: {str(order)} selected.",
+                f"Order: {str(order)} with uuid {self.uuid} selected.",
             )
             order.user = self.user
         else:
@@ -224,30 +238,159 @@ class Cart(models.Model):
                 f"Order with uuid {self.uuid} doesn't exist.",
             )
             order = Order(user=self.user)
-            logger.info(
-                f"Order {str(order)} created.",
-            )
 
-        order_items = []
-        if save_order_to_db_and_delete_cart:
-            if not self.uuid or not invoice_reference:
-                raise ValueError(
-                    "If save_order_to_db_and_delete_cart is True then \
-                    the cart must have a uuid and an invoice_reference must be passed in."
+        if hydrated_items is None:
+            hydrated_items = self.get_hydrated_items()
+        order_items = self.get_order_items(order, hydrated_items)
+        logger.info(f"Returning order {order} and order items.")
+        return order, order_items
+
+    def save_order(self, invoice_reference):
+        with transaction.atomic():
+            cart_exists = bool(
+                Cart.objects.select_for_update()
+                .prefetch_related(None)
+                .filter(pk=self.pk)
+                .values_list("pk", flat=True)
+            )
+            order = Order.objects.filter(uuid=self.uuid).first()
+            if order and order.payment_confirmed:
+                logger.info(
+                    f"Order {order} for cart with uuid {self.uuid} has already been saved.",
                 )
+                return order, list(order.items.all())
+            if not cart_exists:
+                raise Cart.DoesNotExist(
+                    f"Cart with uuid {self.uuid} no longer exists and has no saved order."
+                )
+
             logger.info("Populating Order")
-            order.uuid = self.uuid
+            if order:
+                # Left over from an attempt that did not finish
+                order.items.all().delete()
+            else:
+                order = Order(uuid=self.uuid)
+            order.user = self.user
             order.invoice_reference = invoice_reference
             order.is_no_payment = self.is_no_payment
             if self.retailer_group:
                 order.retailer_group = self.retailer_group
             else:
                 order.retailer_group = RetailerGroup.get_dbca_retailer_group()
+            order.payment_confirmed = True
             order.save()
+
             logger.info(
                 "Transferring cart items to order items.",
             )
-        for cart_item in self.items.all():
+            hydrated_items = self.get_hydrated_items()
+            order_items = OrderItem.objects.bulk_create(
+                self.get_order_items(order, hydrated_items)
+            )
+            logger.info(f"{len(order_items)} order items saved.")
+
+            vouchers = []
+            park_passes = []
+            for cart_item, purchase in hydrated_items:
+                purchase.in_cart = False
+                if cart_item.is_voucher_purchase():
+                    vouchers.append(purchase)
+                else:
+                    # Store the pricing so it doesn't have to be worked out again every time it is displayed
+                    purchase.set_stored_prices()
+                    purchase.processing_status = (
+                        Pass.CANCELLED if purchase.is_cancelled else Pass.VALID
+                    )
+                    if purchase.requires_park_pass_pdf():
+                        purchase.pdf_status = Pass.PDF_STATUS_PENDING
+                    park_passes.append(purchase)
+
+            Voucher.objects.bulk_update(vouchers, ["in_cart"])
+            Pass.objects.bulk_update(
+                park_passes,
+                ["in_cart", "processing_status", "pdf_status"]
+                + Pass.STORED_PRICE_FIELDS,
+            )
+            PassPdfJob.enqueue_many(
+                [
+                    park_pass
+                    for park_pass in park_passes
+                    if Pass.PDF_STATUS_PENDING == park_pass.pdf_status
+                ]
+            )
+
+            logger.info(f"Deleting Cart {self}.")
+            self.delete()
+            logger.info("Cart Deleted.")
+
+            # The pass pdfs (and the purchased emails that go with them) are generated by the
+            # pass_process_pdf_jobs management command once the jobs above are committed
+            transaction.on_commit(lambda: Cart.send_voucher_emails(vouchers))
+
+        logger.info(f"Returning order {order} and order items.")
+        return order, order_items
+
+    @classmethod
+    def send_voucher_emails(self, vouchers):
+        for voucher in vouchers:
+            try:
+                voucher.send_notification_emails()
+            except Exception as e:
+                logger.exception(
+                    f"Failed to send the notification emails for voucher {voucher}: {e}"
+                )
+            Voucher.objects.filter(pk=voucher.pk).update(
+                processing_status=voucher.processing_status
+            )
+
+    def get_hydrated_items(self):
+        """Returns (cart item, voucher or pass) for each item in the cart loading the vouchers
+        and the passes (along with their concession, discount code and voucher usages) in one
+        query each rather than one query per cart item
+
+        This is used to build the cart page, the ledger order lines and the order so each of
+        them runs the same number of queries however many items are in the cart."""
+        cart_items = list(
+            self.items.select_related(
+                "content_type",
+                "rac_discount_usage",
+                "concession_usage__concession",
+                "discount_code_usage__discount_code__discount_code_batch",
+                "voucher_transaction__voucher",
+            )
+        )
+        voucher_content_type = ContentType.objects.get_for_model(Voucher)
+        voucher_ids = []
+        park_pass_ids = []
+        for cart_item in cart_items:
+            if voucher_content_type.id == cart_item.content_type_id:
+                voucher_ids.append(cart_item.object_id)
+            else:
+                park_pass_ids.append(cart_item.object_id)
+        vouchers = Voucher.objects.in_bulk(voucher_ids) if voucher_ids else {}
+        park_passes = (
+            Pass.objects.with_usages().in_bulk(park_pass_ids) if park_pass_ids else {}
+        )
+
+        hydrated_items = []
+        for cart_item in cart_items:
+            if voucher_content_type.id == cart_item.content_type_id:
+                model, purchases = Voucher, vouchers
+            else:
+                model, purchases = Pass, park_passes
+            purchase = purchases.get(int(cart_item.object_id))
+            if purchase is None:
+                raise model.DoesNotExist(
+                    f"{model.__name__} with id {cart_item.object_id} in cart item {cart_item.pk} does not exist."
+                )
+            hydrated_items.append((cart_item, purchase))
+        return hydrated_items
+
+    def get_order_items(self, order, hydrated_items):
+        """Returns the (unsaved) order items for the cart items and their vouchers or passes
+        (see get_hydrated_items)"""
+        order_items = []
+        for cart_item, purchase in hydrated_items:
             logger.info(
                 f"Creating new order item with data from cart item: {cart_item}.",
             )
@@ -260,207 +403,154 @@ class Cart(models.Model):
                 logger.info(
                     "Cart item is a voucher purchase.",
                 )
-                voucher = Voucher.objects.get(pk=cart_item.object_id)
+                voucher = purchase
                 order_item.description = CartUtils.get_voucher_purchase_description(
                     voucher.voucher_number
                 )
                 order_item.amount = voucher.amount
                 order_items.append(order_item)
-                if save_order_to_db_and_delete_cart:
-                    voucher.in_cart = False
-                    voucher.save()
-                    order_item.save()
-                    logger.info(
-                        f"Order item {order_item} saved.",
-                    )
+                continue
 
-            else:
+            logger.info(
+                "Cart item is a park pass purchase.",
+            )
+            park_pass = purchase
+            order_item.description = CartUtils.get_pass_purchase_description(
+                park_pass.pass_number
+            )
+            order_item.amount = park_pass.option.price
+            order_items.append(order_item)
+
+            if cart_item.rac_discount_usage:
                 logger.info(
-                    "Cart item is a park pass purchase.",
-                )
-                park_pass = Pass.objects.get(pk=cart_item.object_id)
-                order_item.description = CartUtils.get_pass_purchase_description(
-                    park_pass.pass_number
+                    f"RAC Discount Usage exists for cart_item {cart_item}.",
                 )
-                order_item.amount = park_pass.option.price
-                order_items.append(order_item)
-                if save_order_to_db_and_delete_cart:
-                    park_pass.in_cart = False
-                    park_pass.save()
-                    order_item.save()
+                # A RAC discount is being applied to this pass purchase
+                rac_discount_amount = cart_item.rac_discount_usage.discount_amount
+                if rac_discount_amount > Decimal(0.00):
                     logger.info(
-                        f"Order item {order_item} saved.",
+                        "RAC discount is greater than 0.00. Proceeding.",
                     )
-
-                if cart_item.rac_discount_usage:
+                    order_item = OrderItem()
+                    order_item.order = order
+                    order_item.description = CartUtils.get_rac_discount_description()
                     logger.info(
-                        f"RAC Discount Usage exists for cart_item {cart_item}.",
+                        f"RAC order item description: {order_item.description}",
                     )
-                    # A RAC discount is being applied to this pass purchase
-                    rac_discount_amount = cart_item.rac_discount_usage.discount_amount
-                    if rac_discount_amount > Decimal(0.00):
-                        logger.info(
-                            "RAC discount is greater than 0.00. Proceeding.",
-                        )
-                        order_item = OrderItem()
-                        order_item.order = order
-                        order_item.description = (
-                            CartUtils.get_rac_discount_description()
-                        )
-                        logger.info(
-                            f"RAC order item description: {order_item.description}",
-                        )
-                        order_item.amount = -abs(rac_discount_amount)
-                        # Give the rac discount usage the same oracle code as the pass that it is attached to
-                        order_item.oracle_code = cart_item.oracle_code
-                        order_items.append(order_item)
-                        if save_order_to_db_and_delete_cart:
-                            order_item.save()
-                            logger.info(
-                                f"Order item {order_item} saved.",
-                            )
-                elif cart_item.concession_usage:
+                    order_item.amount = -abs(rac_discount_amount)
+                    # Give the rac discount usage the same oracle code as the pass that it is attached to
+                    order_item.oracle_code = cart_item.oracle_code
+                    order_items.append(order_item)
+            elif cart_item.concession_usage:
+                logger.info(
+                    f"Concession Usage exists for cart_item {cart_item}.",
+                )
+                # A concession discount is being applied to this pass purchase
+                concession = cart_item.concession_usage.concession
+                concession_discount = concession.discount_as_amount(
+                    park_pass.option.price
+                )
+                if concession_discount > Decimal(0.00):
                     logger.info(
-                        f"Concession Usage exists for cart_item {cart_item}.",
+                        "Concession discount is greater than 0.00. Proceeding.",
                     )
-                    # A concession discount is being applied to this pass purchase
-                    concession = cart_item.concession_usage.concession
-                    concession_discount = concession.discount_as_amount(
-                        park_pass.option.price
+                    order_item = OrderItem()
+                    order_item.order = order
+                    order_item.description = CartUtils.get_concession_description(
+                        concession.concession_type
                     )
-                    if concession_discount > Decimal(0.00):
-                        logger.info(
-                            "Concession discount is greater than 0.00. Proceeding.",
-                        )
-                        order_item = OrderItem()
-                        order_item.order = order
-                        order_item.description = CartUtils.get_concession_description(
-                            concession.concession_type
-                        )
-                        logger.info(
-                            f"Concession order item description: {order_item.description}",
-                        )
-
-                        # The ledger checkout doesn't round a negative balance to zero so in order to avoid
-                        # processing a refund we have to make sure the discount is no more than the total pass price
-                        if concession_discount >= park_pass.price:
-                            order_item.amount = -abs(
-                                park_pass.price.quantize(Decimal("0.01"))
-                            )
-                        else:
-                            order_item.amount = -abs(
-                                concession_discount.quantize(Decimal("0.01"))
-                            )
-                        logger.info(
-                            f"Concession order item amount: {order_item.amount}",
-                        )
-                        # Give the concession usage the same oracle code as the pass that it is attached to
-                        order_item.oracle_code = cart_item.oracle_code
-
-                        order_items.append(order_item)
-                        logger.info(
-                            "Concession order item appended to order items.",
-                        )
-                        if save_order_to_db_and_delete_cart:
-                            order_item.save()
-                            logger.info(
-                                f"Concession order item saved: {order_item}.",
-                            )
-
-                if cart_item.discount_code_usage:
                     logger.info(
-                        f"Discount Code Usage exists for cart_item {cart_item}.",
-                    )
-                    # A discount code is being applied to this pass purchase
-                    discount_code_discount = (
-                        cart_item.get_discount_code_discount_as_amount()
+                        f"Concession order item description: {order_item.description}",
                     )
-                    if discount_code_discount > 0.00:
-                        logger.info(
-                            "Discount Code discount is greater than 0.00. Proceeding.",
-                        )
-                        order_item = OrderItem()
-                        order_item.order = order
-                        order_item.description = (
-                            CartUtils.get_discount_code_description(
-                                cart_item.discount_code_usage.discount_code.code
-                            )
-                        )
-                        logger.info(
-                            f"Discount Code order item description: {order_item.description}",
-                        )
 
-                        # The ledger checkout doesn't round a negative balance to zero so in order to avoid
-                        # processing a refund we have to make sure the discount is no more than the total pass price
-                        if discount_code_discount >= park_pass.price:
-                            order_item.amount = -abs(
-                                park_pass.price.quantize(Decimal("0.01"))
-                            )
-                        else:
-                            order_item.amount = -abs(
-                                discount_code_discount.quantize(Decimal("0.01"))
-                            )
-                        logger.info(
-                            f"Discount Code order item amount: {order_item.amount}",
+                    # The ledger checkout doesn't round a negative balance to zero so in order to avoid
+                    # processing a refund we have to make sure the discount is no more than the total pass price
+                    if concession_discount >= park_pass.price:
+                        order_item.amount = -abs(
+                            park_pass.price.quantize(Decimal("0.01"))
                         )
-                        # Give the discount code usage the same oracle code as the pass that it is attached to
-                        order_item.oracle_code = cart_item.oracle_code
-
-                        order_items.append(order_item)
-                        logger.info(
-                            "Discount Code order item appended to order items.",
+                    else:
+                        order_item.amount = -abs(
+                            concession_discount.quantize(Decimal("0.01"))
                         )
+                    logger.info(
+                        f"Concession order item amount: {order_item.amount}",
+                    )
+                    # Give the concession usage the same oracle code as the pass that it is attached to
+                    order_item.oracle_code = cart_item.oracle_code
 
-                        if save_order_to_db_and_delete_cart:
-                            order_item.save()
-                            logger.info(
-                                f"Discount Code order item saved: {order_item}.",
-                            )
-
-                if cart_item.voucher_transaction:
+                    order_items.append(order_item)
                     logger.info(
-                        f"Voucher Transaction exists for cart_item {cart_item}.",
+                        "Concession order item appended to order items.",
                     )
-                    # A voucher is being used for this pass purchase
-                    voucher_transaction_balance = (
-                        cart_item.voucher_transaction.balance()
+            if cart_item.discount_code_usage:
+                logger.info(
+                    f"Discount Code Usage exists for cart_item {cart_item}.",
+                )
+                # A discount code is being applied to this pass purchase
+                discount_code_discount = cart_item.get_discount_code_discount_as_amount(
+                    park_pass.price
+                )
+                if discount_code_discount > 0.00:
+                    logger.info(
+                        "Discount Code discount is greater than 0.00. Proceeding.",
                     )
                     order_item = OrderItem()
                     order_item.order = order
-                    order_item.description = CartUtils.get_voucher_code_description(
-                        cart_item.voucher_transaction.voucher.code
+                    order_item.description = CartUtils.get_discount_code_description(
+                        cart_item.discount_code_usage.discount_code.code
                     )
                     logger.info(
-                        f"Voucher transaction order item description: {order_item.description}",
+                        f"Discount Code order item description: {order_item.description}",
                     )
 
-                    order_item.amount = voucher_transaction_balance.quantize(
-                        Decimal("0.01")
-                    )
+                    # The ledger checkout doesn't round a negative balance to zero so in order to avoid
+                    # processing a refund we have to make sure the discount is no more than the total pass price
+                    if discount_code_discount >= park_pass.price:
+                        order_item.amount = -abs(
+                            park_pass.price.quantize(Decimal("0.01"))
+                        )
+                    else:
+                        order_item.amount = -abs(
+                            discount_code_discount.quantize(Decimal("0.01"))
+                        )
                     logger.info(
-                        f"Voucher transaction order item amount: {order_item.amount}",
+                        f"Discount Code order item amount: {order_item.amount}",
                     )
+                    # Give the discount code usage the same oracle code as the pass that it is attached to
+                    order_item.oracle_code = cart_item.oracle_code
 
-                    order_item.oracle_code = (
-                        settings.PARKPASSES_DEFAULT_VOUCHER_ORACLE_CODE
+                    order_items.append(order_item)
+                    logger.info(
+                        "Discount Code order item appended to order items.",
                     )
 
-                    order_items.append(order_item)
-                    if save_order_to_db_and_delete_cart:
-                        order_item.save()
-                        logger.info(
-                            f"Voucher transaction order item saved: {order_item}.",
-                        )
+            if cart_item.voucher_transaction:
+                logger.info(
+                    f"Voucher Transaction exists for cart_item {cart_item}.",
+                )
+                # A voucher is being used for this pass purchase
+                voucher_transaction_balance = cart_item.voucher_transaction.balance()
+                order_item = OrderItem()
+                order_item.order = order
+                order_item.description = CartUtils.get_voucher_code_description(
+                    cart_item.voucher_transaction.voucher.code
+                )
+                logger.info(
+                    f"Voucher transaction order item description: {order_item.description}",
+                )
 
-        if save_order_to_db_and_delete_cart:
-            order.payment_confirmed = True
-            order.save()
-            logger.info(f"Deleting Cart {self}.")
-            self.delete()
-            logger.info("Cart Deleted.")
+                order_item.amount = voucher_transaction_balance.quantize(
+                    Decimal("0.01")
+                )
+                logger.info(
+                    f"Voucher transaction order item amount: {order_item.amount}",
+                )
 
-        logger.info(f"Returning order {order} and order items.")
-        return order, order_items
+                order_item.oracle_code = settings.PARKPASSES_DEFAULT_VOUCHER_ORACLE_CODE
+
+                order_items.append(order_item)
+        return order_items
 
     def save(self, *args, **kwargs):
         logger.info(f"Saving Cart: {self}.")
@@ -688,10 +778,11 @@ class CartItem(models.Model):
         total_price = self.get_price_before_discounts()
         return Decimal(total_price * (concession.discount_percentage / 100))
 
-    def get_discount_code_discount_as_amount(self):
+    def get_discount_code_discount_as_amount(self, price_before_discounts=None):
         if not self.discount_code_usage:
             return Decimal(0.00)
-        price_before_discounts = self.get_price_before_discounts()
+        if price_before_discounts is None:
+            price_before_discounts = self.get_price_before_discounts()
         discount_code_batch = self.discount_code_usage.discount_code.discount_code_batch
         if discount_code_batch.discount_amount:
             return (
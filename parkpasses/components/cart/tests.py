@@ -1,9 +1,32 @@
+import io
+from decimal import Decimal
+from unittest import mock
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.db import connection
 from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from ledger_api_client.ledger_models import EmailUserRO
 from rest_framework.test import force_authenticate
 
-from parkpasses.components.cart.models import Cart
+from parkpasses.components.cart.models import Cart, CartItem
+from parkpasses.components.orders.models import Order, OrderItem
+from parkpasses.components.passes.models import (
+    Pass,
+    PassPdfJob,
+    PassType,
+    PassTypePricingWindow,
+    PassTypePricingWindowOption,
+)
+from parkpasses.components.retailers.models import RetailerGroup
+from parkpasses.components.vouchers.models import Voucher, VoucherTransaction
+from parkpasses.management.commands.clear_expired_sessions import (
+    Command as ClearExpiredSessionsCommand,
+)
 
 User = get_user_model()
 
@@ -28,3 +51,234 @@ class CartTestCase(TestCase):
         cart_str = self.cart1.__str__()
         self.assertEqual(cart_str, f"Cart for user: 1 (Created: {datetime_created})")
         self.assertNotEqual(cart_str, "Random Name")
+
+
+class CreateOrderTestCase(TestCase):
+    fixtures = ["parkpasses/components/passes/fixtures/pass-types.json"]
+
+    def setUp(self):
+        today = timezone.now()
+        pricing_window = PassTypePricingWindow.objects.create(
+            name="Default",
+            pass_type=PassType.objects.get(name=settings.HOLIDAY_PASS),
+            date_start=today,
+        )
+        self.option = PassTypePricingWindowOption.objects.create(
+            pricing_window=pricing_window,
+            name="Option 1",
+            duration=5,
+            price=Decimal("10.00"),
+        )
+        self.sold_via, created = RetailerGroup.objects.get_or_create(
+            ledger_organisation=settings.PARKPASSES_DEFAULT_SOLD_VIA_ORGANISATION_ID
+        )
+        self.cart = Cart.objects.create(user=1)
+        self.park_pass = self.add_park_pass_to_cart()
+
+    def add_park_pass_to_cart(self):
+        park_pass = Pass.objects.create(
+            user=1,
+            option=self.option,
+            first_name="Test",
+            last_name="User",
+            email="test.user@gmail.com",
+            vehicle_registration_1="12312312",
+            date_start=timezone.now().date(),
+            sold_via=self.sold_via,
+        )
+        CartItem.objects.create(
+            cart=self.cart,
+            object_id=park_pass.id,
+            content_type=ContentType.objects.get_for_model(Pass),
+        )
+        return park_pass
+
+    def test_hydrated_items_load_in_a_constant_number_of_queries(self):
+        with CaptureQueriesContext(connection) as one_item_queries:
+            self.cart.get_hydrated_items()
+        self.add_park_pass_to_cart()
+        self.add_park_pass_to_cart()
+        with CaptureQueriesContext(connection) as three_item_queries:
+            hydrated_items = self.cart.get_hydrated_items()
+        self.assertEqual(len(hydrated_items), 3)
+        self.assertEqual(len(three_item_queries), len(one_item_queries))
+        with self.assertNumQueries(0):
+            order_items = self.cart.get_order_items(Order(user=1), hydrated_items)
+        self.assertEqual(len(order_items), 3)
+
+    def test_create_order_saves_the_order(self):
+        order, order_items = self.cart.create_order(
+            save_order_to_db_and_delete_cart=True, invoice_reference="00000001"
+        )
+        self.assertTrue(order.payment_confirmed)
+        self.assertEqual(order.items.count(), 1)
+        self.assertEqual(order.total, Decimal("10.00"))
+        self.park_pass.refresh_from_db()
+        self.assertFalse(self.park_pass.in_cart)
+        self.assertEqual(self.park_pass.price_paid, Decimal("10.00"))
+        self.assertEqual(self.park_pass.pdf_status, Pass.PDF_STATUS_PENDING)
+        self.assertTrue(PassPdfJob.objects.filter(park_pass=self.park_pass).exists())
+        self.assertFalse(Cart.objects.filter(pk=self.cart.pk).exists())
+
+    def test_create_order_is_idempotent(self):
+        order, order_items = self.cart.create_order(
+            save_order_to_db_and_delete_cart=True, invoice_reference="00000001"
+        )
+        duplicate_order, duplicate_order_items = self.cart.create_order(
+            save_order_to_db_and_delete_cart=True, invoice_reference="00000001"
+        )
+        self.assertEqual(duplicate_order, order)
+        self.assertEqual(len(duplicate_order_items), 1)
+        self.assertEqual(Order.objects.filter(uuid=self.cart.uuid).count(), 1)
+        self.assertEqual(OrderItem.objects.filter(order=order).count(), 1)
+
+
+class ClearExpiredSessionsTestCase(TestCase):
+    fixtures = ["parkpasses/components/passes/fixtures/pass-types.json"]
+
+    def setUp(self):
+        today = timezone.now()
+        pricing_window = PassTypePricingWindow.objects.create(
+            name="Default",
+            pass_type=PassType.objects.get(name=settings.HOLIDAY_PASS),
+            date_start=today,
+        )
+        self.option = PassTypePricingWindowOption.objects.create(
+            pricing_window=pricing_window,
+            name="Option 1",
+            duration=5,
+            price=Decimal("10.00"),
+        )
+        self.sold_via, created = RetailerGroup.objects.get_or_create(
+            ledger_organisation=settings.PARKPASSES_DEFAULT_SOLD_VIA_ORGANISATION_ID
+        )
+        self.paying_voucher = self.create_voucher()
+        self.pass_content_type = ContentType.objects.get_for_model(Pass)
+        self.voucher_content_type = ContentType.objects.get_for_model(Voucher)
+
+    def create_voucher(self):
+        return Voucher.objects.create(
+            purchaser=1,
+            recipient_name="John Smith",
+            recipient_email="john.smith@totallymadeupmailserver.com",
+            datetime_to_email=timezone.now() + timezone.timedelta(days=30),
+            personal_message="A very personal message.",
+            amount=Decimal("50.00"),
+        )
+
+    def create_cart(self, days_since_last_added_to, in_cart=True):
+        """Creates a cart with a park pass (paid for in part with a voucher) and a voucher"""
+        cart = Cart.objects.create(
+            user=1,
+            datetime_last_added_to=timezone.now()
+            - timezone.timedelta(days=days_since_last_added_to),
+        )
+        park_pass = Pass.objects.create(
+            user=1,
+            option=self.option,
+            first_name="Test",
+            last_name="User",
+            email="test.user@gmail.com",
+            vehicle_registration_1="12312312",
+            date_start=timezone.now().date(),
+            sold_via=self.sold_via,
+            in_cart=in_cart,
+        )
+        voucher_transaction = VoucherTransaction.objects.create(
+            voucher=self.paying_voucher,
+            park_pass=park_pass,
+            credit=Decimal("0.00"),
+            debit=Decimal("5.00"),
+        )
+        CartItem.objects.create(
+            cart=cart,
+            object_id=park_pass.id,
+            content_type=self.pass_content_type,
+            voucher_transaction=voucher_transaction,
+        )
+        voucher = self.create_voucher()
+        CartItem.objects.create(
+            cart=cart, object_id=voucher.id, content_type=self.voucher_content_type
+        )
+        return cart, park_pass, voucher
+
+    def clear_expired_sessions(self, *args):
+        stdout = io.StringIO()
+        call_command("clear_expired_sessions", *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_expired_carts_are_cleared(self):
+        expired_cart, expired_pass, expired_voucher = self.create_cart(15)
+        cart, park_pass, voucher = self.create_cart(1)
+
+        output = self.clear_expired_sessions()
+
+        self.assertIn("Deleted 1 carts", output)
+        self.assertFalse(Cart.objects.filter(pk=expired_cart.pk).exists())
+        self.assertFalse(CartItem.objects.filter(cart_id=expired_cart.pk).exists())
+        self.assertFalse(Pass.objects.filter(pk=expired_pass.pk).exists())
+        self.assertFalse(
+            VoucherTransaction.objects.filter(park_pass_id=expired_pass.pk).exists()
+        )
+        self.assertFalse(Voucher.objects.filter(pk=expired_voucher.pk).exists())
+        # The cart that was added to recently is left alone
+        self.assertEqual(cart.items.count(), 2)
+        self.assertTrue(Pass.objects.filter(pk=park_pass.pk).exists())
+        self.assertTrue(
+            VoucherTransaction.objects.filter(park_pass_id=park_pass.pk).exists()
+        )
+        self.assertTrue(Voucher.objects.filter(pk=voucher.pk).exists())
+
+    def test_purchased_passes_are_kept(self):
+        expired_cart, purchased_pass, expired_voucher = self.create_cart(
+            15, in_cart=False
+        )
+
+        self.clear_expired_sessions()
+
+        self.assertFalse(Cart.objects.filter(pk=expired_cart.pk).exists())
+        self.assertTrue(Pass.objects.filter(pk=purchased_pass.pk).exists())
+        self.assertTrue(
+            VoucherTransaction.objects.filter(park_pass_id=purchased_pass.pk).exists()
+        )
+
+    def test_dry_run_deletes_nothing(self):
+        self.create_cart(15)
+        self.create_cart(15)
+
+        output = self.clear_expired_sessions("--dry-run")
+
+        self.assertIn("DRY RUN: would delete 2 carts", output)
+        self.assertIn("DRY RUN: would delete 4 cart items", output)
+        self.assertIn("DRY RUN: would delete 2 Passes", output)
+        self.assertIn("DRY RUN: would delete 2 voucher transactions", output)
+        self.assertIn("DRY RUN: would delete 2 vouchers", output)
+        self.assertEqual(Cart.objects.count(), 2)
+        self.assertEqual(CartItem.objects.count(), 4)
+        self.assertEqual(Pass.objects.count(), 2)
+        self.assertEqual(VoucherTransaction.objects.count(), 2)
+        # The two vouchers in the carts and the voucher that paid for the passes
+        self.assertEqual(Voucher.objects.count(), 3)
+
+    def test_expired_carts_are_cleared_in_batches(self):
+        for i in range(3):
+            self.create_cart(15)
+
+        with mock.patch.object(
+            ClearExpiredSessionsCommand,
+            "get_cart_related_querysets",
+            autospec=True,
+            side_effect=ClearExpiredSessionsCommand.get_cart_related_querysets,
+        ) as get_cart_related_querysets:
+            output = self.clear_expired_sessions("--batch-size", "2")
+
+        self.assertEqual(
+            [len(call.args[1]) for call in get_cart_related_querysets.call_args_list],
+            [2, 1],
+        )
+        self.assertIn("Deleted 3 carts", output)
+        self.assertIn("Deleted 3 Passes", output)
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(CartItem.objects.exists())
+        self.assertFalse(Pass.objects.exists())
+        self.assertEqual(list(Voucher.objects.all()), [self.paying_voucher])
@@ -4,7 +4,8 @@ from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 
 from parkpasses.components.passes.exceptions import NoOracleCodeFoundForCartItem
-from parkpasses.components.passes.models import DistrictPassTypeDurationOracleCode, Pass
+from parkpasses.components.passes.models import Pass
+from parkpasses.components.passes.oracle_codes import OracleCodeResolver
 from parkpasses.components.passes.serializers import ExternalPassSerializer
 from parkpasses.components.retailers.models import RetailerGroupUser
 from parkpasses.components.vouchers.models import Voucher
@@ -16,14 +17,22 @@ logger = logging.getLogger(__name__)
 
 class CartUtils:
     @classmethod
-    def get_serialized_object_by_id_and_content_type(self, object_id, content_type_id):
-        content_type = ContentType.objects.get(id=content_type_id)
-        if "parkpasses | voucher" == str(content_type):
-            voucher = Voucher.objects.get(id=object_id)
-            return ExternalListVoucherSerializer(voucher).data
-        if "parkpasses | pass" == str(content_type):
-            park_pass = Pass.objects.get(id=object_id)
-            return ExternalPassSerializer(park_pass).data
+    def get_serialized_cart_items(self, cart, hydrated_items=None):
+        """Serializes the vouchers and passes in a cart (see Cart.get_hydrated_items)"""
+        if hydrated_items is None:
+            hydrated_items = cart.get_hydrated_items()
+        # Shared so the purchaser and sold via lookups are only done once per cart
+        context = {}
+        serialized_cart_items = []
+        for cart_item, purchase in hydrated_items:
+            if cart_item.is_voucher_purchase():
+                item = ExternalListVoucherSerializer(purchase, context=context).data
+            else:
+                item = ExternalPassSerializer(purchase, context=context).data
+            item["cart_item_id"] = cart_item.id
+            item["cart_id"] = cart.id
+            serialized_cart_items.append(item)
+        return serialized_cart_items
 
     @classmethod
     def get_ledger_order_lines(self, request, cart):
@@ -35,14 +44,28 @@ class CartUtils:
 
         previous_item_oracle_code = None
 
-        order, order_items = cart.create_order()
+        hydrated_items = cart.get_hydrated_items()
+        park_passes = {
+            cart_item.object_id: purchase
+            for cart_item, purchase in hydrated_items
+            if cart_item.is_pass_purchase()
+        }
+        order, order_items = cart.create_order(hydrated_items=hydrated_items)
         for order_item in order_items:
             if settings.DEBUG:
                 order_item.amount = int(order_item.amount)
                 order_item.description += " (Price rounded for dev env)"
 
+            content_type = None
+            if order_item.content_type_id:
+                content_type = ContentType.objects.get_for_id(
+                    order_item.content_type_id
+                )
             oracle_code = CartUtils.get_oracle_code(
-                request, order_item.content_type, order_item.object_id
+                request,
+                content_type,
+                order_item.object_id,
+                park_pass=park_passes.get(order_item.object_id),
             )
             if oracle_code:
                 previous_item_oracle_code = oracle_code
@@ -117,7 +140,7 @@ class CartUtils:
         }
 
     @classmethod
-    def get_oracle_code(self, request, content_type, object_id):
+    def get_oracle_code(self, request, content_type, object_id, park_pass=None):
         """
         There are two main ways that the system determines the oracle code to be used for a
         park pass purchase. The first is if the sale is via a retailer or not. If it is via a retailer
@@ -130,6 +153,8 @@ class CartUtils:
         If they are not a retailer then the sale must be online via the website, in this case,
         the system will use a PICA oracle code. If the pass type is a local park pass then the
         system will use the pica oracle code for the park group that the pass is for.
+
+        The codes themselves are looked up in memory by the OracleCodeResolver.
         """
         logger.info(
             f"Calling get_oracle_code with content_type: {content_type} and object_id: {object_id}"
@@ -141,73 +166,40 @@ class CartUtils:
         if content_type is None or object_id is None:
             return None
 
-        # Check if the pass is being sold via a retailer
-        if is_retailer(request):
-            logger.info(
-                "User is a retailer.",
-            )
-            user = request.user
-            retailer_group_user = (
-                RetailerGroupUser.objects.filter(emailuser=user)
-                .order_by("-datetime_created")
-                .first()
-            )
-            if retailer_group_user:
-                logger.info(
-                    f"Retailer Group User: {retailer_group_user} exists.",
-                )
-                retailer_group = retailer_group_user.retailer_group
-                district = retailer_group.district
-                # Retailers can only sell passes, not vouchers so we know the content type is a pass
-                park_pass = Pass.objects.get(id=object_id)
-                oracle_codes = DistrictPassTypeDurationOracleCode.objects.filter(
-                    district=district, option=park_pass.option
-                )
-                if oracle_codes.exists():
-                    district_pass_type_duration_oracle_code = oracle_codes.first()
-                    if district_pass_type_duration_oracle_code.oracle_code:
-                        logger.info(
-                            f"Returning oracle code: {district_pass_type_duration_oracle_code}.",
-                        )
-                        return district_pass_type_duration_oracle_code.oracle_code
-
-                logger.error(
-                    f"No oracle code found: {district_pass_type_duration_oracle_code}.",
-                )
-
-        # If not, the pass or voucher is being sold online
         pass_content_type = ContentType.objects.get_for_model(Pass)
         if pass_content_type == content_type:
             logger.info(
                 f"Content type is : {pass_content_type}.",
             )
-            if Pass.objects.filter(id=object_id).exists():
-                logger.info(
-                    f"Park pass with object_id: {object_id} exists.",
+            if park_pass is None:
+                park_pass = (
+                    Pass.objects.filter(id=object_id)
+                    .values("option_id", "park_group_id")
+                    .first()
                 )
-                park_pass = Pass.objects.get(id=object_id)
-                pass_type = park_pass.option.pricing_window.pass_type
-                if settings.ANNUAL_LOCAL_PASS == pass_type.name:
-                    # PICA Oracle codes for local park passes are based on the park group
-                    return park_pass.park_group.oracle_code
-
-                # For other pass types, PICA oracle codes are based on the pass type
-                # and duration
-                # Note: PICA oracle codes have a null district
-                oracle_codes = DistrictPassTypeDurationOracleCode.objects.filter(
-                    district__isnull=True, option=park_pass.option
+            else:
+                park_pass = {
+                    "option_id": park_pass.option_id,
+                    "park_group_id": park_pass.park_group_id,
+                }
+            if park_pass:
+                district_id = None
+                # Check if the pass is being sold via a retailer
+                if is_retailer(request):
+                    logger.info(
+                        "User is a retailer.",
+                    )
+                    district_id = CartUtils.get_retailer_district_id(request)
+                oracle_code = OracleCodeResolver.resolve(
+                    park_pass["option_id"],
+                    district_id=district_id,
+                    park_group_id=park_pass["park_group_id"],
                 )
-                if oracle_codes.exists():
-                    district_pass_type_duration_oracle_code = oracle_codes.first()
-                    if district_pass_type_duration_oracle_code.oracle_code:
-                        logger.info(
-                            f"Returning oracle code: {district_pass_type_duration_oracle_code}.",
-                        )
-                        return district_pass_type_duration_oracle_code.oracle_code
-
-                # If no oracle code is found, then try getting a code from the pass type
-                if pass_type.oracle_code:
-                    return pass_type.oracle_code
+                if oracle_code:
+                    logger.info(
+                        f"Returning oracle code: {oracle_code}.",
+                    )
+                    return oracle_code
 
         voucher_content_type = ContentType.objects.get_for_model(Voucher)
         if voucher_content_type == content_type:
@@ -225,6 +217,19 @@ class CartUtils:
         logger.critical(error_message)
         raise NoOracleCodeFoundForCartItem(error_message)
 
+    @classmethod
+    def get_retailer_district_id(self, request):
+        """Returns the district of the retailer group the user was most recently added to
+        (looked up once per request as every pass in the cart needs it)"""
+        if not hasattr(request, "_retailer_district_id"):
+            request._retailer_district_id = (
+                RetailerGroupUser.objects.filter(emailuser=request.user)
+                .order_by("-datetime_created")
+                .values_list("retailer_group__district_id", flat=True)
+                .first()
+            )
+        return request._retailer_district_id
+
     @classmethod
     def get_voucher_purchase_description(self, voucher_number):
         return f"{settings.PARKPASSES_VOUCHER_PURCHASE_DESCRIPTION} {voucher_number}"
@@ -233,6 +238,10 @@ class CartUtils:
     def get_pass_purchase_description(self, pass_number):
         return f"{settings.PARKPASSES_PASS_PURCHASE_DESCRIPTION} {pass_number}"
 
+    @classmethod
+    def get_pass_sales_description(self, pass_type_display_name):
+        return f"{settings.PARKPASSES_PASS_SALES_DESCRIPTION} {pass_type_display_name}"
+
     @classmethod
     def get_rac_discount_description(self):
         return f"{settings.PARKPASSES_RAC_DISCOUNT_APPLIED_DESCRIPTION}"
@@ -92,5 +92,17 @@ class ConcessionUsage(models.Model):
             + ")"
         )
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if not self.park_pass.in_cart:
+            self.park_pass.update_stored_prices()
+
+    def delete(self, *args, **kwargs):
+        park_pass_id = self.park_pass_id
+        super().delete(*args, **kwargs)
+        park_pass = Pass.objects.get(pk=park_pass_id)
+        if not park_pass.in_cart:
+            park_pass.update_stored_prices()
+
     class Meta:
         app_label = "parkpasses"
@@ -2,9 +2,9 @@ import logging
 
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.db.models import Case, Count, F, IntegerField, Value, When
+from django.shortcuts import get_object_or_404
 from django.utils import timezone
-from drf_excel.mixins import XLSXFileMixin
-from drf_excel.renderers import XLSXRenderer
 from org_model_logs.models import UserAction
 from org_model_logs.utils import BaseUserActionViewSet
 from rest_framework import status, viewsets
@@ -14,7 +14,6 @@ from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
 from rest_framework.response import Response
 from rest_framework.throttling import AnonRateThrottle
 from rest_framework.views import APIView
-from rest_framework_datatables.filters import DatatablesFilterBackend
 from rest_framework_datatables.pagination import DatatablesPageNumberPagination
 
 from parkpasses.components.discount_codes.models import (
@@ -28,46 +27,68 @@ from parkpasses.components.discount_codes.serializers import (
     InternalDiscountCodeBatchCommentSerializer,
     InternalDiscountCodeBatchSerializer,
     InternalDiscountCodeSerializer,
-    InternalDiscountCodeXlsxSerializer,
 )
 from parkpasses.components.main.api import (
+    CustomDatatablesFilterBackend,
     CustomDatatablesListMixin,
     CustomDatatablesRenderer,
 )
+from parkpasses.components.main.exports import ExportColumn, xlsx_export_response
 from parkpasses.components.main.serializers import UserActionSerializer
 from parkpasses.permissions import IsInternal
 
 logger = logging.getLogger(__name__)
 
 
-class DiscountCodeXlsxViewSet(XLSXFileMixin, viewsets.ReadOnlyModelViewSet):
+class DiscountCodeXlsxViewSet(viewsets.GenericViewSet):
     """
-    A ViewSet for performing actions on discount codes.
+    A ViewSet for downloading the discount codes of a discount code batch as an xlsx file.
     """
 
     model = DiscountCode
     permission_classes = [IsInternal]
-    serializer_class = InternalDiscountCodeXlsxSerializer
-    renderer_classes = (XLSXRenderer,)
-    paginator = None
+    export_columns = [
+        ExportColumn("Discount Code Batch", "discount_code_batch_number"),
+        ExportColumn("Code", "code"),
+        ExportColumn("Remaining Uses", "remaining_uses"),
+    ]
 
     def get_discount_code_batch(self):
-        discount_code_batch_id = self.kwargs["discount_code_batch_id"]
-        if DiscountCodeBatch.objects.filter(id=discount_code_batch_id).exists():
-            return DiscountCodeBatch.objects.get(id=discount_code_batch_id)
-        return None  # raise object does not exist exception?
+        return get_object_or_404(
+            DiscountCodeBatch.objects.only("id", "discount_code_batch_number"),
+            id=self.kwargs["discount_code_batch_id"],
+        )
 
     def get_queryset(self):
         discount_code_batch = self.get_discount_code_batch()
-        return DiscountCode.objects.filter(
-            discount_code_batch_id=discount_code_batch.id
+        # Works out the remaining uses in the query rather than counting the usages of each code
+        return (
+            DiscountCode.objects.filter(discount_code_batch_id=discount_code_batch.id)
+            .annotate(
+                discount_code_batch_number=F(
+                    "discount_code_batch__discount_code_batch_number"
+                ),
+                remaining_uses=Case(
+                    When(
+                        discount_code_batch__times_each_code_can_be_used__gt=0,
+                        then=F("discount_code_batch__times_each_code_can_be_used")
+                        - Count("discount_code_usages"),
+                    ),
+                    default=Value(settings.UNLIMITED_USES),
+                    output_field=IntegerField(),
+                ),
+            )
+            .order_by("id")
         )
 
-    def get_filename(self, request, *args, **kwargs):
+    def list(self, request, *args, **kwargs):
         discount_code_batch = self.get_discount_code_batch()
-        discount_code_batch_number = discount_code_batch.discount_code_batch_number
-        discount_codes_count = len(list(self.get_queryset()))
-        return f"discount_code_batch_{discount_code_batch_number}_{discount_codes_count}_codes.xlsx"
+        queryset = self.get_queryset()
+        filename = (
+            f"discount_code_batch_{discount_code_batch.discount_code_batch_number}_"
+            f"{queryset.count()}_codes.xlsx"
+        )
+        return xlsx_export_response(queryset, self.export_columns, filename)
 
 
 class DiscountCodeViewSet(viewsets.ModelViewSet):
@@ -81,10 +102,8 @@ class DiscountCodeViewSet(viewsets.ModelViewSet):
     serializer_class = InternalDiscountCodeSerializer
 
 
-class DiscountCodeBatchFilterBackend(DatatablesFilterBackend):
+class DiscountCodeBatchFilterBackend(CustomDatatablesFilterBackend):
     def filter_queryset(self, request, queryset, view):
-        total_count = queryset.count()
-
         status = request.GET.get("status")
 
         datetime_start_from = request.GET.get("datetime_start_from")
@@ -128,7 +147,6 @@ class DiscountCodeBatchFilterBackend(DatatablesFilterBackend):
             queryset = queryset.order_by(*ordering)
 
         queryset = super().filter_queryset(request, queryset, view)
-        setattr(view, "_datatables_total_count", total_count)
 
         return queryset
 
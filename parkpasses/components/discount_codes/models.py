@@ -2,12 +2,13 @@
     This module contains the models required for implimenting discount codes
 """
 import logging
-import uuid
+import secrets
 from decimal import Decimal
 
 from django.conf import settings
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Subquery
 from django.utils import timezone
 from ledger_api_client.ledger_models import EmailUserRO as EmailUser
 
@@ -35,15 +36,35 @@ class DiscountCodeBatch(models.Model):
     When saved, a discount code batch will create a series
     of random, unqiue discount codes with the characteristics
     defined in the batch.
+
+    If more than settings.DISCOUNT_CODE_GENERATION_BACKGROUND_THRESHOLD codes are needed
+    the batch is queued and the codes are generated by the
+    discount_codes_generate_codes management command instead.
     """
 
     objects = DiscountCodeBatchManager()
 
+    GENERATION_QUEUED = "QU"
+    GENERATION_GENERATING = "GE"
+    GENERATION_COMPLETED = "CO"
+    GENERATION_FAILED = "FA"
+    GENERATION_STATUS_CHOICES = [
+        (GENERATION_QUEUED, "Queued"),
+        (GENERATION_GENERATING, "Generating"),
+        (GENERATION_COMPLETED, "Completed"),
+        (GENERATION_FAILED, "Failed"),
+    ]
+
     created_by = models.IntegerField(null=False, blank=False)  # EmailUserRO
     discount_code_batch_number = models.CharField(max_length=10, null=True, blank=True)
     datetime_start = models.DateTimeField(null=False, blank=False)
     datetime_expiry = models.DateTimeField(null=False, blank=False)
-    codes_to_generate = models.SmallIntegerField()
+    codes_to_generate = models.PositiveIntegerField()
+    codes_generated = models.PositiveIntegerField(null=False, blank=False, default=0)
+    generation_status = models.CharField(
+        max_length=2, choices=GENERATION_STATUS_CHOICES, default=GENERATION_COMPLETED
+    )
+    generation_error = models.TextField(null=True, blank=True)
     times_each_code_can_be_used = models.SmallIntegerField(null=True, blank=True)
     invalidated = models.BooleanField(default=False)
     discount_amount = models.DecimalField(
@@ -113,37 +134,141 @@ class DiscountCodeBatch(models.Model):
 
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
-        existing_discount_codes = DiscountCode.objects.filter(
-            discount_code_batch=self
-        ).count()
-        if existing_discount_codes < self.codes_to_generate:
-            difference = self.codes_to_generate - existing_discount_codes
-            for i in range(difference):
-                code_unique = False
-                while not code_unique:
-                    code = str(uuid.uuid4())[:8].upper()
-                    code_count = DiscountCode.objects.filter(code=code).count()
-                    if 0 == code_count:
-                        code_unique = True
-                DiscountCode.objects.create(
-                    discount_code_batch=self,
-                    code=code,
-                )
-        elif existing_discount_codes > self.codes_to_generate:
-            difference = existing_discount_codes - self.codes_to_generate
-            existing_discount_codes = DiscountCode.objects.filter(
-                discount_code_batch=self
+        codes_required = self.codes_to_generate - self.discount_codes.count()
+        if codes_required > settings.DISCOUNT_CODE_GENERATION_BACKGROUND_THRESHOLD:
+            self.generation_status = DiscountCodeBatch.GENERATION_QUEUED
+            self.generation_error = None
+            DiscountCodeBatch.objects.filter(pk=self.pk).update(
+                generation_status=self.generation_status,
+                generation_error=None,
+            )
+            logger.info(f"Queued the generation of {codes_required} codes for {self}.")
+        else:
+            self.generate_discount_codes()
+            self.generation_status = DiscountCodeBatch.GENERATION_COMPLETED
+            DiscountCodeBatch.objects.filter(pk=self.pk).update(
+                generation_status=self.generation_status
             )
-            discount_codes = DiscountCode.objects.filter(
-                discount_code_batch=self
-            ).order_by("?")[:difference]
-            for discount_code in discount_codes:
-                discount_code.delete()
         if not self.discount_code_batch_number:
             discount_code_batch_number = f"DC{self.pk:06d}"
             self.discount_code_batch_number = discount_code_batch_number
             super().save(force_insert=False)
 
+    def generate_discount_codes(self):
+        """Creates (or deletes) discount codes until the batch has codes_to_generate codes.
+
+        Codes are drawn a block at a time, checked against the existing codes with one query
+        per block and then inserted with a single bulk insert."""
+        existing_discount_codes = self.discount_codes.count()
+        if existing_discount_codes > self.codes_to_generate:
+            self.trim_discount_codes(existing_discount_codes - self.codes_to_generate)
+            existing_discount_codes = self.discount_codes.count()
+
+        block_size = settings.DISCOUNT_CODE_GENERATION_BLOCK_SIZE
+        while existing_discount_codes < self.codes_to_generate:
+            codes_required = min(
+                self.codes_to_generate - existing_discount_codes, block_size
+            )
+            codes = set()
+            while len(codes) < codes_required:
+                codes.add(secrets.token_hex(4).upper())
+            codes.difference_update(
+                DiscountCode.objects.filter(code__in=codes).values_list(
+                    "code", flat=True
+                )
+            )
+            try:
+                with transaction.atomic():
+                    DiscountCode.objects.bulk_create(
+                        [
+                            DiscountCode(discount_code_batch=self, code=code)
+                            for code in codes
+                        ]
+                    )
+            except IntegrityError:
+                # Another batch inserted one of the codes since they were checked
+                logger.warning(f"Duplicate discount code drawn for {self}, retrying.")
+                continue
+            existing_discount_codes += len(codes)
+            self.set_codes_generated(existing_discount_codes)
+
+        self.set_codes_generated(existing_discount_codes)
+
+    def trim_discount_codes(self, number_of_codes):
+        """Deletes number_of_codes of the batch's codes (that have not been used) in one delete"""
+        unused_discount_codes = DiscountCode.objects.filter(
+            discount_code_batch=self, discount_code_usages__isnull=True
+        ).order_by("-id")
+        deleted, _ = DiscountCode.objects.filter(
+            pk__in=Subquery(unused_discount_codes.values("pk")[:number_of_codes])
+        ).delete()
+        if deleted < number_of_codes:
+            logger.warning(
+                f"Only {deleted} of the {number_of_codes} codes to be removed from {self} "
+                "had not been used."
+            )
+
+    def set_codes_generated(self, codes_generated):
+        self.codes_generated = codes_generated
+        DiscountCodeBatch.objects.filter(pk=self.pk).update(
+            codes_generated=codes_generated, datetime_updated=timezone.now()
+        )
+
+    @classmethod
+    def requeue_stale_generations(self):
+        """Requeues batches that were claimed by a worker that has since died."""
+        stale_before = timezone.now() - timezone.timedelta(
+            seconds=settings.DISCOUNT_CODE_GENERATION_STALE_AFTER_SECONDS
+        )
+        return DiscountCodeBatch.objects.filter(
+            generation_status=DiscountCodeBatch.GENERATION_GENERATING,
+            datetime_updated__lt=stale_before,
+        ).update(generation_status=DiscountCodeBatch.GENERATION_QUEUED)
+
+    @classmethod
+    def claim_queued_generation(self):
+        """Marks the oldest queued batch as generating and returns it (or None)
+
+        Rows locked by another worker are skipped so several workers can run at once."""
+        with transaction.atomic():
+            discount_code_batch_id = (
+                DiscountCodeBatch.objects.select_for_update(skip_locked=True)
+                .filter(generation_status=DiscountCodeBatch.GENERATION_QUEUED)
+                .order_by("datetime_updated")
+                .values_list("id", flat=True)
+                .first()
+            )
+            if discount_code_batch_id is None:
+                return None
+            DiscountCodeBatch.objects.filter(pk=discount_code_batch_id).update(
+                generation_status=DiscountCodeBatch.GENERATION_GENERATING,
+                datetime_updated=timezone.now(),
+            )
+        return DiscountCodeBatch.objects.get(pk=discount_code_batch_id)
+
+    def run_generation(self):
+        """Generates the codes for a claimed batch and records the outcome.
+        Returns True if the generation succeeded."""
+        try:
+            self.generate_discount_codes()
+        except Exception as e:
+            logger.exception(f"Generating the codes for {self} failed: {e}")
+            DiscountCodeBatch.objects.filter(
+                pk=self.pk, generation_status=DiscountCodeBatch.GENERATION_GENERATING
+            ).update(
+                generation_status=DiscountCodeBatch.GENERATION_FAILED,
+                generation_error=str(e),
+            )
+            return False
+        # If the batch was requeued while the codes were being generated leave it queued
+        DiscountCodeBatch.objects.filter(
+            pk=self.pk, generation_status=DiscountCodeBatch.GENERATION_GENERATING
+        ).update(
+            generation_status=DiscountCodeBatch.GENERATION_COMPLETED,
+            generation_error=None,
+        )
+        return True
+
     def valid_pass_type_ids(self):
         return list(self.valid_pass_types.values_list("pass_type_id", flat=True))
 
@@ -372,6 +497,18 @@ class DiscountCodeUsage(models.Model):
         )
         return str_value
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if not self.park_pass.in_cart:
+            self.park_pass.update_stored_prices()
+
+    def delete(self, *args, **kwargs):
+        park_pass_id = self.park_pass_id
+        super().delete(*args, **kwargs)
+        park_pass = Pass.objects.get(pk=park_pass_id)
+        if not park_pass.in_cart:
+            park_pass.update_stored_prices()
+
     class Meta:
         app_label = "parkpasses"
 
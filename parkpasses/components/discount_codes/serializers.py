@@ -11,17 +11,6 @@ from parkpasses.components.discount_codes.models import (
 from parkpasses.helpers import is_parkpasses_discount_code_percentage_user
 
 
-class InternalDiscountCodeXlsxSerializer(serializers.ModelSerializer):
-    discount_code_batch = serializers.ReadOnlyField(
-        source="discount_code_batch.discount_code_batch_number"
-    )
-    remaining_uses = serializers.ReadOnlyField()
-
-    class Meta:
-        model = DiscountCode
-        fields = ["discount_code_batch", "code", "remaining_uses"]
-
-
 class InternalDiscountCodeSerializer(serializers.ModelSerializer):
     remaining_uses = serializers.ReadOnlyField()
 
@@ -95,6 +84,9 @@ class InternalDiscountCodeBatchSerializer(serializers.ModelSerializer):
             "datetime_start",
             "datetime_expiry",
             "codes_to_generate",
+            "codes_generated",
+            "generation_status",
+            "generation_error",
             "times_each_code_can_be_used",
             "invalidated",
             "discount_type",
@@ -111,6 +103,9 @@ class InternalDiscountCodeBatchSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = [
             "created_by_name",
+            "codes_generated",
+            "generation_status",
+            "generation_error",
         ]
         datatables_always_serialize = [
             "id",
@@ -1,4 +1,4 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.utils import timezone
 
 from parkpasses.components.discount_codes.models import DiscountCode, DiscountCodeBatch
@@ -78,3 +78,58 @@ class DiscountCodeBatchTestCase(TestCase):
     def test_discount_code_usage(self):
         pass
         # discount_code_usage = DiscountCodeUsage()
+
+
+@override_settings(
+    DISCOUNT_CODE_GENERATION_BLOCK_SIZE=5,
+    DISCOUNT_CODE_GENERATION_BACKGROUND_THRESHOLD=20,
+)
+class DiscountCodeGenerationTestCase(TestCase):
+    def create_discount_code_batch(self, codes_to_generate):
+        discount_code_batch = DiscountCodeBatch(
+            created_by=1,
+            datetime_start=timezone.now(),
+            datetime_expiry=timezone.now() + timezone.timedelta(365),
+            codes_to_generate=codes_to_generate,
+            discount_percentage=10,
+        )
+        discount_code_batch.save()
+        return discount_code_batch
+
+    def test_codes_generated_in_blocks(self):
+        discount_code_batch = self.create_discount_code_batch(12)
+        codes = list(discount_code_batch.discount_codes.values_list("code", flat=True))
+        self.assertEqual(len(codes), 12)
+        self.assertEqual(len(set(codes)), 12)
+        self.assertEqual(discount_code_batch.codes_generated, 12)
+        self.assertEqual(
+            discount_code_batch.generation_status,
+            DiscountCodeBatch.GENERATION_COMPLETED,
+        )
+
+    def test_codes_trimmed(self):
+        discount_code_batch = self.create_discount_code_batch(12)
+        discount_code_batch.codes_to_generate = 4
+        discount_code_batch.save()
+        self.assertEqual(discount_code_batch.discount_codes.count(), 4)
+        self.assertEqual(discount_code_batch.codes_generated, 4)
+
+    def test_large_batch_generated_in_background(self):
+        discount_code_batch = self.create_discount_code_batch(23)
+        self.assertEqual(discount_code_batch.discount_codes.count(), 0)
+        self.assertEqual(
+            discount_code_batch.generation_status, DiscountCodeBatch.GENERATION_QUEUED
+        )
+
+        claimed_discount_code_batch = DiscountCodeBatch.claim_queued_generation()
+        self.assertEqual(claimed_discount_code_batch.pk, discount_code_batch.pk)
+        self.assertIsNone(DiscountCodeBatch.claim_queued_generation())
+
+        self.assertTrue(claimed_discount_code_batch.run_generation())
+        discount_code_batch.refresh_from_db()
+        self.assertEqual(discount_code_batch.discount_codes.count(), 23)
+        self.assertEqual(discount_code_batch.codes_generated, 23)
+        self.assertEqual(
+            discount_code_batch.generation_status,
+            DiscountCodeBatch.GENERATION_COMPLETED,
+        )
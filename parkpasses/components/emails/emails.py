@@ -1,8 +1,10 @@
 import logging
 import mimetypes
+from concurrent.futures import ThreadPoolExecutor
 
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import connection
 from django.template import Template, loader
 from django.utils.html import strip_tags
 from ledger_api_client.ledger_models import Document
@@ -54,12 +56,49 @@ class TemplateEmailBase:
         :param cc:
         :return:
         """
+        msg = self.build_message(
+            to_addresses,
+            from_address=from_address,
+            context=context,
+            attachments=attachments,
+            cc=cc,
+            bcc=bcc,
+        )
+        try:
+            if not settings.DISABLE_EMAIL:
+                msg.send(fail_silently=False)
+            return msg
+        except Exception as e:
+            logger.exception(f"Error while sending email to {to_addresses}: {e}")
+            return None
+
+    def get_templates(self):
         # The next line will throw a TemplateDoesNotExist if html template cannot be found
         html_template = loader.get_template(self.html_template)
-        # render html
-        html_body = _render(html_template, context)
+        txt_template = None
         if self.txt_template is not None:
             txt_template = loader.get_template(self.txt_template)
+        return html_template, txt_template
+
+    def build_message(
+        self,
+        to_addresses,
+        from_address=None,
+        context=None,
+        attachments=None,
+        cc=None,
+        bcc=None,
+        templates=None,
+    ):
+        """Renders the templates and returns the (unsent) message, see send for the parameters.
+
+        :param templates: the (html, txt) templates as returned by get_templates so they don't
+               have to be loaded again when building many messages
+        """
+        html_template, txt_template = templates or self.get_templates()
+        # render html
+        html_body = _render(html_template, context)
+        if txt_template is not None:
             txt_body = _render(txt_template, context)
         else:
             txt_body = strip_tags(html_body)
@@ -72,9 +111,6 @@ class TemplateEmailBase:
         if attachments is not None and not isinstance(attachments, list):
             attachments = list(attachments)
 
-        if attachments is None:
-            attachments = []
-
         # Convert Documents to (filename, content, mime) attachment
         _attachments = []
         for attachment in attachments:
@@ -95,10 +131,127 @@ class TemplateEmailBase:
             bcc=bcc,
         )
         msg.attach_alternative(html_body, "text/html")
+        return msg
+
+
+class BatchEmailMessage:
+    """An email added to a BatchEmailSender and, once sent, the outcome of sending it"""
+
+    def __init__(
+        self,
+        email,
+        to_addresses,
+        context=None,
+        attachments=None,
+        instance=None,
+        customer=None,
+    ):
+        self.email = email
+        self.to_addresses = to_addresses
+        self.context = context
+        self.attachments = attachments
+        # The object the email is about and the customer it was sent to (for the communications log)
+        self.instance = instance
+        self.customer = customer
+        self.message = None
+        self.sent = False
+        self.error = None
+
+
+class BatchEmailSender:
+    """Sends many template emails at once
+
+    The templates are loaded once, the messages are rendered on a thread pool chunk_size
+    messages at a time and they are all sent over the same connection.
+
+    Usage:
+        batch = BatchEmailSender()
+        batch.add(email, park_pass.email, context=context, instance=park_pass)
+        for batch_message in batch.send():
+            batch_message.sent
+    """
+
+    def __init__(self, chunk_size=None, render_workers=None):
+        self.chunk_size = chunk_size or settings.EMAIL_BATCH_CHUNK_SIZE
+        self.render_workers = render_workers or settings.EMAIL_BATCH_RENDER_WORKERS
+        self.messages = []
+
+    def add(
+        self,
+        email,
+        to_addresses,
+        context=None,
+        attachments=None,
+        instance=None,
+        customer=None,
+    ):
+        batch_message = BatchEmailMessage(
+            email,
+            to_addresses,
+            context=context,
+            attachments=attachments,
+            instance=instance,
+            customer=customer,
+        )
+        self.messages.append(batch_message)
+        return batch_message
+
+    def render(self, batch_message, templates):
+        email = batch_message.email
+        try:
+            batch_message.message = email.build_message(
+                batch_message.to_addresses,
+                context=batch_message.context,
+                attachments=batch_message.attachments,
+                templates=templates[email.html_template, email.txt_template],
+            )
+        except Exception as e:
+            logger.exception(
+                f"Error while rendering email to {batch_message.to_addresses}: {e}"
+            )
+            batch_message.error = str(e)
+        finally:
+            # Each thread has its own database connection
+            connection.close()
+
+    def send_message(self, email_connection, batch_message):
         try:
             if not settings.DISABLE_EMAIL:
-                msg.send(fail_silently=False)
-            return msg
+                email_connection.send_messages([batch_message.message])
+            batch_message.sent = True
         except Exception as e:
-            logger.exception(f"Error while sending email to {to_addresses}: {e}")
-            return None
+            logger.exception(
+                f"Error while sending email to {batch_message.to_addresses}: {e}"
+            )
+            batch_message.error = str(e)
+            # The connection may have been dropped so start a new one for the rest of the messages
+            email_connection.close()
+            email_connection.open()
+
+    def send(self):
+        """Renders and sends all of the messages that have been added and returns them
+        with sent (and error) set"""
+        templates = {}
+        for batch_message in self.messages:
+            email = batch_message.email
+            key = email.html_template, email.txt_template
+            if key not in templates:
+                templates[key] = email.get_templates()
+
+        email_connection = get_connection(fail_silently=False)
+        email_connection.open()
+        try:
+            with ThreadPoolExecutor(max_workers=self.render_workers) as executor:
+                for start in range(0, len(self.messages), self.chunk_size):
+                    end = start + self.chunk_size
+                    chunk = self.messages[start:end]
+                    list(executor.map(lambda m: self.render(m, templates), chunk))
+                    for batch_message in chunk:
+                        if batch_message.message is not None:
+                            self.send_message(email_connection, batch_message)
+        finally:
+            email_connection.close()
+
+        sent = len([m for m in self.messages if m.sent])
+        logger.info(f"Sent {sent} of {len(self.messages)} emails.")
+        return self.messages
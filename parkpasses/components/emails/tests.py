@@ -0,0 +1,45 @@
+from unittest import mock
+
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.template import loader
+from django.test import TestCase, override_settings
+
+from parkpasses.components.emails.emails import BatchEmailSender, TemplateEmailBase
+
+
+@override_settings(
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend", DISABLE_EMAIL=False
+)
+class BatchEmailSenderTestCase(TestCase):
+    def test_send(self):
+        batch = BatchEmailSender(chunk_size=2)
+        for i in range(5):
+            batch.add(TemplateEmailBase(subject=f"Email {i}"), f"user{i}@example.com")
+        with mock.patch.object(
+            loader, "get_template", wraps=loader.get_template
+        ) as get_template:
+            batch_messages = batch.send()
+        # The html and txt templates are only loaded once for the whole batch
+        self.assertEqual(get_template.call_count, 2)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertTrue(all(m.sent for m in batch_messages))
+        self.assertEqual(mail.outbox[4].to, ["user4@example.com"])
+
+    def test_failed_messages_are_recorded(self):
+        send_messages = EmailBackend.send_messages
+
+        def fail_for_one_address(backend, messages):
+            if messages[0].to == ["bounce@example.com"]:
+                raise Exception("Recipient refused")
+            return send_messages(backend, messages)
+
+        batch = BatchEmailSender()
+        batch.add(TemplateEmailBase(subject="Email"), "user1@example.com")
+        batch.add(TemplateEmailBase(subject="Email"), "bounce@example.com")
+        batch.add(TemplateEmailBase(subject="Email"), "user2@example.com")
+        with mock.patch.object(EmailBackend, "send_messages", fail_for_one_address):
+            batch_messages = batch.send()
+        self.assertEqual([m.sent for m in batch_messages], [True, False, True])
+        self.assertEqual(batch_messages[1].error, "Recipient refused")
+        self.assertEqual(len(mail.outbox), 2)
@@ -1,6 +1,10 @@
 import logging
+from collections import OrderedDict
 
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import EmptyResultSet
+from django.utils import timezone
 from org_model_documents.api import DocumentCreateView, DocumentViewSet
 from org_model_logs.api import EntryTypeList as BaseEntryTypeList
 from org_model_logs.api import (
@@ -11,16 +15,22 @@ from org_model_logs.api import UserActionViewSet as BaseUserActionViewSet
 from org_model_logs.models import CommunicationsLogEntry
 from org_model_logs.serializers import EntryTypeSerializer
 from rest_framework import status
+from rest_framework.decorators import action
 from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.serializers import ValidationError
 from rest_framework.views import APIView
+from rest_framework_datatables.filters import DatatablesFilterBackend
 from rest_framework_datatables.renderers import DatatablesRenderer
+from rest_framework_datatables.utils import get_param
 
+from parkpasses.components.main.cache import get_cache_metrics
+from parkpasses.components.main.exports import export_response
 from parkpasses.components.main.serializers import (
     CommunicationsLogEntrySerializer,
     UserActionSerializer,
 )
+from parkpasses.components.main.utils import get_count_estimate
 from parkpasses.helpers import park_passes_system_check
 from parkpasses.permissions import IsInternal, IsInternalAPIView
 
@@ -45,18 +55,151 @@ class CustomDatatablesRenderer(DatatablesRenderer):
         return JSONRenderer().render(data, accepted_media_type, renderer_context)
 
 
+class CustomDatatablesFilterBackend(DatatablesFilterBackend):
+    """Applies the datatables search and ordering to the queryset
+
+    Unlike DatatablesFilterBackend the queryset is not counted here, the counts
+    are worked out once by CustomDatatablesListMixin"""
+
+    def filter_queryset(self, request, queryset, view):
+        if not self.check_renderer_format(request):
+            return queryset
+
+        datatables_query = self.parse_datatables_query(request, view)
+
+        q = self.get_q(datatables_query)
+        if q:
+            queryset = queryset.filter(q).distinct()
+
+        ordering = self.get_ordering(request, view, datatables_query["fields"])
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+
+        return queryset
+
+
 class CustomDatatablesListMixin:
+    """Returns only the page of rows datatables asked for (start and length)
+
+    The page is fetched in two queries, first the primary keys of the rows on the page are
+    selected (which the database can do from an index) and then the rows themselves. This
+    keeps requests for pages deep into large tables fast.
+
+    recordsTotal is exact for small tables and the query planner's estimate for large ones
+    (see get_count_estimate). The planner's estimates for searches are too rough to page
+    with so recordsFiltered is always an exact count when a search or filter is applied.
+
+    Requests for any other format (json) still get every row in one page."""
+
     def list(self, request, *args, **kwargs):
-        qs = self.get_queryset()
-        qs = self.filter_queryset(qs)
-        qs = qs.distinct()
-        self.paginator.page_size = qs.count()
-        result_page = self.paginator.paginate_queryset(qs, request)
+        if request.accepted_renderer.format != "datatables":
+            return self.list_all(request)
+
+        queryset = self.filter_queryset(self.get_queryset()).distinct()
+        queryset = self.get_stable_ordering(queryset)
+
+        records_total = get_count_estimate(self.get_queryset())
+        if self.is_filtered(queryset):
+            records_filtered = queryset.count()
+        else:
+            records_filtered = records_total
+        setattr(self, "_datatables_total_count", records_total)
+
+        start, length = self.get_datatables_page_range(request)
+        page = self.get_datatables_page(queryset, start, length)
+
+        serializer = self.get_serializer(page, context={"request": request}, many=True)
+        return Response(
+            OrderedDict(
+                [
+                    ("recordsTotal", records_total),
+                    ("recordsFiltered", records_filtered),
+                    ("data", serializer.data),
+                ]
+            )
+        )
+
+    def list_all(self, request):
+        queryset = self.filter_queryset(self.get_queryset()).distinct()
+        self.paginator.page_size = queryset.count()
+        result_page = self.paginator.paginate_queryset(queryset, request)
         serializer = self.get_serializer(
             result_page, context={"request": request}, many=True
         )
         return self.paginator.get_paginated_response(serializer.data)
 
+    def is_filtered(self, queryset):
+        """Whether the filter backends have narrowed down the queryset"""
+        unfiltered_queryset = self.get_queryset().distinct()
+        try:
+            return str(queryset.order_by().query) != str(
+                unfiltered_queryset.order_by().query
+            )
+        except EmptyResultSet:
+            return True
+
+    def get_stable_ordering(self, queryset):
+        """Rows with equal sort values must always come back in the same order or
+        they can appear on more than one page (or none)"""
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        if not any(
+            field.lstrip("-") in ("pk", "id")
+            for field in ordering
+            if isinstance(field, str)
+        ):
+            ordering.append("id")
+        return queryset.order_by(*ordering)
+
+    def get_datatables_page_range(self, request):
+        try:
+            start = max(int(get_param(request, "start", 0)), 0)
+        except (TypeError, ValueError):
+            start = 0
+        try:
+            length = int(
+                get_param(request, "length", settings.REST_FRAMEWORK["PAGE_SIZE"])
+            )
+        except (TypeError, ValueError):
+            length = settings.REST_FRAMEWORK["PAGE_SIZE"]
+        if length < 0 or length > settings.DATATABLES_MAX_PAGE_SIZE:
+            # length=-1 is how datatables asks for every row
+            length = settings.DATATABLES_MAX_PAGE_SIZE
+        return start, length
+
+    def get_datatables_page(self, queryset, start, length):
+        # Ordering by a field on a many relation can return the same row more than once
+        end = start + length
+        page_ids = list(dict.fromkeys(queryset.values_list("pk", flat=True)[start:end]))
+        if not page_ids:
+            return []
+        rows_by_id = {
+            row.pk: row for row in self.get_queryset().filter(pk__in=page_ids)
+        }
+        return [rows_by_id[pk] for pk in page_ids if pk in rows_by_id]
+
+
+class ExportListMixin:
+    """Adds export/csv/ and export/xlsx/ list routes that stream every row (matching the
+    same filters as the list) out as a file with the columns in export_columns"""
+
+    export_columns = []
+    export_filename = "export"
+
+    def get_export_queryset(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        if not queryset.query.order_by:
+            queryset = queryset.order_by("id")
+        return queryset
+
+    @action(
+        methods=["GET"], detail=False, url_path=r"export/(?P<export_format>csv|xlsx)"
+    )
+    def export(self, request, export_format, *args, **kwargs):
+        filename = f"{self.export_filename}_{timezone.localtime():%Y%m%d_%H%M%S}.{export_format}"
+        return export_response(
+            self.get_export_queryset(), self.export_columns, export_format, filename
+        )
+
 
 class DocumentCreateView(DocumentCreateView):
     permission_classes = [IsInternalAPIView]
@@ -128,3 +271,12 @@ class ParkPassesSystemCheck(APIView):
         return Response(
             {"passed": passed, "messages": messages, "critical_issues": critical_issues}
         )
+
+
+class CacheMetrics(APIView):
+    """The hit / miss / latency counters of the caches in the process that handles the request"""
+
+    permission_classes = [IsInternalAPIView]
+
+    def get(self, request, format=None):
+        return Response(get_cache_metrics())
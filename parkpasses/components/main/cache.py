@@ -0,0 +1,284 @@
+"""
+    This module contains the building blocks for caching in park passes.
+
+    - TieredCache (A cache backend with a local memory tier in front of a shared tier)
+    - CacheMetrics (Hit / miss / latency counters for a TieredCache)
+    - Namespaced keys (Groups of keys that can be invalidated together)
+    - VersionedLocalCache (Data that rarely changes that every process keeps its own copy of)
+"""
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.locmem import LocMemCache
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class CacheMetrics:
+    """Counts the hits and misses of each tier of a cache and how long reads and writes take
+
+    The counters are kept in the memory of the process so they describe the process
+    that reports them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {
+                "l1_hits": 0,
+                "l1_misses": 0,
+                "l2_hits": 0,
+                "l2_misses": 0,
+                "sets": 0,
+                "deletes": 0,
+            }
+            self.latency = {
+                "get": {"count": 0, "total_ms": 0.0, "max_ms": 0.0},
+                "set": {"count": 0, "total_ms": 0.0, "max_ms": 0.0},
+            }
+
+    def record(self, operation, started, *counters):
+        elapsed_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            for counter in counters:
+                self.counters[counter] += 1
+            latency = self.latency.get(operation)
+            if latency is not None:
+                latency["count"] += 1
+                latency["total_ms"] += elapsed_ms
+                latency["max_ms"] = max(latency["max_ms"], elapsed_ms)
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+            latency = {
+                operation: {
+                    "count": values["count"],
+                    "average_ms": round(values["total_ms"] / values["count"], 3)
+                    if values["count"]
+                    else 0.0,
+                    "max_ms": round(values["max_ms"], 3),
+                }
+                for operation, values in self.latency.items()
+            }
+        gets = counters["l1_hits"] + counters["l1_misses"]
+        hits = counters["l1_hits"] + counters["l2_hits"]
+        counters["hit_ratio"] = round(hits / gets, 3) if gets else 0.0
+        return {"counters": counters, "latency": latency}
+
+
+class TieredCache(BaseCache):
+    """A cache backend that keeps values in the memory of the process (L1) in front of a
+    shared cache (L2) such as redis.
+
+    OPTIONS:
+        L2: The alias (in settings.CACHES) of the shared cache. Without one the local
+            memory is the only tier.
+        L1_TIMEOUT: The most seconds a value is kept in local memory before being read
+            from the shared cache again. Changes made by other processes can take this
+            long to be seen so it should be kept short.
+        L1_MAX_ENTRIES: The most values kept in local memory.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self.l2_alias = options.get("L2")
+        self.l1_timeout = int(options.get("L1_TIMEOUT", 10))
+        self.l1 = LocMemCache(
+            f"tiered-cache-{location}",
+            {
+                "TIMEOUT": self.default_timeout,
+                "OPTIONS": {"MAX_ENTRIES": options.get("L1_MAX_ENTRIES", 10000)},
+            },
+        )
+        self.metrics = CacheMetrics()
+
+    @property
+    def l2(self):
+        if self.l2_alias is None:
+            return None
+        return caches[self.l2_alias]
+
+    def get_l1_timeout(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if self.l2_alias is None:
+            return timeout
+        if timeout is None:
+            return self.l1_timeout
+        return min(timeout, self.l1_timeout)
+
+    def get(self, key, default=None, version=None):
+        started = time.monotonic()
+        value = self.l1.get(key, _MISSING, version=version)
+        if value is not _MISSING:
+            self.metrics.record("get", started, "l1_hits")
+            return value
+        if self.l2 is None:
+            self.metrics.record("get", started, "l1_misses")
+            return default
+        value = self.l2.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            self.metrics.record("get", started, "l1_misses", "l2_misses")
+            return default
+        self.l1.set(key, value, self.l1_timeout, version=version)
+        self.metrics.record("get", started, "l1_misses", "l2_hits")
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        started = time.monotonic()
+        if self.l2 is not None:
+            self.l2.set(key, value, timeout, version=version)
+        self.l1.set(key, value, self.get_l1_timeout(timeout), version=version)
+        self.metrics.record("set", started, "sets")
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if self.l2 is None:
+            return self.l1.add(key, value, timeout, version=version)
+        if self.l2.add(key, value, timeout, version=version):
+            self.l1.set(key, value, self.get_l1_timeout(timeout), version=version)
+            return True
+        # Another process got there first so make sure we read their value
+        self.l1.delete(key, version=version)
+        return False
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        touched = self.l1.touch(key, self.get_l1_timeout(timeout), version=version)
+        if self.l2 is not None:
+            return self.l2.touch(key, timeout, version=version)
+        return touched
+
+    def delete(self, key, version=None):
+        started = time.monotonic()
+        deleted = self.l1.delete(key, version=version)
+        if self.l2 is not None:
+            deleted = self.l2.delete(key, version=version)
+        self.metrics.record("delete", started, "deletes")
+        return deleted
+
+    def incr(self, key, delta=1, version=None):
+        if self.l2 is None:
+            return self.l1.incr(key, delta, version=version)
+        value = self.l2.incr(key, delta, version=version)
+        self.l1.delete(key, version=version)
+        return value
+
+    def clear(self):
+        self.l1.clear()
+        if self.l2 is not None:
+            self.l2.clear()
+
+    def close(self, **kwargs):
+        if self.l2 is not None:
+            self.l2.close(**kwargs)
+
+
+def get_cache_metrics():
+    """Returns the metrics of each tiered cache in settings.CACHES"""
+    return {
+        alias: caches[alias].metrics.snapshot()
+        for alias in settings.CACHES
+        if isinstance(caches[alias], TieredCache)
+    }
+
+
+def get_namespace_version(namespace):
+    cache_key = settings.CACHE_KEY_NAMESPACE_VERSION.format(namespace)
+    version = cache.get(cache_key)
+    if version is None:
+        cache.add(cache_key, uuid.uuid4().hex, None)
+        version = cache.get(cache_key)
+    return version
+
+
+def namespaced_key(namespace, cache_key):
+    """Returns the key to cache a value under so that it is invalidated along with
+    every other key in the namespace when invalidate_namespace is called"""
+    return f"{namespace}:{get_namespace_version(namespace)}:{cache_key}"
+
+
+def invalidate_namespace(namespace):
+    """Changing the version of the namespace means none of the keys already cached in
+    it will be read again (they are left for the cache to expire)"""
+    cache.set(
+        settings.CACHE_KEY_NAMESPACE_VERSION.format(namespace), uuid.uuid4().hex, None
+    )
+
+
+def user_permissions_key(user_id, cache_key):
+    return namespaced_key(
+        settings.CACHE_NAMESPACE_USER_PERMISSIONS.format(str(user_id)), cache_key
+    )
+
+
+def invalidate_user_permissions(user_id):
+    """Invalidates everything cached about what the user is allowed to do"""
+    invalidate_namespace(settings.CACHE_NAMESPACE_USER_PERMISSIONS.format(str(user_id)))
+
+
+class VersionedLocalCache:
+    """A class to represent data loaded from the database into the memory of each python process
+
+    Each process keeps its own copy of the data along with the version it was loaded at.
+    The version is kept in the shared django cache and invalidate is called (from model signals)
+    whenever the data changes so every process reloads the data the next time it is used.
+
+    Subclasses must set version_cache_key and implement load."""
+
+    version_cache_key = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._lock = threading.Lock()
+        cls._version = None
+        cls._data = None
+
+    @classmethod
+    def load(self):
+        raise NotImplementedError
+
+    @classmethod
+    def get_version(self):
+        version = cache.get(self.version_cache_key)
+        if version is None:
+            # add rather than set so concurrent processes end up with the same version
+            cache.add(self.version_cache_key, uuid.uuid4().hex, None)
+            version = cache.get(self.version_cache_key)
+        return version
+
+    @classmethod
+    def invalidate(self):
+        cache.set(self.version_cache_key, uuid.uuid4().hex, None)
+        with self._lock:
+            self._data = None
+        logger.info(f"{self.__name__} invalidated.")
+
+    @classmethod
+    def warm(self):
+        """Loads the data when the process starts rather than when it is first used"""
+        try:
+            self.get()
+        except Exception as e:
+            logger.exception(f"Unable to warm {self.__name__}: {e}")
+
+    @classmethod
+    def get(self):
+        version = self.get_version()
+        if version is None:
+            # There is no shared cache (USE_DUMMY_CACHE) so changes made by other processes can't be seen
+            return self.load()
+        with self._lock:
+            if self._data is None or self._version != version:
+                self._data = self.load()
+                self._version = version
+            return self._data
@@ -0,0 +1,18 @@
+""" Custom exceptions for the main component """
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentConversionFailed(Exception):
+    """The exception to be raised if LibreOffice is unable to convert a document to pdf"""
+
+
+class DocumentConversionTimedOut(DocumentConversionFailed):
+    """The exception to be raised if LibreOffice takes longer than
+    settings.LIBREOFFICE_CONVERSION_TIMEOUT_SECONDS to convert a document to pdf"""
+
+
+class QueryBudgetExceeded(Exception):
+    """The exception to be raised if a view runs more queries than its query_budget
+    (only when settings.QUERY_BUDGET_RAISE is set)"""
@@ -0,0 +1,157 @@
+"""
+    This module streams querysets out as csv or xlsx files.
+
+    The rows are read from the database chunk_size at a time (with a server side cursor)
+    and only the columns being exported are selected so the memory used doesn't grow
+    with the number of rows being exported.
+
+    csv files are streamed to the client as they are written. xlsx files are written by
+    xlsxwriter in constant memory mode to a spooled temporary file (which is moved to disk
+    once it is larger than settings.EXPORT_XLSX_SPOOL_MAX_SIZE) and then streamed from there.
+"""
+import csv
+import datetime
+import logging
+import tempfile
+from decimal import Decimal
+
+import xlsxwriter
+from django.conf import settings
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# The number of rows in a worksheet (one less than excel's limit to leave room for the headings)
+XLSX_MAX_ROWS_PER_WORKSHEET = 1048575
+
+
+class ExportColumn:
+    """A column in an export, field is the name of a field (or annotation) of the
+    queryset and may span relationships i.e. option__pricing_window__pass_type__display_name"""
+
+    def __init__(self, heading, field, choices=None):
+        self.heading = heading
+        self.field = field
+        self.choices = dict(choices) if choices else None
+
+    def get_value(self, value):
+        if self.choices is not None and value is not None:
+            return self.choices.get(value, value)
+        if isinstance(value, datetime.datetime):
+            if timezone.is_aware(value):
+                value = timezone.localtime(value)
+            return value.replace(tzinfo=None)
+        return value
+
+
+def get_export_rows(queryset, columns, chunk_size=None):
+    """Yields a list of the column values for each row of the queryset"""
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    rows = queryset.values_list(*[column.field for column in columns]).iterator(
+        chunk_size=chunk_size
+    )
+    for row in rows:
+        yield [column.get_value(value) for column, value in zip(columns, row)]
+
+
+class Echo:
+    """An object that implements just the write method of the file-like interface
+    so the csv writer hands back each row rather than buffering it"""
+
+    def write(self, value):
+        return value
+
+
+def get_csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%d/%m/%Y %H:%M:%S")
+    if isinstance(value, datetime.date):
+        return value.strftime("%d/%m/%Y")
+    return value
+
+
+def stream_csv(queryset, columns, chunk_size=None):
+    writer = csv.writer(Echo())
+    # The byte order mark tells excel the file is utf-8
+    yield "\ufeff" + writer.writerow([column.heading for column in columns])
+    for row in get_export_rows(queryset, columns, chunk_size):
+        yield writer.writerow([get_csv_value(value) for value in row])
+
+
+def csv_export_response(queryset, columns, filename, chunk_size=None):
+    response = StreamingHttpResponse(
+        stream_csv(queryset, columns, chunk_size), content_type="text/csv"
+    )
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+def write_xlsx(file, queryset, columns, chunk_size=None):
+    """Writes the queryset to file as an xlsx workbook and returns the number of rows written.
+
+    If there are more rows than fit on a worksheet they are continued on another worksheet."""
+    workbook = xlsxwriter.Workbook(
+        file, {"constant_memory": True, "remove_timezone": True}
+    )
+    heading_format = workbook.add_format({"bold": True})
+    date_format = workbook.add_format({"num_format": "dd/mm/yyyy"})
+    datetime_format = workbook.add_format({"num_format": "dd/mm/yyyy hh:mm:ss"})
+    money_format = workbook.add_format({"num_format": "#,##0.00"})
+
+    def add_worksheet():
+        worksheet = workbook.add_worksheet()
+        worksheet.write_row(
+            0, 0, [column.heading for column in columns], heading_format
+        )
+        return worksheet
+
+    worksheet = add_worksheet()
+    row_number = 0
+    rows_written = 0
+    for row in get_export_rows(queryset, columns, chunk_size):
+        if row_number == XLSX_MAX_ROWS_PER_WORKSHEET:
+            worksheet = add_worksheet()
+            row_number = 0
+        row_number += 1
+        for column_number, value in enumerate(row):
+            if value is None:
+                continue
+            if isinstance(value, datetime.datetime):
+                worksheet.write_datetime(
+                    row_number, column_number, value, datetime_format
+                )
+            elif isinstance(value, datetime.date):
+                worksheet.write_datetime(row_number, column_number, value, date_format)
+            elif isinstance(value, Decimal):
+                worksheet.write_number(
+                    row_number, column_number, float(value), money_format
+                )
+            else:
+                worksheet.write(row_number, column_number, value)
+        rows_written += 1
+
+    workbook.close()
+    return rows_written
+
+
+def xlsx_export_response(queryset, columns, filename, chunk_size=None):
+    file = tempfile.SpooledTemporaryFile(max_size=settings.EXPORT_XLSX_SPOOL_MAX_SIZE)
+    rows_written = write_xlsx(file, queryset, columns, chunk_size)
+    logger.info(f"Exported {rows_written} rows to {filename}.")
+    file.seek(0)
+    return FileResponse(
+        file, as_attachment=True, filename=filename, content_type=XLSX_CONTENT_TYPE
+    )
+
+
+def export_response(queryset, columns, export_format, filename, chunk_size=None):
+    if "csv" == export_format:
+        return csv_export_response(queryset, columns, filename, chunk_size)
+    if "xlsx" == export_format:
+        return xlsx_export_response(queryset, columns, filename, chunk_size)
+    raise ValueError(f"Unknown export format: {export_format}")
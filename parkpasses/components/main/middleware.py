@@ -0,0 +1,201 @@
+"""
+    This module contains the query instrumentation middleware.
+
+    When settings.QUERY_INSTRUMENTATION_ENABLED is set every query run while handling a
+    request is recorded and the number of queries, the queries that were run more than once
+    (usually an N+1 in a serializer), the database time and the time taken to render the
+    response are logged (as a json log line) and returned in the Server-Timing header.
+
+    Views can declare the most queries they should need with a query_budget attribute
+    (a number or a dict of numbers keyed by action / method) or the query_budget decorator.
+    Going over budget is logged as a warning or raises QueryBudgetExceeded if
+    settings.QUERY_BUDGET_RAISE is set (which tests can use to fail when a view regresses).
+"""
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+from parkpasses.components.main.exceptions import QueryBudgetExceeded
+
+logger = logging.getLogger(__name__)
+
+WHITESPACE = re.compile(r"\s+")
+PLACEHOLDER_LIST = re.compile(r"\((?:%s, )+%s\)")
+
+
+def get_query_fingerprint(sql):
+    """Queries that only differ by their parameters (including the number of
+    parameters in an IN list) have the same fingerprint"""
+    return PLACEHOLDER_LIST.sub("(%s, ...)", WHITESPACE.sub(" ", sql)).strip()
+
+
+def query_budget(budget):
+    """Sets the most queries a function based view should run"""
+
+    def decorator(view_func):
+        view_func.query_budget = budget
+        return view_func
+
+    return decorator
+
+
+def get_query_budget(view_func, request):
+    view_class = getattr(view_func, "cls", None) or getattr(
+        view_func, "view_class", None
+    )
+    budget = getattr(view_class or view_func, "query_budget", None)
+    if not isinstance(budget, dict):
+        return budget
+    method = request.method.lower()
+    actions = getattr(view_func, "actions", None) or {}
+    return budget.get(actions.get(method, method))
+
+
+def get_view_name(view_func, request):
+    view_class = getattr(view_func, "cls", None) or getattr(
+        view_func, "view_class", None
+    )
+    if view_class is None:
+        return f"{view_func.__module__}.{view_func.__name__}"
+    actions = getattr(view_func, "actions", None) or {}
+    action = actions.get(request.method.lower(), request.method.lower())
+    return f"{view_class.__module__}.{view_class.__name__}.{action}"
+
+
+class QueryRecorder:
+    """Records the fingerprint and duration of every query run on any database connection"""
+
+    def __init__(self):
+        self.queries = []
+        self.view_name = None
+        self.budget = None
+        self.render_start = None
+        self.render_time = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(
+                (get_query_fingerprint(sql), time.perf_counter() - start)
+            )
+
+    @contextmanager
+    def record(self):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+    @property
+    def query_count(self):
+        return len(self.queries)
+
+    @property
+    def db_time(self):
+        return sum(duration for fingerprint, duration in self.queries)
+
+    def get_duplicates(self):
+        """Returns (fingerprint, count) for each query that was run more than once, most repeated first"""
+        counts = Counter(fingerprint for fingerprint, duration in self.queries)
+        return [
+            (fingerprint, count)
+            for fingerprint, count in counts.most_common()
+            if count > 1
+        ]
+
+
+class QueryInstrumentationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.QUERY_INSTRUMENTATION_ENABLED:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        request._query_recorder = recorder
+        start = time.perf_counter()
+        with recorder.record():
+            response = self.get_response(request)
+        total_time = time.perf_counter() - start
+
+        duplicates = recorder.get_duplicates()
+        response["Server-Timing"] = self.get_server_timing(
+            recorder, duplicates, total_time
+        )
+        self.log(request, response, recorder, duplicates, total_time)
+        self.check_budget(recorder, duplicates)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        recorder = getattr(request, "_query_recorder", None)
+        if recorder is not None:
+            recorder.view_name = get_view_name(view_func, request)
+            recorder.budget = get_query_budget(view_func, request)
+
+    def process_template_response(self, request, response):
+        """DRF responses are rendered (and their serializer data turned into json) after this"""
+        recorder = getattr(request, "_query_recorder", None)
+        if recorder is not None:
+            recorder.render_start = time.perf_counter()
+
+            def record_render_time(response):
+                recorder.render_time = time.perf_counter() - recorder.render_start
+
+            response.add_post_render_callback(record_render_time)
+        return response
+
+    def get_server_timing(self, recorder, duplicates, total_time):
+        duplicated = sum(count for fingerprint, count in duplicates)
+        metrics = [
+            f'db;dur={recorder.db_time * 1000:.1f};desc="{recorder.query_count} queries '
+            f'({duplicated} duplicated)"'
+        ]
+        if recorder.render_time is not None:
+            metrics.append(f"render;dur={recorder.render_time * 1000:.1f}")
+        metrics.append(f"total;dur={total_time * 1000:.1f}")
+        return ", ".join(metrics)
+
+    def log(self, request, response, recorder, duplicates, total_time):
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "view": recorder.view_name,
+            "status": response.status_code,
+            "queries": recorder.query_count,
+            "query_budget": recorder.budget,
+            "db_ms": round(recorder.db_time * 1000, 1),
+            "render_ms": None
+            if recorder.render_time is None
+            else round(recorder.render_time * 1000, 1),
+            "total_ms": round(total_time * 1000, 1),
+            "duplicates": [
+                {"count": count, "sql": fingerprint[:200]}
+                for fingerprint, count in duplicates[
+                    : settings.QUERY_INSTRUMENTATION_DUPLICATES_LOGGED
+                ]
+            ],
+        }
+        logger.info(f"Query instrumentation: {json.dumps(record)}")
+
+    def check_budget(self, recorder, duplicates):
+        if recorder.budget is None or recorder.query_count <= recorder.budget:
+            return
+        message = (
+            f"{recorder.view_name} ran {recorder.query_count} queries "
+            f"(budget {recorder.budget})."
+        )
+        if duplicates:
+            fingerprint, count = duplicates[0]
+            message += f" Most repeated ({count} times): {fingerprint[:200]}"
+        if settings.QUERY_BUDGET_RAISE:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
@@ -0,0 +1,283 @@
+"""
+    This module converts documents (docx) to pdf using LibreOffice.
+
+    Starting LibreOffice takes a few seconds so rather than running
+    libreoffice --convert-to pdf for every document, each python process keeps a small pool
+    of headless soffice processes running and sends documents to them over a UNO named pipe.
+
+    - SofficeInstance (A single soffice process and the UNO connection to it)
+    - LibreOfficeConverterPool (A thread safe pool of soffice instances)
+
+    The python uno bindings are provided by the python3-uno os package. If they are not
+    installed (or settings.LIBREOFFICE_POOL_SIZE is 0) documents are converted by running
+    libreoffice --convert-to pdf for each document.
+"""
+import atexit
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+from parkpasses.components.main.exceptions import (
+    DocumentConversionFailed,
+    DocumentConversionTimedOut,
+)
+
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+    from com.sun.star.connection import NoConnectException
+except ImportError:
+    uno = None
+
+logger = logging.getLogger(__name__)
+
+
+def property_value(name, value):
+    prop = PropertyValue()
+    prop.Name = name
+    prop.Value = value
+    return prop
+
+
+class SofficeInstance:
+    """A class to represent a single headless soffice process"""
+
+    def __init__(self):
+        self.pipe_name = f"parkpasses-soffice-{uuid.uuid4().hex}"
+        self.profile_dir = None
+        self.process = None
+        self.desktop = None
+        self.conversions = 0
+
+    def __str__(self):
+        pid = self.process.pid if self.process else None
+        return f"soffice instance {self.pipe_name} (pid: {pid})"
+
+    def start(self):
+        # Each instance needs its own user profile or soffice will hand the
+        # request over to whichever instance is already using the profile
+        self.profile_dir = tempfile.mkdtemp(prefix="parkpasses-soffice-")
+        self.process = subprocess.Popen(
+            [
+                settings.LIBREOFFICE_BINARY,
+                "--headless",
+                "--invisible",
+                "--nologo",
+                "--nodefault",
+                "--norestore",
+                "--nolockcheck",
+                f"-env:UserInstallation=file://{self.profile_dir}",
+                f"--accept=pipe,name={self.pipe_name};urp;StarOffice.ComponentContext",
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", local_context
+        )
+        deadline = time.monotonic() + settings.LIBREOFFICE_STARTUP_TIMEOUT_SECONDS
+        while True:
+            try:
+                context = resolver.resolve(
+                    f"uno:pipe,name={self.pipe_name};urp;StarOffice.ComponentContext"
+                )
+                break
+            except NoConnectException:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.stop()
+                    raise DocumentConversionFailed(
+                        f"Unable to connect to soffice on pipe {self.pipe_name}."
+                    )
+                time.sleep(0.25)
+
+        self.desktop = context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.frame.Desktop", context
+        )
+        self.conversions = 0
+        logger.info(f"Started {self}.")
+
+    def stop(self):
+        logger.info(f"Stopping {self}.")
+        if self.desktop is not None:
+            try:
+                self.desktop.terminate()
+            except Exception:
+                # The process is most likely already dead
+                pass
+            self.desktop = None
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.terminate()
+                try:
+                    self.process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+                    self.process.wait()
+            self.process = None
+        if self.profile_dir is not None:
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+            self.profile_dir = None
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def is_healthy(self):
+        if self.process is None or self.desktop is None:
+            return False
+        if self.process.poll() is not None:
+            logger.warning(f"{self} has exited with code {self.process.returncode}.")
+            return False
+        try:
+            # A cheap round trip to make sure the instance is still responding
+            self.desktop.getComponents()
+        except Exception as e:
+            logger.warning(f"{self} failed its health check: {e}")
+            return False
+        return True
+
+    def convert(self, source_path, pdf_path):
+        source_url = uno.systemPathToFileUrl(os.path.abspath(source_path))
+        pdf_url = uno.systemPathToFileUrl(os.path.abspath(pdf_path))
+        document = self.desktop.loadComponentFromURL(
+            source_url,
+            "_blank",
+            0,
+            (property_value("Hidden", True), property_value("ReadOnly", True)),
+        )
+        if document is None:
+            raise DocumentConversionFailed(f"soffice was unable to open {source_path}.")
+        try:
+            document.storeToURL(
+                pdf_url, (property_value("FilterName", "writer_pdf_Export"),)
+            )
+        finally:
+            document.close(True)
+        self.conversions += 1
+
+    def convert_with_timeout(self, source_path, pdf_path, timeout):
+        errors = []
+
+        def target():
+            try:
+                self.convert(source_path, pdf_path)
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        thread.join(timeout)
+        if thread.is_alive():
+            # Killing the process makes the blocked uno call in the thread return
+            self.process.kill()
+            raise DocumentConversionTimedOut(
+                f"{self} took longer than {timeout} seconds to convert {source_path}."
+            )
+        if errors:
+            raise DocumentConversionFailed(
+                f"{self} failed to convert {source_path}: {errors[0]}"
+            ) from errors[0]
+
+
+class LibreOfficeConverterPool:
+    """A class to represent a pool of soffice instances
+
+    Instances are started the first time they are used, restarted if they fail a health
+    check or a conversion and recycled after settings.LIBREOFFICE_RECYCLE_AFTER_CONVERSIONS
+    conversions. convert_to_pdf blocks until an instance is free so it can be called from
+    as many threads as you like."""
+
+    def __init__(self, size):
+        self.size = size
+        # Last in first out so a lightly loaded pool keeps reusing the same warm instance
+        self.idle_instances = queue.LifoQueue()
+        for i in range(size):
+            self.idle_instances.put(SofficeInstance())
+
+    def convert_to_pdf(self, source_path, pdf_path, timeout=None):
+        if timeout is None:
+            timeout = settings.LIBREOFFICE_CONVERSION_TIMEOUT_SECONDS
+        instance = self.idle_instances.get()
+        try:
+            if not instance.is_healthy():
+                instance.restart()
+            instance.convert_with_timeout(source_path, pdf_path, timeout)
+            if instance.conversions >= settings.LIBREOFFICE_RECYCLE_AFTER_CONVERSIONS:
+                logger.info(
+                    f"Recycling {instance} after {instance.conversions} conversions."
+                )
+                # The instance is started again the next time it is used
+                instance.stop()
+        except DocumentConversionFailed:
+            instance.stop()
+            raise
+        finally:
+            self.idle_instances.put(instance)
+        return pdf_path
+
+    def shutdown(self):
+        while True:
+            try:
+                instance = self.idle_instances.get_nowait()
+            except queue.Empty:
+                break
+            instance.stop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_converter_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = LibreOfficeConverterPool(settings.LIBREOFFICE_POOL_SIZE)
+            atexit.register(_pool.shutdown)
+    return _pool
+
+
+def convert_with_subprocess(source_path, pdf_path):
+    outdir = os.path.dirname(pdf_path)
+    try:
+        output = subprocess.check_output(
+            [
+                settings.LIBREOFFICE_BINARY,
+                "--headless",
+                "--convert-to",
+                "pdf",
+                source_path,
+                "--outdir",
+                outdir,
+            ],
+            timeout=settings.LIBREOFFICE_CONVERSION_TIMEOUT_SECONDS,
+        )
+    except subprocess.TimeoutExpired as e:
+        raise DocumentConversionTimedOut(f"Timed out converting {source_path}.") from e
+    except subprocess.CalledProcessError as e:
+        raise DocumentConversionFailed(f"Failed to convert {source_path}.") from e
+    logger.info(f"Subprocess output = {output}")
+
+    converted_path = os.path.join(
+        outdir, os.path.splitext(os.path.basename(source_path))[0] + ".pdf"
+    )
+    if converted_path != pdf_path:
+        os.replace(converted_path, pdf_path)
+    return pdf_path
+
+
+def convert_to_pdf(source_path, pdf_path):
+    """Converts the document at source_path to a pdf saved at pdf_path"""
+    if uno is None or not settings.LIBREOFFICE_POOL_SIZE:
+        return convert_with_subprocess(source_path, pdf_path)
+    return get_converter_pool().convert_to_pdf(source_path, pdf_path)
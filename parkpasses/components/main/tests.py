@@ -1,5 +1,63 @@
 # from datetime import datetime
-from django.test import TestCase
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from decimal import Decimal
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import transaction
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from parkpasses.components.cart.models import Cart, CartItem
+from parkpasses.components.discount_codes.models import DiscountCode, DiscountCodeBatch
+from parkpasses.components.main import pdf_converter
+from parkpasses.components.main.api import CustomDatatablesListMixin
+from parkpasses.components.main.cache import (
+    invalidate_user_permissions,
+    user_permissions_key,
+)
+from parkpasses.components.main.exceptions import (
+    DocumentConversionFailed,
+    DocumentConversionTimedOut,
+    QueryBudgetExceeded,
+)
+from parkpasses.components.main.exports import (
+    ExportColumn,
+    stream_csv,
+    xlsx_export_response,
+)
+from parkpasses.components.main.middleware import (
+    QueryInstrumentationMiddleware,
+    query_budget,
+)
+from parkpasses.components.main.pdf_converter import (
+    LibreOfficeConverterPool,
+    SofficeInstance,
+)
+from parkpasses.components.main.utils import get_count_estimate
+from parkpasses.components.orders.models import Order, OrderItem
+from parkpasses.components.passes.models import (
+    Pass,
+    PassType,
+    PassTypePricingWindow,
+    PassTypePricingWindowOption,
+)
+from parkpasses.components.retailers.models import RetailerGroup
+from parkpasses.components.vouchers.models import Voucher, VoucherTransaction
+from parkpasses.management.commands.cron_tasks import run_task_graph
 
 # from parkpasses.components.main.models import UserAction
 
@@ -10,3 +68,420 @@ class TestTestCase(TestCase):
 
     def test_tests(self):
         self.assertEqual("test", "test")
+
+
+class CustomDatatablesListMixinTestCase(TestCase):
+    class ContentTypeListView(CustomDatatablesListMixin):
+        def get_queryset(self):
+            return ContentType.objects.all()
+
+    def setUp(self):
+        self.view = self.ContentTypeListView()
+        self.factory = APIRequestFactory()
+
+    def get_request(self, **params):
+        return Request(self.factory.get("/", params))
+
+    def test_page_range_honours_start_and_length(self):
+        request = self.get_request(start=40, length=10)
+        self.assertEqual((40, 10), self.view.get_datatables_page_range(request))
+
+    def test_page_range_is_capped(self):
+        request = self.get_request(start=-5, length=-1)
+        self.assertEqual(
+            (0, settings.DATATABLES_MAX_PAGE_SIZE),
+            self.view.get_datatables_page_range(request),
+        )
+
+    def test_only_the_requested_page_is_returned_in_order(self):
+        queryset = self.view.get_stable_ordering(ContentType.objects.order_by("-model"))
+        expected = list(queryset)[2:5]
+        self.assertEqual(expected, self.view.get_datatables_page(queryset, 2, 3))
+
+    def test_only_filtered_querysets_are_counted_again(self):
+        self.assertFalse(self.view.is_filtered(ContentType.objects.distinct()))
+        self.assertTrue(
+            self.view.is_filtered(
+                ContentType.objects.filter(app_label="parkpasses").distinct()
+            )
+        )
+        self.assertTrue(self.view.is_filtered(ContentType.objects.none()))
+
+    def test_count_estimate_is_exact_for_small_tables(self):
+        self.assertEqual(
+            ContentType.objects.count(), get_count_estimate(ContentType.objects.all())
+        )
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "parkpasses.components.main.cache.TieredCache",
+            "OPTIONS": {"L2": "shared", "L1_TIMEOUT": 10},
+        },
+        "shared": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    }
+)
+class TieredCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        cache.metrics.reset()
+
+    def test_values_are_read_from_the_shared_tier_and_kept_locally(self):
+        caches["shared"].set("key", "value")
+        self.assertEqual(cache.get("key"), "value")
+        caches["shared"].delete("key")
+        self.assertEqual(cache.get("key"), "value")
+        counters = cache.metrics.snapshot()["counters"]
+        self.assertEqual(counters["l2_hits"], 1)
+        self.assertEqual(counters["l1_hits"], 1)
+
+    def test_writes_go_to_both_tiers(self):
+        cache.set("key", "value")
+        self.assertEqual(caches["shared"].get("key"), "value")
+        cache.delete("key")
+        self.assertIsNone(caches["shared"].get("key"))
+        self.assertIsNone(cache.get("key"))
+
+    def test_invalidate_user_permissions(self):
+        cache_key = user_permissions_key(1, "user-1-is-internal")
+        cache.set(cache_key, True)
+        other_cache_key = user_permissions_key(2, "user-2-is-internal")
+        cache.set(other_cache_key, True)
+        invalidate_user_permissions(1)
+        self.assertIsNone(cache.get(user_permissions_key(1, "user-1-is-internal")))
+        self.assertTrue(cache.get(other_cache_key))
+
+
+class CronTasksTestCase(SimpleTestCase):
+    def test_tasks_run_after_the_tasks_they_depend_on(self):
+        tasks = {"a": [], "b": ["a"], "c": [], "d": ["b", "c"]}
+        started = []
+
+        def run_task(name):
+            started.append(name)
+            return name
+
+        finished = run_task_graph(tasks, run_task, 2)
+        self.assertCountEqual(finished, tasks.keys())
+        for name, dependencies in tasks.items():
+            for dependency in dependencies:
+                self.assertLess(started.index(dependency), started.index(name))
+
+    def test_cycles_are_rejected(self):
+        with self.assertRaises(CommandError):
+            run_task_graph({"a": ["b"], "b": ["a"]}, lambda name: name, 2)
+        with self.assertRaises(CommandError):
+            run_task_graph({"a": ["missing"]}, lambda name: name, 2)
+
+
+@override_settings(EXPORT_CHUNK_SIZE=2)
+class ExportsTestCase(TestCase):
+    columns = [
+        ExportColumn("App Label", "app_label"),
+        ExportColumn("Model", "model"),
+    ]
+
+    def get_queryset(self):
+        return ContentType.objects.filter(app_label="contenttypes").order_by("id")
+
+    def test_csv_export(self):
+        lines = "".join(stream_csv(self.get_queryset(), self.columns)).splitlines()
+        self.assertEqual(lines[0], "\ufeffApp Label,Model")
+        self.assertEqual(lines[1:], ["contenttypes,contenttype"])
+
+    def test_xlsx_export(self):
+        response = xlsx_export_response(
+            self.get_queryset(), self.columns, "content_types.xlsx"
+        )
+        content = b"".join(response.streaming_content)
+        self.assertIn("content_types.xlsx", response["Content-Disposition"])
+        # xlsx files are zip files
+        self.assertTrue(content.startswith(b"PK"))
+
+
+@query_budget(2)
+def content_types_view(request):
+    # One query per content type (an N+1)
+    for content_type_id in ContentType.objects.values_list("id", flat=True)[:3]:
+        ContentType.objects.filter(id=content_type_id).exists()
+    return HttpResponse()
+
+
+@override_settings(QUERY_INSTRUMENTATION_ENABLED=True, QUERY_BUDGET_RAISE=True)
+class QueryInstrumentationMiddlewareTestCase(TestCase):
+    def get_response(self, view):
+        request = RequestFactory().get("/")
+        middleware = QueryInstrumentationMiddleware(
+            lambda request: middleware.process_view(request, view, (), {})
+            or view(request)
+        )
+        return middleware(request)
+
+    def test_server_timing(self):
+        with self.settings(QUERY_BUDGET_RAISE=False):
+            response = self.get_response(content_types_view)
+        self.assertIn('desc="4 queries (3 duplicated)"', response["Server-Timing"])
+
+    def test_query_budget_exceeded(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.get_response(content_types_view)
+
+    @override_settings(QUERY_INSTRUMENTATION_ENABLED=False)
+    def test_disabled(self):
+        response = self.get_response(content_types_view)
+        self.assertFalse(response.has_header("Server-Timing"))
+
+
+class FakeSofficeInstance(SofficeInstance):
+    """A soffice instance that 'converts' documents without running soffice"""
+
+    def __init__(self):
+        super().__init__()
+        self.starts = 0
+        self.stops = 0
+        self.convert_seconds = 0
+        self.on_convert = None
+
+    def start(self):
+        self.starts += 1
+        self.process = mock.Mock(pid=1)
+        self.process.poll.return_value = None
+        self.desktop = mock.Mock()
+        self.conversions = 0
+
+    def stop(self):
+        self.stops += 1
+        self.process = None
+        self.desktop = None
+
+    def convert(self, source_path, pdf_path):
+        time.sleep(self.convert_seconds)
+        if self.on_convert:
+            self.on_convert()
+        self.conversions += 1
+
+
+@override_settings(LIBREOFFICE_RECYCLE_AFTER_CONVERSIONS=3)
+class LibreOfficeConverterPoolTestCase(SimpleTestCase):
+    def setUp(self):
+        with mock.patch.object(pdf_converter, "SofficeInstance", FakeSofficeInstance):
+            self.pool = LibreOfficeConverterPool(1)
+        self.instance = self.pool.idle_instances.queue[0]
+
+    def test_instance_is_checked_out_and_returned(self):
+        idle_during_conversion = []
+        self.instance.on_convert = lambda: idle_during_conversion.append(
+            self.pool.idle_instances.qsize()
+        )
+        self.pool.convert_to_pdf("a.docx", "a.pdf")
+        self.pool.convert_to_pdf("b.docx", "b.pdf")
+        self.assertEqual(idle_during_conversion, [0, 0])
+        self.assertEqual(self.pool.idle_instances.qsize(), 1)
+        # Started the first time it was used and then reused
+        self.assertEqual(self.instance.starts, 1)
+        self.assertEqual(self.instance.conversions, 2)
+
+    def test_conversion_timeout(self):
+        self.pool.convert_to_pdf("a.docx", "a.pdf")
+        process = self.instance.process
+        stops = self.instance.stops
+        self.instance.convert_seconds = 1
+        with self.assertRaises(DocumentConversionTimedOut):
+            self.pool.convert_to_pdf("b.docx", "b.pdf", timeout=0.1)
+        process.kill.assert_called_once()
+        self.assertEqual(self.instance.stops, stops + 1)
+        self.assertEqual(self.pool.idle_instances.qsize(), 1)
+        # The instance is started again the next time it is used
+        self.instance.convert_seconds = 0
+        self.pool.convert_to_pdf("c.docx", "c.pdf")
+        self.assertEqual(self.instance.starts, 2)
+
+    def test_instance_is_recycled(self):
+        for i in range(3):
+            self.pool.convert_to_pdf(f"{i}.docx", f"{i}.pdf")
+        self.assertEqual(self.instance.starts, 1)
+        self.assertIsNone(self.instance.process)
+        self.pool.convert_to_pdf("3.docx", "3.pdf")
+        self.assertEqual(self.instance.starts, 2)
+        self.assertEqual(self.instance.conversions, 1)
+
+
+class ConvertWithSubprocessTestCase(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.source_path = os.path.join(self.temp_dir, "Pass.docx")
+        self.pdf_path = os.path.join(self.temp_dir, "PP000001.pdf")
+
+    def fake_libreoffice(self, command, timeout):
+        outdir = command[command.index("--outdir") + 1]
+        with open(os.path.join(outdir, "Pass.pdf"), "w") as pdf:
+            pdf.write("%PDF")
+        return b""
+
+    @mock.patch.object(pdf_converter, "uno", None)
+    @mock.patch.object(pdf_converter.subprocess, "check_output")
+    def test_falls_back_to_subprocess_without_uno(self, check_output):
+        check_output.side_effect = self.fake_libreoffice
+        self.assertEqual(
+            pdf_converter.convert_to_pdf(self.source_path, self.pdf_path),
+            self.pdf_path,
+        )
+        self.assertTrue(os.path.exists(self.pdf_path))
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, "Pass.pdf")))
+
+    @override_settings(LIBREOFFICE_POOL_SIZE=0)
+    @mock.patch.object(pdf_converter, "get_converter_pool")
+    @mock.patch.object(pdf_converter.subprocess, "check_output")
+    def test_falls_back_to_subprocess_without_a_pool(
+        self, check_output, get_converter_pool
+    ):
+        check_output.side_effect = self.fake_libreoffice
+        pdf_converter.convert_to_pdf(self.source_path, self.pdf_path)
+        get_converter_pool.assert_not_called()
+        self.assertTrue(os.path.exists(self.pdf_path))
+
+    @mock.patch.object(pdf_converter.subprocess, "check_output")
+    def test_subprocess_errors(self, check_output):
+        check_output.side_effect = subprocess.CalledProcessError(1, "libreoffice")
+        with self.assertRaises(DocumentConversionFailed):
+            pdf_converter.convert_with_subprocess(self.source_path, self.pdf_path)
+        check_output.side_effect = subprocess.TimeoutExpired("libreoffice", 60)
+        with self.assertRaises(DocumentConversionTimedOut):
+            pdf_converter.convert_with_subprocess(self.source_path, self.pdf_path)
+
+
+class GenerateDatasetTestCase(TestCase):
+    fixtures = ["parkpasses/components/passes/fixtures/pass-types.json"]
+
+    def setUp(self):
+        RetailerGroup.objects.get_or_create(
+            ledger_organisation=settings.PARKPASSES_DEFAULT_SOLD_VIA_ORGANISATION_ID
+        )
+        # The pricing windows are invalidated when the changes are committed
+        with self.captureOnCommitCallbacks(execute=True):
+            for pass_type_name, duration in [
+                (settings.HOLIDAY_PASS, 5),
+                (settings.ANNUAL_LOCAL_PASS, 365),
+            ]:
+                pricing_window = PassTypePricingWindow.objects.create(
+                    name="Default",
+                    pass_type=PassType.objects.get(name=pass_type_name),
+                    date_start=timezone.now().date() - timezone.timedelta(days=800),
+                )
+                PassTypePricingWindowOption.objects.create(
+                    pricing_window=pricing_window,
+                    name="Option 1",
+                    duration=duration,
+                    price=Decimal("50.00"),
+                )
+
+    def generate_dataset(self, seed=1):
+        stdout = io.StringIO()
+        call_command(
+            "parkpasses_generate_dataset",
+            "--seed",
+            str(seed),
+            "--passes",
+            "30",
+            "--vouchers",
+            "10",
+            "--carts",
+            "5",
+            "--retailers",
+            "3",
+            "--discount-code-batches",
+            "2",
+            "--codes-per-batch",
+            "5",
+            "--users",
+            "10",
+            "--voucher-share",
+            "0.5",
+            "--batch-size",
+            "7",
+            "--force",
+            stdout=stdout,
+        )
+        return stdout.getvalue()
+
+    def get_dataset(self):
+        """The generated rows without the ids (and the numbers made from them)"""
+        return {
+            "passes": list(
+                Pass.objects.order_by("id").values_list(
+                    "first_name",
+                    "email",
+                    "vehicle_registration_1",
+                    "option_id",
+                    "date_start",
+                    "in_cart",
+                    "processing_status",
+                    "price_paid",
+                    "sold_via__ledger_organisation",
+                    "datetime_created",
+                )
+            ),
+            "vouchers": list(
+                Voucher.objects.order_by("id").values_list(
+                    "code", "pin", "amount", "balance", "datetime_purchased"
+                )
+            ),
+            "orders": list(
+                Order.objects.order_by("id").values_list(
+                    "uuid", "invoice_reference", "items__amount", "datetime_created"
+                )
+            ),
+            "discount_codes": list(
+                DiscountCode.objects.order_by("id").values_list("code", flat=True)
+            ),
+        }
+
+    def test_row_counts(self):
+        output = self.generate_dataset()
+
+        self.assertIn("Dataset generated.", output)
+        self.assertEqual(Pass.objects.filter(in_cart=False).count(), 30)
+        self.assertEqual(Voucher.objects.count(), 10)
+        self.assertEqual(Order.objects.count(), 40)
+        self.assertEqual(OrderItem.objects.count(), 40)
+        self.assertEqual(Cart.objects.count(), 5)
+        self.assertEqual(
+            CartItem.objects.count(), Pass.objects.filter(in_cart=True).count()
+        )
+        self.assertGreaterEqual(CartItem.objects.count(), 5)
+        self.assertEqual(DiscountCodeBatch.objects.count(), 2)
+        self.assertEqual(DiscountCode.objects.count(), 10)
+        self.assertEqual(
+            RetailerGroup.objects.exclude(
+                ledger_organisation=settings.PARKPASSES_DEFAULT_SOLD_VIA_ORGANISATION_ID
+            ).count(),
+            3,
+        )
+
+    def test_the_same_seed_generates_the_same_dataset(self):
+        with transaction.atomic():
+            self.generate_dataset()
+            dataset = self.get_dataset()
+            transaction.set_rollback(True)
+        self.assertFalse(Pass.objects.exists())
+
+        self.generate_dataset()
+
+        self.assertEqual(self.get_dataset(), dataset)
+
+    def test_voucher_balances_match_their_transactions(self):
+        self.generate_dataset()
+
+        self.assertTrue(VoucherTransaction.objects.exists())
+        for voucher in Voucher.objects.all():
+            transactions = voucher.transactions.aggregate(
+                credit=Sum("credit"), debit=Sum("debit")
+            )
+            self.assertEqual(
+                voucher.balance,
+                voucher.amount
+                + (transactions["credit"] or Decimal("0.00"))
+                - (transactions["debit"] or Decimal("0.00")),
+            )
@@ -2,6 +2,7 @@ from django.conf.urls import url
 from rest_framework import routers
 
 from parkpasses.components.main.api import (
+    CacheMetrics,
     DocumentCreateView,
     DocumentViewSet,
     EntryTypeList,
@@ -18,6 +19,7 @@ router.register(
 )
 urlpatterns = [
     url(r"internal/park-passes-system-check/$", ParkPassesSystemCheck.as_view()),
+    url(r"internal/cache-metrics/$", CacheMetrics.as_view(), name="cache-metrics"),
     # ========================================================================== Org Model Logs
     url(
         r"org-model-logs/user-actions",
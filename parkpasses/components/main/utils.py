@@ -1,7 +1,9 @@
+import json
+
 import pytz
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
-from django.db import connection
+from django.db import connection, connections
 from ledger_api_client.ledger_models import EmailUserRO as EmailUser
 from org_model_logs.models import CommunicationsLogEntry, EntryType
 from rest_framework import serializers
@@ -31,6 +33,27 @@ def check_db_connection():
         connection.connect()
 
 
+def get_count_estimate(queryset):
+    """Returns the number of rows in the queryset
+
+    Counting a large table in postgres means scanning the whole table so when the query
+    planner estimates there are at least settings.DATATABLES_EXACT_COUNT_THRESHOLD rows
+    its estimate is returned instead of an exact count."""
+    queryset = queryset.order_by()
+    db_connection = connections[queryset.db]
+    if "postgresql" == db_connection.vendor:
+        sql, params = queryset.query.sql_with_params()
+        with db_connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        estimate = int(plan[0]["Plan"]["Plan Rows"])
+        if estimate >= settings.DATATABLES_EXACT_COUNT_THRESHOLD:
+            return estimate
+    return queryset.count()
+
+
 def _get_params(layer_name):
     return {
         "SERVICE": "WFS",
@@ -58,3 +81,28 @@ def log_communication(to, message, entry_type, instance):
         "staff": staff.id,
     }
     CommunicationsLogEntry.objects.log_communication(**communication_log_kwargs)
+
+
+def log_communications(batch_messages, entry_type):
+    """Logs the messages of a BatchEmailSender that were sent in one insert"""
+    entry_type = EntryType.objects.get(entry_type__iexact=entry_type)
+    staff = EmailUser.objects.get(email__icontains=settings.DEFAULT_FROM_EMAIL)
+    communications_log_entries = []
+    for batch_message in batch_messages:
+        if not batch_message.sent:
+            continue
+        instance = batch_message.instance
+        communications_log_entries.append(
+            CommunicationsLogEntry(
+                content_type=ContentType.objects.get_for_model(instance),
+                object_id=str(instance.id),
+                to=batch_message.to_addresses,
+                fromm=settings.DEFAULT_FROM_EMAIL,
+                entry_type=entry_type,
+                subject=batch_message.message.subject,
+                text=batch_message.message.body,
+                customer=batch_message.customer,
+                staff=staff.id,
+            )
+        )
+    CommunicationsLogEntry.objects.bulk_create(communications_log_entries)
@@ -1,13 +1,14 @@
 import logging
 
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from rest_framework import viewsets
-from rest_framework.generics import ListAPIView
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from parkpasses.components.parks.models import LGA, Park, ParkGroup, Postcode
+from parkpasses.components.parks.models import LGA, Park, Postcode
+from parkpasses.components.parks.postcodes import PostcodeParkGroupIndex
 from parkpasses.components.parks.serializers import (
-    ExternalParkGroupSerializer,
     LGASerializer,
     ParkSerializer,
     PostcodeSerializer,
@@ -68,21 +69,45 @@ class LGAViewSet(viewsets.ModelViewSet):
         return False
 
 
+def postcode_response(request, data, etag):
+    """Returns a 304 (not modified) response when the client already has this data"""
+    response = get_conditional_response(request, etag=quote_etag(etag))
+    if response is None:
+        response = Response(data)
+    response["ETag"] = quote_etag(etag)
+    return response
+
+
 class ValidatePostcodeView(APIView):
     def get(self, request, format=None):
         postcode = request.query_params.get("postcode", None)
-        if postcode:
-            if Postcode.objects.filter(postcode=postcode).exists():
-                return Response({"is_postcode_valid": True})
-        return Response({"is_postcode_valid": False})
+        is_postcode_valid = bool(postcode) and PostcodeParkGroupIndex.is_valid(postcode)
+        return postcode_response(
+            request,
+            {"is_postcode_valid": is_postcode_valid},
+            "valid" if is_postcode_valid else "invalid",
+        )
 
 
-class ParkGroupsForPostcodeView(ListAPIView):
-    serializer_class = ExternalParkGroupSerializer
+class ParkGroupsForPostcodeView(APIView):
+    """The park groups local to a postcode laid out as ExternalParkGroupSerializer would
+    (in a single page of results like the list view this replaced returned)"""
 
-    def get_queryset(self):
-        queryset = ParkGroup.objects.none()
-        postcode = self.request.query_params.get("postcode")
-        if Postcode.objects.filter(postcode=postcode).exists():
-            queryset = ParkGroup.get_park_groups_by_postcode(postcode=postcode)
-        return queryset
+    def get(self, request, format=None):
+        postcode = request.query_params.get("postcode")
+        postcode_park_groups = PostcodeParkGroupIndex.resolve(postcode)
+        if postcode_park_groups is None:
+            return postcode_response(request, self.get_page_data([]), "no-park-groups")
+        return postcode_response(
+            request,
+            self.get_page_data(postcode_park_groups.park_groups),
+            postcode_park_groups.etag,
+        )
+
+    def get_page_data(self, park_groups):
+        return {
+            "count": len(park_groups),
+            "next": None,
+            "previous": None,
+            "results": park_groups,
+        }
@@ -83,7 +83,7 @@ class LGA(models.Model):
 
 class ParkGroupManager(models.Manager):
     def get_queryset(self):
-        return super().get_queryset().select_related("parks")
+        return super().get_queryset().prefetch_related("parks")
 
 
 class ParkGroup(models.Model):
@@ -117,20 +117,15 @@ class ParkGroup(models.Model):
 
     @classmethod
     def get_park_groups_by_postcode(self, postcode):
-        lga_ids = list(
-            LGA.objects.filter(postcodes__postcode=postcode)
-            .values_list("id", flat=True)
-            .distinct()
-        )
-        return ParkGroup.objects.filter(lgas__id__in=lga_ids).distinct()
+        return ParkGroup.objects.filter(lgas__postcodes__postcode=postcode).distinct()
 
     @classmethod
     def get_park_groups_name_list_by_postcode(self, postcode):
-        return self.get_park_group_by_postcode(postcode).values_list("name", flat=True)
+        return self.get_park_groups_by_postcode(postcode).values_list("name", flat=True)
 
     @classmethod
     def get_park_groups_name_list_by_postcode_as_string(self, postcode):
-        return ", ".join(self.get_park_group_name_list_by_postcode(postcode))
+        return ", ".join(self.get_park_groups_name_list_by_postcode(postcode))
 
 
 class MemberManager(models.Manager):
@@ -0,0 +1,98 @@
+"""
+    This module contains the postcode index used by the public purchase form.
+
+    Every postcode is mapped to the (serialized) park groups local to it the first time the
+    index is needed. The mapping is built with a few queries and changes very rarely, so
+    validating a postcode or listing its park groups doesn't touch the database.
+
+    Each python process keeps its own copy of the index which is reloaded whenever a postcode,
+    LGA, park, park group or membership is changed (see parkpasses.components.parks.signals).
+"""
+import hashlib
+import json
+import logging
+
+from django.conf import settings
+
+from parkpasses.components.main.cache import VersionedLocalCache
+from parkpasses.components.parks.models import LGA, Member, ParkGroup, Postcode
+
+logger = logging.getLogger(__name__)
+
+
+class PostcodeParkGroups:
+    """The park groups local to a postcode along with an etag for them"""
+
+    def __init__(self, park_groups):
+        self.park_groups = park_groups
+        self.etag = hashlib.md5(
+            json.dumps(park_groups, sort_keys=True).encode()
+        ).hexdigest()
+
+
+class PostcodeParkGroupIndex(VersionedLocalCache):
+    version_cache_key = settings.CACHE_KEY_POSTCODE_PARK_GROUPS_VERSION
+
+    @classmethod
+    def load(self):
+        parks = {}
+        for park_group_id, park_id, park_name in (
+            Member.objects.order_by("park_group_id", "display_order")
+            .values_list("park_group_id", "park_id", "park__name")
+            .iterator()
+        ):
+            parks.setdefault(park_group_id, []).append(
+                {"id": park_id, "name": park_name}
+            )
+
+        # Laid out the same as parkpasses.components.parks.serializers.ExternalParkGroupSerializer
+        park_groups = {
+            park_group_id: {
+                "id": park_group_id,
+                "name": name,
+                "parks": parks.get(park_group_id, []),
+            }
+            for park_group_id, name in ParkGroup.objects.order_by(
+                "display_order"
+            ).values_list("id", "name")
+        }
+
+        lga_park_group_ids = {}
+        for lga_id, park_group_id in ParkGroup.lgas.through.objects.values_list(
+            "lga_id", "parkgroup_id"
+        ):
+            lga_park_group_ids.setdefault(lga_id, set()).add(park_group_id)
+
+        postcode_park_group_ids = {
+            postcode: set()
+            for postcode in Postcode.objects.values_list("postcode", flat=True)
+        }
+        for postcode, lga_id in LGA.postcodes.through.objects.values_list(
+            "postcode__postcode", "lga_id"
+        ):
+            postcode_park_group_ids[postcode].update(
+                lga_park_group_ids.get(lga_id, set())
+            )
+
+        index = {}
+        for postcode, park_group_ids in postcode_park_group_ids.items():
+            # Keep the park groups in display order
+            index[postcode] = PostcodeParkGroups(
+                [
+                    park_group
+                    for park_group_id, park_group in park_groups.items()
+                    if park_group_id in park_group_ids
+                ]
+            )
+
+        logger.info(f"Loaded the park groups for {len(index)} postcodes.")
+        return index
+
+    @classmethod
+    def is_valid(self, postcode):
+        return postcode in self.get()
+
+    @classmethod
+    def resolve(self, postcode):
+        """Returns the park groups (with an etag) for the postcode or None if it isn't valid"""
+        return self.get().get(postcode)
@@ -0,0 +1,34 @@
+import logging
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from parkpasses.components.parks.models import LGA, Member, Park, ParkGroup, Postcode
+from parkpasses.components.parks.postcodes import PostcodeParkGroupIndex
+
+logger = logging.getLogger(__name__)
+
+
+def invalidate_postcode_park_groups(sender, instance, **kwargs):
+    """The postcode index is built from these models so any change to
+    them means the index has to be loaded again
+
+    Not until the change is committed otherwise another process could build the
+    index (and its etags) from the old rows and cache it under the new version"""
+    logger.info(
+        f"{sender.__name__} {instance} changed so invalidating postcode park groups."
+    )
+    transaction.on_commit(PostcodeParkGroupIndex.invalidate)
+
+
+def invalidate_postcode_park_groups_m2m(sender, instance, action, **kwargs):
+    if action in ["post_add", "post_remove", "post_clear"]:
+        invalidate_postcode_park_groups(sender, instance, **kwargs)
+
+
+for model in (LGA, Member, Park, ParkGroup, Postcode):
+    post_save.connect(invalidate_postcode_park_groups, sender=model)
+    post_delete.connect(invalidate_postcode_park_groups, sender=model)
+
+for through in (LGA.postcodes.through, ParkGroup.lgas.through):
+    m2m_changed.connect(invalidate_postcode_park_groups_m2m, sender=through)
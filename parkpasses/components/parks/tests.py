@@ -1,3 +1,61 @@
-# from django.test import TestCase
+from django.test import TestCase, override_settings
+from rest_framework.test import APIRequestFactory
 
-# Create your tests here.
+from parkpasses.components.parks.api import ParkGroupsForPostcodeView
+from parkpasses.components.parks.models import LGA, Member, Park, ParkGroup, Postcode
+from parkpasses.components.parks.postcodes import PostcodeParkGroupIndex
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class PostcodeParkGroupIndexTestCase(TestCase):
+    def setUp(self):
+        # The index is invalidated when the changes are committed
+        with self.captureOnCommitCallbacks(execute=True):
+            self.postcode = Postcode.objects.create(postcode="6163")
+            Postcode.objects.create(postcode="6000")
+            self.lga = LGA.objects.create(name="Cockburn")
+            self.lga.postcodes.add(self.postcode)
+            self.park_group = ParkGroup.objects.create(
+                name="Perth Hills", display_order=1, display_externally=True
+            )
+            park = Park.objects.create(name="John Forrest", display_externally=True)
+            Member.objects.create(
+                park_group=self.park_group, park=park, display_order=1
+            )
+
+    def test_resolve(self):
+        self.assertTrue(PostcodeParkGroupIndex.is_valid("6000"))
+        self.assertFalse(PostcodeParkGroupIndex.is_valid("9999"))
+        self.assertEqual(PostcodeParkGroupIndex.resolve("6163").park_groups, [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.park_group.lgas.add(self.lga)
+            # Not until the change is committed
+            self.assertEqual(PostcodeParkGroupIndex.resolve("6163").park_groups, [])
+        park_groups = PostcodeParkGroupIndex.resolve("6163").park_groups
+        self.assertEqual(len(park_groups), 1)
+        self.assertEqual(park_groups[0]["name"], "Perth Hills")
+        self.assertEqual(park_groups[0]["parks"][0]["name"], "John Forrest")
+        self.assertEqual(PostcodeParkGroupIndex.resolve("6000").park_groups, [])
+
+    def test_park_groups_for_postcode_etag(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.park_group.lgas.add(self.lga)
+        view = ParkGroupsForPostcodeView.as_view()
+        factory = APIRequestFactory()
+        with self.assertNumQueries(0):
+            PostcodeParkGroupIndex.get()
+            response = view(factory.get("/", {"postcode": "6163"}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 1)
+        self.assertEqual(response.data["results"][0]["id"], self.park_group.id)
+        self.assertEqual(response.data["results"][0]["name"], "Perth Hills")
+        response = view(
+            factory.get("/", {"postcode": "6163"}, HTTP_IF_NONE_MATCH=response["ETag"])
+        )
+        self.assertEqual(response.status_code, 304)
+        response = view(factory.get("/", {"postcode": "9999"}))
+        self.assertEqual(response.data["count"], 0)
+        self.assertEqual(response.data["results"], [])
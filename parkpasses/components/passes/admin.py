@@ -8,10 +8,12 @@ from parkpasses.components.passes.models import (
     Pass,
     PassAutoRenewalAttempt,
     PassCancellation,
+    PassPdfJob,
     PassTemplate,
     PassType,
     PassTypePricingWindow,
     PassTypePricingWindowOption,
+    PersonnelPassImport,
     RACDiscountUsage,
 )
 
@@ -54,6 +56,7 @@ class PassAdmin(admin.ModelAdmin):
         "in_cart",
         "purchase_email_sent",
         "processing_status",
+        "pdf_status",
         "sold_via",
         "first_name",
         "last_name",
@@ -76,6 +79,11 @@ class PassAdmin(admin.ModelAdmin):
         "date_expiry",
         "renew_automatically",
         "park_pass_renewed_from",
+        "concession_discount_amount",
+        "discount_code_discount_amount",
+        "voucher_amount",
+        "price_paid",
+        "gst_amount",
         "datetime_created",
         "datetime_updated",
     ]
@@ -85,6 +93,7 @@ class PassAdmin(admin.ModelAdmin):
         "sold_via",
         "park_pass_pdf_secure",
         "processing_status",
+        "pdf_status",
         "pass_type",
         "pricing_window",
         "price",
@@ -96,12 +105,18 @@ class PassAdmin(admin.ModelAdmin):
     autocomplete_fields = ("sold_via",)
     readonly_fields = [
         "park_pass_pdf_secure",
+        "pdf_status",
         "pass_number",
         "first_name",
         "last_name",
         "email",
         "date_expiry",
         "park_pass_renewed_from",
+        "concession_discount_amount",
+        "discount_code_discount_amount",
+        "voucher_amount",
+        "price_paid",
+        "gst_amount",
         "datetime_created",
         "datetime_updated",
     ]
@@ -145,6 +160,69 @@ class PassAdmin(admin.ModelAdmin):
 admin.site.register(Pass, PassAdmin)
 
 
+class PassPdfJobAdmin(admin.ModelAdmin):
+    model = PassPdfJob
+    list_display = (
+        "park_pass",
+        "status",
+        "attempts",
+        "run_after",
+        "datetime_created",
+        "datetime_completed",
+    )
+    list_filter = ("status",)
+    raw_id_fields = ["park_pass"]
+    readonly_fields = [
+        "park_pass",
+        "attempts",
+        "last_error",
+        "datetime_created",
+        "datetime_updated",
+        "datetime_completed",
+    ]
+    ordering = ["-datetime_created"]
+    actions = ["requeue"]
+
+    @admin.action(description="Requeue selected jobs")
+    def requeue(self, request, queryset):
+        for job in queryset:
+            PassPdfJob.enqueue(job.park_pass)
+
+
+admin.site.register(PassPdfJob, PassPdfJobAdmin)
+
+
+class PersonnelPassImportAdmin(admin.ModelAdmin):
+    model = PersonnelPassImport
+    list_display = (
+        "id",
+        "status",
+        "data_row_count",
+        "rows_processed",
+        "park_passes_created",
+        "park_passes_duplicates",
+        "datetime_created",
+        "datetime_completed",
+    )
+    list_filter = ("status",)
+    readonly_fields = [
+        "created_by",
+        "personnel_data_file",
+        "data_row_count",
+        "rows_processed",
+        "park_passes_created",
+        "park_passes_duplicates",
+        "errors",
+        "datetime_created",
+        "datetime_updated",
+        "datetime_completed",
+    ]
+    ordering = ["-datetime_created"]
+
+
+admin.site.register(PersonnelPassImport, PersonnelPassImportAdmin)
+
+
 class PassTypeAdmin(admin.ModelAdmin):
     model = PassType
     list_display = (
@@ -220,6 +298,7 @@ class PassTemplateAdmin(admin.ModelAdmin):
         "pass_type_field",
         "template_secure",
         "version",
+        "rendering_engine",
     )
     ordering = ["pass_type", "-version"]
 
@@ -1,7 +1,5 @@
 import logging
 import os
-import pickle
-import sys
 import uuid
 from decimal import Decimal
 
@@ -10,6 +8,7 @@ import requests
 from dateutil.relativedelta import relativedelta
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
 from django.http import FileResponse, Http404
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse
@@ -27,7 +26,6 @@ from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
 from rest_framework.response import Response
 from rest_framework.throttling import AnonRateThrottle
 from rest_framework.views import APIView
-from rest_framework_datatables.filters import DatatablesFilterBackend
 from rest_framework_datatables.pagination import DatatablesPageNumberPagination
 
 from parkpasses.components.cart.models import Cart, CartItem
@@ -35,10 +33,13 @@ from parkpasses.components.cart.utils import CartUtils
 from parkpasses.components.concessions.models import Concession, ConcessionUsage
 from parkpasses.components.discount_codes.models import DiscountCode, DiscountCodeUsage
 from parkpasses.components.main.api import (
+    CustomDatatablesFilterBackend,
     CustomDatatablesListMixin,
     CustomDatatablesRenderer,
+    ExportListMixin,
     UserActionViewSet,
 )
+from parkpasses.components.main.exports import ExportColumn
 from parkpasses.components.main.serializers import UserActionSerializer
 from parkpasses.components.orders.models import Order, OrderItem
 from parkpasses.components.passes.exceptions import NoValidPassTypeFoundInPost
@@ -49,6 +50,7 @@ from parkpasses.components.passes.models import (  # RACDiscountUsage,
     PassType,
     PassTypePricingWindow,
     PassTypePricingWindowOption,
+    PersonnelPassImport,
 )
 from parkpasses.components.passes.serializers import (
     ExternalCreateAllParksPassSerializer,
@@ -67,6 +69,7 @@ from parkpasses.components.passes.serializers import (
     InternalPassRetrieveSerializer,
     InternalPassSerializer,
     InternalPassTypeSerializer,
+    InternalPersonnelPassImportSerializer,
     InternalPricingWindowSerializer,
     OptionSerializer,
     PassTemplateSerializer,
@@ -198,10 +201,8 @@ class InternalPassTypeViewSet(viewsets.ModelViewSet):
         return super().list(request, slug=slug)
 
 
-class PricingWindowFilterBackend(DatatablesFilterBackend):
+class PricingWindowFilterBackend(CustomDatatablesFilterBackend):
     def filter_queryset(self, request, queryset, view):
-        total_count = queryset.count()
-
         pass_type = request.GET.get("pass_type")
 
         start_date_from = request.GET.get("start_date_from")
@@ -232,7 +233,6 @@ class PricingWindowFilterBackend(DatatablesFilterBackend):
             queryset = queryset.order_by(*ordering)
 
         queryset = super().filter_queryset(request, queryset, view)
-        setattr(view, "_datatables_total_count", total_count)
 
         return queryset
 
@@ -367,10 +367,13 @@ class ExternalPassViewSet(
     viewsets.GenericViewSet,
 ):
     pagination_class = SmallResultSetPagination
+    # The most queries listing a page of passes or retrieving a pass should run
+    # (see parkpasses.components.main.middleware)
+    query_budget = {"list": 30, "retrieve": 30}
     model = Pass
 
     def get_queryset(self):
-        return (
+        queryset = (
             Pass.objects.exclude(user__isnull=True)
             .exclude(processing_status=Pass.CANCELLED)
             .exclude(date_expiry__lte=timezone.now().date())
@@ -378,6 +381,9 @@ class ExternalPassViewSet(
             .filter(user=self.request.user.id)
             .order_by("-pass_number")
         )
+        if self.action in ["list", "retrieve"]:
+            return queryset.for_list()
+        return queryset
 
     def get_serializer_class(self):
         if self.action in ["update", "partial_update"]:
@@ -542,7 +548,7 @@ class ExternalPassViewSet(
 
         content_type = ContentType.objects.get_for_model(park_pass)
         oracle_code = CartUtils.get_oracle_code(
-            self.request, content_type, park_pass.id
+            self.request, content_type, park_pass.id, park_pass=park_pass
         )
         logger.info(f"Oracle code: {oracle_code} will be used for this park pass.")
         cart_item = CartItem(
@@ -632,21 +638,25 @@ class ExternalPassViewSet(
 
         if voucher_code:
             if Voucher.is_valid(voucher_code, voucher_pin):
-                voucher = Voucher.objects.get(code=voucher_code, pin=voucher_pin)
-                logger.info(
-                    f"This pass purchase includes a voucher transaction for voucher: {voucher}.",
-                )
-                logger.info(
-                    "Creating voucher transaction.",
-                )
-                voucher_transaction = VoucherTransaction.objects.create(
-                    voucher=voucher,
-                    park_pass=park_pass,
-                    debit=voucher.balance_available_for_purchase(
-                        park_pass.price_after_discount_code_applied
-                    ),
-                    credit=Decimal(0.00),
-                )
+                with transaction.atomic():
+                    # Lock the voucher so another checkout can't spend the same balance
+                    voucher = Voucher.objects.select_for_update().get(
+                        code=voucher_code, pin=voucher_pin
+                    )
+                    logger.info(
+                        f"This pass purchase includes a voucher transaction for voucher: {voucher}.",
+                    )
+                    logger.info(
+                        "Creating voucher transaction.",
+                    )
+                    voucher_transaction = VoucherTransaction.objects.create(
+                        voucher=voucher,
+                        park_pass=park_pass,
+                        debit=voucher.balance_available_for_purchase(
+                            park_pass.price_after_discount_code_applied
+                        ),
+                        credit=Decimal(0.00),
+                    )
                 logger.info(
                     f"Voucher transaction: {voucher_transaction} created.",
                 )
@@ -758,14 +768,12 @@ class ExternalPassViewSet(
         raise Http404
 
 
-class PassFilterBackend(DatatablesFilterBackend):
+class PassFilterBackend(CustomDatatablesFilterBackend):
     """
     Custom Filters for Internal Pass Viewset
     """
 
     def filter_queryset(self, request, queryset, view):
-        total_count = queryset.count()
-
         pass_type = request.GET.get("pass_type")
         status = request.GET.get("status")
         start_date_from = request.GET.get("start_date_from")
@@ -803,7 +811,6 @@ class PassFilterBackend(DatatablesFilterBackend):
             queryset = queryset.order_by(*ordering)
 
         queryset = super().filter_queryset(request, queryset, view)
-        setattr(view, "_datatables_total_count", total_count)
 
         return queryset
 
@@ -816,6 +823,7 @@ class RetailerPassViewSet(CustomDatatablesListMixin, UserActionViewSet):
         "vehicle_registration_1",
         "vehicle_registration_2",
     ]
+    query_budget = {"list": 30, "retrieve": 30}
     model = Pass
     pagination_class = DatatablesPageNumberPagination
     permission_classes = [IsRetailer]
@@ -840,9 +848,12 @@ class RetailerPassViewSet(CustomDatatablesListMixin, UserActionViewSet):
             retailer_groups = RetailerGroupUser.objects.filter(
                 emailuser__id=self.request.user.id
             ).values_list("retailer_group__id")
-            return Pass.objects.exclude(in_cart=True).filter(
+            queryset = Pass.objects.exclude(in_cart=True).filter(
                 sold_via__in=list(retailer_groups)
             )
+            if self.action in ["list", "retrieve"]:
+                return queryset.for_list()
+            return queryset
 
         return Pass.objects.none()
 
@@ -861,7 +872,9 @@ class RetailerPassViewSet(CustomDatatablesListMixin, UserActionViewSet):
         raise Http404
 
 
-class InternalPassViewSet(CustomDatatablesListMixin, UserActionViewSet):
+class InternalPassViewSet(
+    ExportListMixin, CustomDatatablesListMixin, UserActionViewSet
+):
     search_fields = [
         "pass_number",
         "first_name",
@@ -869,12 +882,44 @@ class InternalPassViewSet(CustomDatatablesListMixin, UserActionViewSet):
         "vehicle_registration_1",
         "vehicle_registration_2",
     ]
+    query_budget = {"list": 30, "retrieve": 30}
     model = Pass
     pagination_class = DatatablesPageNumberPagination
-    queryset = Pass.objects.exclude(in_cart=True)
     permission_classes = [IsInternal]
     filter_backends = (PassFilterBackend,)
     renderer_classes = (JSONRenderer, BrowsableAPIRenderer, CustomDatatablesRenderer)
+    export_filename = "park_passes"
+    export_columns = [
+        ExportColumn("Pass Number", "pass_number"),
+        ExportColumn("Pass Type", "option__pricing_window__pass_type__display_name"),
+        ExportColumn("Duration", "option__name"),
+        ExportColumn("First Name", "first_name"),
+        ExportColumn("Last Name", "last_name"),
+        ExportColumn("Email", "email"),
+        ExportColumn("Park Group", "park_group__name"),
+        ExportColumn("Vehicle Registration 1", "vehicle_registration_1"),
+        ExportColumn("Vehicle Registration 2", "vehicle_registration_2"),
+        ExportColumn("Start Date", "date_start"),
+        ExportColumn("Expiry Date", "date_expiry"),
+        ExportColumn("Renew Automatically", "renew_automatically"),
+        ExportColumn(
+            "Status", "processing_status", choices=Pass.PROCESSING_STATUS_CHOICES
+        ),
+        ExportColumn("Sold Via", "sold_via__name"),
+        ExportColumn("Price", "option__price"),
+        ExportColumn("Concession Discount", "concession_discount_amount"),
+        ExportColumn("Discount Code Discount", "discount_code_discount_amount"),
+        ExportColumn("Voucher Amount", "voucher_amount"),
+        ExportColumn("Price Paid", "price_paid"),
+        ExportColumn("GST", "gst_amount"),
+        ExportColumn("Date Created", "datetime_created"),
+    ]
+
+    def get_queryset(self):
+        queryset = Pass.objects.exclude(in_cart=True)
+        if self.action in ["list", "retrieve"]:
+            return queryset.for_list()
+        return queryset
 
     def get_serializer_class(self):
         if "retrieve" == self.action:
@@ -1113,65 +1158,24 @@ class UploadPersonnelPasses(APIView):
             logger.critical(error)
             raise ValidationError(error)
 
-        pass_type = PassType.objects.get(name=settings.PERSONNEL_PASS)
-        default_option = (
-            PassTypePricingWindowOption.get_default_options_by_pass_type_id(
-                pass_type.id
-            ).first()
+        # The passes are created by the pass_process_personnel_pass_imports management command
+        # and the progress of the import can be polled from internal/personnel-pass-imports/<id>
+        personnel_pass_import = PersonnelPassImport.objects.create(
+            created_by=request.user.id,
+            personnel_data_file=personnel_data_file,
+            data_row_count=total_row_count - 1,
         )
-        default_sold_via = RetailerGroup.get_dbca_retailer_group()
-
-        park_passes_created = 0
-        park_passes_duplicates = 0
-        park_passes_errors = []
-
-        data_row_count = total_row_count - 1
+        logger.info(f"Queued {personnel_pass_import}.")
 
-        # iterate through excel and display data
-        for row in sh.iter_rows(min_row=2, max_col=4):
-            logger.info(
-                f"Attempting to create park pass for row: { row[0].value} {row[1].value} {row[2].value} {row[3].value}"
-            )
-            if Pass.objects.filter(
-                first_name=row[0].value,
-                last_name=row[1].value,
-                email=row[2].value,
-                date_start=row[3].value,
-            ).exists():
-                logger.warning(
-                    f"Pass already exists for: \
-                    { row[0].value} {row[1].value} {row[2].value} {row[3].value} - skipping row."
-                )
-                park_passes_duplicates += 1
-                continue
-            else:
-                try:
-                    aware_date = timezone.make_aware(row[3].value).date()
-                    logger.debug("type(aware_date): " + str(type(aware_date)))
-                    Pass.objects.create(
-                        first_name=row[0].value,
-                        last_name=row[1].value,
-                        email=row[2].value,
-                        date_start=aware_date,
-                        option=default_option,
-                        in_cart=False,
-                        sold_via=default_sold_via,
-                    )
-                    park_passes_created += 1
-                except Exception as e:
-                    logger.error(e)
-                    park_passes_errors.append(pickle.dumps(sys.exc_info()))
-
-        results = {
-            "data_row_count": data_row_count,
-            "park_passes_created": park_passes_created,
-            "park_passes_duplicates": park_passes_duplicates,
-            "park_passes_errors": park_passes_errors,
-        }
+        serializer = InternalPersonnelPassImportSerializer(personnel_pass_import)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
 
-        logger.info("UploadPersonnelPasses results: " + str(results))
 
-        return Response({"results": results}, status=status.HTTP_201_CREATED)
+class InternalPersonnelPassImportViewSet(viewsets.ReadOnlyModelViewSet):
+    model = PersonnelPassImport
+    queryset = PersonnelPassImport.objects.all()
+    permission_classes = [IsInternal]
+    serializer_class = InternalPersonnelPassImportSerializer
 
 
 class RacDiscountCodeCheckView(APIView):
@@ -121,6 +121,21 @@ class PassGoldPassDetailsForPICAEmail(TemplateEmailBase):
 
 
 class PassEmails:
+    @classmethod
+    def send_email(self, email, park_pass, context, batch=None):
+        """Sends the email now or, if a BatchEmailSender is passed, adds it to the batch
+        (the caller then sends the batch and logs the communications)"""
+        if batch is not None:
+            return batch.add(
+                email,
+                park_pass.email,
+                context=context,
+                instance=park_pass,
+                customer=park_pass.user,
+            )
+        message = email.send(park_pass.email, context=context)
+        log_communication(park_pass.email, message, "email", park_pass)
+
     @classmethod
     def send_pass_purchased_notification_email(self, park_pass):
         email = PassPurchasedNotificationEmail()
@@ -160,7 +175,9 @@ class PassEmails:
         log_communication(park_pass.email, message, "email", park_pass)
 
     @classmethod
-    def send_pass_vehicle_details_not_yet_provided_notification_email(self, park_pass):
+    def send_pass_vehicle_details_not_yet_provided_notification_email(
+        self, park_pass, batch=None
+    ):
         email = PassVehicleDetailsNotYetProvidedNotificationEmail()
         from parkpasses.components.passes.serializers import ExternalPassSerializer
 
@@ -169,11 +186,10 @@ class PassEmails:
             "pass": serializer.data,
             "site_url": settings.SITE_URL,
         }
-        message = email.send(park_pass.email, context=context)
-        log_communication(park_pass.email, message, "email", park_pass)
+        return self.send_email(email, park_pass, context, batch=batch)
 
     @classmethod
-    def send_pass_expiry_notification_email(self, park_pass):
+    def send_pass_expiry_notification_email(self, park_pass, batch=None):
         email = PassExpiryNotificationEmail()
         from parkpasses.components.passes.serializers import ExternalPassSerializer
 
@@ -182,11 +198,10 @@ class PassEmails:
             "pass": serializer.data,
             "site_url": settings.SITE_URL,
         }
-        message = email.send(park_pass.email, context=context)
-        log_communication(park_pass.email, message, "email", park_pass)
+        return self.send_email(email, park_pass, context, batch=batch)
 
     @classmethod
-    def send_pass_expired_notification_email(self, park_pass):
+    def send_pass_expired_notification_email(self, park_pass, batch=None):
         email = PassExpiredNotificationEmail()
         from parkpasses.components.passes.serializers import ExternalPassSerializer
 
@@ -195,8 +210,7 @@ class PassEmails:
             "pass": serializer.data,
             "site_url": settings.SITE_URL,
         }
-        message = email.send(park_pass.email, context=context)
-        log_communication(park_pass.email, message, "email", park_pass)
+        return self.send_email(email, park_pass, context, batch=batch)
 
     @classmethod
     def send_no_primary_card_for_autorenewal_email(self, park_pass):
@@ -212,7 +226,7 @@ class PassEmails:
         log_communication(park_pass.email, message, "email", park_pass)
 
     @classmethod
-    def send_pass_autorenew_notification_email(self, park_pass):
+    def send_pass_autorenew_notification_email(self, park_pass, batch=None):
         email = PassAutoRenewNotificationEmail()
         from parkpasses.components.passes.serializers import ExternalPassSerializer
 
@@ -223,8 +237,7 @@ class PassEmails:
             "next_renewal_option": next_renewal_option,
             "site_url": settings.SITE_URL,
         }
-        message = email.send(park_pass.email, context=context)
-        log_communication(park_pass.email, message, "email", park_pass)
+        return self.send_email(email, park_pass, context, batch=batch)
 
     @classmethod
     def send_pass_autorenew_success_notification_email(self, park_pass):
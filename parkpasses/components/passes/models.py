@@ -7,11 +7,13 @@
     - Pass (The pass itself which contains the information required to generate the QR Code)
 """
 
+import datetime
 import logging
 import math
 import os
 from decimal import Decimal
 
+import openpyxl
 import qrcode
 from autoslug import AutoSlugField
 from ckeditor.fields import RichTextField
@@ -29,7 +31,8 @@ from django.core.validators import (
     MinLengthValidator,
     MinValueValidator,
 )
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, F, Value, When
 from django.utils import timezone
 from django_resized import ResizedImageField
 
@@ -369,76 +372,22 @@ class PassTypePricingWindowOption(models.Model):
 
     @classmethod
     def get_current_options_by_pass_type_id(self, pass_type_id, date=None):
-        try:
-            pass_type = PassType.objects.get(id=pass_type_id)
-        except ObjectDoesNotExist:
-            logger.info(f"No Pass Type Exists with ID: {pass_type_id}.")
-            return []
-
-        pricing_windows_for_pass = PassTypePricingWindow.objects.filter(
-            pass_type=pass_type
-        )
-
-        if date:
-            pricing_windows_for_pass.filter(date_start__lte=date, date_expiry__gte=date)
+        """Returns the options of the pricing window of the pass type that applies on the date
+        (today if date is None)"""
+        from parkpasses.components.passes.pricing_windows import PricingWindowResolver
 
-        pricing_windows_for_pass_count = pricing_windows_for_pass.count()
-
-        if 0 == pricing_windows_for_pass_count:
+        pricing_window_id = PricingWindowResolver.resolve(pass_type_id, date)
+        if pricing_window_id is None:
             logger.critical(
                 "CRITICAL: There is no default pricing window for Pass Type: {}.".format(
-                    pass_type
+                    pass_type_id
                 )
             )
             return []
-        # If there is only one pricing window for the pass type it must be the default
-        if 1 == PassTypePricingWindow.objects.filter(pass_type=pass_type).count():
-            pricing_window = PassTypePricingWindow.objects.get(pass_type=pass_type)
-        else:
-            # Get any pricing windows that are currently valid excluding the default pricing window
-            current_pricing_window_count = (
-                PassTypePricingWindow.objects.exclude(date_expiry__isnull=True)
-                .filter(
-                    pass_type=pass_type,
-                    date_start__lte=timezone.now(),
-                    date_expiry__gte=timezone.now(),
-                )
-                .count()
-            )
-
-            # If there are none just get the default pricing window
-            if 0 == current_pricing_window_count:
-                pricing_window = PassTypePricingWindow.objects.get(
-                    pass_type=pass_type, date_expiry__isnull=True
-                )
-
-            elif 1 == current_pricing_window_count:
-                pricing_window = PassTypePricingWindow.objects.exclude(
-                    date_expiry__isnull=True
-                ).get(
-                    pass_type=pass_type,
-                    date_start__lte=timezone.now(),
-                    date_expiry__gte=timezone.now(),
-                )
-            else:
-                # When there are two or more currently valid pricing windows we return the window that
-                # started the most recently And log a warning so that admins can be alerted to this.
-                # Validation shouldn't allow this sitation to occur but ... just in case.
-                logger.warning(
-                    f"WARNING: There are more than one currently valid pricing windows for Pass Type: {pass_type}"
-                )
-                pricing_window = (
-                    PassTypePricingWindow.objects.exclude(date_expiry__isnull=True)
-                    .filter(
-                        pass_type=pass_type,
-                        date_start__lte=timezone.now(),
-                        date_expiry__gte=timezone.now(),
-                    )
-                    .order_by("date_start")
-                    .last()
-                )
 
-        return PassTypePricingWindowOption.objects.filter(pricing_window=pricing_window)
+        return PassTypePricingWindowOption.objects.filter(
+            pricing_window_id=pricing_window_id
+        )
 
     @classmethod
     def get_default_options_by_pass_type_id(self, pass_type_id):
@@ -473,8 +422,18 @@ class PassTemplate(models.Model):
     will use this template.
 
     The highest version number will be the template that is used to generate passes.
+
+    The rendering engine determines how the pdf is generated from the template, see
+    parkpasses.components.passes.utils for details.
     """
 
+    LIBREOFFICE = "LO"
+    PYMUPDF = "PM"
+    RENDERING_ENGINE_CHOICES = [
+        (LIBREOFFICE, "LibreOffice (convert every pass)"),
+        (PYMUPDF, "PyMuPDF (compile template once then stamp every pass)"),
+    ]
+
     template = models.FileField(
         upload_to=pass_template_file_path,
         storage=upload_protected_files_storage,
@@ -490,6 +449,13 @@ class PassTemplate(models.Model):
         blank=True,
     )
     version = models.SmallIntegerField(null=False, blank=False)
+    rendering_engine = models.CharField(
+        max_length=2,
+        choices=RENDERING_ENGINE_CHOICES,
+        default=LIBREOFFICE,
+        null=False,
+        blank=False,
+    )
 
     class Meta:
         app_label = "parkpasses"
@@ -518,7 +484,51 @@ class PassTemplate(models.Model):
         return f"{s} {size_name[i]}"
 
 
-class PassManager(models.Manager):
+class PassQuerySet(models.QuerySet):
+    def with_status(self):
+        """Works out the status of each pass in the database (see Pass.status and
+        Pass.status_display) so listing passes doesn't rely on the date and cancellation
+        checks being run for each pass in python"""
+        today = timezone.now().date()
+        return self.annotate(
+            annotated_status=Case(
+                When(
+                    in_cart=True,
+                    park_pass_renewed_from__isnull=False,
+                    then=Value(Pass.AWAITING_AUTO_RENEWAL),
+                ),
+                When(cancellation__isnull=False, then=Value(Pass.CANCELLED)),
+                When(date_start__gt=today, then=Value(Pass.FUTURE)),
+                When(date_expiry__lte=today, then=Value(Pass.EXPIRED)),
+                default=Value(Pass.CURRENT),
+                output_field=models.CharField(),
+            ),
+            annotated_status_display=Case(
+                When(cancellation__isnull=False, then=Value("Cancelled")),
+                When(date_start__gt=today, then=Value("Future")),
+                When(date_expiry__lte=today, then=Value("Expired")),
+                default=Value("Current"),
+                output_field=models.CharField(),
+            ),
+        )
+
+    def with_usages(self):
+        """Loads the park group and the concession, discount code, voucher and rac discount
+        used for each pass along with the passes so serializing a page of passes runs the
+        same number of queries however many passes are on the page"""
+        return self.select_related(
+            "park_group",
+            "concession_usage__concession",
+            "discount_code_usage__discount_code__discount_code_batch",
+            "voucher_transaction__voucher",
+            "rac_discount_usage",
+        )
+
+    def for_list(self):
+        return self.with_status().with_usages()
+
+
+class PassManager(models.Manager.from_queryset(PassQuerySet)):
     def get_queryset(self):
         return (
             super()
@@ -570,6 +580,24 @@ class Pass(models.Model):
         (VALID, "Valid"),
     ]
 
+    PDF_STATUS_PENDING = "PE"
+    PDF_STATUS_GENERATED = "GE"
+    PDF_STATUS_FAILED = "FA"
+    PDF_STATUS_CHOICES = [
+        (PDF_STATUS_PENDING, "Pending"),
+        (PDF_STATUS_GENERATED, "Generated"),
+        (PDF_STATUS_FAILED, "Failed"),
+    ]
+
+    # The fields set by set_stored_prices
+    STORED_PRICE_FIELDS = [
+        "concession_discount_amount",
+        "discount_code_discount_amount",
+        "voucher_amount",
+        "price_paid",
+        "gst_amount",
+    ]
+
     user = models.IntegerField(null=True, blank=True)  # EmailUserRO
     option = models.ForeignKey(PassTypePricingWindowOption, on_delete=models.PROTECT)
     pass_number = models.CharField(max_length=50, null=True, blank=True)
@@ -624,9 +652,28 @@ class Pass(models.Model):
     )
     in_cart = models.BooleanField(null=False, blank=False, default=True)
     purchase_email_sent = models.BooleanField(null=False, blank=False, default=False)
+    pdf_status = models.CharField(
+        max_length=2, choices=PDF_STATUS_CHOICES, null=True, blank=True
+    )
     sold_via = models.ForeignKey(
         RetailerGroup, on_delete=models.PROTECT, null=True, blank=True
     )
+    # The pricing of the pass is stored when the pass is purchased (see set_stored_prices)
+    concession_discount_amount = models.DecimalField(
+        max_digits=7, decimal_places=2, null=True, blank=True
+    )
+    discount_code_discount_amount = models.DecimalField(
+        max_digits=7, decimal_places=2, null=True, blank=True
+    )
+    voucher_amount = models.DecimalField(
+        max_digits=7, decimal_places=2, null=True, blank=True
+    )
+    price_paid = models.DecimalField(
+        max_digits=7, decimal_places=2, null=True, blank=True
+    )
+    gst_amount = models.DecimalField(
+        max_digits=7, decimal_places=2, null=True, blank=True
+    )
     datetime_created = models.DateTimeField(auto_now_add=True)
     datetime_updated = models.DateTimeField(auto_now=True)
 
@@ -699,19 +746,26 @@ class Pass(models.Model):
     @property
     def price_after_all_discounts(self):
         """Convenience method that makes more descriptive sense"""
+        if self.price_paid is not None:
+            return self.price_paid
         return self.price_after_voucher_applied.quantize(Decimal("0.00"))
 
     @property
     def price_display(self):
         return f"${self.price_after_all_discounts}"
 
+    @classmethod
+    def calculate_gst(self, price_incl_gst):
+        gst_calcuation = Decimal(100 / (100 + int(settings.LEDGER_GST)))
+        return Decimal(price_incl_gst - (price_incl_gst * gst_calcuation)).quantize(
+            Decimal("0.00")
+        )
+
     @property
     def gst(self):
-        gst_calcuation = Decimal(100 / (100 + int(settings.LEDGER_GST)))
-        return Decimal(
-            self.price_after_all_discounts
-            - (self.price_after_all_discounts * gst_calcuation)
-        ).quantize(Decimal("0.00"))
+        if self.gst_amount is not None:
+            return self.gst_amount
+        return Pass.calculate_gst(self.price_after_all_discounts)
 
     @property
     def gst_display(self):
@@ -723,6 +777,8 @@ class Pass(models.Model):
 
     @property
     def status(self):
+        if hasattr(self, "annotated_status"):
+            return self.annotated_status
         if self.in_cart and self.park_pass_renewed_from:
             return Pass.AWAITING_AUTO_RENEWAL
         elif self.is_cancelled:
@@ -736,6 +792,8 @@ class Pass(models.Model):
 
     @property
     def status_display(self):
+        if hasattr(self, "annotated_status_display"):
+            return self.annotated_status_display
         if self.is_cancelled:
             return "Cancelled"
         elif self.date_start > timezone.now().date():
@@ -762,13 +820,35 @@ class Pass(models.Model):
         if not self.renew_automatically:
             return None
 
-        reminder_date = self.date_expiry - timezone.timedelta(
-            days=settings.PASS_REMINDER_DAYS_PRIOR
-        )
-        options = PassTypePricingWindowOption.get_options_by_pass_type_and_date(
-            self.option.pricing_window.pass_type.id, reminder_date
-        )
-        return options.filter(duration=self.option.duration).first()
+        return Pass.get_next_renewal_options([self]).get(self.id)
+
+    @classmethod
+    def get_next_renewal_options(self, park_passes):
+        """Returns the option each of the passes will be renewed with (keyed by pass id) loading
+        the options of all the pricing windows involved in one query (see get_next_renewal_option)"""
+        from parkpasses.components.passes.pricing_windows import PricingWindowResolver
+
+        pricing_window_ids = {}
+        for park_pass in park_passes:
+            reminder_date = park_pass.date_expiry - timezone.timedelta(
+                days=settings.PASS_REMINDER_DAYS_PRIOR
+            )
+            pricing_window_ids[park_pass.id] = PricingWindowResolver.resolve(
+                park_pass.option.pricing_window.pass_type_id, reminder_date
+            )
+
+        options = {}
+        for option in PassTypePricingWindowOption.objects.filter(
+            pricing_window_id__in=set(pricing_window_ids.values())
+        ).order_by("price"):
+            options.setdefault((option.pricing_window_id, option.duration), option)
+
+        return {
+            park_pass.id: options.get(
+                (pricing_window_ids[park_pass.id], park_pass.option.duration)
+            )
+            for park_pass in park_passes
+        }
 
     @property
     def get_next_renewal_price(self):
@@ -808,6 +888,47 @@ class Pass(models.Model):
         )
         return Decimal(amount).quantize(Decimal("0.00"))
 
+    def calculate_prices(self):
+        """Works out the discounts applied to the pass and the price paid for it in one go
+        rather than walking the price_after_... properties (which each repeat the steps before them)"""
+        price_after_concession = self.price_after_concession_applied
+        discount_code_discount = Decimal(0.00)
+        if hasattr(self, "discount_code_usage"):
+            discount_code = self.discount_code_usage.discount_code
+            discount_code_discount = discount_code.discount_as_amount(
+                price_after_concession
+            )
+        voucher_amount = Decimal(0.00)
+        if hasattr(self, "voucher_transaction"):
+            voucher_amount = -self.voucher_transaction.balance()
+        price_paid = (
+            price_after_concession - discount_code_discount - voucher_amount
+        ).quantize(Decimal("0.00"))
+        return {
+            "concession_discount_amount": (
+                self.price - price_after_concession
+            ).quantize(Decimal("0.00")),
+            "discount_code_discount_amount": Decimal(discount_code_discount).quantize(
+                Decimal("0.00")
+            ),
+            "voucher_amount": Decimal(voucher_amount).quantize(Decimal("0.00")),
+            "price_paid": price_paid,
+            "gst_amount": Pass.calculate_gst(price_paid),
+        }
+
+    def set_stored_prices(self):
+        for field_name, value in self.calculate_prices().items():
+            setattr(self, field_name, value)
+        logger.info(f"Stored prices set for park pass: {self}.")
+
+    def update_stored_prices(self):
+        """Recalculates the stored prices without calling save (which would queue the pass pdf)"""
+        prices = self.calculate_prices()
+        for field_name, value in prices.items():
+            setattr(self, field_name, value)
+        Pass.objects.filter(pk=self.pk).update(**prices)
+        logger.info(f"Stored prices updated for park pass: {self}.")
+
     def generate_qrcode(self):
         logger.info(f"Generating qr code for pass {self.pass_number}.")
         from parkpasses.components.passes.serializers import (
@@ -855,8 +976,32 @@ class Pass(models.Model):
             != safe_template_path
         ):
             raise ValueError("Unsafe path detected in pass_template_path")
-        pass_utils.generate_pass_pdf_from_docx_template(
-            self, pass_template_path, qr_code_path
+        if PassTemplate.PYMUPDF == pass_template.rendering_engine:
+            pass_utils.generate_pass_pdf_from_compiled_template(
+                self, pass_template, qr_code_path
+            )
+        else:
+            pass_utils.generate_pass_pdf_from_docx_template(
+                self, pass_template_path, qr_code_path
+            )
+
+    def update_park_pass_pdf(self):
+        """Generates the park pass pdf and stores it against the pass without sending
+        any emails or queueing another pdf job"""
+        self.generate_park_pass_pdf()
+        # Use update() rather than save() so that another job is not queued
+        Pass.objects.filter(pk=self.pk).update(
+            park_pass_pdf=self.park_pass_pdf.name,
+            pdf_status=Pass.PDF_STATUS_GENERATED,
+        )
+        self.pdf_status = Pass.PDF_STATUS_GENERATED
+        logger.info(f"Park pass pdf generated for pass {self}.")
+
+    def requires_park_pass_pdf(self):
+        return (
+            not Pass.CANCELLED == self.processing_status
+            and not self.has_expired
+            and not self.in_cart
         )
 
     def imaginary_encryption_endpoint(self, json_pass_data):
@@ -908,6 +1053,10 @@ class Pass(models.Model):
 
         self.set_processing_status()
 
+        if not self.in_cart and self.price_paid is None:
+            # Passes are normally priced in Cart.create_order but not every pass is bought through a cart
+            self.set_stored_prices()
+
         # if self.user:
         #     logger.info(
         #         f"Pass has a user id: {self.user}",
@@ -933,45 +1082,22 @@ class Pass(models.Model):
                 f"Park pass assigned pass number: {self.pass_number}.",
             )
 
-        if not Pass.CANCELLED == self.processing_status and not self.has_expired:
-            if not self.in_cart:
-                logger.info(
-                    "Park pass has not been cancelled and is not in cart so generating park pass pdf.",
-                )
-
-                """Consider: Running generate_park_pass_pdf() with a message queue would be much better"""
-                self.generate_park_pass_pdf()
-
-                logger.info(
-                    "Park pass pdf generated.",
-                )
-
-                if not self.purchase_email_sent:
-                    logger.info(
-                        "Park pass purchase email has not yet been sent.",
-                    )
-                    self.send_purchased_notification_email()
-                    logger.info(
-                        f"Pass purchased notification email sent for pass {self.pass_number}",
-                    )
-                    self.purchase_email_sent = True
-                    logger.info(
-                        "Assigning purchase email as sent.",
-                    )
-
-                else:
-                    logger.info(
-                        "Park pass purchase email has already been sent.",
-                    )
-                    self.send_updated_notification_email()
-                    logger.info(
-                        f"Pass update notification email sent for pass {self.pass_number}",
-                    )
+        queue_park_pass_pdf = self.requires_park_pass_pdf()
+        if queue_park_pass_pdf:
+            self.pdf_status = Pass.PDF_STATUS_PENDING
 
         logger.info(f"Updating park pass: {self}.")
         super().save(force_update=True)
         logger.info("Park pass updated.")
 
+        if queue_park_pass_pdf:
+            logger.info(
+                "Park pass has not been cancelled and is not in cart so queueing park pass pdf.",
+            )
+            # The pdf and the purchased / updated email are handled by the
+            # pass_process_pdf_jobs management command
+            PassPdfJob.enqueue(self)
+
     def send_no_primary_card_for_autorenewal_email(self):
         error_message = "An exception occured trying to run "
         error_message += "send_no_primary_card_for_autorenewal_email for Pass with id {}. Exception {}"
@@ -1089,6 +1215,447 @@ class Pass(models.Model):
             )
 
 
+class PassPdfJobManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().select_related("park_pass")
+
+
+class PassPdfJob(models.Model):
+    """A class to represent a queued park pass pdf job
+
+    Generating a park pass pdf and emailing it to the pass holder is slow so rather than
+    doing it in Pass.save() a job is queued in the database and processed by the
+    pass_process_pdf_jobs management command.
+
+    There is only ever one job per pass, so a pass that is saved several times before the
+    worker gets to it will only have its pdf generated (and be emailed) once."""
+
+    objects = PassPdfJobManager()
+
+    QUEUED = "QU"
+    PROCESSING = "PR"
+    COMPLETED = "CO"
+    FAILED = "FA"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (PROCESSING, "Processing"),
+        (COMPLETED, "Completed"),
+        (FAILED, "Failed"),
+    ]
+
+    park_pass = models.OneToOneField(
+        Pass, on_delete=models.CASCADE, related_name="pdf_job"
+    )
+    status = models.CharField(max_length=2, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(null=False, blank=False, default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(null=True, blank=True)
+    datetime_created = models.DateTimeField(auto_now_add=True)
+    datetime_updated = models.DateTimeField(auto_now=True)
+    datetime_completed = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        app_label = "parkpasses"
+        verbose_name = "Pass PDF Job"
+        verbose_name_plural = "Pass PDF Jobs"
+        indexes = [models.Index(fields=["status", "run_after"])]
+
+    def __str__(self):
+        return f"PDF Job for Pass: {self.park_pass} ({self.get_status_display()})"
+
+    @classmethod
+    def enqueue(self, park_pass):
+        """Queues (or requeues) the pdf job for a park pass.
+
+        If the worker is part way through processing the job it will be processed again
+        as the worker only marks a job completed if it is still flagged as processing."""
+        job, created = PassPdfJob.objects.update_or_create(
+            park_pass=park_pass,
+            defaults={
+                "status": PassPdfJob.QUEUED,
+                "attempts": 0,
+                "run_after": timezone.now(),
+                "last_error": None,
+            },
+        )
+        logger.info(f"{'Queued' if created else 'Requeued'} {job}.")
+        return job
+
+    @classmethod
+    def enqueue_many(self, park_passes):
+        """Queues (or requeues) the pdf jobs for several park passes at once (see enqueue)"""
+        now = timezone.now()
+        park_pass_ids = [park_pass.pk for park_pass in park_passes]
+        requeued_ids = set(
+            PassPdfJob.objects.filter(park_pass_id__in=park_pass_ids).values_list(
+                "park_pass_id", flat=True
+            )
+        )
+        if requeued_ids:
+            PassPdfJob.objects.filter(park_pass_id__in=requeued_ids).update(
+                status=PassPdfJob.QUEUED, attempts=0, run_after=now, last_error=None
+            )
+        PassPdfJob.objects.bulk_create(
+            [
+                PassPdfJob(park_pass_id=park_pass_id, run_after=now)
+                for park_pass_id in park_pass_ids
+                if park_pass_id not in requeued_ids
+            ]
+        )
+        logger.info(
+            f"Queued pdf jobs for {len(park_pass_ids) - len(requeued_ids)} park passes "
+            f"and requeued {len(requeued_ids)}."
+        )
+
+    @classmethod
+    def requeue_stale_jobs(self):
+        """Requeues jobs that were claimed by a worker that has since died."""
+        stale_before = timezone.now() - timezone.timedelta(
+            seconds=settings.PASS_PDF_JOB_STALE_AFTER_SECONDS
+        )
+        return PassPdfJob.objects.filter(
+            status=PassPdfJob.PROCESSING, datetime_updated__lt=stale_before
+        ).update(status=PassPdfJob.QUEUED, run_after=timezone.now())
+
+    @classmethod
+    def claim_jobs(self, batch_size):
+        """Marks up to batch_size due jobs as processing and returns them.
+
+        Rows locked by another worker are skipped so several workers can run at once."""
+        now = timezone.now()
+        with transaction.atomic():
+            job_ids = list(
+                PassPdfJob.objects.select_for_update(skip_locked=True, of=("self",))
+                .filter(status=PassPdfJob.QUEUED, run_after__lte=now)
+                .order_by("run_after")
+                .values_list("id", flat=True)[:batch_size]
+            )
+            PassPdfJob.objects.filter(id__in=job_ids).update(
+                status=PassPdfJob.PROCESSING,
+                attempts=F("attempts") + 1,
+                datetime_updated=now,
+            )
+        return list(PassPdfJob.objects.filter(id__in=job_ids).order_by("run_after"))
+
+    def process(self):
+        park_pass = Pass.objects.get(pk=self.park_pass_id)
+        if not park_pass.requires_park_pass_pdf():
+            logger.info(
+                f"Park pass {park_pass} no longer requires a pdf (cancelled, expired or in cart)."
+            )
+            Pass.objects.filter(pk=park_pass.pk).update(
+                pdf_status=Pass.PDF_STATUS_GENERATED
+                if park_pass.park_pass_pdf
+                else None
+            )
+            return
+
+        park_pass.update_park_pass_pdf()
+
+        if not park_pass.purchase_email_sent:
+            park_pass.send_purchased_notification_email()
+            Pass.objects.filter(pk=park_pass.pk).update(purchase_email_sent=True)
+            logger.info(f"Pass purchased notification email sent for pass {park_pass}")
+        else:
+            park_pass.send_updated_notification_email()
+            logger.info(f"Pass update notification email sent for pass {park_pass}")
+
+    def run(self):
+        """Processes the job and records the outcome. Returns True if the job succeeded."""
+        try:
+            self.process()
+        except Exception as e:
+            logger.exception(f"{self} failed on attempt {self.attempts}: {e}")
+            self.mark_failed(e)
+            return False
+        self.mark_completed()
+        return True
+
+    def mark_completed(self):
+        now = timezone.now()
+        PassPdfJob.objects.filter(pk=self.pk, status=PassPdfJob.PROCESSING).update(
+            status=PassPdfJob.COMPLETED,
+            last_error=None,
+            datetime_completed=now,
+            datetime_updated=now,
+        )
+
+    def mark_failed(self, error):
+        now = timezone.now()
+        if self.attempts >= settings.PASS_PDF_JOB_MAX_ATTEMPTS:
+            if PassPdfJob.objects.filter(
+                pk=self.pk, status=PassPdfJob.PROCESSING
+            ).update(
+                status=PassPdfJob.FAILED, last_error=str(error), datetime_updated=now
+            ):
+                Pass.objects.filter(pk=self.park_pass_id).update(
+                    pdf_status=Pass.PDF_STATUS_FAILED
+                )
+                logger.critical(f"Giving up on {self} after {self.attempts} attempts.")
+            return
+
+        # Back off exponentially between retries
+        delay = settings.PASS_PDF_JOB_RETRY_DELAY_SECONDS * 2 ** (self.attempts - 1)
+        PassPdfJob.objects.filter(pk=self.pk, status=PassPdfJob.PROCESSING).update(
+            status=PassPdfJob.QUEUED,
+            last_error=str(error),
+            run_after=now + timezone.timedelta(seconds=delay),
+            datetime_updated=now,
+        )
+
+
+def personnel_pass_import_file_path(instance, filename):
+    return f"{instance._meta.app_label}/{instance._meta.model.__name__}/{filename}"
+
+
+class PersonnelPassImport(models.Model):
+    """A class to represent an uploaded personnel pass data file being imported
+
+    The file is imported by the pass_process_personnel_pass_imports management command
+    settings.PERSONNEL_PASS_IMPORT_CHUNK_SIZE rows at a time and the counts are updated
+    after each chunk so the progress of the import can be shown while it runs.
+
+    A row is a duplicate if a pass already exists with the same first name, last name,
+    email and start date (so an import that is interrupted can simply be run again)."""
+
+    QUEUED = "QU"
+    PROCESSING = "PR"
+    COMPLETED = "CO"
+    FAILED = "FA"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (PROCESSING, "Processing"),
+        (COMPLETED, "Completed"),
+        (FAILED, "Failed"),
+    ]
+
+    created_by = models.IntegerField(null=False, blank=False)  # EmailUserRO
+    personnel_data_file = models.FileField(
+        upload_to=personnel_pass_import_file_path,
+        storage=upload_protected_files_storage,
+        max_length=500,
+    )
+    status = models.CharField(max_length=2, choices=STATUS_CHOICES, default=QUEUED)
+    data_row_count = models.PositiveIntegerField(null=False, blank=False, default=0)
+    rows_processed = models.PositiveIntegerField(null=False, blank=False, default=0)
+    park_passes_created = models.PositiveIntegerField(
+        null=False, blank=False, default=0
+    )
+    park_passes_duplicates = models.PositiveIntegerField(
+        null=False, blank=False, default=0
+    )
+    errors = models.TextField(null=True, blank=True)
+    datetime_created = models.DateTimeField(auto_now_add=True)
+    datetime_updated = models.DateTimeField(auto_now=True)
+    datetime_completed = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        app_label = "parkpasses"
+        verbose_name = "Personnel Pass Import"
+        verbose_name_plural = "Personnel Pass Imports"
+
+    def __str__(self):
+        return f"Personnel Pass Import {self.pk} ({self.get_status_display()})"
+
+    @property
+    def error_list(self):
+        if not self.errors:
+            return []
+        return self.errors.splitlines()
+
+    @classmethod
+    def requeue_stale_imports(self):
+        """Requeues imports that were claimed by a worker that has since died."""
+        stale_before = timezone.now() - timezone.timedelta(
+            seconds=settings.PERSONNEL_PASS_IMPORT_STALE_AFTER_SECONDS
+        )
+        return PersonnelPassImport.objects.filter(
+            status=PersonnelPassImport.PROCESSING, datetime_updated__lt=stale_before
+        ).update(status=PersonnelPassImport.QUEUED)
+
+    @classmethod
+    def claim_import(self):
+        """Marks the oldest queued import as processing and returns it (or None)
+
+        Rows locked by another worker are skipped so several workers can run at once."""
+        with transaction.atomic():
+            personnel_pass_import_id = (
+                PersonnelPassImport.objects.select_for_update(skip_locked=True)
+                .filter(status=PersonnelPassImport.QUEUED)
+                .order_by("datetime_created")
+                .values_list("id", flat=True)
+                .first()
+            )
+            if personnel_pass_import_id is None:
+                return None
+            PersonnelPassImport.objects.filter(pk=personnel_pass_import_id).update(
+                status=PersonnelPassImport.PROCESSING,
+                rows_processed=0,
+                park_passes_created=0,
+                park_passes_duplicates=0,
+                errors=None,
+                datetime_updated=timezone.now(),
+            )
+        return PersonnelPassImport.objects.get(pk=personnel_pass_import_id)
+
+    def get_rows(self):
+        """Yields the row number and the values of each row of the data file (streamed
+        rather than loading the whole sheet)"""
+        with self.personnel_data_file.open("rb") as personnel_data_file:
+            workbook = openpyxl.load_workbook(personnel_data_file, read_only=True)
+            try:
+                rows = workbook.active.iter_rows(min_row=2, max_col=4, values_only=True)
+                for row_number, row in enumerate(rows, start=2):
+                    yield row_number, row
+            finally:
+                workbook.close()
+
+    def get_pass(self, row, option):
+        """Returns an (unsaved) park pass for a row of the data file or raises a ValidationError"""
+        first_name, last_name, email, date_start = (list(row) + [None] * 4)[:4]
+        if not first_name or not last_name or not email:
+            raise ValidationError(
+                "First Name, Last Name and Email Address are required."
+            )
+        if isinstance(date_start, datetime.datetime):
+            date_start = date_start.date()
+        elif not isinstance(date_start, datetime.date):
+            raise ValidationError(f"Start Date must be a date (not {date_start}).")
+        park_pass = Pass(
+            first_name=str(first_name).strip(),
+            last_name=str(last_name).strip(),
+            email=str(email).strip(),
+            date_start=date_start,
+            date_expiry=date_start + timezone.timedelta(days=option.duration),
+            option=option,
+            in_cart=False,
+            processing_status=Pass.VALID,
+        )
+        park_pass.clean_fields(
+            exclude=[
+                field.name
+                for field in Pass._meta.fields
+                if field.name not in ["first_name", "last_name", "email"]
+            ]
+        )
+        return park_pass
+
+    def import_rows(self, rows, option, sold_via, keys_seen):
+        """Creates the passes for a chunk of rows that are not duplicates"""
+        park_passes = []
+        errors = []
+        duplicates = 0
+        for row_number, row in rows:
+            try:
+                park_pass = self.get_pass(row, option)
+            except ValidationError as e:
+                errors.append(f"Row {row_number}: {'; '.join(e.messages)}")
+                continue
+            key = (
+                park_pass.first_name,
+                park_pass.last_name,
+                park_pass.email,
+                park_pass.date_start,
+            )
+            if key in keys_seen:
+                duplicates += 1
+                continue
+            keys_seen.add(key)
+            park_passes.append(park_pass)
+
+        # Checks for existing passes for the whole chunk in one query
+        existing_keys = set(
+            Pass.objects.filter(
+                email__in={park_pass.email for park_pass in park_passes},
+                date_start__in={park_pass.date_start for park_pass in park_passes},
+            ).values_list("first_name", "last_name", "email", "date_start")
+        )
+        new_park_passes = []
+        for park_pass in park_passes:
+            if (
+                park_pass.first_name,
+                park_pass.last_name,
+                park_pass.email,
+                park_pass.date_start,
+            ) in existing_keys:
+                duplicates += 1
+                continue
+            park_pass.sold_via = sold_via
+            park_pass.set_stored_prices()
+            if park_pass.requires_park_pass_pdf():
+                park_pass.pdf_status = Pass.PDF_STATUS_PENDING
+            new_park_passes.append(park_pass)
+
+        with transaction.atomic():
+            # bulk_create doesn't call save so the pass numbers are assigned here
+            Pass.objects.bulk_create(new_park_passes)
+            for park_pass in new_park_passes:
+                park_pass.pass_number = f"PP{park_pass.pk:06d}"
+            Pass.objects.bulk_update(new_park_passes, ["pass_number"])
+            # The pdfs and purchased emails are handled by the pass_process_pdf_jobs command
+            PassPdfJob.objects.bulk_create(
+                [
+                    PassPdfJob(park_pass=park_pass)
+                    for park_pass in new_park_passes
+                    if Pass.PDF_STATUS_PENDING == park_pass.pdf_status
+                ]
+            )
+
+        self.rows_processed += len(rows)
+        self.park_passes_created += len(new_park_passes)
+        self.park_passes_duplicates += duplicates
+        if errors:
+            self.errors = "\n".join(self.error_list + errors)
+        PersonnelPassImport.objects.filter(pk=self.pk).update(
+            rows_processed=self.rows_processed,
+            park_passes_created=self.park_passes_created,
+            park_passes_duplicates=self.park_passes_duplicates,
+            errors=self.errors,
+            datetime_updated=timezone.now(),
+        )
+
+    def process(self):
+        pass_type = PassType.objects.get(name=settings.PERSONNEL_PASS)
+        option = PassTypePricingWindowOption.get_default_options_by_pass_type_id(
+            pass_type.id
+        ).first()
+        sold_via = RetailerGroup.get_dbca_retailer_group()
+
+        chunk_size = settings.PERSONNEL_PASS_IMPORT_CHUNK_SIZE
+        keys_seen = set()
+        rows = []
+        for row_number, row in self.get_rows():
+            if all(value is None for value in row):
+                continue
+            rows.append((row_number, row))
+            if len(rows) == chunk_size:
+                self.import_rows(rows, option, sold_via, keys_seen)
+                rows = []
+        if rows:
+            self.import_rows(rows, option, sold_via, keys_seen)
+
+    def run(self):
+        """Processes the import and records the outcome. Returns True if the import succeeded."""
+        try:
+            self.process()
+        except Exception as e:
+            logger.exception(f"{self} failed: {e}")
+            PersonnelPassImport.objects.filter(pk=self.pk).update(
+                status=PersonnelPassImport.FAILED,
+                errors="\n".join(self.error_list + [str(e)]),
+                datetime_completed=timezone.now(),
+            )
+            return False
+        PersonnelPassImport.objects.filter(pk=self.pk).update(
+            status=PersonnelPassImport.COMPLETED, datetime_completed=timezone.now()
+        )
+        logger.info(
+            f"{self} completed: {self.park_passes_created} passes created, "
+            f"{self.park_passes_duplicates} duplicates."
+        )
+        return True
+
+
 class PassCancellationManager(models.Manager):
     def get_queryset(self):
         return super().get_queryset().select_related("park_pass")
@@ -0,0 +1,82 @@
+"""
+    This module resolves the oracle code to use for a park pass sale.
+
+    All of the oracle codes (district / PICA codes for each pass option, park group codes for
+    local park passes and pass type codes) are loaded into a dictionary keyed by
+    (district, option, park group) the first time one is needed, so resolving a code doesn't
+    touch the database.
+
+    Each python process keeps its own copy of the dictionary which is reloaded whenever one of
+    the models the codes come from is saved or deleted (see parkpasses.components.passes.signals).
+"""
+import logging
+
+from django.conf import settings
+
+from parkpasses.components.main.cache import VersionedLocalCache
+from parkpasses.components.parks.models import ParkGroup
+from parkpasses.components.passes.models import (
+    DistrictPassTypeDurationOracleCode,
+    PassTypePricingWindowOption,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class OracleCodeResolver(VersionedLocalCache):
+    version_cache_key = settings.CACHE_KEY_ORACLE_CODES_VERSION
+
+    @classmethod
+    def load(self):
+        district_oracle_codes = DistrictPassTypeDurationOracleCode.objects.exclude(
+            oracle_code=""
+        ).values_list("district_id", "option_id", "oracle_code")
+        district_oracle_codes = {
+            (district_id, option_id): oracle_code
+            for district_id, option_id, oracle_code in district_oracle_codes
+        }
+        park_group_oracle_codes = dict(
+            ParkGroup.objects.values_list("id", "oracle_code")
+        )
+
+        oracle_codes = {}
+        for (district_id, option_id), oracle_code in district_oracle_codes.items():
+            if district_id is not None:
+                # Passes sold by a retailer in this district
+                oracle_codes[(district_id, option_id, None)] = oracle_code
+
+        options = PassTypePricingWindowOption.objects.values_list(
+            "id",
+            "pricing_window__pass_type__name",
+            "pricing_window__pass_type__oracle_code",
+        )
+        for option_id, pass_type_name, pass_type_oracle_code in options:
+            if settings.ANNUAL_LOCAL_PASS == pass_type_name:
+                # PICA Oracle codes for local park passes are based on the park group
+                for park_group_id, oracle_code in park_group_oracle_codes.items():
+                    oracle_codes[(None, option_id, park_group_id)] = oracle_code
+                continue
+            # PICA oracle codes are based on the pass type and duration (option) and if there
+            # isn't one we fall back to the code for the pass type
+            oracle_code = (
+                district_oracle_codes.get((None, option_id)) or pass_type_oracle_code
+            )
+            if oracle_code:
+                oracle_codes[(None, option_id, None)] = oracle_code
+
+        logger.info(f"Loaded {len(oracle_codes)} oracle codes.")
+        return oracle_codes
+
+    @classmethod
+    def resolve(self, option_id, district_id=None, park_group_id=None):
+        """Returns the oracle code for a pass with this option (and park group) sold by a
+        retailer in this district (or online if district_id is None) or None if there isn't one"""
+        oracle_codes = self.get()
+        if district_id is not None:
+            oracle_code = oracle_codes.get((district_id, option_id, None))
+            if oracle_code:
+                return oracle_code
+        oracle_code = oracle_codes.get((None, option_id, park_group_id))
+        if oracle_code:
+            return oracle_code
+        return oracle_codes.get((None, option_id, None))
@@ -0,0 +1,109 @@
+"""
+    This module resolves which pricing window of a pass type applies on a given date.
+
+    All of the pricing windows are loaded (one query) into a dictionary keyed by pass type the
+    first time one is needed. The dated windows of each pass type are kept sorted by start date
+    so the window for a date can be found with a binary search instead of several queries.
+
+    Each python process keeps its own copy of the dictionary which is reloaded whenever a
+    pricing window is saved or deleted (see parkpasses.components.passes.signals).
+"""
+import bisect
+import datetime
+import logging
+
+from django.conf import settings
+from django.utils import timezone
+
+from parkpasses.components.main.cache import VersionedLocalCache
+from parkpasses.components.passes.models import PassTypePricingWindow
+
+logger = logging.getLogger(__name__)
+
+
+class PassTypePricingWindows:
+    """The pricing windows of a single pass type"""
+
+    def __init__(self, pass_type_id):
+        self.pass_type_id = pass_type_id
+        self.default_pricing_window_id = None
+        self.date_starts = []
+        self.pricing_windows = []
+
+    def add(self, pricing_window_id, date_start, date_expiry):
+        if date_expiry is None:
+            self.default_pricing_window_id = pricing_window_id
+            return
+        index = bisect.bisect_right(self.date_starts, date_start)
+        self.date_starts.insert(index, date_start)
+        self.pricing_windows.insert(index, (pricing_window_id, date_expiry))
+
+    def count(self):
+        return len(self.pricing_windows) + (
+            1 if self.default_pricing_window_id is not None else 0
+        )
+
+    def get_pricing_window_id(self, date):
+        # If there is only one pricing window for the pass type it must be the default
+        if 1 == self.count() and self.default_pricing_window_id is None:
+            return self.pricing_windows[0][0]
+
+        # Of the windows that have started by this date use the one that started the most recently
+        # and hasn't expired. Validation shouldn't allow windows to overlap but ... just in case.
+        index = bisect.bisect_right(self.date_starts, date)
+        valid_pricing_window_ids = [
+            pricing_window_id
+            for pricing_window_id, date_expiry in self.pricing_windows[:index]
+            if date_expiry >= date
+        ]
+        if len(valid_pricing_window_ids) > 1:
+            logger.warning(
+                f"WARNING: There are more than one valid pricing windows on {date} "
+                f"for Pass Type: {self.pass_type_id}"
+            )
+        if valid_pricing_window_ids:
+            return valid_pricing_window_ids[-1]
+
+        # If there are none just use the default pricing window
+        return self.default_pricing_window_id
+
+
+class PricingWindowResolver(VersionedLocalCache):
+    version_cache_key = settings.CACHE_KEY_PRICING_WINDOWS_VERSION
+
+    @classmethod
+    def load(self):
+        pricing_windows = {}
+        for (
+            pricing_window_id,
+            pass_type_id,
+            date_start,
+            date_expiry,
+        ) in PassTypePricingWindow.objects.values_list(
+            "id", "pass_type_id", "date_start", "date_expiry"
+        ).order_by():
+            if pass_type_id not in pricing_windows:
+                pricing_windows[pass_type_id] = PassTypePricingWindows(pass_type_id)
+            pricing_windows[pass_type_id].add(
+                pricing_window_id, date_start, date_expiry
+            )
+        logger.info(f"Loaded pricing windows for {len(pricing_windows)} pass types.")
+        return pricing_windows
+
+    @classmethod
+    def resolve(self, pass_type_id, date=None):
+        """Returns the id of the pricing window of the pass type that applies on the date
+        (today if date is None) or None if the pass type has no pricing windows"""
+        if date is None:
+            date = timezone.now().date()
+        elif isinstance(date, datetime.datetime):
+            date = (
+                timezone.localtime(date).date()
+                if timezone.is_aware(date)
+                else date.date()
+            )
+
+        pricing_windows = self.get().get(pass_type_id)
+        if pricing_windows is None:
+            return None
+        return pricing_windows.get_pricing_window_id(date)
@@ -16,6 +16,7 @@ from parkpasses.components.passes.models import (
     PassType,
     PassTypePricingWindow,
     PassTypePricingWindowOption,
+    PersonnelPassImport,
 )
 from parkpasses.components.retailers.models import RetailerGroup
 from parkpasses.components.vouchers.serializers import (
@@ -356,7 +357,37 @@ class ExternalCreatePinjarOffRoadPassSerializer(PassModelCreateSerializer):
         ] + PassModelCreateSerializer.Meta.fields
 
 
-class ExternalPassSerializer(serializers.ModelSerializer):
+class PassListSerializerMixin:
+    """Values that are the same for many (or all) of the passes in a list are worked out once
+    per request and kept in the serializer context (which is shared by every pass in the list)"""
+
+    def get_sold_via_name(self, obj):
+        sold_via_names = self.context.setdefault("sold_via_names", {})
+        if obj.sold_via_id not in sold_via_names:
+            sold_via_names[obj.sold_via_id] = obj.sold_via.organisation[
+                "organisation_name"
+            ]
+        return sold_via_names[obj.sold_via_id]
+
+    def get_user_permissions(self):
+        user_permissions = self.context.get("user_permissions")
+        if user_permissions is None:
+            request = self.context["request"]
+            user_permissions = {
+                "is_superuser": request.user.is_superuser,
+                "is_parkpasses_payments_officer": is_parkpasses_payments_officer(
+                    request
+                ),
+                "is_parkpasses_officer": is_parkpasses_officer(request),
+                "retailer_group_ids": get_retailer_group_ids_for_user(request)
+                if is_retailer(request)
+                else [],
+            }
+            self.context["user_permissions"] = user_permissions
+        return user_permissions
+
+
+class ExternalPassSerializer(PassListSerializerMixin, serializers.ModelSerializer):
     status = serializers.CharField(read_only=True)
     status_display = serializers.CharField(read_only=True)
     price = serializers.SerializerMethodField()
@@ -410,6 +441,7 @@ class ExternalPassSerializer(serializers.ModelSerializer):
             "drivers_licence_number",
             "park_group",
             "park_pass_pdf",
+            "pdf_status",
             "date_start",
             "date_start_formatted",
             "date_expiry_formatted",
@@ -440,6 +472,7 @@ class ExternalPassSerializer(serializers.ModelSerializer):
             "date_expiry_formatted",
             "date_expiry",
             "park_pass_pdf",
+            "pdf_status",
             "status",
             "status_display",
             "datetime_created",
@@ -454,9 +487,6 @@ class ExternalPassSerializer(serializers.ModelSerializer):
             "sold_via_name",
         ]
 
-    def get_sold_via_name(self, obj):
-        return obj.sold_via.organisation["organisation_name"]
-
     def get_price(self, obj):
         return f"{obj.option.price:.2f}"
 
@@ -577,7 +607,9 @@ class RetailerUpdatePassSerializer(serializers.ModelSerializer):
         read_only_fields = ["id"]
 
 
-class InternalPassRetrieveSerializer(serializers.ModelSerializer):
+class InternalPassRetrieveSerializer(
+    PassListSerializerMixin, serializers.ModelSerializer
+):
     pass_type = serializers.CharField(
         source="option.pricing_window.pass_type", read_only=True
     )
@@ -646,9 +678,6 @@ class InternalPassRetrieveSerializer(serializers.ModelSerializer):
             "user_can_edit",
         ]
 
-    def get_sold_via_name(self, obj):
-        return obj.sold_via.organisation["organisation_name"]
-
     def get_discount_code_discount(self, obj):
         if hasattr(obj, "discount_code_usage"):
             discount = (
@@ -666,17 +695,16 @@ class InternalPassRetrieveSerializer(serializers.ModelSerializer):
         return os.path.basename(obj.park_pass_pdf.name)
 
     def get_user_can_edit(self, obj):
-        request = self.context["request"]
-        if is_retailer(request):
-            retailer_group_ids = get_retailer_group_ids_for_user(request)
-            if obj.sold_via_id in retailer_group_ids:
-                return True
-        return is_parkpasses_payments_officer(
-            self.context["request"]
-        ) or is_parkpasses_officer(self.context["request"])
+        user_permissions = self.get_user_permissions()
+        if obj.sold_via_id in user_permissions["retailer_group_ids"]:
+            return True
+        return (
+            user_permissions["is_parkpasses_payments_officer"]
+            or user_permissions["is_parkpasses_officer"]
+        )
 
 
-class InternalPassSerializer(serializers.ModelSerializer):
+class InternalPassSerializer(PassListSerializerMixin, serializers.ModelSerializer):
     pass_type = serializers.CharField(
         source="option.pricing_window.pass_type", read_only=True
     )
@@ -705,25 +733,22 @@ class InternalPassSerializer(serializers.ModelSerializer):
             "user_can_edit_and_cancel",
         ]
 
-    def get_sold_via_name(self, obj):
-        return obj.sold_via.organisation["organisation_name"]
-
     def get_park_pass_pdf(self, obj):
         return os.path.basename(obj.park_pass_pdf.name)
 
     def get_user_can_view_payment_details(self, obj):
-        return is_parkpasses_payments_officer(self.context["request"])
+        return self.get_user_permissions()["is_parkpasses_payments_officer"]
 
     def get_user_can_upload_personnel_passes(self, obj):
-        return is_parkpasses_officer(self.context["request"])
+        return self.get_user_permissions()["is_parkpasses_officer"]
 
     def get_user_can_edit_and_cancel(self, obj):
-        request = self.context["request"]
-        if request.user.is_superuser:
-            return True
-        return is_parkpasses_payments_officer(
-            self.context["request"]
-        ) or is_parkpasses_officer(self.context["request"])
+        user_permissions = self.get_user_permissions()
+        return (
+            user_permissions["is_superuser"]
+            or user_permissions["is_parkpasses_payments_officer"]
+            or user_permissions["is_parkpasses_officer"]
+        )
 
 
 class RetailerApiCreatePassSerializer(serializers.ModelSerializer):
@@ -764,6 +789,27 @@ class InternalPassCancellationSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
+class InternalPersonnelPassImportSerializer(serializers.ModelSerializer):
+    status_display = serializers.CharField(source="get_status_display", read_only=True)
+    park_passes_errors = serializers.ListField(source="error_list", read_only=True)
+
+    class Meta:
+        model = PersonnelPassImport
+        fields = [
+            "id",
+            "status",
+            "status_display",
+            "data_row_count",
+            "rows_processed",
+            "park_passes_created",
+            "park_passes_duplicates",
+            "park_passes_errors",
+            "datetime_created",
+            "datetime_completed",
+        ]
+        read_only_fields = fields
+
+
 class InternalPassTypesOptionsSerializer(serializers.ModelSerializer):
     class Meta:
         model = PassType
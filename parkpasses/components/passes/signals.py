@@ -0,0 +1,45 @@
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from parkpasses.components.parks.models import ParkGroup
+from parkpasses.components.passes.models import (
+    DistrictPassTypeDurationOracleCode,
+    PassType,
+    PassTypePricingWindow,
+    PassTypePricingWindowOption,
+)
+from parkpasses.components.passes.oracle_codes import OracleCodeResolver
+from parkpasses.components.passes.pricing_windows import PricingWindowResolver
+
+logger = logging.getLogger(__name__)
+
+
+def invalidate_oracle_codes(sender, instance, **kwargs):
+    """The oracle codes are worked out from these models so
+    any change to them means the codes have to be loaded again
+
+    Not until the change is committed otherwise another process could load the
+    old codes again and cache them under the new version"""
+    logger.info(f"{sender.__name__} {instance} changed so invalidating oracle codes.")
+    transaction.on_commit(OracleCodeResolver.invalidate)
+
+
+def invalidate_pricing_windows(sender, instance, **kwargs):
+    logger.info(f"Pricing window {instance} changed so invalidating pricing windows.")
+    # Not until the change is committed (see invalidate_oracle_codes)
+    transaction.on_commit(PricingWindowResolver.invalidate)
+
+
+for model in (
+    DistrictPassTypeDurationOracleCode,
+    ParkGroup,
+    PassType,
+    PassTypePricingWindowOption,
+):
+    post_save.connect(invalidate_oracle_codes, sender=model)
+    post_delete.connect(invalidate_oracle_codes, sender=model)
+
+post_save.connect(invalidate_pricing_windows, sender=PassTypePricingWindow)
+post_delete.connect(invalidate_pricing_windows, sender=PassTypePricingWindow)
@@ -1,16 +1,45 @@
+import io
+import os
+import shutil
+import tempfile
+import uuid
 from decimal import Decimal
+from unittest import mock, skipUnless
 
+import fitz
 from django.conf import settings
-from django.test import TestCase
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import TestCase, override_settings
 from django.utils import timezone
+from docx import Document
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
 
+from parkpasses.components.orders.models import Order, OrderItem
 from parkpasses.components.passes.models import (
+    DistrictPassTypeDurationOracleCode,
     Pass,
+    PassAutoRenewalAttempt,
+    PassPdfJob,
+    PassTemplate,
     PassType,
     PassTypePricingWindow,
     PassTypePricingWindowOption,
+    PersonnelPassImport,
+)
+from parkpasses.components.passes.oracle_codes import OracleCodeResolver
+from parkpasses.components.passes.pricing_windows import PricingWindowResolver
+from parkpasses.components.passes.utils import CompiledPassTemplate, PassUtils
+from parkpasses.components.retailers.models import District, RetailerGroup
+from parkpasses.management.commands.pass_process_autorenew_payments import (
+    AUTORENEWAL_ADVISORY_LOCK_NAMESPACE,
+)
+from parkpasses.management.commands.pass_process_autorenew_payments import (
+    Command as ProcessAutoRenewPaymentsCommand,
 )
-from parkpasses.components.retailers.models import RetailerGroup
 
 
 class PassTestCase(TestCase):
@@ -68,3 +97,794 @@ class PassTestCase(TestCase):
         self.assertEqual(holiday_pass_str, f"PP{pass_id:06d}")
         self.assertNotEqual(holiday_pass_str, "Random Name")
         self.assertEqual(str(self.holiday_pass), f"PP{pass_id:06d}")
+
+    def test_pass_in_cart_does_not_queue_pdf_job(self):
+        self.assertIsNone(self.holiday_pass.pdf_status)
+        self.assertFalse(
+            PassPdfJob.objects.filter(park_pass=self.holiday_pass).exists()
+        )
+
+    def test_pdf_job_is_queued_once_per_pass(self):
+        self.holiday_pass.in_cart = False
+        self.holiday_pass.save()
+        self.holiday_pass.save()
+        self.assertEqual(self.holiday_pass.pdf_status, Pass.PDF_STATUS_PENDING)
+        self.assertEqual(
+            PassPdfJob.objects.filter(park_pass=self.holiday_pass).count(), 1
+        )
+        jobs = PassPdfJob.claim_jobs(10)
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0].status, PassPdfJob.PROCESSING)
+        self.assertEqual(jobs[0].attempts, 1)
+        self.assertEqual(PassPdfJob.claim_jobs(10), [])
+
+    def test_prices_are_stored_when_the_pass_is_purchased(self):
+        self.assertIsNone(self.holiday_pass.price_paid)
+        self.holiday_pass.in_cart = False
+        self.holiday_pass.save()
+        self.holiday_pass.refresh_from_db()
+        self.assertEqual(self.holiday_pass.price_paid, Decimal("10.00"))
+        self.assertEqual(self.holiday_pass.concession_discount_amount, Decimal("0.00"))
+        self.assertEqual(self.holiday_pass.voucher_amount, Decimal("0.00"))
+        self.assertEqual(
+            self.holiday_pass.gst_amount, Pass.calculate_gst(Decimal("10.00"))
+        )
+        # The price paid doesn't change when the price of the option does
+        self.option1.price = Decimal("20.00")
+        self.option1.save()
+        self.holiday_pass.refresh_from_db()
+        self.assertEqual(self.holiday_pass.price_after_all_discounts, Decimal("10.00"))
+
+    def test_status_is_annotated(self):
+        future_pass = Pass.objects.get(pk=self.holiday_pass.pk)
+        future_pass.pk = None
+        future_pass.pass_number = None
+        future_pass.date_start = timezone.now().date() + timezone.timedelta(days=7)
+        future_pass.save()
+        for park_pass in Pass.objects.all():
+            annotated_pass = Pass.objects.with_status().get(pk=park_pass.pk)
+            self.assertEqual(annotated_pass.status, park_pass.status)
+            self.assertEqual(annotated_pass.status_display, park_pass.status_display)
+        self.assertEqual(
+            Pass.objects.with_status().get(pk=future_pass.pk).status, Pass.FUTURE
+        )
+
+    def test_list_queryset_loads_the_usages(self):
+        park_passes = list(Pass.objects.for_list())
+        with self.assertNumQueries(0):
+            for park_pass in park_passes:
+                self.assertEqual(park_pass.status, park_pass.annotated_status)
+                self.assertEqual(
+                    park_pass.price_after_voucher_applied, Decimal("10.00")
+                )
+                self.assertIsNone(park_pass.park_group)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class OracleCodeResolverTestCase(TestCase):
+    fixtures = ["parkpasses/components/passes/fixtures/pass-types.json"]
+
+    def setUp(self):
+        # The oracle codes are invalidated when the changes are committed
+        with self.captureOnCommitCallbacks(execute=True):
+            today = timezone.now()
+            pricing_window = PassTypePricingWindow.objects.create(
+                name="Default",
+                pass_type=PassType.objects.get(name=settings.HOLIDAY_PASS),
+                date_start=today,
+                date_expiry=today + timezone.timedelta(days=28),
+            )
+            self.option = PassTypePricingWindowOption.objects.create(
+                pricing_window=pricing_window,
+                name="Option 1",
+                duration=5,
+                price=Decimal("10.00"),
+            )
+            self.district = District.objects.create(name="Test District")
+            DistrictPassTypeDurationOracleCode.objects.create(
+                district=self.district, option=self.option, oracle_code="DISTRICT"
+            )
+            self.pica_oracle_code = DistrictPassTypeDurationOracleCode.objects.create(
+                district=None, option=self.option, oracle_code="PICA"
+            )
+
+    def test_resolve(self):
+        self.assertEqual(
+            OracleCodeResolver.resolve(self.option.id, district_id=self.district.id),
+            "DISTRICT",
+        )
+        self.assertEqual(OracleCodeResolver.resolve(self.option.id), "PICA")
+        other_district = District.objects.create(name="Other District")
+        self.assertEqual(
+            OracleCodeResolver.resolve(self.option.id, district_id=other_district.id),
+            "PICA",
+        )
+
+    def test_saving_an_oracle_code_invalidates_the_codes(self):
+        self.assertEqual(OracleCodeResolver.resolve(self.option.id), "PICA")
+        self.pica_oracle_code.oracle_code = "PICA2"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pica_oracle_code.save()
+            # Not until the change is committed
+            self.assertEqual(OracleCodeResolver.resolve(self.option.id), "PICA")
+        self.assertEqual(OracleCodeResolver.resolve(self.option.id), "PICA2")
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class PricingWindowResolverTestCase(TestCase):
+    fixtures = ["parkpasses/components/passes/fixtures/pass-types.json"]
+
+    def setUp(self):
+        # The pricing windows are invalidated when the changes are committed
+        with self.captureOnCommitCallbacks(execute=True):
+            today = timezone.now()
+            self.pass_type = PassType.objects.get(name=settings.HOLIDAY_PASS)
+            self.default_pricing_window = PassTypePricingWindow.objects.create(
+                name="Default",
+                pass_type=self.pass_type,
+                date_start=today - timezone.timedelta(days=7),
+            )
+            self.default_option = PassTypePricingWindowOption.objects.create(
+                pricing_window=self.default_pricing_window,
+                name="Option 1",
+                duration=5,
+                price=Decimal("10.00"),
+            )
+            self.pricing_window = PassTypePricingWindow.objects.create(
+                name="Summer",
+                pass_type=self.pass_type,
+                date_start=today + timezone.timedelta(days=10),
+                date_expiry=today + timezone.timedelta(days=20),
+            )
+            self.option = PassTypePricingWindowOption.objects.create(
+                pricing_window=self.pricing_window,
+                name="Option 1",
+                duration=5,
+                price=Decimal("15.00"),
+            )
+
+    def test_resolve_by_date(self):
+        today = timezone.now().date()
+        self.assertEqual(
+            PricingWindowResolver.resolve(self.pass_type.id),
+            self.default_pricing_window.id,
+        )
+        self.assertEqual(
+            PricingWindowResolver.resolve(
+                self.pass_type.id, today + timezone.timedelta(days=15)
+            ),
+            self.pricing_window.id,
+        )
+        self.assertEqual(
+            PricingWindowResolver.resolve(
+                self.pass_type.id, today + timezone.timedelta(days=21)
+            ),
+            self.default_pricing_window.id,
+        )
+        self.assertIsNone(PricingWindowResolver.resolve(0))
+
+    def test_options_respect_the_date(self):
+        options = PassTypePricingWindowOption.get_options_by_pass_type_and_date(
+            self.pass_type.id, timezone.now() + timezone.timedelta(days=15)
+        )
+        self.assertEqual(list(options), [self.option])
+
+    def test_saving_a_pricing_window_invalidates_the_windows(self):
+        self.assertEqual(
+            PricingWindowResolver.resolve(self.pass_type.id),
+            self.default_pricing_window.id,
+        )
+        self.pricing_window.date_start = timezone.now() - timezone.timedelta(days=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pricing_window.save()
+            # Not until the change is committed
+            self.assertEqual(
+                PricingWindowResolver.resolve(self.pass_type.id),
+                self.default_pricing_window.id,
+            )
+        self.assertEqual(
+            PricingWindowResolver.resolve(self.pass_type.id), self.pricing_window.id
+        )
+
+
+@skipUnless(shutil.which(settings.LIBREOFFICE_BINARY), "LibreOffice is not installed")
+class PassPdfRenderingEngineParityTestCase(TestCase):
+    """Checks that passes stamped on a compiled template (PyMuPDF) match passes
+    converted by LibreOffice."""
+
+    fixtures = ["parkpasses/components/passes/fixtures/pass-types.json"]
+
+    def setUp(self):
+        self.protected_media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            PROTECTED_MEDIA_ROOT=self.protected_media_root,
+            PASS_TEMPLATE_COMPILED_ROOT=f"{self.protected_media_root}/compiled",
+            PASS_TEMPLATE_DEFAULT_IMAGE_PATH=os.path.join(
+                settings.BASE_DIR,
+                "parkpasses/static/parkpasses/img/default-pass-template-image.png",
+            ),
+        )
+        self.settings_override.enable()
+
+        template_name = "parkpasses/PassTemplate/1/parity-test-template.docx"
+        os.makedirs(os.path.dirname(f"{self.protected_media_root}/{template_name}"))
+        document = Document()
+        document.add_paragraph("{{r pass_type }}")
+        document.add_paragraph("Pass Number: {{ pass_number }}")
+        # The rider name is centred on a dark shaded background which stands in for the
+        # background image of a real template
+        rider_paragraph = document.add_paragraph("{{ pass_rider_name }}")
+        shading = OxmlElement("w:shd")
+        shading.set(qn("w:val"), "clear")
+        shading.set(qn("w:color"), "auto")
+        shading.set(qn("w:fill"), "1F3864")
+        rider_paragraph._p.get_or_add_pPr().append(shading)
+        rider_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        document.add_paragraph("Valid From: {{ pass_start }}")
+        document.add_paragraph("Valid To: {{ pass_expiry }}")
+        document.add_paragraph("Vehicle: {{ pass_vehicle_registration_1 }}")
+        document.save(f"{self.protected_media_root}/{template_name}")
+        self.pass_template = PassTemplate.objects.create(
+            template=template_name, version=1, rendering_engine=PassTemplate.PYMUPDF
+        )
+
+        today = timezone.now()
+        pass_type = PassType.objects.get(name=settings.HOLIDAY_PASS)
+        pricing_window = PassTypePricingWindow.objects.create(
+            name="Default",
+            pass_type=pass_type,
+            date_start=today,
+            date_expiry=today + timezone.timedelta(days=28),
+        )
+        option = PassTypePricingWindowOption.objects.create(
+            pricing_window=pricing_window,
+            name="Option 1",
+            duration=5,
+            price=Decimal("10.00"),
+        )
+        sold_via, created = RetailerGroup.objects.get_or_create(
+            ledger_organisation=settings.PARKPASSES_DEFAULT_SOLD_VIA_ORGANISATION_ID
+        )
+        self.park_pass = Pass.objects.create(
+            user=1,
+            option=option,
+            first_name="Test",
+            last_name="User",
+            email="test.user@gmail.com",
+            mobile="0405454043",
+            postcode="6163",
+            vehicle_registration_1="12312312",
+            date_start=today.date(),
+            sold_via=sold_via,
+        )
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.protected_media_root, ignore_errors=True)
+
+    def render(self, rendering_engine):
+        pass_utils = PassUtils()
+        qr_code_path = self.park_pass.generate_qrcode()
+        if PassTemplate.PYMUPDF == rendering_engine:
+            pass_utils.generate_pass_pdf_from_compiled_template(
+                self.park_pass, self.pass_template, qr_code_path
+            )
+        else:
+            pass_utils.generate_pass_pdf_from_docx_template(
+                self.park_pass, f"/{self.pass_template.template.name}", qr_code_path
+            )
+        pdf_path = f"{self.protected_media_root}/{self.park_pass.park_pass_pdf.name}"
+        copy_path = f"{pdf_path}.{rendering_engine}.pdf"
+        shutil.copyfile(pdf_path, copy_path)
+        return fitz.open(copy_path)[0]
+
+    def test_field_values_are_in_the_same_place(self):
+        libreoffice_page = self.render(PassTemplate.LIBREOFFICE)
+        pymupdf_page = self.render(PassTemplate.PYMUPDF)
+
+        (
+            context,
+            template_image,
+            display_name_colour,
+        ) = PassUtils().get_pass_template_variables(self.park_pass)
+        for key in [
+            "pass_type",
+            "pass_number",
+            "pass_rider_name",
+            "pass_start",
+            "pass_expiry",
+            "pass_vehicle_registration_1",
+        ]:
+            libreoffice_rects = libreoffice_page.search_for(context[key])
+            pymupdf_rects = pymupdf_page.search_for(context[key])
+            self.assertTrue(libreoffice_rects, f"{key} missing from LibreOffice pdf")
+            self.assertTrue(pymupdf_rects, f"{key} missing from PyMuPDF pdf")
+            if "pass_rider_name" == key:
+                # Centred (the fonts differ slightly in width so compare the centres)
+                self.assertAlmostEqual(
+                    (libreoffice_rects[0].x0 + libreoffice_rects[0].x1) / 2,
+                    (pymupdf_rects[0].x0 + pymupdf_rects[0].x1) / 2,
+                    delta=2,
+                )
+            else:
+                self.assertAlmostEqual(
+                    libreoffice_rects[0].x0, pymupdf_rects[0].x0, delta=2
+                )
+            self.assertAlmostEqual(
+                libreoffice_rects[0].y1, pymupdf_rects[0].y1, delta=3
+            )
+
+        self.assertEqual(
+            len(libreoffice_page.get_images()), len(pymupdf_page.get_images())
+        )
+
+    def test_background_behind_fields_is_kept(self):
+        pymupdf_page = self.render(PassTemplate.PYMUPDF)
+        (
+            context,
+            template_image,
+            display_name_colour,
+        ) = PassUtils().get_pass_template_variables(self.park_pass)
+        rect = pymupdf_page.search_for(context["pass_rider_name"])[0]
+        # Just above the text but still inside the shaded paragraph (and the redacted marker)
+        clip = fitz.Rect(rect.x0, rect.y0, rect.x1, rect.y0 + 2)
+        pixmap = pymupdf_page.get_pixmap(clip=clip)
+        samples = pixmap.samples
+        average = sum(samples) / len(samples)
+        # A white patch would average close to 255
+        self.assertLess(average, 128)
+
+    def test_compiled_template_is_reused(self):
+        self.render(PassTemplate.PYMUPDF)
+        self.render(PassTemplate.PYMUPDF)
+        compiled_files = os.listdir(f"{self.protected_media_root}/compiled")
+        self.assertEqual(len([f for f in compiled_files if f.endswith(".pdf")]), 1)
+
+
+class CompiledPassTemplateTestCase(TestCase):
+    def setUp(self):
+        document = fitz.open()
+        page = document.new_page()
+        page.insert_text((300, 100), "Expires", fontname="helv", fontsize=10)
+        self.expires_rect = page.search_for("Expires")[0]
+        # Where the marker of the value would have been
+        marker_rect = fitz.Rect(100, 90, 140, 102)
+        min_x, max_x = CompiledPassTemplate.get_space_on_line(
+            page.rect, page.get_text("words"), marker_rect
+        )
+        self.compiled_template = CompiledPassTemplate(
+            document.tobytes(),
+            [
+                {
+                    "key": "pass_rider_name",
+                    "x": marker_rect.x0,
+                    "x1": marker_rect.x1,
+                    "min_x": min_x,
+                    "max_x": max_x,
+                    "y": 100,
+                    "size": 10,
+                    "color": (0, 0, 0),
+                    "fontname": "helv",
+                    "align": "left",
+                }
+            ],
+        )
+        document.close()
+        self.qr_code_path = os.path.join(
+            settings.BASE_DIR,
+            "parkpasses/static/parkpasses/img/default-pass-template-image.png",
+        )
+
+    def stamp(self, rider_name):
+        document = self.compiled_template.stamp(
+            {"pass_rider_name": rider_name}, self.qr_code_path
+        )
+        spans = [
+            span
+            for block in document[0].get_text("dict")["blocks"]
+            for line in block.get("lines", [])
+            for span in line["spans"]
+            if "Expires" != span["text"]
+        ]
+        document.close()
+        return spans
+
+    def test_short_value_keeps_its_size(self):
+        spans = self.stamp("John Smith")
+        self.assertEqual(len(spans), 1)
+        self.assertAlmostEqual(spans[0]["size"], 10, places=1)
+
+    def test_long_value_is_shrunk_to_fit_its_line(self):
+        spans = self.stamp(
+            "Johnathan Maximilian Bartholomew Fitzgerald-Smythe The Third Of Perth"
+        )
+        self.assertEqual(len(spans), 1)
+        self.assertLess(spans[0]["size"], 10)
+        self.assertAlmostEqual(spans[0]["bbox"][0], 100, delta=1)
+        self.assertLess(spans[0]["bbox"][2], self.expires_rect.x0)
+
+
+class PersonnelPassImportTestCase(TestCase):
+    fixtures = ["parkpasses/components/passes/fixtures/pass-types.json"]
+
+    def setUp(self):
+        pass_type = PassType.objects.get(name=settings.HOLIDAY_PASS)
+        pricing_window = PassTypePricingWindow.objects.create(
+            name="Default",
+            pass_type=pass_type,
+            date_start=timezone.now(),
+        )
+        self.option = PassTypePricingWindowOption.objects.create(
+            pricing_window=pricing_window,
+            name="Option 1",
+            duration=365,
+            price=Decimal("0.00"),
+        )
+        self.sold_via, created = RetailerGroup.objects.get_or_create(
+            ledger_organisation=settings.PARKPASSES_DEFAULT_SOLD_VIA_ORGANISATION_ID
+        )
+        self.personnel_pass_import = PersonnelPassImport.objects.create(
+            created_by=1, personnel_data_file="personnel.xlsx", data_row_count=4
+        )
+
+    def test_import_rows(self):
+        date_start = timezone.now().replace(tzinfo=None)
+        Pass.objects.create(
+            option=self.option,
+            first_name="Existing",
+            last_name="Person",
+            email="existing.person@example.com",
+            date_start=date_start.date(),
+            in_cart=False,
+        )
+        rows = [
+            (2, ("New", "Person", "new.person@example.com", date_start)),
+            (3, ("New", "Person", "new.person@example.com", date_start)),
+            (4, ("Existing", "Person", "existing.person@example.com", date_start)),
+            (5, ("Bad", "Date", "bad.date@example.com", "tomorrow")),
+        ]
+        self.personnel_pass_import.import_rows(rows, self.option, self.sold_via, set())
+
+        self.personnel_pass_import.refresh_from_db()
+        self.assertEqual(self.personnel_pass_import.rows_processed, 4)
+        self.assertEqual(self.personnel_pass_import.park_passes_created, 1)
+        self.assertEqual(self.personnel_pass_import.park_passes_duplicates, 2)
+        self.assertEqual(len(self.personnel_pass_import.error_list), 1)
+        self.assertTrue(self.personnel_pass_import.error_list[0].startswith("Row 5"))
+
+        park_pass = Pass.objects.get(email="new.person@example.com")
+        self.assertEqual(park_pass.pass_number, f"PP{park_pass.pk:06d}")
+        self.assertEqual(park_pass.price_paid, Decimal("0.00"))
+        self.assertTrue(PassPdfJob.objects.filter(park_pass=park_pass).exists())
+
+
+@mock.patch(
+    "parkpasses.management.commands.pass_process_autorenew_payments.utils_ledger_api_client"
+)
+class ProcessAutoRenewPaymentsTestCase(TestCase):
+    fixtures = ["parkpasses/components/passes/fixtures/pass-types.json"]
+
+    def setUp(self):
+        self.today = timezone.now().date()
+        # The pricing windows are invalidated when the changes are committed
+        with self.captureOnCommitCallbacks(execute=True):
+            pricing_window = PassTypePricingWindow.objects.create(
+                name="Default",
+                pass_type=PassType.objects.get(name=settings.ANNUAL_LOCAL_PASS),
+                date_start=self.today - timezone.timedelta(days=400),
+            )
+            self.option = PassTypePricingWindowOption.objects.create(
+                pricing_window=pricing_window,
+                name="Option 1",
+                duration=365,
+                price=Decimal("100.00"),
+            )
+        self.dbca_retailer_group, created = RetailerGroup.objects.get_or_create(
+            ledger_organisation=settings.PARKPASSES_DEFAULT_SOLD_VIA_ORGANISATION_ID
+        )
+        self.park_pass_content_type = ContentType.objects.get_for_model(Pass)
+        self.command = ProcessAutoRenewPaymentsCommand()
+        self.email_user = mock.Mock(id=1)
+        for number in range(2):
+            park_pass = Pass.objects.create(
+                user=1,
+                option=self.option,
+                first_name="Test",
+                last_name=f"User {number}",
+                email="test.user@gmail.com",
+                vehicle_registration_1="12312312",
+                date_start=self.today - timezone.timedelta(days=366),
+                renew_automatically=True,
+                in_cart=False,
+                sold_via=self.dbca_retailer_group,
+            )
+            order = Order.objects.create(
+                user=1,
+                uuid=uuid.uuid4(),
+                invoice_reference=f"INV{number}",
+                retailer_group=self.dbca_retailer_group,
+            )
+            OrderItem.objects.create(
+                order=order,
+                content_type=self.park_pass_content_type,
+                object_id=park_pass.id,
+                description="Park Pass",
+                amount=self.option.price,
+            )
+
+    def get_passes(self):
+        return list(self.command.get_passes(self.today, self.dbca_retailer_group))
+
+    def run_process_payment(self, park_pass):
+        renewal_passes = self.command.get_renewal_passes([park_pass], self.today)
+        order_items = self.command.get_renewed_from_order_items(
+            [park_pass], self.park_pass_content_type
+        )
+        return self.command.run_process_payment(
+            park_pass,
+            renewal_passes[park_pass.id],
+            order_items[park_pass.id],
+            self.email_user,
+            self.park_pass_content_type,
+            self.dbca_retailer_group,
+        )
+
+    def test_renewal_passes_are_created_in_bulk(self, ledger):
+        passes = self.get_passes()
+        self.assertEqual(len(passes), 2)
+        renewal_passes = self.command.get_renewal_passes(passes, self.today)
+        for park_pass in passes:
+            renewal_pass = renewal_passes[park_pass.id]
+            self.assertTrue(renewal_pass.in_cart)
+            self.assertEqual(renewal_pass.park_pass_renewed_from, park_pass)
+            self.assertEqual(renewal_pass.option, self.option)
+            self.assertEqual(renewal_pass.last_name, park_pass.last_name)
+            self.assertEqual(renewal_pass.processing_status, Pass.AWAITING_AUTO_RENEWAL)
+            self.assertEqual(renewal_pass.pass_number, f"PP{renewal_pass.pk:06d}")
+        # The renewal passes created by a previous run are reused
+        self.assertEqual(
+            {
+                park_pass_id: renewal_pass.id
+                for park_pass_id, renewal_pass in self.command.get_renewal_passes(
+                    passes, self.today
+                ).items()
+            },
+            {
+                park_pass_id: renewal_pass.id
+                for park_pass_id, renewal_pass in renewal_passes.items()
+            },
+        )
+
+    @mock.patch.object(Pass, "send_autorenew_success_notification_email")
+    def test_successful_payment(self, send_email, ledger):
+        ledger.get_primary_card_token_for_user.return_value = {"primary_card": 1}
+        park_pass = self.get_passes()[0]
+
+        attempt = self.run_process_payment(park_pass)
+
+        self.assertTrue(attempt.auto_renewal_succeeded)
+        self.assertTrue(
+            PassAutoRenewalAttempt.objects.filter(
+                park_pass=park_pass, auto_renewal_succeeded=True
+            ).exists()
+        )
+        ledger.process_payment_with_token.assert_called_once()
+        send_email.assert_called_once()
+        park_pass.refresh_from_db()
+        self.assertFalse(park_pass.renew_automatically)
+        renewal_pass = Pass.objects.get(park_pass_renewed_from=park_pass)
+        self.assertFalse(renewal_pass.in_cart)
+        order_item = OrderItem.objects.get(
+            content_type=self.park_pass_content_type, object_id=renewal_pass.id
+        )
+        self.assertEqual(order_item.amount, Decimal("100.00"))
+        self.assertTrue(order_item.order.payment_confirmed)
+        # The pass that was renewed is no longer picked up
+        self.assertEqual(len(self.get_passes()), 1)
+
+    @mock.patch.object(Pass, "send_autorenew_failure_notification_email")
+    def test_failed_payment(self, send_email, ledger):
+        ledger.get_primary_card_token_for_user.return_value = {"primary_card": 1}
+        ledger.process_payment_with_token.side_effect = Exception("Card declined")
+        park_pass = self.get_passes()[0]
+
+        attempt = self.run_process_payment(park_pass)
+
+        self.assertFalse(attempt.auto_renewal_succeeded)
+        send_email.assert_called_once_with(1)
+        self.assertEqual(
+            PassAutoRenewalAttempt.objects.filter(
+                park_pass=park_pass, auto_renewal_succeeded=False
+            ).count(),
+            1,
+        )
+        park_pass.refresh_from_db()
+        self.assertTrue(park_pass.renew_automatically)
+        self.assertTrue(
+            Pass.objects.filter(park_pass_renewed_from=park_pass, in_cart=True).exists()
+        )
+
+    @mock.patch.object(Pass, "send_final_autorenewal_failure_notification_email")
+    def test_third_failed_payment_disables_automatic_renewal(self, send_email, ledger):
+        ledger.get_primary_card_token_for_user.return_value = {"primary_card": None}
+        park_pass = self.get_passes()[0]
+        # Failed attempts made since the passes were loaded are counted
+        for _ in range(2):
+            PassAutoRenewalAttempt.objects.create(
+                park_pass=park_pass, auto_renewal_succeeded=False
+            )
+
+        attempt = self.run_process_payment(park_pass)
+
+        self.assertFalse(attempt.auto_renewal_succeeded)
+        send_email.assert_called_once()
+        ledger.process_payment_with_token.assert_not_called()
+        park_pass.refresh_from_db()
+        self.assertFalse(park_pass.renew_automatically)
+        self.assertFalse(Pass.objects.filter(park_pass_renewed_from=park_pass).exists())
+
+    def test_pass_locked_by_another_process_is_skipped(self, ledger):
+        park_pass = self.get_passes()[0]
+        other_connection = connections.create_connection(DEFAULT_DB_ALIAS)
+        try:
+            with other_connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT pg_advisory_lock(%s, %s)",
+                    [AUTORENEWAL_ADVISORY_LOCK_NAMESPACE, park_pass.id],
+                )
+            self.assertIsNone(self.run_process_payment(park_pass))
+        finally:
+            other_connection.close()
+        ledger.process_payment_with_token.assert_not_called()
+        self.assertFalse(
+            PassAutoRenewalAttempt.objects.filter(park_pass=park_pass).exists()
+        )
+
+
+class InProcessPool:
+    """Runs the work of a multiprocessing pool in the test's own process (and transaction)"""
+
+    def __init__(self, processes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def imap_unordered(self, func, iterable, chunksize=1):
+        return map(func, iterable)
+
+
+@mock.patch(
+    "parkpasses.management.commands.pass_regenerate_pdfs.multiprocessing.Pool",
+    InProcessPool,
+)
+@mock.patch("parkpasses.management.commands.pass_regenerate_pdfs.connections")
+class RegeneratePassPdfsTestCase(TestCase):
+    fixtures = ["parkpasses/components/passes/fixtures/pass-types.json"]
+
+    def setUp(self):
+        today = timezone.now().date()
+        pricing_window = PassTypePricingWindow.objects.create(
+            name="Default",
+            pass_type=PassType.objects.get(name=settings.HOLIDAY_PASS),
+            date_start=today - timezone.timedelta(days=500),
+        )
+        option = PassTypePricingWindowOption.objects.create(
+            pricing_window=pricing_window,
+            name="Option 1",
+            duration=365,
+            price=Decimal("10.00"),
+        )
+        self.park_passes = {}
+        for status, date_start in [
+            (Pass.CURRENT, today),
+            (Pass.FUTURE, today + timezone.timedelta(days=10)),
+            (Pass.EXPIRED, today - timezone.timedelta(days=400)),
+            (Pass.CANCELLED, today),
+        ]:
+            self.park_passes[status] = Pass.objects.create(
+                option=option,
+                first_name="Test",
+                last_name="User",
+                email="test.user@gmail.com",
+                vehicle_registration_1="12312312",
+                date_start=date_start,
+                in_cart=False,
+            )
+        Pass.objects.filter(pk=self.park_passes[Pass.CANCELLED].pk).update(
+            processing_status=Pass.CANCELLED
+        )
+        Pass.objects.filter(pk=self.park_passes[Pass.EXPIRED].pk).update(
+            datetime_created=timezone.make_aware(timezone.datetime(2020, 6, 1))
+        )
+        checkpoint_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, checkpoint_dir)
+        self.checkpoint_file = os.path.join(checkpoint_dir, "regenerate.checkpoint")
+
+    def regenerate(self, *args):
+        stdout = io.StringIO()
+        call_command("pass_regenerate_pdfs", *args, "--processes", "2", stdout=stdout)
+        return stdout.getvalue()
+
+    def read_checkpoint(self):
+        with open(self.checkpoint_file) as f:
+            return {int(line) for line in f}
+
+    def test_status_filter(self, connections):
+        self.assertIn("Found 4 park passes", self.regenerate("--test"))
+        for status in [Pass.CURRENT, Pass.FUTURE, Pass.EXPIRED, Pass.CANCELLED]:
+            self.assertIn(
+                "Found 1 park passes", self.regenerate("--status", status, "--test")
+            )
+
+    def test_date_filters(self, connections):
+        self.assertIn(
+            "Found 1 park passes",
+            self.regenerate("--created-before", "2020-12-31", "--test"),
+        )
+        self.assertIn(
+            "Found 3 park passes",
+            self.regenerate("--created-after", "2021-01-01", "--test"),
+        )
+
+    @mock.patch.object(Pass, "update_park_pass_pdf", autospec=True)
+    def test_resume_from_checkpoint(self, update_park_pass_pdf, connections):
+        completed = {
+            self.park_passes[Pass.CURRENT].id,
+            self.park_passes[Pass.FUTURE].id,
+        }
+        with open(self.checkpoint_file, "w") as f:
+            f.writelines(f"{pass_id}\n" for pass_id in completed)
+
+        output = self.regenerate("--checkpoint-file", self.checkpoint_file)
+
+        self.assertIn("Skipping 2 passes listed", output)
+        self.assertIn("Regenerated 2 park pass pdfs (0 failed)", output)
+        self.assertEqual(
+            {call.args[0].id for call in update_park_pass_pdf.call_args_list},
+            {
+                self.park_passes[Pass.EXPIRED].id,
+                self.park_passes[Pass.CANCELLED].id,
+            },
+        )
+        self.assertEqual(
+            self.read_checkpoint(),
+            {park_pass.id for park_pass in self.park_passes.values()},
+        )
+
+    @mock.patch.object(Pass, "update_park_pass_pdf", autospec=True)
+    def test_failing_pass_is_recorded_and_the_run_continues(
+        self, update_park_pass_pdf, connections
+    ):
+        failing_pass = self.park_passes[Pass.FUTURE]
+
+        def update_park_pass_pdf_side_effect(park_pass):
+            if park_pass.id == failing_pass.id:
+                raise Exception("Template missing")
+
+        update_park_pass_pdf.side_effect = update_park_pass_pdf_side_effect
+
+        output = self.regenerate("--checkpoint-file", self.checkpoint_file)
+
+        self.assertIn(
+            f"Failed to regenerate pass with id {failing_pass.id}: Template missing",
+            output,
+        )
+        self.assertIn("Regenerated 3 park pass pdfs (1 failed)", output)
+        self.assertEqual(update_park_pass_pdf.call_count, 4)
+        # The failed pass is not checkpointed so it is tried again next time
+        self.assertEqual(
+            self.read_checkpoint(),
+            {
+                park_pass.id
+                for park_pass in self.park_passes.values()
+                if park_pass.id != failing_pass.id
+            },
+        )
@@ -10,6 +10,7 @@ from parkpasses.components.passes.api import (
     InternalDistrictPassTypeDurationOracleCodeViewSet,
     InternalPassTypeViewSet,
     InternalPassViewSet,
+    InternalPersonnelPassImportViewSet,
     InternalPricingWindowViewSet,
     PassAutoRenewSuccessView,
     PassProcessingStatusesDistinct,
@@ -46,6 +47,11 @@ router.register(r"pass-templates", PassTemplateViewSet, basename="pass-templates
 router.register(r"external/passes", ExternalPassViewSet, basename="passes-external")
 router.register(r"retailer/passes", RetailerPassViewSet, basename="passes-internal")
 router.register(r"internal/passes", InternalPassViewSet, basename="passes-internal")
+router.register(
+    r"internal/personnel-pass-imports",
+    InternalPersonnelPassImportViewSet,
+    basename="personnel-pass-imports-internal",
+)
 router.register(
     r"internal/oracle-codes",
     InternalDistrictPassTypeDurationOracleCodeViewSet,
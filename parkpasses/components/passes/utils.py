@@ -1,28 +1,61 @@
 """
     This module provides utilities for the passes component
+
+    Park pass pdfs can be generated in two ways (selected per PassTemplate):
+
+    - LibreOffice: The docx template is rendered with docxtpl and converted to pdf by LibreOffice.
+
+    - PyMuPDF: The docx template is compiled once into a base pdf (by rendering it with marker
+      values, converting it with LibreOffice and then finding and removing the markers) and the
+      field values are then stamped onto a copy of the base pdf for each pass.
+      The values keep the size, colour, weight, slant and alignment of the template text but
+      are stamped in the closest standard pdf font (Helvetica, Times or Courier) as the fonts
+      embedded in the base pdf are subsets that only contain the glyphs of the markers.
+      Values are not wrapped, a value too long for the space the template leaves for it on
+      its line is stamped in a smaller font so it doesn't run into the text next to it.
 """
 
+import hashlib
+import json
 import logging
 import os
-import subprocess
+import tempfile
+import threading
 from pathlib import Path
 
 import fitz
 from django.conf import settings
 from django.utils.dateformat import DateFormat
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.oxml.ns import qn
+from docx.text.paragraph import Paragraph
 from docxtpl import DocxTemplate, RichText
 
+from parkpasses.components.main.pdf_converter import convert_to_pdf
+
 logger = logging.getLogger(__name__)
 
+QR_CODE_RECTANGLE = (409, 69, 529, 189)
+
+# Changing how templates are compiled (or what is recorded about each field) means
+# templates compiled before the change have to be compiled again
+COMPILED_TEMPLATE_FORMAT = 3
+
+# The standard pdf fonts (regular, bold, italic, bold italic) used to stamp field values
+STANDARD_FONTS = {
+    "sans-serif": ["helv", "hebo", "heit", "hebi"],
+    "serif": ["tiro", "tibo", "tiit", "tibi"],
+    "monospace": ["cour", "cobo", "coit", "cobi"],
+}
+
 
 class PassUtils:
-    def generate_pass_pdf_from_docx_template(
-        self, park_pass, pass_template_path, qr_code_path
-    ):
-        park_pass_docx = DocxTemplate(
-            f"{settings.PROTECTED_MEDIA_ROOT}{pass_template_path}"
-        )
+    def get_pass_template_variables(self, park_pass):
+        """Returns the values that vary from pass to pass as a tuple of
+        (context, template_image, display_name_colour).
 
+        The pass type display name in the context is a plain string, it is up to the
+        rendering engine to style it."""
         date_format = DateFormat(park_pass.date_start)
         date_start = date_format.format("jS F Y")
 
@@ -53,11 +86,6 @@ class PassUtils:
             if pass_type.concession_template_image:
                 template_image = pass_type.concession_template_image.path
 
-        # This line replaces the background image in the docx file
-        park_pass_docx.replace_zipname(
-            settings.PASS_TEMPLATE_REPLACEMENT_IMAGE_PATH, template_image
-        )
-
         park_group = None
         if park_pass.park_group:
             park_group = park_pass.park_group.name
@@ -69,17 +97,10 @@ class PassUtils:
 
         rider_name = f"{park_pass.first_name} {park_pass.last_name}"
 
-        rich_text_pass_type_display_name = RichText(
-            pass_type_display_name,
-            color=display_name_colour,
-            size=28,
-            bold=True,
-        )
-
         if settings.USE_DUMMY_QR_CODE_DATA:
             # In a test environment, we don't add any personal data into the pass context
             context = {
-                "pass_type": rich_text_pass_type_display_name,
+                "pass_type": pass_type_display_name,
                 "pass_park_group": park_group,
                 "pass_postcode": park_pass.postcode,
                 "pass_number": park_pass.pass_number,
@@ -98,7 +119,7 @@ class PassUtils:
             }
         else:
             context = {
-                "pass_type": rich_text_pass_type_display_name,
+                "pass_type": pass_type_display_name,
                 "pass_park_group": park_group,
                 "pass_postcode": park_pass.postcode,
                 "pass_number": park_pass.pass_number,
@@ -116,8 +137,9 @@ class PassUtils:
                 "pass_order_number": order_number,
             }
 
-        park_pass_docx.render(context)
+        return context, template_image, display_name_colour
 
+    def get_park_pass_file_path(self, park_pass):
         park_pass_file_path = f"{park_pass._meta.app_label}/"
         park_pass_file_path += (
             f"{park_pass._meta.model.__name__}/passes/{park_pass.user}/{park_pass.pk}/"
@@ -125,6 +147,55 @@ class PassUtils:
         Path(settings.PROTECTED_MEDIA_ROOT + "/" + park_pass_file_path).mkdir(
             parents=True, exist_ok=True
         )
+        return park_pass_file_path
+
+    def get_document_title(self, park_pass):
+        date_format = DateFormat(park_pass.datetime_created)
+        datetime_created = date_format.format("jS F Y")
+        pass_type_display_name = park_pass.option.pricing_window.pass_type.display_name
+        return f"{pass_type_display_name} - {park_pass.first_name} {park_pass.last_name} - {datetime_created}"
+
+    def render_docx_template(
+        self, pass_template_path, context, template_image, display_name_colour
+    ):
+        park_pass_docx = DocxTemplate(
+            f"{settings.PROTECTED_MEDIA_ROOT}{pass_template_path}"
+        )
+
+        # This line replaces the background image in the docx file
+        park_pass_docx.replace_zipname(
+            settings.PASS_TEMPLATE_REPLACEMENT_IMAGE_PATH, template_image
+        )
+
+        context = dict(context)
+        context["pass_type"] = RichText(
+            context["pass_type"],
+            color=display_name_colour,
+            size=28,
+            bold=True,
+        )
+        park_pass_docx.render(context)
+        return park_pass_docx
+
+    def insert_qr_code(self, pdf_path, qr_code_path):
+        file_handle = fitz.open(pdf_path)
+        first_page = file_handle[0]
+
+        first_page.insert_image(fitz.Rect(*QR_CODE_RECTANGLE), filename=qr_code_path)
+        file_handle.saveIncr()
+        file_handle.close()
+
+    def generate_pass_pdf_from_docx_template(
+        self, park_pass, pass_template_path, qr_code_path
+    ):
+        context, template_image, display_name_colour = self.get_pass_template_variables(
+            park_pass
+        )
+        park_pass_docx = self.render_docx_template(
+            pass_template_path, context, template_image, display_name_colour
+        )
+
+        park_pass_file_path = self.get_park_pass_file_path(park_pass)
 
         park_pass_docx_file_name = "ParkPass.docx"
         park_pass_docx_full_file_path = (
@@ -133,43 +204,292 @@ class PassUtils:
             + park_pass_file_path
             + park_pass_docx_file_name
         )
-        document_title = f"{pass_type_display_name} - {park_pass.first_name} {park_pass.last_name} - {datetime_created}"
+        document_title = self.get_document_title(park_pass)
         park_pass_docx.docx.core_properties.title = document_title
         park_pass_docx.save(f"{park_pass_docx_full_file_path}")
-        output = subprocess.check_output(
+        park_pass_pdf_path = park_pass_file_path + f"{park_pass.pass_number}.pdf"
+        convert_to_pdf(
+            park_pass_docx_full_file_path,
+            settings.PROTECTED_MEDIA_ROOT + "/" + park_pass_pdf_path,
+        )
+
+        park_pass.park_pass_pdf.name = park_pass_pdf_path
+
+        self.insert_qr_code(
+            settings.PROTECTED_MEDIA_ROOT + "/" + park_pass_pdf_path, qr_code_path
+        )
+
+        # Clean up unused files
+        # os.remove(park_pass_docx_full_file_path)
+
+        logger.info(qr_code_path)
+        # os.remove(qr_code_path)
+
+    def generate_pass_pdf_from_compiled_template(
+        self, park_pass, pass_template, qr_code_path
+    ):
+        context, template_image, display_name_colour = self.get_pass_template_variables(
+            park_pass
+        )
+        compiled_template = CompiledPassTemplate.get(
+            pass_template, context, template_image, display_name_colour
+        )
+
+        park_pass_file_path = self.get_park_pass_file_path(park_pass)
+        park_pass_pdf_path = park_pass_file_path + f"{park_pass.pass_number}.pdf"
+
+        document = compiled_template.stamp(context, qr_code_path)
+        document.set_metadata(
+            {**document.metadata, "title": self.get_document_title(park_pass)}
+        )
+        document.save(settings.PROTECTED_MEDIA_ROOT + "/" + park_pass_pdf_path)
+        document.close()
+
+        park_pass.park_pass_pdf.name = park_pass_pdf_path
+
+
+class CompiledPassTemplate:
+    """A class to represent a pass template that has been compiled into a base pdf
+
+    The base pdf contains everything except the field values, and the position and style
+    of each field is stored alongside it so that passes can be generated by stamping the
+    values onto a copy of the base pdf (which is very fast compared to LibreOffice).
+
+    Fields that are empty are compiled into the template as empty because docx templates
+    may contain conditional sections, so a template is compiled once per combination
+    of background image, name colour and empty fields. Compiled templates are stored
+    in settings.PASS_TEMPLATE_COMPILED_ROOT and kept in memory once loaded."""
+
+    _compiled_templates = {}
+    _lock = threading.Lock()
+
+    def __init__(self, base_pdf, fields):
+        self.base_pdf = base_pdf
+        self.fields = fields
+
+    @classmethod
+    def get_cache_key(
+        self, pass_template, context, template_image, display_name_colour
+    ):
+        empty_fields = sorted(key for key, value in context.items() if not value)
+        key = json.dumps(
             [
-                "libreoffice",
-                # "--headless",
-                "--convert-to",
-                "pdf",
-                park_pass_docx_full_file_path,
-                "--outdir",
-                settings.PROTECTED_MEDIA_ROOT + "/" + park_pass_file_path,
+                COMPILED_TEMPLATE_FORMAT,
+                pass_template.id,
+                pass_template.version,
+                pass_template.template.name,
+                template_image,
+                os.path.getmtime(template_image),
+                display_name_colour,
+                empty_fields,
             ]
         )
+        return hashlib.sha256(key.encode()).hexdigest()
 
-        logger.info(f"Subprocess output = {output}")
+    @classmethod
+    def get(self, pass_template, context, template_image, display_name_colour):
+        cache_key = self.get_cache_key(
+            pass_template, context, template_image, display_name_colour
+        )
+        with self._lock:
+            if cache_key not in self._compiled_templates:
+                self._compiled_templates[cache_key] = self.load_or_compile(
+                    cache_key,
+                    pass_template,
+                    context,
+                    template_image,
+                    display_name_colour,
+                )
+            return self._compiled_templates[cache_key]
 
-        park_pass_pdf_file_name = "ParkPass.pdf"
-        park_pass_pdf_path = park_pass_file_path + park_pass_pdf_file_name
-        new_path = park_pass_file_path + f"{park_pass.pass_number}.pdf"
+    @classmethod
+    def load_or_compile(
+        self, cache_key, pass_template, context, template_image, display_name_colour
+    ):
+        compiled_root = Path(settings.PASS_TEMPLATE_COMPILED_ROOT)
+        base_pdf_path = compiled_root / f"{cache_key}.pdf"
+        fields_path = compiled_root / f"{cache_key}.json"
+        if base_pdf_path.exists() and fields_path.exists():
+            return CompiledPassTemplate(
+                base_pdf_path.read_bytes(), json.loads(fields_path.read_text())
+            )
 
-        os.rename(
-            settings.PROTECTED_MEDIA_ROOT + "/" + park_pass_pdf_path,
-            settings.PROTECTED_MEDIA_ROOT + "/" + new_path,
+        logger.info(f"Compiling pass template: {pass_template}.")
+        compiled_template = self.compile(
+            pass_template, context, template_image, display_name_colour
         )
+        compiled_root.mkdir(parents=True, exist_ok=True)
+        base_pdf_path.write_bytes(compiled_template.base_pdf)
+        fields_path.write_text(json.dumps(compiled_template.fields))
+        return compiled_template
 
-        park_pass.park_pass_pdf.name = new_path
+    @classmethod
+    def compile(self, pass_template, context, template_image, display_name_colour):
+        # Render the template with a unique marker in place of each value
+        markers = {
+            key: f"QQ{index:02d}QQ"
+            for index, key in enumerate(sorted(context))
+            if context[key]
+        }
+        marker_context = {
+            key: markers.get(key, value) for key, value in context.items()
+        }
+        park_pass_docx = PassUtils().render_docx_template(
+            os.path.normpath(f"/{pass_template.template.name}"),
+            marker_context,
+            template_image,
+            display_name_colour,
+        )
 
-        image_rectangle = fitz.Rect(409, 69, 529, 189)
-        file_handle = fitz.open(park_pass.park_pass_pdf.path)
-        first_page = file_handle[0]
+        alignments = self.get_marker_alignments(park_pass_docx.docx, markers.values())
 
-        first_page.insert_image(image_rectangle, filename=qr_code_path)
-        file_handle.saveIncr()
+        with tempfile.TemporaryDirectory(prefix="parkpasses-template-") as temp_dir:
+            docx_path = os.path.join(temp_dir, "PassTemplate.docx")
+            pdf_path = os.path.join(temp_dir, "PassTemplate.pdf")
+            park_pass_docx.save(docx_path)
+            convert_to_pdf(docx_path, pdf_path)
+            document = fitz.open(pdf_path)
 
-        # Clean up unused files
-        # os.remove(park_pass_docx_full_file_path)
+        # Record where each marker is and how it is styled then remove it from the page
+        fields = []
+        page = document[0]
+        words = page.get_text("words")
+        spans = [
+            span
+            for block in page.get_text("dict")["blocks"]
+            for line in block.get("lines", [])
+            for span in line["spans"]
+        ]
+        for key, marker in markers.items():
+            for rect in page.search_for(marker):
+                span = next(
+                    (
+                        span
+                        for span in spans
+                        if marker in span["text"]
+                        and fitz.Rect(span["bbox"]).intersects(rect)
+                    ),
+                    None,
+                )
+                if span is None:
+                    continue
+                min_x, max_x = self.get_space_on_line(page.rect, words, rect)
+                fields.append(
+                    {
+                        "key": key,
+                        "x": rect.x0,
+                        "x1": rect.x1,
+                        "min_x": min_x,
+                        "max_x": max_x,
+                        "y": span["origin"][1],
+                        "size": span["size"],
+                        "color": fitz.sRGB_to_pdf(span["color"]),
+                        "fontname": self.get_standard_font(span["flags"]),
+                        "align": alignments.get(marker, "left"),
+                    }
+                )
+                # fill=False so the background behind the marker is left as it is
+                page.add_redact_annot(rect, fill=False)
+        page.apply_redactions(images=fitz.PDF_REDACT_IMAGE_NONE)
 
-        logger.info(qr_code_path)
-        # os.remove(qr_code_path)
+        base_pdf = document.tobytes(garbage=3, deflate=True)
+        document.close()
+        return CompiledPassTemplate(base_pdf, fields)
+
+    @classmethod
+    def get_space_on_line(self, page_rect, words, rect):
+        """Returns how far left and right a value stamped in place of the marker in rect
+        can reach before it runs into the other words on the same line (or off the page)"""
+        min_x, max_x = page_rect.x0, page_rect.x1
+        for word in words:
+            word_rect = fitz.Rect(word[:4])
+            overlap = min(word_rect.y1, rect.y1) - max(word_rect.y0, rect.y0)
+            if overlap <= rect.height / 2:
+                continue
+            if word_rect.x0 >= rect.x1 - 1:
+                max_x = min(max_x, word_rect.x0)
+            elif word_rect.x1 <= rect.x0 + 1:
+                min_x = max(min_x, word_rect.x1)
+        return min_x, max_x
+
+    @classmethod
+    def get_marker_alignments(self, docx_document, markers):
+        """Returns the alignment (left, center or right) of the paragraph each marker is in"""
+        alignments = {}
+        # Paragraphs in text boxes are inside the paragraph the text box is anchored to and
+        # come after it so they overwrite the alignment of that paragraph
+        for p in docx_document.element.body.iter(qn("w:p")):
+            text = "".join(t.text or "" for t in p.iter(qn("w:t")))
+            paragraph_markers = [marker for marker in markers if marker in text]
+            if not paragraph_markers:
+                continue
+            paragraph = Paragraph(p, docx_document._body)
+            alignment = paragraph.paragraph_format.alignment
+            style = paragraph.style
+            while alignment is None and style is not None:
+                alignment = style.paragraph_format.alignment
+                style = style.base_style
+            for marker in paragraph_markers:
+                if WD_ALIGN_PARAGRAPH.CENTER == alignment:
+                    alignments[marker] = "center"
+                elif WD_ALIGN_PARAGRAPH.RIGHT == alignment:
+                    alignments[marker] = "right"
+                else:
+                    alignments[marker] = "left"
+        return alignments
+
+    @classmethod
+    def get_standard_font(self, flags):
+        """Returns the standard pdf font closest to the font of a text span (see get_text)"""
+        if flags & 2**3:
+            fonts = STANDARD_FONTS["monospace"]
+        elif flags & 2**2:
+            fonts = STANDARD_FONTS["serif"]
+        else:
+            fonts = STANDARD_FONTS["sans-serif"]
+        bold = bool(flags & 2**4)
+        italic = bool(flags & 2**1)
+        return fonts[bold + 2 * italic]
+
+    def stamp(self, context, qr_code_path):
+        """Returns a new pdf document with the context values and qr code stamped on the base pdf"""
+        document = fitz.open("pdf", self.base_pdf)
+        page = document[0]
+        for field in self.fields:
+            value = context.get(field["key"])
+            if not value:
+                continue
+            text = str(value)
+            size = field["size"]
+            width = fitz.get_text_length(
+                text, fontname=field["fontname"], fontsize=size
+            )
+            # Leave (at least) a space between the value and the text next to it
+            space = fitz.get_text_length(" ", fontname=field["fontname"], fontsize=size)
+            if "center" == field["align"]:
+                centre = (field["x"] + field["x1"]) / 2
+                available = (
+                    2 * min(centre - field["min_x"], field["max_x"] - centre)
+                    - 2 * space
+                )
+            elif "right" == field["align"]:
+                available = field["x1"] - field["min_x"] - space
+            else:
+                available = field["max_x"] - field["x"] - space
+            if 0 < available < width:
+                size = size * available / width
+                width = available
+            x = field["x"]
+            if "center" == field["align"]:
+                x = (field["x"] + field["x1"] - width) / 2
+            elif "right" == field["align"]:
+                x = field["x1"] - width
+            page.insert_text(
+                (x, field["y"]),
+                text,
+                fontsize=size,
+                fontname=field["fontname"],
+                color=field["color"],
+            )
+        page.insert_image(fitz.Rect(*QR_CODE_RECTANGLE), filename=qr_code_path)
+        return document
@@ -14,10 +14,10 @@ from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
 from rest_framework.response import Response
 from rest_framework.throttling import AnonRateThrottle
 from rest_framework.views import APIView
-from rest_framework_datatables.filters import DatatablesFilterBackend
 from rest_framework_datatables.pagination import DatatablesPageNumberPagination
 
 from parkpasses.components.main.api import (
+    CustomDatatablesFilterBackend,
     CustomDatatablesListMixin,
     CustomDatatablesRenderer,
 )
@@ -33,14 +33,12 @@ from parkpasses.permissions import IsInternal, IsRetailer
 logger = logging.getLogger(__name__)
 
 
-class RetailerReportFilterBackend(DatatablesFilterBackend):
+class RetailerReportFilterBackend(CustomDatatablesFilterBackend):
     """
     Custom Filters for Internal Report Viewset
     """
 
     def filter_queryset(self, request, queryset, view):
-        total_count = queryset.count()
-
         processing_status = request.GET.get("processing_status")
         datetime_created_from = request.GET.get("datetime_created_from")
         datetime_created_to = request.GET.get("datetime_created_to")
@@ -61,7 +59,6 @@ class RetailerReportFilterBackend(DatatablesFilterBackend):
             queryset = queryset.order_by(*ordering)
 
         queryset = super().filter_queryset(request, queryset, view)
-        setattr(view, "_datatables_total_count", total_count)
 
         return queryset
 
@@ -194,14 +191,12 @@ class PayInvoiceSuccessCallbackView(APIView):
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
-class ReportFilterBackend(DatatablesFilterBackend):
+class ReportFilterBackend(CustomDatatablesFilterBackend):
     """
     Custom Filters for Internal Report Viewset
     """
 
     def filter_queryset(self, request, queryset, view):
-        total_count = queryset.count()
-
         retailer_group = request.GET.get("retailer_group")
         processing_status = request.GET.get("processing_status")
         datetime_created_from = request.GET.get("datetime_created_from")
@@ -226,7 +221,6 @@ class ReportFilterBackend(DatatablesFilterBackend):
             queryset = queryset.order_by(*ordering)
 
         queryset = super().filter_queryset(request, queryset, view)
-        setattr(view, "_datatables_total_count", total_count)
 
         return queryset
 
@@ -15,6 +15,7 @@ from rest_framework_datatables.filters import DatatablesFilterBackend
 from rest_framework_datatables.pagination import DatatablesPageNumberPagination
 
 from parkpasses.components.main.api import (
+    CustomDatatablesFilterBackend,
     CustomDatatablesListMixin,
     CustomDatatablesRenderer,
 )
@@ -117,10 +118,8 @@ class InternalRetailerGroupViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class RetailerGroupUserFilterBackend(DatatablesFilterBackend):
+class RetailerGroupUserFilterBackend(CustomDatatablesFilterBackend):
     def filter_queryset(self, request, queryset, view):
-        total_count = queryset.count()
-
         is_active = request.GET.get("is_active")
         datetime_created_from = request.GET.get("datetime_created_from")
         datetime_created_to = request.GET.get("datetime_created_to")
@@ -141,7 +140,6 @@ class RetailerGroupUserFilterBackend(DatatablesFilterBackend):
             queryset = queryset.order_by(*ordering)
 
         queryset = super().filter_queryset(request, queryset, view)
-        setattr(view, "_datatables_total_count", total_count)
 
         return queryset
 
@@ -177,10 +175,8 @@ class RetailerRetailerGroupUserViewSet(
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class RetailerGroupUserFilterBackend(DatatablesFilterBackend):
+class RetailerGroupUserFilterBackend(CustomDatatablesFilterBackend):
     def filter_queryset(self, request, queryset, view):
-        total_count = queryset.count()
-
         retailer_group = request.GET.get("retailer_group")
         is_admin = request.GET.get("is_admin")
         datetime_created_from = request.GET.get("datetime_created_from")
@@ -205,7 +201,6 @@ class RetailerGroupUserFilterBackend(DatatablesFilterBackend):
             queryset = queryset.order_by(*ordering)
 
         queryset = super().filter_queryset(request, queryset, view)
-        setattr(view, "_datatables_total_count", total_count)
 
         return queryset
 
@@ -285,10 +280,8 @@ class ExternalRetailerGroupInviteViewSet(mixins.RetrieveModelMixin, GenericViewS
         raise Http404
 
 
-class RetailerGroupUserInviteFilterBackend(DatatablesFilterBackend):
+class RetailerGroupUserInviteFilterBackend(CustomDatatablesFilterBackend):
     def filter_queryset(self, request, queryset, view):
-        total_count = queryset.count()
-
         retailer_group = request.GET.get("retailer_group")
         status = request.GET.get("status")
         datetime_created_from = request.GET.get("datetime_created_from")
@@ -313,7 +306,6 @@ class RetailerGroupUserInviteFilterBackend(DatatablesFilterBackend):
             queryset = queryset.order_by(*ordering)
 
         queryset = super().filter_queryset(request, queryset, view)
-        setattr(view, "_datatables_total_count", total_count)
 
         return queryset
 
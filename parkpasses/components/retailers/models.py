@@ -13,6 +13,7 @@ from ledger_api_client.ledger_models import EmailUserRO as EmailUser
 from ledger_api_client.utils import get_organisation
 from rest_framework import status
 
+from parkpasses.components.main.cache import invalidate_user_permissions
 from parkpasses.components.retailers.emails import RetailerEmails
 from parkpasses.components.retailers.exceptions import (
     MultipleDBCARetailerGroupsExist,
@@ -91,17 +92,10 @@ class RetailerGroup(models.Model):
             settings.CACHE_KEY_LEDGER_ORGANISATION.format(self.ledger_organisation)
         )
         # If we deactivated a retailer group then all the users in that group need to be kicked out
-        for retailer_group_user in self.retailer_group_users.all():
-            cache.delete(
-                settings.CACHE_KEY_RETAILER.format(
-                    str(retailer_group_user.emailuser.id)
-                )
-            )
-            cache.delete(
-                settings.CACHE_KEY_RETAILER_ADMIN.format(
-                    str(retailer_group_user.emailuser.id)
-                )
-            )
+        for emailuser_id in self.retailer_group_users.values_list(
+            "emailuser_id", flat=True
+        ):
+            invalidate_user_permissions(emailuser_id)
 
         super().save(*args, **kwargs)
 
@@ -258,8 +252,7 @@ class RetailerGroupUser(models.Model):
         return f"{self.emailuser} [{self.retailer_group}]"
 
     def save(self, *args, **kwargs):
-        cache.delete(settings.CACHE_KEY_RETAILER.format(str(self.emailuser.id)))
-        cache.delete(settings.CACHE_KEY_RETAILER_ADMIN.format(str(self.emailuser.id)))
+        invalidate_user_permissions(self.emailuser_id)
         cache.delete(
             settings.CACHE_KEY_GROUP_IDS.format(
                 self._meta.label_lower, str(self.retailer_group.id)
@@ -1,9 +1,27 @@
+import tempfile
 from decimal import Decimal
+from unittest import mock
 
-from django.test import TestCase
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from docx import Document
 from rest_framework.test import APIRequestFactory
 
+from parkpasses.components.passes.models import (
+    DistrictPassTypeDurationOracleCode,
+    Pass,
+    PassType,
+    PassTypePricingWindow,
+    PassTypePricingWindowOption,
+)
 from parkpasses.components.retailers.models import RetailerGroup
+from parkpasses.management.commands.retailers_generate_monthly_invoices import (
+    Command as GenerateMonthlyInvoicesCommand,
+)
+from parkpasses.management.commands.retailers_generate_monthly_invoices import (
+    get_sales_by_retailer_group,
+)
 
 
 class RetailerGroupTestCase(TestCase):
@@ -23,3 +41,144 @@ class RetailerGroupTestCase(TestCase):
 
     def test_list_retailer_groups(self):
         self.api_request_factory.get("/api/retailers/external/retailer-groups/")
+
+
+@mock.patch.object(
+    RetailerGroup,
+    "organisation",
+    new_callable=mock.PropertyMock,
+    return_value={"organisation_name": "Test Retailer"},
+)
+class GenerateMonthlyInvoicesTestCase(TestCase):
+    fixtures = ["parkpasses/components/passes/fixtures/pass-types.json"]
+
+    def setUp(self):
+        today = timezone.now()
+        self.retailer_group = RetailerGroup.objects.create(
+            ledger_organisation=99,
+            commission_oracle_code="COMMISSION",
+            commission_percentage=Decimal("10.00"),
+        )
+        # The oracle codes are invalidated when the changes are committed
+        with self.captureOnCommitCallbacks(execute=True):
+            holiday_pass_option = self.create_option(
+                settings.HOLIDAY_PASS, Decimal("10.00"), "HOLIDAY"
+            )
+            annual_local_pass_option = self.create_option(
+                settings.ANNUAL_LOCAL_PASS, Decimal("100.00"), "ANNUAL"
+            )
+        for option in [
+            holiday_pass_option,
+            holiday_pass_option,
+            annual_local_pass_option,
+        ]:
+            Pass.objects.create(
+                option=option,
+                first_name="Test",
+                last_name="User",
+                email="test.user@gmail.com",
+                vehicle_registration_1="12312312",
+                date_start=today.date(),
+                in_cart=False,
+                sold_via=self.retailer_group,
+            )
+        self.sales = get_sales_by_retailer_group(
+            Pass.objects.filter(sold_via=self.retailer_group)
+        )[self.retailer_group.id]
+
+    def create_option(self, pass_type_name, price, oracle_code):
+        today = timezone.now()
+        pricing_window = PassTypePricingWindow.objects.create(
+            name="Default",
+            pass_type=PassType.objects.get(name=pass_type_name),
+            date_start=today,
+        )
+        option = PassTypePricingWindowOption.objects.create(
+            pricing_window=pricing_window,
+            name="Option 1",
+            duration=365,
+            price=price,
+        )
+        DistrictPassTypeDurationOracleCode.objects.create(
+            district=None, option=option, oracle_code=oracle_code
+        )
+        return option
+
+    def test_sales_are_grouped_into_invoice_lines(self, organisation):
+        self.assertEqual(self.sales["pass_count"], 3)
+        self.assertEqual(self.sales["total_sales"], Decimal("120.00"))
+        lines = sorted(self.sales["lines"].values(), key=lambda line: line["quantity"])
+        self.assertEqual(
+            [
+                (line["pass_type"], line["oracle_code"], line["quantity"])
+                for line in lines
+            ],
+            [
+                ("Annual Local Park Pass", "ANNUAL", 1),
+                ("WA Holiday Park Pass", "HOLIDAY", 2),
+            ],
+        )
+        self.assertEqual(lines[1]["price_incl_tax"], Decimal("10.00"))
+        self.assertEqual(
+            self.sales["total_sales_by_pass_type"]["WA Holiday Park Pass"],
+            {"count": 2, "total_sales": Decimal("20.00")},
+        )
+
+    @mock.patch(
+        "parkpasses.management.commands.retailers_generate_monthly_invoices.convert_to_pdf"
+    )
+    @mock.patch(
+        "parkpasses.management.commands.retailers_generate_monthly_invoices.ledger_api_client_utils"
+    )
+    def test_generate_invoice(self, ledger, convert_to_pdf, organisation):
+        ledger.create_basket_session.return_value = "basket-hash|1"
+        ledger.process_create_future_invoice.return_value = {
+            "status": 200,
+            "data": {"order": "O000001", "basket_id": 1, "invoice": "00000001"},
+        }
+        report_text = []
+
+        def read_report(docx_path, pdf_path):
+            document = Document(docx_path)
+            report_text.extend(paragraph.text for paragraph in document.paragraphs)
+            for table in document.tables:
+                for row in table.rows:
+                    report_text.extend(cell.text for cell in row.cells)
+
+        convert_to_pdf.side_effect = read_report
+        first_day_of_previous_month = timezone.now().replace(day=1)
+
+        with override_settings(RETAILER_GROUP_REPORT_ROOT=tempfile.mkdtemp()):
+            report = GenerateMonthlyInvoicesCommand().generate_invoice(
+                self.retailer_group,
+                mock.Mock(id=1),
+                self.sales,
+                first_day_of_previous_month,
+                first_day_of_previous_month + timezone.timedelta(days=27),
+                timezone.now(),
+            )
+
+        products = ledger.create_basket_session.call_args[0][2]["products"]
+        self.assertEqual(
+            [
+                (product["ledger_description"], product["quantity"])
+                for product in products
+            ],
+            [
+                ("Park Pass Sales: WA Holiday Park Pass", 2),
+                ("Park Pass Sales: Annual Local Park Pass", 1),
+                (
+                    "10.00% Commission on Sales for the Month of "
+                    f"{first_day_of_previous_month:%B %Y}",
+                    1,
+                ),
+            ],
+        )
+        self.assertEqual(products[2]["price_incl_tax"], "-12.0000")
+        self.assertEqual(products[2]["oracle_code"], "COMMISSION")
+        self.assertEqual(report.invoice_reference, "00000001")
+        self.assertTrue(report.report.name.endswith(".pdf"))
+        report_text = "\n".join(report_text)
+        self.assertIn("WA Holiday Park Pass", report_text)
+        self.assertIn("$120.00", report_text)
+        self.assertIn("$108.00", report_text)
@@ -3,6 +3,7 @@ import logging
 from django.contrib.auth.signals import user_logged_in
 
 from parkpasses.components.cart.models import Cart
+from parkpasses.components.main.cache import invalidate_user_permissions
 from parkpasses.components.passes.models import Pass
 from parkpasses.components.retailers.models import RetailerGroupUser
 
@@ -22,6 +23,13 @@ def add_retailer_to_session(sender, user, request, **kwargs):
     RetailerGroupUser.update_session(request, user.id)
 
 
+def refresh_user_permissions(sender, user, request, **kwargs):
+    """Group memberships are managed in ledger so make sure they are checked again
+    rather than read from the cache whenever a user logs in"""
+    logger.info("user_logged_in signal running refresh_user_permissions function")
+    invalidate_user_permissions(user.id)
+
+
 def assign_orphan_passes(sender, user, request, **kwargs):
     """When passes are sold via retailers, the user doesn't necessarily have an account in ledger
     so we need a way to attach the user to those passes when they log in"""
@@ -33,6 +41,7 @@ def assign_orphan_passes(sender, user, request, **kwargs):
             park_pass.save()
 
 
+user_logged_in.connect(refresh_user_permissions)
 user_logged_in.connect(init_cart)
 user_logged_in.connect(assign_orphan_passes)
 user_logged_in.connect(add_retailer_to_session)
@@ -25,6 +25,7 @@ class VoucherAdmin(admin.ModelAdmin):
     readonly_fields = [
         "voucher_number",
         "code",
+        "balance",
         "expiry",
         "datetime_purchased",
         "datetime_updated",
@@ -15,13 +15,15 @@ from rest_framework.response import Response
 from rest_framework.throttling import AnonRateThrottle
 from rest_framework.views import APIView
 from rest_framework_datatables.django_filters.filterset import DatatablesFilterSet
-from rest_framework_datatables.filters import DatatablesFilterBackend
 
 from parkpasses.components.cart.models import Cart, CartItem
 from parkpasses.components.main.api import (
+    CustomDatatablesFilterBackend,
     CustomDatatablesListMixin,
     CustomDatatablesRenderer,
+    ExportListMixin,
 )
+from parkpasses.components.main.exports import ExportColumn
 from parkpasses.components.orders.models import OrderItem
 from parkpasses.components.vouchers.exceptions import (
     RetailerGroupUsersCannotPurchaseGiftVouchers,
@@ -125,10 +127,8 @@ class VoucherFilter(DatatablesFilterSet):
         fields = "__all__"
 
 
-class VoucherFilterBackend(DatatablesFilterBackend):
+class VoucherFilterBackend(CustomDatatablesFilterBackend):
     def filter_queryset(self, request, queryset, view):
-        total_count = queryset.count()
-
         processing_status = request.GET.get("processing_status")
 
         datetime_to_email_from = request.GET.get("datetime_to_email_from")
@@ -150,12 +150,13 @@ class VoucherFilterBackend(DatatablesFilterBackend):
             queryset = queryset.order_by(*ordering)
 
         queryset = super().filter_queryset(request, queryset, view)
-        setattr(view, "_datatables_total_count", total_count)
 
         return queryset
 
 
-class InternalVoucherViewSet(CustomDatatablesListMixin, viewsets.ModelViewSet):
+class InternalVoucherViewSet(
+    ExportListMixin, CustomDatatablesListMixin, viewsets.ModelViewSet
+):
     """
     A ViewSet for internal users to perform actions on vouchers.
     """
@@ -168,6 +169,19 @@ class InternalVoucherViewSet(CustomDatatablesListMixin, viewsets.ModelViewSet):
     filter_backends = (VoucherFilterBackend,)
     filterset_class = VoucherFilter
     renderer_classes = (JSONRenderer, BrowsableAPIRenderer, CustomDatatablesRenderer)
+    export_filename = "vouchers"
+    export_columns = [
+        ExportColumn("Voucher Number", "voucher_number"),
+        ExportColumn("Recipient Name", "recipient_name"),
+        ExportColumn("Recipient Email", "recipient_email"),
+        ExportColumn("Date to Email", "datetime_to_email"),
+        ExportColumn("Amount", "amount"),
+        ExportColumn("Expiry", "expiry"),
+        ExportColumn(
+            "Status", "processing_status", choices=Voucher.PROCESSING_STATUS_CHOICES
+        ),
+        ExportColumn("Date Purchased", "datetime_purchased"),
+    ]
 
     @action(methods=["GET"], detail=True, url_path="retrieve-invoice")
     def retrieve_invoice(self, request, *args, **kwargs):
@@ -238,34 +252,25 @@ class ValidateVoucherView(APIView):
                     email, code, pin
                 ),
             )
-            if Voucher.objects.filter(
+            voucher = Voucher.objects.filter(
                 in_cart=False,
                 recipient_email=email,
                 code=code,
                 pin=pin,
                 processing_status=Voucher.DELIVERED_TO_RECIPIENT,
-            ).exists():
-                voucher = Voucher.objects.get(
-                    in_cart=False,
-                    recipient_email=email,
-                    code=code,
-                    pin=pin,
-                    processing_status=Voucher.DELIVERED_TO_RECIPIENT,
-                )
+                balance__gt=Decimal(0.00),
+            ).first()
+            if voucher:
                 logger.info(
-                    f"Voucher exists: {voucher}.",
+                    f"Voucher: {voucher} exists with remaining balance: {voucher.remaining_balance}.",
                 )
-                if voucher.remaining_balance > Decimal(0.00):
-                    logger.info(
-                        f"Voucher remaining balance: {voucher.remaining_balance}.",
-                    )
-                    return Response(
-                        {
-                            "is_voucher_code_valid": True,
-                            "balance_remaining": voucher.remaining_balance,
-                        }
-                    )
-                logger.info(
-                    f"Voucher exists: {voucher} but has no remaining balance. Returning is_voucher_code_valid=false.",
+                return Response(
+                    {
+                        "is_voucher_code_valid": True,
+                        "balance_remaining": voucher.remaining_balance,
+                    }
                 )
+            logger.info(
+                "No voucher with a remaining balance exists. Returning is_voucher_code_valid=false.",
+            )
         return Response({"is_voucher_code_valid": False})
@@ -44,13 +44,17 @@ class VoucherRecipientNotificationEmail(TemplateEmailBase):
 
 class VoucherEmails:
     @classmethod
-    def send_voucher_purchaser_purchased_notification_email(self, voucher):
-        purchaser = voucher.get_purchaser
-        email = VoucherPurchaserPurchasedNotificationEmail(voucher.recipient_name)
-        context = {
-            "voucher": voucher,
-            "purchaser": purchaser,
-        }
+    def send_email(self, email, voucher, context, customer=None, batch=None):
+        """Sends the email now or, if a BatchEmailSender is passed, adds it to the batch
+        (the caller then sends the batch and logs the communications)"""
+        if batch is not None:
+            return batch.add(
+                email,
+                voucher.recipient_email,
+                context=context,
+                instance=voucher,
+                customer=customer,
+            )
         message = email.send(voucher.recipient_email, context=context)
         content_type = ContentType.objects.get_for_model(voucher)
         entry_type = EntryType.objects.get(entry_type__iexact="email")
@@ -63,38 +67,38 @@ class VoucherEmails:
             "entry_type": entry_type,
             "subject": message.subject,
             "text": message.body,
-            "customer": purchaser.id,
             "staff": staff.id,
         }
+        if customer is not None:
+            communication_log_kwargs["customer"] = customer
         CommunicationsLogEntry.objects.log_communication(**communication_log_kwargs)
 
     @classmethod
-    def send_voucher_purchaser_sent_notification_email(self, voucher):
+    def send_voucher_purchaser_purchased_notification_email(self, voucher, batch=None):
         purchaser = voucher.get_purchaser
-        email = VoucherPurchaserSentNotificationEmail(voucher.recipient_name)
+        email = VoucherPurchaserPurchasedNotificationEmail(voucher.recipient_name)
         context = {
             "voucher": voucher,
             "purchaser": purchaser,
         }
-        message = email.send(voucher.recipient_email, context=context)
-        content_type = ContentType.objects.get_for_model(voucher)
-        entry_type = EntryType.objects.get(entry_type__iexact="email")
-        staff = EmailUser.objects.get(email__icontains=settings.DEFAULT_FROM_EMAIL)
-        communication_log_kwargs = {
-            "content_type": content_type,
-            "object_id": str(voucher.id),
-            "to": voucher.recipient_email,
-            "fromm": settings.DEFAULT_FROM_EMAIL,
-            "entry_type": entry_type,
-            "subject": message.subject,
-            "text": message.body,
-            "customer": purchaser.id,
-            "staff": staff.id,
+        return self.send_email(
+            email, voucher, context, customer=purchaser.id, batch=batch
+        )
+
+    @classmethod
+    def send_voucher_purchaser_sent_notification_email(self, voucher, batch=None):
+        purchaser = voucher.get_purchaser
+        email = VoucherPurchaserSentNotificationEmail(voucher.recipient_name)
+        context = {
+            "voucher": voucher,
+            "purchaser": purchaser,
         }
-        CommunicationsLogEntry.objects.log_communication(**communication_log_kwargs)
+        return self.send_email(
+            email, voucher, context, customer=purchaser.id, batch=batch
+        )
 
     @classmethod
-    def send_voucher_recipient_notification_email(self, voucher):
+    def send_voucher_recipient_notification_email(self, voucher, batch=None):
         purchaser = voucher.get_purchaser
         email = VoucherRecipientNotificationEmail(purchaser.get_full_name())
         context = {
@@ -102,18 +106,4 @@ class VoucherEmails:
             "purchaser": purchaser,
             "site_url": settings.SITE_URL,
         }
-        message = email.send(voucher.recipient_email, context=context)
-        content_type = ContentType.objects.get_for_model(voucher)
-        entry_type = EntryType.objects.get(entry_type__iexact="email")
-        staff = EmailUser.objects.get(email__icontains=settings.DEFAULT_FROM_EMAIL)
-        communication_log_kwargs = {
-            "content_type": content_type,
-            "object_id": str(voucher.id),
-            "to": voucher.recipient_email,
-            "fromm": settings.DEFAULT_FROM_EMAIL,
-            "entry_type": entry_type,
-            "subject": message.subject,
-            "text": message.body,
-            "staff": staff.id,
-        }
-        CommunicationsLogEntry.objects.log_communication(**communication_log_kwargs)
+        return self.send_email(email, voucher, context, batch=batch)
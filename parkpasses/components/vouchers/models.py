@@ -11,6 +11,7 @@ import uuid
 from decimal import Decimal
 
 from django.db import models, transaction
+from django.db.models import F, Sum
 from django.utils import timezone
 
 from parkpasses import settings
@@ -26,16 +27,9 @@ from parkpasses.ledger_api_utils import retrieve_email_user
 logger = logging.getLogger(__name__)
 
 
-class VoucherManager(models.Manager):
-    def get_queryset(self):
-        return super().get_queryset().prefetch_related("transactions")
-
-
 class Voucher(models.Model):
     """A class to represent a voucher"""
 
-    objects = VoucherManager()
-
     voucher_number = models.CharField(max_length=10, blank=True)
     purchaser = models.IntegerField(null=True, blank=True)  # EmailUserRO
     recipient_name = models.CharField(max_length=50, null=False, blank=False)
@@ -45,6 +39,15 @@ class Voucher(models.Model):
     amount = models.DecimalField(
         max_digits=7, decimal_places=2, blank=False, null=False
     )
+    balance = models.DecimalField(
+        max_digits=7,
+        decimal_places=2,
+        blank=False,
+        null=False,
+        default=Decimal("0.00"),
+        help_text="The amount of the voucher plus the credits less the debits of its transactions. \
+            This is kept up to date as voucher transactions are saved and deleted.",
+    )
     expiry = models.DateTimeField(null=False)
     code = models.CharField(unique=True, max_length=10)
     pin = models.DecimalField(max_digits=6, decimal_places=0, blank=False, null=False)
@@ -90,12 +93,7 @@ class Voucher(models.Model):
 
     @property
     def remaining_balance(self):
-        remaining_balance = self.amount
-        for voucher_transaction in self.transactions.all():
-            if voucher_transaction.credit > 0.00:
-                remaining_balance += voucher_transaction.credit
-            if voucher_transaction.debit > 0.00:
-                remaining_balance -= voucher_transaction.debit
+        remaining_balance = self.balance
         if remaining_balance > self.amount:
             exception_message = (
                 f"The remaining balance of {remaining_balance} for voucher with id"
@@ -124,6 +122,31 @@ class Voucher(models.Model):
 
         return self.remaining_balance
 
+    @classmethod
+    def lock_balances(self, voucher_ids):
+        """Locks the vouchers (until the end of the transaction) so only one voucher transaction
+        at a time can change each of their balances and returns the balances (keyed by voucher id)"""
+        return dict(
+            Voucher.objects.select_for_update()
+            .filter(pk__in=voucher_ids)
+            .order_by("pk")
+            .values_list("pk", "balance")
+        )
+
+    @classmethod
+    def adjust_balance(self, voucher_id, amount):
+        Voucher.objects.filter(pk=voucher_id).update(balance=F("balance") + amount)
+
+    @classmethod
+    def get_fields_to_save(self):
+        """All of the fields except the balance which is only changed by adjust_balance so that
+        saving a voucher that was loaded before a voucher transaction was saved doesn't undo it"""
+        return [
+            field.name
+            for field in Voucher._meta.concrete_fields
+            if not field.primary_key and "balance" != field.name
+        ]
+
     @classmethod
     def get_new_voucher_code(self):
         is_voucher_code_unique = False
@@ -152,17 +175,12 @@ class Voucher(models.Model):
             return False
         if 6 != len(pin):
             return False
-        if not Voucher.objects.filter(code=code, pin=pin).exists():
-            return False
-
-        discount_code = Voucher.objects.get(code=code, pin=pin)
-        if discount_code.has_expired:
-            return False
-
-        if 0.00 >= discount_code.remaining_balance:
-            return False
-
-        return True
+        return Voucher.objects.filter(
+            code=code,
+            pin=pin,
+            expiry__gt=timezone.now(),
+            balance__gt=Decimal(0.00),
+        ).exists()
 
     def save(self, *args, **kwargs):
         if not self.code:
@@ -173,19 +191,53 @@ class Voucher(models.Model):
             self.expiry = timezone.now() + timezone.timedelta(
                 days=settings.PARKPASSES_VOUCHER_EXPIRY_IN_DAYS
             )
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            if self._state.adding:
+                # A new voucher doesn't have any transactions yet
+                self.balance = self.amount
+            else:
+                if "update_fields" not in kwargs:
+                    kwargs["update_fields"] = Voucher.get_fields_to_save()
+                if "amount" in kwargs["update_fields"]:
+                    self.apply_amount_change_to_balance()
+            super().save(*args, **kwargs)
         if not self.voucher_number:
             self.voucher_number = f"V{self.pk:06d}"
 
         if not self.in_cart:
-            if self.processing_status in [
-                Voucher.NEW,
-            ]:
-                self.send_voucher_purchase_notification_email()
-            if self.datetime_to_email.date() == timezone.now().date():
-                self.send_voucher_sent_notification_emails()
+            self.send_notification_emails()
 
-        super().save(force_update=True)
+        super().save(update_fields=Voucher.get_fields_to_save())
+
+    def apply_amount_change_to_balance(self):
+        """Adds the difference between the new amount and the saved amount to the balance
+        (when the amount is edited in the admin for example)"""
+        balance = Voucher.lock_balances([self.pk])[self.pk]
+        previous_amount = Voucher.objects.values_list("amount", flat=True).get(
+            pk=self.pk
+        )
+        amount_change = self.amount - previous_amount
+        if not amount_change:
+            return
+        if Decimal(0.00) > balance + amount_change:
+            exception_message = (
+                f"Changing the amount of voucher {self} from {previous_amount} to {self.amount} "
+                f"would take its balance from {balance} to below 0.00."
+            )
+            logger.error(exception_message)
+            raise RemainingVoucherBalanceLessThanZeroException(exception_message)
+        Voucher.adjust_balance(self.pk, amount_change)
+        self.balance = balance + amount_change
+
+    def send_notification_emails(self):
+        """Sends the purchased email (and the sent emails if the voucher is to be emailed today)
+        updating the processing status (but not saving it)"""
+        if self.processing_status in [
+            Voucher.NEW,
+        ]:
+            self.send_voucher_purchase_notification_email()
+        if self.datetime_to_email.date() == timezone.now().date():
+            self.send_voucher_sent_notification_emails()
 
     def send_voucher_purchase_notification_email(self):
         error_message = "An exception occured trying to run "
@@ -221,7 +273,28 @@ class Voucher(models.Model):
                 logger.exception(error_message.format(self.id, timezone.now(), e))
 
 
-class VoucherTransactionManager(models.Manager):
+class VoucherTransactionQuerySet(models.QuerySet):
+    def delete(self):
+        """Gives the balances of the deleted transactions back to their vouchers"""
+        with transaction.atomic():
+            Voucher.lock_balances(set(self.values_list("voucher_id", flat=True)))
+            voucher_balances = list(
+                self.order_by()
+                .values("voucher_id")
+                .annotate(transactions_balance=Sum(F("credit") - F("debit")))
+            )
+            deleted = super().delete()
+            for voucher_balance in voucher_balances:
+                Voucher.adjust_balance(
+                    voucher_balance["voucher_id"],
+                    -voucher_balance["transactions_balance"],
+                )
+        return deleted
+
+
+class VoucherTransactionManager(
+    models.Manager.from_queryset(VoucherTransactionQuerySet)
+):
     def get_queryset(self):
         return super().get_queryset().select_related("voucher")
 
@@ -267,3 +340,43 @@ class VoucherTransaction(models.Model):
 
     def balance(self):
         return self.credit - self.debit
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            # The change this save makes to the balance of each voucher involved
+            balance_changes = {self.voucher_id: self.balance()}
+            if self.pk:
+                previous = (
+                    VoucherTransaction.objects.filter(pk=self.pk)
+                    .values("voucher_id", "credit", "debit")
+                    .first()
+                )
+                if previous:
+                    balance_changes[previous["voucher_id"]] = balance_changes.get(
+                        previous["voucher_id"], Decimal(0.00)
+                    ) - (previous["credit"] - previous["debit"])
+            voucher_balances = Voucher.lock_balances(balance_changes.keys())
+            for voucher_id, balance_change in balance_changes.items():
+                if Decimal(0.00) > voucher_balances[voucher_id] + balance_change:
+                    exception_message = (
+                        f"Voucher transaction {self} would take the balance of voucher with id "
+                        f"{voucher_id} from {voucher_balances[voucher_id]} to below 0.00."
+                    )
+                    logger.error(exception_message)
+                    raise RemainingVoucherBalanceLessThanZeroException(
+                        exception_message
+                    )
+            super().save(*args, **kwargs)
+            for voucher_id, balance_change in balance_changes.items():
+                if balance_change:
+                    Voucher.adjust_balance(voucher_id, balance_change)
+        if not self.park_pass.in_cart:
+            self.park_pass.update_stored_prices()
+
+    def delete(self, *args, **kwargs):
+        park_pass_id = self.park_pass_id
+        # Deleted through the queryset so the balance is given back to the voucher
+        VoucherTransaction.objects.filter(pk=self.pk).delete()
+        park_pass = Pass.objects.get(pk=park_pass_id)
+        if not park_pass.in_cart:
+            park_pass.update_stored_prices()
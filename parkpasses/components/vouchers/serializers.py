@@ -50,8 +50,12 @@ class ExternalListVoucherSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        email_user = EmailUser.objects.get(id=instance.purchaser)
-        data.update({"purchaser": BasicEmailUserSerializer(email_user).data})
+        # The vouchers in a cart usually have the same purchaser so only look each one up once
+        purchasers = self.context.setdefault("purchasers", {})
+        if instance.purchaser not in purchasers:
+            email_user = EmailUser.objects.get(id=instance.purchaser)
+            purchasers[instance.purchaser] = BasicEmailUserSerializer(email_user).data
+        data.update({"purchaser": purchasers[instance.purchaser]})
         return data
 
 
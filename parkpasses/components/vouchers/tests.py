@@ -1,9 +1,24 @@
+import io
 from decimal import Decimal
+from unittest import mock
 
+from django.conf import settings
+from django.core.management import call_command
 from django.test import TestCase
 from django.utils import timezone
 
-from parkpasses.components.vouchers.models import Voucher
+from parkpasses.components.passes.models import (
+    Pass,
+    PassType,
+    PassTypePricingWindow,
+    PassTypePricingWindowOption,
+)
+from parkpasses.components.retailers.models import RetailerGroup
+from parkpasses.components.vouchers.emails import VoucherEmails
+from parkpasses.components.vouchers.exceptions import (
+    RemainingVoucherBalanceLessThanZeroException,
+)
+from parkpasses.components.vouchers.models import Voucher, VoucherTransaction
 
 
 class VouchersTestCase(TestCase):
@@ -32,3 +47,157 @@ class VouchersTestCase(TestCase):
             voucher_str, f"{self.voucher1.voucher_number} (${self.voucher1.amount})"
         )
         self.assertNotEqual(voucher_str, "Random String")
+
+
+class VoucherBalanceTestCase(TestCase):
+    fixtures = ["parkpasses/components/passes/fixtures/pass-types.json"]
+
+    def setUp(self):
+        today = timezone.now()
+        pricing_window = PassTypePricingWindow.objects.create(
+            name="Default",
+            pass_type=PassType.objects.get(name=settings.HOLIDAY_PASS),
+            date_start=today,
+        )
+        self.option = PassTypePricingWindowOption.objects.create(
+            pricing_window=pricing_window,
+            name="Option 1",
+            duration=5,
+            price=Decimal("30.00"),
+        )
+        self.sold_via, created = RetailerGroup.objects.get_or_create(
+            ledger_organisation=settings.PARKPASSES_DEFAULT_SOLD_VIA_ORGANISATION_ID
+        )
+        self.voucher = Voucher.objects.create(
+            purchaser=1,
+            recipient_name="John Smith",
+            recipient_email="john.smith@totallymadeupmailserver.com",
+            datetime_to_email=today + timezone.timedelta(days=365),
+            personal_message="A very personal message.",
+            amount=Decimal("50.00"),
+        )
+
+    def create_voucher_transaction(self, debit):
+        park_pass = Pass.objects.create(
+            user=1,
+            option=self.option,
+            first_name="Test",
+            last_name="User",
+            email="test.user@gmail.com",
+            vehicle_registration_1="12312312",
+            date_start=timezone.now().date(),
+            sold_via=self.sold_via,
+        )
+        return VoucherTransaction.objects.create(
+            voucher=self.voucher,
+            park_pass=park_pass,
+            credit=Decimal("0.00"),
+            debit=debit,
+        )
+
+    def get_balance(self):
+        return Voucher.objects.values_list("balance", flat=True).get(pk=self.voucher.pk)
+
+    def test_balance_follows_voucher_transactions(self):
+        self.assertEqual(self.voucher.balance, Decimal("50.00"))
+        voucher_transaction = self.create_voucher_transaction(Decimal("30.00"))
+        self.assertEqual(self.get_balance(), Decimal("20.00"))
+        voucher_transaction.debit = Decimal("10.00")
+        voucher_transaction.save()
+        self.assertEqual(self.get_balance(), Decimal("40.00"))
+        voucher_transaction.delete()
+        self.assertEqual(self.get_balance(), Decimal("50.00"))
+        self.create_voucher_transaction(Decimal("25.00"))
+        self.create_voucher_transaction(Decimal("25.00"))
+        self.assertEqual(self.get_balance(), Decimal("0.00"))
+        self.assertFalse(Voucher.is_valid(self.voucher.code, self.voucher.pin))
+        VoucherTransaction.objects.filter(voucher=self.voucher).delete()
+        self.assertEqual(self.get_balance(), Decimal("50.00"))
+
+    def test_voucher_can_not_be_overspent(self):
+        self.create_voucher_transaction(Decimal("30.00"))
+        with self.assertRaises(RemainingVoucherBalanceLessThanZeroException):
+            self.create_voucher_transaction(Decimal("30.00"))
+        self.assertEqual(self.get_balance(), Decimal("20.00"))
+
+    def test_saving_a_stale_voucher_keeps_the_balance(self):
+        self.create_voucher_transaction(Decimal("30.00"))
+        self.voucher.recipient_name = "Jane Smith"
+        self.voucher.save()
+        self.assertEqual(self.get_balance(), Decimal("20.00"))
+
+    def test_changing_the_amount_adjusts_the_balance(self):
+        self.create_voucher_transaction(Decimal("30.00"))
+        self.voucher.amount = Decimal("70.00")
+        self.voucher.save()
+        self.assertEqual(self.get_balance(), Decimal("40.00"))
+        self.voucher.amount = Decimal("40.00")
+        self.voucher.save()
+        self.assertEqual(self.get_balance(), Decimal("10.00"))
+        self.voucher.amount = Decimal("20.00")
+        with self.assertRaises(RemainingVoucherBalanceLessThanZeroException):
+            self.voucher.save()
+        self.assertEqual(self.get_balance(), Decimal("10.00"))
+
+    def test_reconcile_balances(self):
+        self.create_voucher_transaction(Decimal("30.00"))
+        Voucher.objects.filter(pk=self.voucher.pk).update(balance=Decimal("45.00"))
+        stdout = io.StringIO()
+        call_command("voucher_reconcile_balances", stdout=stdout)
+        self.assertIn("Found 1 vouchers with drifted balances.", stdout.getvalue())
+        self.assertEqual(self.get_balance(), Decimal("45.00"))
+        call_command("voucher_reconcile_balances", fix=True, stdout=stdout)
+        self.assertEqual(self.get_balance(), Decimal("20.00"))
+
+
+@mock.patch(
+    "parkpasses.management.commands.voucher_send_notification_emails.log_communications"
+)
+@mock.patch(
+    "parkpasses.management.commands.voucher_send_notification_emails.BatchEmailSender"
+)
+class SendVoucherNotificationEmailsTestCase(TestCase):
+    def setUp(self):
+        self.vouchers = [
+            Voucher.objects.create(
+                purchaser=1,
+                recipient_name="John Smith",
+                recipient_email="john.smith@totallymadeupmailserver.com",
+                datetime_to_email=timezone.now() + timezone.timedelta(days=7),
+                personal_message="A very personal message.",
+                amount=Decimal("50.00"),
+            )
+            for i in range(2)
+        ]
+        self.failing_voucher = self.vouchers[0]
+
+    def send_notification_email_side_effect(self, voucher, batch):
+        if voucher.id == self.failing_voucher.id:
+            raise Exception("Template missing")
+
+    @mock.patch.object(
+        VoucherEmails, "send_voucher_purchaser_purchased_notification_email"
+    )
+    def test_a_failing_email_does_not_stop_the_others(
+        self, send_email, BatchEmailSender, log_communications
+    ):
+        BatchEmailSender.return_value.send.return_value = []
+        send_email.side_effect = self.send_notification_email_side_effect
+
+        with self.assertLogs(
+            "parkpasses.management.commands.voucher_send_notification_emails",
+            level="ERROR",
+        ) as logs:
+            call_command("voucher_send_notification_emails", stdout=io.StringIO())
+
+        self.assertEqual(send_email.call_count, 2)
+        self.assertIn(
+            f"Unable to create the purchase notification email for Voucher: {self.failing_voucher}",
+            logs.output[0],
+        )
+        self.failing_voucher.refresh_from_db()
+        self.assertEqual(
+            self.failing_voucher.processing_status, Voucher.NOT_DELIVERED_TO_PURCHASER
+        )
+        self.vouchers[1].refresh_from_db()
+        self.assertEqual(self.vouchers[1].processing_status, Voucher.PURCHASER_NOTIFIED)
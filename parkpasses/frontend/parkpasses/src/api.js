@@ -65,6 +65,9 @@ module.exports = {
         return                          `/api/passes/rac/check-hash-matches-email/${discountHash}/${email}/`
     },
     uploadPersonnelPasses:              '/api/passes/upload-personnel-passes/',
+    personnelPassImport: function (personnelPassImportId) {
+        return                          `/api/passes/internal/personnel-pass-imports/${personnelPassImportId}/`
+    },
 
     /* ========================= Pass Types =============================================*/
 
@@ -6,9 +6,11 @@ from django.utils.text import slugify
 from ledger_api_client.ledger_models import EmailUserRO as EmailUser
 from ledger_api_client.managed_models import SystemGroupPermission
 
+from parkpasses.components.main.cache import user_permissions_key
 from parkpasses.components.passes.models import (
     DistrictPassTypeDurationOracleCode,
     Pass,
+    PassPdfJob,
     PassType,
     PassTypePricingWindow,
 )
@@ -61,7 +63,9 @@ def belongs_to(request, group_name):
         return True
 
     user = request.user
-    cache_key = settings.CACHE_KEY_BELONGS_TO.format(str(user.id), slugify(group_name))
+    cache_key = user_permissions_key(
+        user.id, settings.CACHE_KEY_BELONGS_TO.format(str(user.id), slugify(group_name))
+    )
     belongs_to_value = cache.get(cache_key)
     if belongs_to_value is None:
         belongs_to_value = SystemGroupPermission.objects.filter(
@@ -78,7 +82,9 @@ def is_internal(request):
         return True
 
     user = request.user
-    cache_key = settings.CACHE_KEY_IS_INTERNAL.format(str(user.id))
+    cache_key = user_permissions_key(
+        user.id, settings.CACHE_KEY_IS_INTERNAL.format(str(user.id))
+    )
     is_internal = cache.get(cache_key)
     if is_internal is None:
         is_internal = (
@@ -99,8 +105,7 @@ def test_async(var):
 
 def generate_park_pass_pdf_from_id(id):
     park_pass = Pass.objects.get(id=id)
-    park_pass.generate_park_pass_pdf()
-    park_pass.update()
+    return PassPdfJob.enqueue(park_pass)
 
 
 def is_parkpasses_admin(request):
@@ -127,7 +132,9 @@ def is_retailer(request):
     if not request.user.is_authenticated:
         return False
 
-    cache_key = settings.CACHE_KEY_RETAILER.format(str(request.user.id))
+    cache_key = user_permissions_key(
+        request.user.id, settings.CACHE_KEY_RETAILER.format(str(request.user.id))
+    )
     is_retailer = cache.get(cache_key)
     if is_retailer is None:
         is_retailer = RetailerGroupUser.objects.filter(
@@ -144,7 +151,9 @@ def is_retailer_admin(request):
     if request.user.is_superuser:
         return True
 
-    cache_key = settings.CACHE_KEY_RETAILER_ADMIN.format(str(request.user.id))
+    cache_key = user_permissions_key(
+        request.user.id, settings.CACHE_KEY_RETAILER_ADMIN.format(str(request.user.id))
+    )
     is_retailer_admin = cache.get(cache_key)
     if is_retailer_admin is None:
         is_retailer_admin = RetailerGroupUser.objects.filter(
@@ -159,7 +168,10 @@ def is_retailer_admin(request):
 
 
 def get_retailer_group_ids_for_user(request):
-    cache_key = settings.CACHE_KEY_RETAILER_GROUP_IDS.format(str(request.user.id))
+    cache_key = user_permissions_key(
+        request.user.id,
+        settings.CACHE_KEY_RETAILER_GROUP_IDS.format(str(request.user.id)),
+    )
     retailer_group_ids = cache.get(cache_key)
     if retailer_group_ids is None:
         retailer_group_ids = list(
@@ -2,26 +2,178 @@
 This management commands deleted and park passes objects from sessions
 that have expired and then deletes those sessions.
 
+Everything is deleted batch_size rows at a time (each batch in its own transaction) with
+set based deletes so that a large number of abandoned carts can be cleared without
+locking the tables for long.
+
 Usage: ./manage.sh clear_expired_sessions
+       ./manage.sh clear_expired_sessions --batch-size 5000
+       ./manage.sh clear_expired_sessions --dry-run
+        (outputs how many rows would be deleted without deleting them)
 
 """
+import logging
 from importlib import import_module
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 from django.utils import timezone
 
-from parkpasses.components.cart.models import Cart
+from parkpasses.components.cart.models import Cart, CartItem
 from parkpasses.components.concessions.models import ConcessionUsage
 from parkpasses.components.discount_codes.models import DiscountCodeUsage
-from parkpasses.components.passes.models import Pass
+from parkpasses.components.passes.models import Pass, RACDiscountUsage
 from parkpasses.components.vouchers.models import Voucher, VoucherTransaction
 
+logger = logging.getLogger(__name__)
+
 
 class Command(BaseCommand):
     help = "Clears expired sessions for the park passes system."
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="The number of carts / passes / vouchers / sessions to delete at a time.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Output how many rows would be deleted without deleting them.",
+        )
+
+    def get_batches(self, queryset, batch_size):
+        """Yields the ids of the queryset batch_size at a time. The rows are expected to
+        be deleted between batches so each batch is simply the first batch_size ids left."""
+        queryset = queryset.order_by("pk").values_list("pk", flat=True)
+        while True:
+            ids = list(queryset[:batch_size])
+            if not ids:
+                break
+            yield ids
+
+    def get_pass_related_querysets(self, pass_ids):
+        """The rows that have to be deleted (in this order) before the passes can be deleted"""
+        object_ids = [str(pass_id) for pass_id in pass_ids]
+        return [
+            CartItem.objects.filter(
+                content_type=self.pass_content_type, object_id__in=object_ids
+            ),
+            ConcessionUsage.objects.filter(park_pass_id__in=pass_ids),
+            DiscountCodeUsage.objects.filter(park_pass_id__in=pass_ids),
+            VoucherTransaction.objects.filter(park_pass_id__in=pass_ids),
+            RACDiscountUsage.objects.filter(park_pass_id__in=pass_ids),
+            Pass.objects.filter(id__in=pass_ids),
+        ]
+
+    def get_voucher_related_querysets(self, voucher_ids):
+        object_ids = [str(voucher_id) for voucher_id in voucher_ids]
+        return [
+            CartItem.objects.filter(
+                content_type=self.voucher_content_type, object_id__in=object_ids
+            ),
+            Voucher.objects.filter(id__in=voucher_ids),
+        ]
+
+    def get_cart_related_querysets(self, cart_ids):
+        cart_items = CartItem.objects.filter(cart_id__in=cart_ids)
+        pass_ids = Pass.objects.filter(
+            in_cart=True,
+            id__in=[
+                int(object_id)
+                for object_id in cart_items.filter(
+                    content_type=self.pass_content_type
+                ).values_list("object_id", flat=True)
+            ],
+        ).values_list("id", flat=True)
+        voucher_ids = Voucher.objects.filter(
+            in_cart=True,
+            id__in=[
+                int(object_id)
+                for object_id in cart_items.filter(
+                    content_type=self.voucher_content_type
+                ).values_list("object_id", flat=True)
+            ],
+        ).values_list("id", flat=True)
+        # The cart items of the passes and vouchers are the cart's items (deleted first)
+        return (
+            [cart_items]
+            + self.get_pass_related_querysets(list(pass_ids))[1:]
+            + self.get_voucher_related_querysets(list(voucher_ids))[1:]
+            + [Cart.objects.filter(id__in=cart_ids)]
+        )
+
+    def delete(self, queryset, get_related_querysets):
+        """Deletes the rows of the queryset and their related rows and returns the
+        number of rows deleted (or that would be deleted) by model"""
+        deleted = {}
+        if self.dry_run:
+            batches = [list(queryset.values_list("pk", flat=True))]
+        else:
+            batches = self.get_batches(queryset, self.batch_size)
+        for ids in batches:
+            with transaction.atomic():
+                for related_queryset in get_related_querysets(ids):
+                    model_name = related_queryset.model._meta.verbose_name_plural
+                    if self.dry_run:
+                        count = related_queryset.count()
+                    else:
+                        # Deleting the queryset rather than each object skips the model's
+                        # delete method and its extra queries
+                        count, _ = related_queryset.delete()
+                    deleted[model_name] = deleted.get(model_name, 0) + count
+            logger.info(f"Deleted {deleted}")
+        return deleted
+
+    def write_deleted(self, deleted, description):
+        if not any(deleted.values()):
+            self.stdout.write(f"No {description} found.\n\n")
+            return
+        prefix = "DRY RUN: would delete" if self.dry_run else "Deleted"
+        for model_name, count in deleted.items():
+            if count:
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"{prefix} {count} {model_name} ({description})."
+                    )
+                )
+        self.stdout.write("\n")
+
+    def clear_expired_django_sessions(self):
+        engine = import_module(settings.SESSION_ENGINE)
+        if not hasattr(engine.SessionStore, "get_model_class"):
+            # Sessions that are not stored in the database expire by themselves
+            if not self.dry_run:
+                engine.SessionStore.clear_expired()
+            return
+
+        expired_sessions = (
+            engine.SessionStore.get_model_class()
+            .objects.filter(expire_date__lt=timezone.now())
+            .order_by()
+        )
+        self.write_deleted(
+            self.delete(
+                expired_sessions,
+                lambda session_keys: [
+                    expired_sessions.model.objects.filter(session_key__in=session_keys)
+                ],
+            ),
+            "expired django sessions",
+        )
+
     def handle(self, *args, **options):
+        self.batch_size = options["batch_size"]
+        if self.batch_size < 1:
+            raise CommandError("--batch-size must be at least 1")
+        self.dry_run = options["dry_run"]
+        self.pass_content_type = ContentType.objects.get_for_model(Pass)
+        self.voucher_content_type = ContentType.objects.get_for_model(Voucher)
+
         now = timezone.now()
         date_today = now.date()
         two_weeks_ago = now - timezone.timedelta(days=14)
@@ -29,22 +181,11 @@ class Command(BaseCommand):
         self.stdout.write(
             "\nSelecting any expired park passes carts (that were last added to more than 14 days ago)"
         )
-        if Cart.objects.filter(datetime_last_added_to__lte=two_weeks_ago).exists():
-            expired_carts = Cart.objects.filter(
-                datetime_last_added_to__lte=two_weeks_ago
-            )
-            for expired_cart in expired_carts:
-                expired_cart_items = expired_cart.items.all()
-                for expired_cart_item in expired_cart_items:
-                    expired_cart_item.delete()
-                expired_cart.delete()
-            self.stdout.write(
-                self.style.SUCCESS(f"Deleted {len(expired_carts)} Expired carts.\n\n")
-            )
-        else:
-            self.stdout.write(
-                "No park passes that were added to a cart more than two weeks ago found.\n\n"
-            )
+        expired_carts = Cart.objects.filter(datetime_last_added_to__lte=two_weeks_ago)
+        self.write_deleted(
+            self.delete(expired_carts, self.get_cart_related_querysets),
+            "park passes carts that were added to more than two weeks ago",
+        )
 
         # A pass may have been in a cart less than 2 weeks but has already expired
         # (i.e. 5 day holiday pass or any short duration pass)
@@ -58,31 +199,10 @@ class Command(BaseCommand):
             in_cart=True,
             date_expiry__lte=date_today,
         )
-        if expired_passes.exists():
-            for expired_pass in expired_passes:
-
-                # Make sure to remove any related objects
-                expired_pass.concession_usage = None
-                expired_pass.discount_code_usage = None
-                expired_pass.voucher_transaction = None
-                expired_pass.save()
-
-                # Delete the related objects
-                ConcessionUsage.objects.filter(park_pass=expired_pass).delete()
-                DiscountCodeUsage.objects.filter(park_pass=expired_pass).delete()
-                VoucherTransaction.objects.filter(park_pass=expired_pass).delete()
-
-                expired_pass.delete()
-
-            self.stdout.write(
-                self.style.SUCCESS(
-                    f"Deleted {len(expired_passes)} Expired passes still in carts.\n\n"
-                )
-            )
-        else:
-            self.stdout.write(
-                "No park passes that were still in a cart but had expired were found.\n\n"
-            )
+        self.write_deleted(
+            self.delete(expired_passes, self.get_pass_related_querysets),
+            "park passes that were still in a cart but had expired",
+        )
 
         # A voucher may have been in a cart less than 2 weeks but the date the voucher was
         # going to be sent has already passed.
@@ -94,22 +214,11 @@ class Command(BaseCommand):
             in_cart=True,
             datetime_to_email__date__lt=date_today,
         )
-        if expired_vouchers.exists():
-            for expired_voucher in expired_vouchers:
-                expired_voucher.delete()
-
-            self.stdout.write(
-                self.style.SUCCESS(
-                    f"Deleted {len(expired_vouchers)} Expired vouchers still in carts.\n\n"
-                )
-            )
-        else:
-            self.stdout.write(
-                "No vouchers that were still in a cart but their 'date to send' had already passed were found.\n\n"
-            )
+        self.write_deleted(
+            self.delete(expired_vouchers, self.get_voucher_related_querysets),
+            "vouchers that were still in a cart but their 'date to send' had already passed",
+        )
 
         self.stdout.write("Clearing expired django sessions.")
-        engine = import_module(settings.SESSION_ENGINE)
-        engine.SessionStore.clear_expired()
-
+        self.clear_expired_django_sessions()
         self.stdout.write(self.style.SUCCESS("Expired django sessions cleared.\n"))
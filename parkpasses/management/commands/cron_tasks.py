@@ -1,10 +1,28 @@
+"""
+This management command runs the park passes cron tasks.
+
+The tasks are management commands that are run in this process. Tasks that don't depend on each
+other (see CRON_TASKS) are run at the same time on a thread pool. When all of the tasks have
+finished a single email summarising how long each task took, whether it succeeded and what it
+output is sent to settings.CRON_NOTIFICATION_EMAIL.
+
+Usage: ./manage.sh cron_tasks
+       ./manage.sh cron_tasks --concurrency 1
+        (this command should be run by a cron job or task runner not manually)
+
+"""
+import io
 import logging
-import subprocess
-from pathlib import Path
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 from django.conf import settings
 from django.core.mail import EmailMultiAlternatives
-from django.core.management.base import BaseCommand
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils.html import escape
 
 logger = logging.getLogger(__name__)
 
@@ -13,64 +31,146 @@ cron_email = logging.getLogger("cron_email")
 LOGFILE = "/app/logs/" + settings.CRON_EMAIL_FILE_NAME  # This file is used temporarily.
 # It's cleared whenever this cron starts, then at the end the contents of this file is emailed.
 
+# Each cron task (management command) and the tasks that have to finish before it is started.
+# The dependencies only order the tasks, a task is still run if a task it depends on fails.
+CRON_TASKS = {
+    "parkpasses_check": [],
+    "clear_expired_sessions": [],
+    "pass_send_vehicle_details_not_provided_notification_emails": [],
+    "pass_send_expired_notification_emails": [],
+    "pass_send_autorenew_and_expiry_notification_emails": [],
+    # Customers are told their pass has expired before it is renewed
+    "pass_process_autorenew_payments": ["pass_send_expired_notification_emails"],
+    "pass_send_gold_pass_details_to_pica": [],
+    # Expired carts (and the voucher transactions in them) are cleared first
+    "voucher_reconcile_balances": ["clear_expired_sessions"],
+}
+
+
+class CronTaskResult:
+    def __init__(self, name):
+        self.name = name
+        self.succeeded = None
+        self.seconds = None
+        self.output = ""
+
+
+def check_task_graph(tasks):
+    """Raises a CommandError if a task depends on a task that doesn't exist or the tasks depend
+    on each other in a cycle"""
+    for name, dependencies in tasks.items():
+        for dependency in dependencies:
+            if dependency not in tasks:
+                raise CommandError(
+                    f"Cron task {name} depends on unknown task {dependency}"
+                )
+
+    finished = set()
+    remaining = dict(tasks)
+    while remaining:
+        ready = [
+            name
+            for name, dependencies in remaining.items()
+            if finished.issuperset(dependencies)
+        ]
+        if not ready:
+            raise CommandError(
+                f"The cron tasks {', '.join(remaining)} depend on each other in a cycle"
+            )
+        for name in ready:
+            finished.add(name)
+            del remaining[name]
+
+
+def run_task_graph(tasks, run_task, concurrency):
+    """Runs run_task(name) for each of the tasks, starting each one as soon as the tasks it
+    depends on have finished, and returns the results in the order they finished"""
+    check_task_graph(tasks)
+    results = []
+    finished = set()
+    pending = dict(tasks)
+    running = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while pending or running:
+            for name, dependencies in list(pending.items()):
+                if finished.issuperset(dependencies):
+                    del pending[name]
+                    running[executor.submit(run_task, name)] = name
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                finished.add(running.pop(future))
+                results.append(future.result())
+    return results
+
 
 class Command(BaseCommand):
     help = "Run the Park Passes Cron tasks"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.CRON_TASKS_CONCURRENCY,
+            help="The number of tasks that can run at the same time.",
+        )
+
+    def run_task(self, name):
+        result = CronTaskResult(name)
+        output = io.StringIO()
+        logger.info(f"Running python manage.py {name}\n\n")
+        started = time.monotonic()
+        try:
+            call_command(name, stdout=output, stderr=output)
+            result.succeeded = True
+        except Exception:
+            logger.exception(f"Cron task {name} failed")
+            output.write(traceback.format_exc())
+            result.succeeded = False
+        finally:
+            # Each thread has its own database connection
+            connection.close()
+        result.seconds = time.monotonic() - started
+        result.output = output.getvalue()
+        logger.info(
+            f"Cron task {name} {'succeeded' if result.succeeded else 'failed'} "
+            f"in {result.seconds:.1f} seconds"
+        )
+        return result
+
+    def get_summary(self, results, seconds):
+        failed = len([result for result in results if not result.succeeded])
+        lines = [
+            f"{len(results)} cron tasks ran in {seconds:.1f} seconds, {failed} failed.",
+            "",
+        ]
+        for result in results:
+            status = "OK" if result.succeeded else "FAILED"
+            lines.append(f"{status:<7}{result.seconds:>8.1f}s  {result.name}")
+        for result in results:
+            lines.extend(["", f"==================== {result.name}", result.output])
+        return "\n".join(lines)
+
     def handle(self, *args, **options):
-        stdout_redirect = f" | tee -a {LOGFILE}"
-        subprocess.call(f"cat /dev/null > {LOGFILE}", shell=True)  # empty the log file
+        if options["concurrency"] < 1:
+            raise CommandError("--concurrency must be at least 1")
 
         logger.info(f"Running command {__name__}\n\n")
+        started = time.monotonic()
+        results = run_task_graph(CRON_TASKS, self.run_task, options["concurrency"])
+        summary = self.get_summary(results, time.monotonic() - started)
+        self.stdout.write(summary)
 
-        logger.info("Running python manage.py parkpasses_check\n\n")
-        subprocess.call(
-            "python manage.py parkpasses_check" + stdout_redirect, shell=True
-        )
-        logger.info("Running python manage.py clear_expired_sessions\n\n")
-        subprocess.call(
-            "python manage.py clear_expired_sessions" + stdout_redirect, shell=True
-        )
-        logger.info(
-            "Running python manage.py pass_send_vehicle_details_not_provided_notification_emails\n\n"
-        )
-        subprocess.call(
-            "python manage.py pass_send_vehicle_details_not_provided_notification_emails"
-            + stdout_redirect,
-            shell=True,
-        )
-        logger.info(
-            "Running python manage.py pass_send_expired_notification_emails\n\n"
-        )
-        subprocess.call(
-            "python manage.py pass_send_expired_notification_emails" + stdout_redirect,
-            shell=True,
-        )
-        logger.info(
-            "Running python manage.py pass_send_autorenew_and_expiry_notification_emails\n\n"
-        )
-        subprocess.call(
-            "python manage.py pass_send_autorenew_and_expiry_notification_emails"
-            + stdout_redirect,
-            shell=True,
-        )
-        logger.info("Running python manage.py pass_process_autorenew_payments\n\n")
-        subprocess.call(
-            "python manage.py pass_process_autorenew_payments" + stdout_redirect,
-            shell=True,
-        )
-        logger.info("Running python manage.py pass_send_gold_pass_details_to_pica\n\n")
-        subprocess.call(
-            "python manage.py pass_send_gold_pass_details_to_pica" + stdout_redirect,
-            shell=True,
-        )
+        try:
+            with open(LOGFILE, "w") as logfile:
+                logfile.write(summary)
+        except OSError as e:
+            logger.warning(f"Unable to write the cron email log {LOGFILE}: {e}")
 
         logger.info(f"Command {__name__} completed")
-        self.send_email()
+        self.send_email(summary)
 
-    def send_email(self):
+    def send_email(self, contents_of_cron_email):
         email_instance = settings.EMAIL_INSTANCE
-        contents_of_cron_email = Path(LOGFILE).read_text()
         subject = f"{settings.SYSTEM_NAME_SHORT} - Cronjob"
         to = (
             settings.CRON_NOTIFICATION_EMAIL
@@ -84,9 +184,7 @@ class Command(BaseCommand):
             to,
             headers={"System-Environment": email_instance},
         )
-        msg.attach_alternative(contents_of_cron_email, "text/html")
+        msg.attach_alternative(
+            f"<pre>{escape(contents_of_cron_email)}</pre>", "text/html"
+        )
         msg.send()
-
-    def clear_cron_email_log(self):
-        with open(LOGFILE, "w"):
-            pass
@@ -0,0 +1,78 @@
+"""
+This management command generates the discount codes for queued discount code batches
+(batches that need more than settings.DISCOUNT_CODE_GENERATION_BACKGROUND_THRESHOLD codes).
+
+The number of codes generated so far is stored in the batch's codes_generated field
+as each block of codes is inserted so the progress can be shown while it runs.
+
+Usage: ./manage.sh discount_codes_generate_codes
+        (runs until stopped, this command should be started along side the web server)
+
+       ./manage.sh discount_codes_generate_codes --once
+        (generates the codes for the batches that are currently queued and then exits)
+
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from parkpasses.components.discount_codes.models import DiscountCodeBatch
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Generates the discount codes for queued discount code batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Generate the codes for the batches that are currently queued and then exit.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=int,
+            default=settings.DISCOUNT_CODE_GENERATION_POLL_INTERVAL_SECONDS,
+            help="The number of seconds to wait before checking for queued batches.",
+        )
+
+    def handle(self, *args, **options):
+        succeeded = 0
+        failed = 0
+        while True:
+            requeued = DiscountCodeBatch.requeue_stale_generations()
+            if requeued:
+                logger.warning(f"Requeued {requeued} stale discount code generations.")
+
+            discount_code_batch = DiscountCodeBatch.claim_queued_generation()
+            if discount_code_batch is None:
+                if options["once"]:
+                    break
+                time.sleep(options["sleep"])
+                continue
+
+            start = time.monotonic()
+            if discount_code_batch.run_generation():
+                succeeded += 1
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"Generated {discount_code_batch.codes_generated} codes for "
+                        f"{discount_code_batch} in {time.monotonic() - start:.1f} seconds."
+                    )
+                )
+            else:
+                failed += 1
+                self.stdout.write(
+                    self.style.ERROR(
+                        f"Failed to generate the codes for {discount_code_batch}."
+                    )
+                )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Discount code batches processed: {succeeded} succeeded, {failed} failed."
+            )
+        )
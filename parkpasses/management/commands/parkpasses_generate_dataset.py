@@ -0,0 +1,712 @@
+"""
+This management command fills the database with a synthetic, production sized dataset so the
+performance of passes, carts, orders, vouchers, discount codes and retailer invoicing
+can be measured locally.
+
+The same --seed always generates the same dataset (run it against a freshly migrated database
+with the pass type fixtures and pricing windows loaded) so benchmarks can be compared between runs.
+
+- Sales are spread over the --days before today with peaks in the summer and school holidays
+- A share of the annual passes renew automatically, are sold by retailers (a few retailers sell
+  most of the passes) or use a concession, discount code or voucher
+- Some carts are left open with passes still in them
+
+The passes, vouchers and orders belong to fake ledger users and the retailer groups to fake
+ledger organisations (with ids starting at --ledger-id-start). These are put into the cache the
+same way the ledger api client responses are so pages that show them don't call ledger.
+
+Usage: ./manage.sh parkpasses_generate_dataset
+       ./manage.sh parkpasses_generate_dataset --passes 500000 --vouchers 20000 --seed 2
+       ./manage.sh parkpasses_generate_dataset --force
+        (generate the dataset even though settings.DEBUG is not set)
+
+"""
+import datetime
+import logging
+import random
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from ledger_api_client.ledger_models import EmailUserRO as EmailUser
+
+from parkpasses.components.cart.models import Cart, CartItem
+from parkpasses.components.concessions.models import Concession, ConcessionUsage
+from parkpasses.components.discount_codes.models import (
+    DiscountCode,
+    DiscountCodeBatch,
+    DiscountCodeUsage,
+)
+from parkpasses.components.orders.models import Order, OrderItem
+from parkpasses.components.parks.models import ParkGroup, Postcode
+from parkpasses.components.passes.models import (
+    Pass,
+    PassCancellation,
+    PassTypePricingWindowOption,
+)
+from parkpasses.components.passes.oracle_codes import OracleCodeResolver
+from parkpasses.components.retailers.models import District, RetailerGroup
+from parkpasses.components.vouchers.models import Voucher, VoucherTransaction
+
+logger = logging.getLogger(__name__)
+
+# Relative number of sales in each month (summer and the school holidays are the busiest)
+SEASONAL_SALES_WEIGHTS = {
+    1: 15,
+    2: 7,
+    3: 8,
+    4: 12,
+    5: 6,
+    6: 5,
+    7: 9,
+    8: 5,
+    9: 7,
+    10: 10,
+    11: 6,
+    12: 14,
+}
+
+PASS_TYPE_WEIGHTS = {
+    settings.DAY_ENTRY_PASS: 40,
+    settings.HOLIDAY_PASS: 25,
+    settings.ALL_PARKS_PASS: 15,
+    settings.ANNUAL_LOCAL_PASS: 12,
+    settings.GOLD_STAR_PASS: 5,
+    settings.PINJAR_OFF_ROAD_VEHICLE_AREA_ANNUAL_PASS: 3,
+}
+
+VOUCHER_AMOUNTS = [Decimal("20.00"), Decimal("50.00"), Decimal("100.00")]
+
+FIRST_NAMES = [
+    "Alex",
+    "Charlie",
+    "Jamie",
+    "Jordan",
+    "Morgan",
+    "Riley",
+    "Sam",
+    "Taylor",
+    "Casey",
+    "Robin",
+]
+LAST_NAMES = [
+    "Brown",
+    "Chen",
+    "Nguyen",
+    "Smith",
+    "Jones",
+    "Williams",
+    "Taylor",
+    "Walker",
+    "Kelly",
+    "Singh",
+]
+
+USAGE_RELATIONS = [
+    "rac_discount_usage",
+    "concession_usage",
+    "discount_code_usage",
+    "voucher_transaction",
+]
+
+
+class Command(BaseCommand):
+    help = "Generates a synthetic dataset for load and benchmark testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--passes", type=int, default=10000)
+        parser.add_argument("--vouchers", type=int, default=1000)
+        parser.add_argument(
+            "--carts",
+            type=int,
+            default=500,
+            help="The number of open carts (each with passes still in them).",
+        )
+        parser.add_argument("--retailers", type=int, default=20)
+        parser.add_argument("--discount-code-batches", type=int, default=10)
+        parser.add_argument("--codes-per-batch", type=int, default=100)
+        parser.add_argument(
+            "--users",
+            type=int,
+            default=5000,
+            help="The number of ledger users the passes and vouchers are shared between.",
+        )
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=730,
+            help="The number of days before today that the sales are spread over.",
+        )
+        parser.add_argument("--auto-renew-share", type=float, default=0.3)
+        parser.add_argument("--retailer-share", type=float, default=0.25)
+        parser.add_argument("--concession-share", type=float, default=0.1)
+        parser.add_argument("--discount-code-share", type=float, default=0.1)
+        parser.add_argument("--voucher-share", type=float, default=0.05)
+        parser.add_argument("--cancelled-share", type=float, default=0.02)
+        parser.add_argument(
+            "--ledger-id-start",
+            type=int,
+            default=900000,
+            help="The first id of the fake ledger users and organisations.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="The number of rows to insert at a time.",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Generate the dataset even though settings.DEBUG is not set.",
+        )
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options["force"]:
+            raise CommandError(
+                "This command fills the database with fake data. "
+                "Use --force to run it without settings.DEBUG set."
+            )
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1")
+
+        self.options = options
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        self.today = timezone.now().date()
+        self.pass_content_type = ContentType.objects.get_for_model(Pass)
+        self.voucher_content_type = ContentType.objects.get_for_model(Voucher)
+        self.counts = {}
+
+        self.load_reference_data()
+        self.user_ids = [
+            options["ledger_id_start"] + index for index in range(options["users"])
+        ]
+        self.sale_days = self.get_sale_days()
+
+        try:
+            self.create_retailer_groups()
+            self.stub_ledger()
+            self.create_discount_codes()
+            self.create_vouchers()
+            self.create_passes()
+            self.create_carts()
+            self.save_voucher_balances()
+        except IntegrityError as e:
+            raise CommandError(
+                f"{e} (Has a dataset already been generated with this seed? "
+                "Use a different --seed or a fresh database.)"
+            )
+
+        for model_name, count in self.counts.items():
+            self.stdout.write(f"{model_name}: {count}")
+        self.stdout.write(self.style.SUCCESS("Dataset generated."))
+
+    def count(self, model, number):
+        self.counts[model.__name__] = self.counts.get(model.__name__, 0) + number
+
+    def get_batches(self, total):
+        for start in range(0, total, self.batch_size):
+            yield min(self.batch_size, total - start)
+
+    def load_reference_data(self):
+        self.options_by_pass_type = {}
+        for option in PassTypePricingWindowOption.objects.select_related(
+            "pricing_window__pass_type"
+        ).order_by("id"):
+            self.options_by_pass_type.setdefault(
+                option.pricing_window.pass_type.name, []
+            ).append(option)
+        self.pass_type_names = [
+            name for name in PASS_TYPE_WEIGHTS if name in self.options_by_pass_type
+        ]
+        if not self.pass_type_names:
+            raise CommandError(
+                "There are no pass type options. Load the pass type fixtures "
+                "and create the pricing windows first."
+            )
+        self.pass_type_weights = [
+            PASS_TYPE_WEIGHTS[name] for name in self.pass_type_names
+        ]
+        self.concessions = list(Concession.objects.order_by("id"))
+        self.park_group_ids = list(
+            ParkGroup.objects.order_by("id").values_list("id", flat=True)
+        )
+        self.postcodes = list(
+            Postcode.objects.order_by("id").values_list("postcode", flat=True)
+        ) or ["6000"]
+        self.dbca_retailer_group = RetailerGroup.get_dbca_retailer_group()
+
+    def get_sale_days(self):
+        days = [
+            self.today - datetime.timedelta(days=days_ago)
+            for days_ago in range(self.options["days"])
+        ]
+        weights = [SEASONAL_SALES_WEIGHTS[day.month] for day in days]
+        return days, weights
+
+    def get_datetime_sold(self):
+        days, weights = self.sale_days
+        day = self.rng.choices(days, weights)[0]
+        seconds = self.rng.randrange(7 * 3600, 22 * 3600)
+        return timezone.make_aware(
+            datetime.datetime.combine(day, datetime.time())
+            + datetime.timedelta(seconds=seconds)
+        )
+
+    def get_uuid(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def get_code(self, length=8):
+        return f"{self.rng.getrandbits(length * 4):0{length}X}"
+
+    def get_person(self):
+        first_name = self.rng.choice(FIRST_NAMES)
+        last_name = self.rng.choice(LAST_NAMES)
+        user_id = self.rng.choice(self.user_ids)
+        return {
+            "user_id": user_id,
+            "first_name": first_name,
+            "last_name": last_name,
+            "email": f"{first_name}.{last_name}.{user_id}@example.com".lower(),
+        }
+
+    def create_retailer_groups(self):
+        """Retailer groups are reused (by ledger organisation) if they were created by an earlier run"""
+        district = District.objects.order_by("id").first()
+        if district is None:
+            district = District.objects.create(name="Generated District")
+        ledger_organisations = [
+            self.options["ledger_id_start"] + index
+            for index in range(self.options["retailers"])
+        ]
+        existing = set(
+            RetailerGroup.objects.filter(
+                ledger_organisation__in=ledger_organisations
+            ).values_list("ledger_organisation", flat=True)
+        )
+        new_retailer_groups = [
+            RetailerGroup(
+                ledger_organisation=ledger_organisation,
+                district=district,
+                commission_oracle_code=f"GENERATED-{ledger_organisation}",
+                commission_percentage=Decimal(self.rng.choice([5, 10, 15])),
+            )
+            for ledger_organisation in ledger_organisations
+            if ledger_organisation not in existing
+        ]
+        RetailerGroup.objects.bulk_create(new_retailer_groups)
+        self.count(RetailerGroup, len(new_retailer_groups))
+
+        self.retailer_groups = list(
+            RetailerGroup.objects.filter(
+                ledger_organisation__in=ledger_organisations
+            ).order_by("ledger_organisation")
+        )
+        # A few retailers sell most of the passes
+        self.retailer_group_weights = [
+            1 / (rank + 1) for rank in range(len(self.retailer_groups))
+        ]
+
+    def stub_ledger(self):
+        """Caches a fake ledger organisation for each retailer group and a fake email user for
+        each user (see RetailerGroup.organisation and retrieve_email_user)"""
+        for retailer_group in self.retailer_groups:
+            cache.set(
+                settings.CACHE_KEY_LEDGER_ORGANISATION.format(
+                    retailer_group.ledger_organisation
+                ),
+                {
+                    "organisation_id": retailer_group.ledger_organisation,
+                    "organisation_name": f"Retailer {retailer_group.ledger_organisation}",
+                    "organisation_abn": f"{retailer_group.ledger_organisation:011d}",
+                    "organisation_email": f"retailer.{retailer_group.ledger_organisation}@example.com",
+                },
+                None,
+            )
+        for user_id in self.user_ids:
+            cache.set(
+                settings.CACHE_KEY_EMAIL_USER.format(str(user_id)),
+                EmailUser(
+                    id=user_id,
+                    email=f"user.{user_id}@example.com",
+                    first_name="User",
+                    last_name=str(user_id),
+                ),
+                None,
+            )
+        logger.info(
+            f"Stubbed {len(self.retailer_groups)} ledger organisations "
+            f"and {len(self.user_ids)} email users."
+        )
+
+    def create_discount_codes(self):
+        self.discount_codes = []
+        self.discount_code_uses = {}
+        with transaction.atomic():
+            discount_code_batches = []
+            for index in range(self.options["discount_code_batches"]):
+                datetime_start = self.get_datetime_sold()
+                is_percentage = self.rng.random() < 0.5
+                discount_code_batches.append(
+                    DiscountCodeBatch(
+                        created_by=self.rng.choice(self.user_ids),
+                        datetime_start=datetime_start,
+                        datetime_expiry=datetime_start + datetime.timedelta(days=365),
+                        codes_to_generate=self.options["codes_per_batch"],
+                        codes_generated=self.options["codes_per_batch"],
+                        generation_status=DiscountCodeBatch.GENERATION_COMPLETED,
+                        times_each_code_can_be_used=self.rng.choice([None, 1, 5]),
+                        discount_percentage=Decimal(self.rng.choice([10, 20, 50]))
+                        if is_percentage
+                        else None,
+                        discount_amount=None
+                        if is_percentage
+                        else Decimal(self.rng.choice([5, 10, 20])),
+                    )
+                )
+            DiscountCodeBatch.objects.bulk_create(discount_code_batches)
+            for discount_code_batch in discount_code_batches:
+                discount_code_batch.discount_code_batch_number = (
+                    f"DC{discount_code_batch.pk:06d}"
+                )
+            DiscountCodeBatch.objects.bulk_update(
+                discount_code_batches, ["discount_code_batch_number"]
+            )
+            self.count(DiscountCodeBatch, len(discount_code_batches))
+
+            codes = set()
+            for discount_code_batch in discount_code_batches:
+                while (
+                    len(codes)
+                    < len(self.discount_codes) + self.options["codes_per_batch"]
+                ):
+                    code = self.get_code()
+                    if code not in codes:
+                        codes.add(code)
+                        self.discount_codes.append(
+                            DiscountCode(
+                                discount_code_batch=discount_code_batch, code=code
+                            )
+                        )
+            DiscountCode.objects.bulk_create(
+                self.discount_codes, batch_size=self.batch_size
+            )
+            self.count(DiscountCode, len(self.discount_codes))
+
+    def get_discount_code(self):
+        """Returns a discount code that hasn't been used up"""
+        for attempt in range(10):
+            discount_code = self.rng.choice(self.discount_codes)
+            uses = self.discount_code_uses.get(discount_code.pk, 0)
+            times = discount_code.discount_code_batch.times_each_code_can_be_used
+            if times is None or uses < times:
+                self.discount_code_uses[discount_code.pk] = uses + 1
+                return discount_code
+        return None
+
+    def create_orders(self, sales):
+        """Creates an order (with one item) for each (object, content type, amount, description,
+        oracle code, user id, retailer group, datetime) sale"""
+        orders = []
+        order_items = []
+        for (
+            sold,
+            content_type,
+            amount,
+            description,
+            oracle_code,
+            user_id,
+            retailer_group,
+            datetime_sold,
+        ) in sales:
+            order_uuid = self.get_uuid()
+            orders.append(
+                Order(
+                    order_number=order_uuid,
+                    uuid=order_uuid,
+                    invoice_reference=self.get_uuid(),
+                    retailer_group=retailer_group,
+                    user=user_id,
+                    payment_confirmed=True,
+                    datetime_created=datetime_sold,
+                )
+            )
+            order_items.append(
+                OrderItem(
+                    object_id=str(sold.pk),
+                    content_type=content_type,
+                    description=description,
+                    amount=amount,
+                    oracle_code=oracle_code,
+                )
+            )
+        Order.objects.bulk_create(orders)
+        for order, order_item in zip(orders, order_items):
+            order.order_number = f"O{order.pk:06d}"
+            order_item.order = order
+        # datetime_created is auto_now_add so it is set again once the orders exist
+        Order.objects.bulk_update(orders, ["order_number", "datetime_created"])
+        OrderItem.objects.bulk_create(order_items)
+        self.count(Order, len(orders))
+        self.count(OrderItem, len(order_items))
+
+    def create_vouchers(self):
+        self.voucher_balances = {}
+        codes = set()
+        for batch_size in self.get_batches(self.options["vouchers"]):
+            vouchers = []
+            for index in range(batch_size):
+                purchaser = self.get_person()
+                recipient = self.get_person()
+                datetime_sold = self.get_datetime_sold()
+                code = self.get_code()
+                while code in codes:
+                    code = self.get_code()
+                codes.add(code)
+                amount = self.rng.choice(VOUCHER_AMOUNTS)
+                vouchers.append(
+                    Voucher(
+                        purchaser=purchaser["user_id"],
+                        recipient_name=f"{recipient['first_name']} {recipient['last_name']}",
+                        recipient_email=recipient["email"],
+                        datetime_to_email=datetime_sold,
+                        personal_message="Enjoy the parks!",
+                        amount=amount,
+                        balance=amount,
+                        expiry=datetime_sold
+                        + datetime.timedelta(
+                            days=settings.PARKPASSES_VOUCHER_EXPIRY_IN_DAYS
+                        ),
+                        code=code,
+                        pin=Decimal(self.rng.randrange(1000000)),
+                        processing_status=Voucher.DELIVERED_TO_RECIPIENT,
+                        in_cart=False,
+                        datetime_purchased=datetime_sold,
+                    )
+                )
+            with transaction.atomic():
+                Voucher.objects.bulk_create(vouchers)
+                for voucher in vouchers:
+                    voucher.voucher_number = f"V{voucher.pk:06d}"
+                    self.voucher_balances[voucher] = voucher.amount
+                Voucher.objects.bulk_update(
+                    vouchers, ["voucher_number", "datetime_purchased"]
+                )
+                self.create_orders(
+                    (
+                        voucher,
+                        self.voucher_content_type,
+                        voucher.amount,
+                        f"Park Pass Voucher {voucher.voucher_number}",
+                        settings.PARKPASSES_DEFAULT_VOUCHER_ORACLE_CODE,
+                        voucher.purchaser,
+                        None,
+                        voucher.datetime_purchased,
+                    )
+                    for voucher in vouchers
+                )
+            self.count(Voucher, len(vouchers))
+        self.vouchers = list(self.voucher_balances)
+
+    def save_voucher_balances(self):
+        """The voucher transactions are bulk created so the balances they leave are stored afterwards"""
+        for voucher, balance in self.voucher_balances.items():
+            voucher.balance = balance
+        Voucher.objects.bulk_update(
+            list(self.voucher_balances), ["balance"], batch_size=self.batch_size
+        )
+
+    def get_pass(self, in_cart=False):
+        """Returns an unsaved pass along with its unsaved usages"""
+        pass_type_name = self.rng.choices(self.pass_type_names, self.pass_type_weights)[
+            0
+        ]
+        option = self.rng.choice(self.options_by_pass_type[pass_type_name])
+        person = self.get_person()
+        datetime_sold = self.get_datetime_sold()
+        date_start = datetime_sold.date() + datetime.timedelta(
+            days=self.rng.choice([0, 0, 0, 1, 7, 14, 30])
+        )
+
+        sold_via = self.dbca_retailer_group
+        if self.retailer_groups and self.rng.random() < self.options["retailer_share"]:
+            sold_via = self.rng.choices(
+                self.retailer_groups, self.retailer_group_weights
+            )[0]
+
+        park_pass = Pass(
+            user=person["user_id"],
+            option=option,
+            first_name=person["first_name"],
+            last_name=person["last_name"],
+            email=person["email"],
+            mobile=f"04{self.rng.randrange(100000000):08d}",
+            postcode=self.rng.choice(self.postcodes),
+            vehicle_registration_1=self.get_code(6),
+            park_group_id=self.rng.choice(self.park_group_ids)
+            if settings.ANNUAL_LOCAL_PASS == pass_type_name and self.park_group_ids
+            else None,
+            date_start=date_start,
+            date_expiry=date_start + datetime.timedelta(days=option.duration),
+            renew_automatically=option.duration >= 365
+            and self.rng.random() < self.options["auto_renew_share"],
+            in_cart=in_cart,
+            processing_status=Pass.VALID,
+            sold_via=sold_via,
+            datetime_created=datetime_sold,
+        )
+
+        usages = {}
+        if self.concessions and self.rng.random() < self.options["concession_share"]:
+            usages["concession_usage"] = ConcessionUsage(
+                concession=self.rng.choice(self.concessions),
+                concession_card_number=str(self.rng.randrange(10**9)),
+                date_expiry=date_start + datetime.timedelta(days=365),
+            )
+        if (
+            self.discount_codes
+            and self.rng.random() < self.options["discount_code_share"]
+        ):
+            discount_code = self.get_discount_code()
+            if discount_code is not None:
+                usages["discount_code_usage"] = DiscountCodeUsage(
+                    discount_code=discount_code
+                )
+        # The usages are cached on the pass so the prices can be worked out without queries
+        for relation in USAGE_RELATIONS:
+            getattr(Pass, relation).related.set_cached_value(
+                park_pass, usages.get(relation)
+            )
+        if self.vouchers and self.rng.random() < self.options["voucher_share"]:
+            voucher = self.rng.choice(self.vouchers)
+            debit = min(
+                self.voucher_balances[voucher],
+                park_pass.price_after_discount_code_applied,
+            ).quantize(Decimal("0.00"))
+            if debit > Decimal("0.00"):
+                self.voucher_balances[voucher] -= debit
+                usages["voucher_transaction"] = VoucherTransaction(
+                    voucher=voucher, credit=Decimal("0.00"), debit=debit
+                )
+                Pass.voucher_transaction.related.set_cached_value(
+                    park_pass, usages["voucher_transaction"]
+                )
+        if not in_cart:
+            park_pass.set_stored_prices()
+        return park_pass, usages
+
+    def save_passes(self, park_passes_and_usages):
+        park_passes = [park_pass for park_pass, usages in park_passes_and_usages]
+        Pass.objects.bulk_create(park_passes)
+        for park_pass in park_passes:
+            park_pass.pass_number = f"PP{park_pass.pk:06d}"
+        # datetime_created is auto_now_add so it is set again once the passes exist
+        Pass.objects.bulk_update(park_passes, ["pass_number", "datetime_created"])
+        self.count(Pass, len(park_passes))
+
+        usages_by_model = {}
+        for park_pass, usages in park_passes_and_usages:
+            for usage in usages.values():
+                usage.park_pass = park_pass
+                usages_by_model.setdefault(type(usage), []).append(usage)
+        for model, usages in usages_by_model.items():
+            model.objects.bulk_create(usages)
+            self.count(model, len(usages))
+        return park_passes
+
+    def create_passes(self):
+        for batch_size in self.get_batches(self.options["passes"]):
+            park_passes_and_usages = [self.get_pass() for index in range(batch_size)]
+            with transaction.atomic():
+                park_passes = self.save_passes(park_passes_and_usages)
+
+                cancellations = [
+                    PassCancellation(
+                        park_pass=park_pass, cancellation_reason="Generated"
+                    )
+                    for park_pass in park_passes
+                    if self.rng.random() < self.options["cancelled_share"]
+                ]
+                PassCancellation.objects.bulk_create(cancellations)
+                Pass.objects.filter(
+                    pk__in=[cancellation.park_pass_id for cancellation in cancellations]
+                ).update(processing_status=Pass.CANCELLED)
+                self.count(PassCancellation, len(cancellations))
+
+                self.create_orders(
+                    (
+                        park_pass,
+                        self.pass_content_type,
+                        park_pass.price_paid,
+                        f"{park_pass.option.pricing_window.pass_type.display_name} "
+                        f"({park_pass.option.name})",
+                        OracleCodeResolver.resolve(
+                            park_pass.option_id,
+                            park_pass.sold_via.district_id
+                            if park_pass.sold_via != self.dbca_retailer_group
+                            else None,
+                            park_pass.park_group_id,
+                        )
+                        or settings.PARKPASSES_DEFAULT_ORACLE_CODE,
+                        park_pass.user,
+                        park_pass.sold_via
+                        if park_pass.sold_via != self.dbca_retailer_group
+                        else None,
+                        park_pass.datetime_created,
+                    )
+                    for park_pass in park_passes
+                )
+            logger.info(f"Generated {self.counts[Pass.__name__]} park passes.")
+
+    def create_carts(self):
+        """Open carts are recent and hold passes that haven't been paid for"""
+        recent = timezone.now() - datetime.timedelta(days=14)
+        for batch_size in self.get_batches(self.options["carts"]):
+            carts = []
+            park_passes_and_usages = []
+            cart_indexes = []
+            for index in range(batch_size):
+                datetime_created = recent + datetime.timedelta(
+                    seconds=self.rng.randrange(14 * 24 * 3600)
+                )
+                carts.append(
+                    Cart(
+                        user=self.rng.choice(self.user_ids),
+                        uuid=self.get_uuid(),
+                        datetime_created=datetime_created,
+                        datetime_first_added_to=datetime_created,
+                        datetime_last_added_to=datetime_created,
+                    )
+                )
+                for item in range(self.rng.choice([1, 1, 1, 2, 3])):
+                    park_passes_and_usages.append(self.get_pass(in_cart=True))
+                    cart_indexes.append(index)
+            with transaction.atomic():
+                Cart.objects.bulk_create(carts)
+                Cart.objects.bulk_update(carts, ["datetime_created"])
+                self.count(Cart, len(carts))
+                self.save_passes(park_passes_and_usages)
+                cart_items = []
+                for cart_index, (park_pass, usages) in zip(
+                    cart_indexes, park_passes_and_usages
+                ):
+                    cart_items.append(
+                        CartItem(
+                            cart=carts[cart_index],
+                            object_id=str(park_pass.pk),
+                            content_type=self.pass_content_type,
+                            concession_usage=usages.get("concession_usage"),
+                            discount_code_usage=usages.get("discount_code_usage"),
+                            voucher_transaction=usages.get("voucher_transaction"),
+                        )
+                    )
+                CartItem.objects.bulk_create(cart_items)
+                self.count(CartItem, len(cart_items))
+            logger.info(f"Generated {self.counts[Cart.__name__]} open carts.")
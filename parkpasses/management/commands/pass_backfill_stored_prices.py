@@ -0,0 +1,78 @@
+"""
+This management command populates the stored pricing columns (concession discount, discount code discount,
+voucher amount, price paid and gst) of park passes that were purchased before the columns existed.
+
+Usage: ./manage.sh pass_backfill_stored_prices
+       ./manage.sh pass_backfill_stored_prices --batch-size 2000
+       ./manage.sh pass_backfill_stored_prices --all
+        (recalculates the stored pricing of every purchased park pass)
+
+"""
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from parkpasses.components.passes.models import Pass
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Populates the stored pricing of purchased park passes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="The number of passes to load and update at a time.",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Recalculate the stored pricing of passes that already have it.",
+        )
+        parser.add_argument(
+            "--test",
+            action="store_true",
+            help="Adding the test flag will output how many passes would be updated without updating them.",
+        )
+
+    def get_passes(self, options):
+        passes = Pass.objects.filter(in_cart=False)
+        if not options["all"]:
+            passes = passes.filter(price_paid__isnull=True)
+        return passes.select_related(
+            "rac_discount_usage",
+            "concession_usage__concession",
+            "discount_code_usage__discount_code__discount_code_batch",
+            "voucher_transaction",
+        ).order_by("id")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1")
+
+        passes = self.get_passes(options)
+        self.stdout.write(f"Found {passes.count()} park passes to update.")
+        if options["test"]:
+            return
+
+        updated = 0
+        last_id = 0
+        while True:
+            # Page by id rather than offset as the passes drop out of the filter once updated
+            batch = list(passes.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            for park_pass in batch:
+                park_pass.set_stored_prices()
+            Pass.objects.bulk_update(batch, Pass.STORED_PRICE_FIELDS)
+            updated += len(batch)
+            last_id = batch[-1].id
+            logger.info(f"Stored prices populated for {updated} park passes.")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Stored prices populated for {updated} park passes.")
+        )
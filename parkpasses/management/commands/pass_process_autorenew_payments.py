@@ -3,17 +3,24 @@
  the result of the processing attempts are stored in the database and if there are 3 failed attempts
  then autorenwal is disabled for that pass and the user is notified via email.
 
+ The passes to renew, their renewal options and the renewal passes are loaded / created in bulk
+ and then the payments are processed --concurrency at a time.
+
 Usage: ./manage.sh pass_process_autorenew_payments
+       ./manage.sh pass_process_autorenew_payments --concurrency 8
         (this command should be run by a cron job or task runner not manually)
 
 """
 import logging
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from decimal import Decimal
 
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
 from django.db.models import Count, Q
 from django.urls import reverse
 from django.utils import timezone
@@ -23,10 +30,36 @@ from ledger_api_client.ledger_models import EmailUserRO as EmailUser
 from parkpasses.components.cart.utils import CartUtils
 from parkpasses.components.orders.models import Order, OrderItem
 from parkpasses.components.passes.models import Pass, PassAutoRenewalAttempt, PassType
+from parkpasses.components.passes.oracle_codes import OracleCodeResolver
 from parkpasses.components.retailers.models import RetailerGroup
 
 logger = logging.getLogger(__name__)
 
+# The first key of the postgres advisory locks taken on the passes being renewed
+# (the second is the pass id) which keeps them apart from any other advisory locks
+AUTORENEWAL_ADVISORY_LOCK_NAMESPACE = 1
+
+# The fields that are copied from the pass being renewed to the renewal pass
+RENEWAL_FIELDS = [
+    "user",
+    "first_name",
+    "last_name",
+    "email",
+    "mobile",
+    "company",
+    "address_line_1",
+    "address_line_2",
+    "suburb",
+    "state",
+    "postcode",
+    "rac_member_number",
+    "vehicle_registration_1",
+    "vehicle_registration_2",
+    "drivers_licence_number",
+    "park_group_id",
+    "sold_via_id",
+]
+
 
 class Command(BaseCommand):
     help = "Attempts to process payment for all passes that expired recently and had autorenewal enabled."
@@ -42,6 +75,12 @@ class Command(BaseCommand):
             action="store_true",
             help="Adding the clear flag will reset the data state for testing purposes.",
         )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.PASS_AUTORENEWAL_CONCURRENCY,
+            help="The number of payments to process at the same time.",
+        )
 
     def clear_test_data(self, park_pass_content_type):
         # Delete the new pass that was just created
@@ -63,16 +102,7 @@ class Command(BaseCommand):
         p.renew_automatically = True
         p.save()
 
-    def handle(self, *args, **options):
-        park_pass_content_type = ContentType.objects.get_for_model(Pass)
-        if options["clear"]:
-            self.clear_test_data(park_pass_content_type)
-
-        no_reply_email_user, created = EmailUser.objects.get_or_create(
-            email=settings.NO_REPLY_EMAIL, password=""
-        )
-        today = timezone.now().date()
-
+    def get_passes(self, today, dbca_retailer_group):
         successful_auto_renewal_attempts = Count(
             "auto_renewal_attempts",
             filter=Q(auto_renewal_attempts__auto_renewal_succeeded=True),
@@ -82,13 +112,11 @@ class Command(BaseCommand):
             filter=Q(auto_renewal_attempts__auto_renewal_succeeded=False),
         )
 
-        dbca_retailer_group = RetailerGroup.get_dbca_retailer_group()
-
         auto_renewal_pass_types = PassType.objects.filter(
             can_be_renewed_automatically=True
         )
 
-        passes = (
+        return (
             Pass.objects.exclude(processing_status=Pass.CANCELLED)
             .annotate(successful_auto_renewal_attempts=successful_auto_renewal_attempts)
             .annotate(failed_auto_renewal_attempts=failed_auto_renewal_attempts)
@@ -101,328 +129,440 @@ class Command(BaseCommand):
                 failed_auto_renewal_attempts__lt=3,
                 option__pricing_window__pass_type__in=auto_renewal_pass_types,
             )
+            .select_related(
+                "rac_discount_usage",
+                "concession_usage__concession",
+            )
+            .order_by("id")
         )
 
-        if passes.exists():
-            self.stdout.write(
-                self.style.SUCCESS(
-                    f"Found {len(passes)} park passes that have expired with autorenewal enabled, "
-                    "have no successful renewal attempts and have less than 3 unsuccessful renewal attempts."
+    def get_renewal_passes(self, passes, today):
+        """Returns the pass each of the passes will be renewed as (keyed by the id of the pass
+        being renewed) reusing the renewal passes created by previous attempts and creating
+        the rest in bulk"""
+        renewal_passes = {}
+        for renewal_pass in Pass.objects.filter(
+            in_cart=True, park_pass_renewed_from__in=passes
+        ).order_by("id"):
+            renewal_passes.setdefault(
+                renewal_pass.park_pass_renewed_from_id, []
+            ).append(renewal_pass)
+        renewal_passes = {
+            park_pass_id: park_passes[0]
+            for park_pass_id, park_passes in renewal_passes.items()
+            if 1 == len(park_passes)
+        }
+
+        # We have to give the customer warning of how much will be charged to their account
+        # See the doc string for Pass.get_next_renewal_option for more information
+        options = Pass.get_next_renewal_options(
+            [park_pass for park_pass in passes if park_pass.id not in renewal_passes]
+        )
+
+        new_park_passes = []
+        for park_pass in passes:
+            if park_pass.id in renewal_passes:
+                continue
+            option = options[park_pass.id]
+            if option is None:
+                logger.error(
+                    f"Unable to renew park pass {park_pass} as there is no renewal option for it."
                 )
+                continue
+            new_park_pass = Pass(
+                park_pass_renewed_from=park_pass,
+                option=option,
+                date_start=today,
+                date_expiry=today + timezone.timedelta(days=option.duration),
+                renew_automatically=True,
+                # Strickly speaking the new pass is not in a cart as it is not stored in a session
+                # however to prevent these passes showing up where they shouldn't we set this flag
+                in_cart=True,
+                processing_status=Pass.AWAITING_AUTO_RENEWAL,
             )
-            for park_pass in passes:
-                if options["test"]:
-                    self.stdout.write(
-                        self.style.SUCCESS(
-                            f"TEST: pretending to process automatic renewal of Pass: {park_pass}"
-                        )
-                    )
-                    continue
+            for field in RENEWAL_FIELDS:
+                setattr(new_park_pass, field, getattr(park_pass, field))
+            new_park_passes.append(new_park_pass)
+
+        if new_park_passes:
+            # bulk_create doesn't call save so the pass numbers are assigned here
+            Pass.objects.bulk_create(new_park_passes)
+            for new_park_pass in new_park_passes:
+                new_park_pass.pass_number = f"PP{new_park_pass.pk:06d}"
+                renewal_passes[new_park_pass.park_pass_renewed_from_id] = new_park_pass
+            Pass.objects.bulk_update(new_park_passes, ["pass_number"])
+            logger.info(f"Created {len(new_park_passes)} renewal park passes.")
+
+        return renewal_passes
+
+    def get_renewed_from_order_items(self, passes, park_pass_content_type):
+        """Returns the order item each of the passes was purchased with (keyed by pass id)"""
+        return {
+            # The object id of an order item is stored as a string
+            int(order_item.object_id): order_item
+            for order_item in OrderItem.objects.filter(
+                content_type=park_pass_content_type,
+                object_id__in=[str(park_pass.id) for park_pass in passes],
+            ).select_related("order")
+        }
+
+    def process_payment(
+        self,
+        park_pass,
+        new_park_pass,
+        renewed_from_order_item,
+        email_user,
+        park_pass_content_type,
+        dbca_retailer_group,
+    ):
+        order_uuid = uuid.uuid4()
+        # Every order must have an invoice reference but we don't yet have one so for now
+        # we use the order uuid (the real reference number will be populated by the return_preload_url code)
+        order = Order(
+            user=park_pass.user,
+            uuid=order_uuid,
+            invoice_reference=order_uuid,
+            retailer_group=dbca_retailer_group,
+        )
+        order_item = OrderItem()
+        order_item.content_type = park_pass_content_type
+        order_item.object_id = new_park_pass.id
+        order_item.description = CartUtils.get_pass_purchase_description(
+            new_park_pass.pass_number
+        )
+        order_item.amount = new_park_pass.option.price
+        # Automatic renewals are online sales so use the PICA oracle code
+        order_item.oracle_code = (
+            OracleCodeResolver.resolve(
+                new_park_pass.option_id,
+                park_group_id=new_park_pass.park_group_id,
+            )
+            or settings.PARKPASSES_DEFAULT_ORACLE_CODE
+        )
 
-                if Pass.objects.filter(user=park_pass.user):
-                    pass  # todo
-
-                # We have to give the customer warning of how much will be charged to their account
-                # See the doc string for the following method for more information
-                option = park_pass.get_next_renewal_option
-
-                if (
-                    1
-                    == Pass.objects.filter(
-                        user=park_pass.user,
-                        in_cart=True,
-                        park_pass_renewed_from=park_pass,
-                    ).count()
-                ):
-                    new_park_pass = Pass.objects.get(
-                        user=park_pass.user,
-                        in_cart=True,
-                        park_pass_renewed_from=park_pass,
-                    )
-                else:
-                    new_park_pass = Pass()
-                    new_park_pass.park_pass_renewed_from = park_pass
-                    new_park_pass.user = park_pass.user
-                    new_park_pass.option = option
-                    new_park_pass.first_name = park_pass.first_name
-                    new_park_pass.last_name = park_pass.last_name
-                    new_park_pass.email = park_pass.email
-                    new_park_pass.mobile = park_pass.mobile
-
-                    if park_pass.company:
-                        new_park_pass.company = park_pass.company
-                    if park_pass.address_line_1:
-                        new_park_pass.address_line_1 = park_pass.address_line_1
-                    if park_pass.address_line_2:
-                        new_park_pass.address_line_2 = park_pass.address_line_2
-
-                    new_park_pass.suburb = park_pass.suburb
-                    new_park_pass.state = park_pass.state
-                    new_park_pass.postcode = park_pass.postcode
-
-                    if park_pass.rac_member_number:
-                        new_park_pass.rac_member_number = park_pass.rac_member_number
-
-                    if park_pass.vehicle_registration_1:
-                        new_park_pass.vehicle_registration_1 = (
-                            park_pass.vehicle_registration_1
-                        )
-
-                    if park_pass.vehicle_registration_2:
-                        new_park_pass.vehicle_registration_2 = (
-                            park_pass.vehicle_registration_2
-                        )
-
-                    if park_pass.drivers_licence_number:
-                        new_park_pass.drivers_licence_number = (
-                            park_pass.drivers_licence_number
-                        )
-
-                    if park_pass.park_group:
-                        new_park_pass.park_group = park_pass.park_group
-
-                    new_park_pass.date_start = today
-                    new_park_pass.renew_automatically = True
-                    # Strickly speaking the new pass is not in a cart as it is not stored in a session
-                    # however to prevent these passes showing up where they shouldn't we set this flag
-                    new_park_pass.in_cart = True
-                    new_park_pass.sold_via = park_pass.sold_via
-
-                    new_park_pass.processing_status = Pass.AWAITING_AUTO_RENEWAL
-                    new_park_pass.save()
-
-                logger.info("new_park_pass.in_cart = " + str(new_park_pass.in_cart))
-                order_uuid = uuid.uuid4()
-                # Every order must have an invoice reference but we don't yet have one so for now
-                # we use the order uuid (the real reference number will be populated by the return_preload_url code)
-                order = Order(
-                    user=park_pass.user,
-                    uuid=order_uuid,
-                    invoice_reference=order_uuid,
-                    retailer_group=dbca_retailer_group,
+        # Check if the pass was purchased with an rac discount and if so apply the same discount
+        rac_discount_order_item = None
+        concession_order_item = None
+        if hasattr(park_pass, "rac_discount_usage"):
+            discount_amount = park_pass.rac_discount_usage.discount_amount
+            if discount_amount > Decimal(0.00):
+                rac_discount_order_item = OrderItem()
+                rac_discount_order_item.description = (
+                    CartUtils.get_rac_discount_description()
                 )
-                order_item = OrderItem()
-                order_item.content_type = park_pass_content_type
-                order_item.object_id = new_park_pass.id
-                order_item.description = CartUtils.get_pass_purchase_description(
-                    new_park_pass.pass_number
+                rac_discount_order_item.amount = -abs(discount_amount)
+                rac_discount_order_item.oracle_code = order_item.oracle_code
+        # If the pass wasn't purchased with an RAC discount then check if it was purchased with
+        # a concession and if so apply that concession
+        elif hasattr(park_pass, "concession_usage"):
+            concession_discount_amount = (
+                park_pass.concession_usage.concession.discount_as_amount(
+                    park_pass.option.price
                 )
-                order_item.amount = new_park_pass.option.price
-                order_item.oracle_code = settings.PARKPASSES_DEFAULT_ORACLE_CODE
-                if new_park_pass.option.pricing_window.pass_type.oracle_code:
-                    order_item.oracle_code = (
-                        new_park_pass.option.pricing_window.pass_type.oracle_code
-                    )
+            )
+            if concession_discount_amount > Decimal(0.00):
+                concession_order_item = OrderItem()
+                concession_order_item.description = (
+                    CartUtils.get_rac_discount_description()
+                )
+                concession_order_item.amount = -abs(concession_discount_amount)
+                concession_order_item.oracle_code = order_item.oracle_code
 
-                # Check if the pass was purchased with an rac discount and if so apply the same discount
-                rac_discount_order_item = None
-                concession_order_item = None
-                if hasattr(park_pass, "rac_discount_usage"):
-                    discount_amount = park_pass.rac_discount_usage.discount_amount
-                    if discount_amount > Decimal(0.00):
-                        rac_discount_order_item = OrderItem()
-                        rac_discount_order_item.description = (
-                            CartUtils.get_rac_discount_description()
-                        )
-                        rac_discount_order_item.amount = -abs(discount_amount)
-                        rac_discount_order_item.oracle_code = order_item.oracle_code
-                # If the pass wasn't purchased with an RAC discount then check if it was purchased with
-                # a concession and if so apply that concession
-                elif hasattr(park_pass, "concession_usage"):
-                    concession_discount_amount = (
-                        park_pass.concession_usage.concession.discount_as_amount(
-                            park_pass.option.price
-                        )
-                    )
-                    if concession_discount_amount > Decimal(0.00):
-                        concession_order_item = OrderItem()
-                        concession_order_item.description = (
-                            CartUtils.get_rac_discount_description()
-                        )
-                        concession_order_item.amount = -abs(concession_discount_amount)
-                        concession_order_item.oracle_code = order_item.oracle_code
+        logger.info("order_item = " + str(order_item))
 
-                logger.info("order_item = " + str(order_item))
+        # Get ledger payment token id
+        primary_card_resp = utils_ledger_api_client.get_primary_card_token_for_user(
+            park_pass.user
+        )
+        ledger_payment_token_id = primary_card_resp["primary_card"]
+        if not ledger_payment_token_id:
+            raise Exception(f"No primary card found for user {park_pass.user}")
 
-                try:
-                    # Get ledger payment token id
-                    primary_card_resp = (
-                        utils_ledger_api_client.get_primary_card_token_for_user(
-                            park_pass.user
-                        )
-                    )
-                    ledger_payment_token_id = primary_card_resp["primary_card"]
-                    if not ledger_payment_token_id:
-                        raise Exception(
-                            f"No primary card found for user {park_pass.user}"
-                        )
-
-                    # Create a fake request session Id
-                    request = utils_ledger_api_client.FakeRequestSessionObj()
-
-                    # using email user assign the email user object to the fake request
-                    request.user = EmailUser.objects.get(id=park_pass.user)
-
-                    # Payment Basket Lines
-                    products = []
-                    if order_item:
-                        products.append(
-                            {
-                                "ledger_description": order_item.description,
-                                "quantity": 1,
-                                "price_incl_tax": str(order_item.amount),
-                                "oracle_code": order_item.oracle_code,
-                            }
-                        )
-                    if rac_discount_order_item:
-                        products.append(
-                            {
-                                "ledger_description": rac_discount_order_item.description,
-                                "quantity": 1,
-                                "price_incl_tax": str(rac_discount_order_item.amount),
-                                "oracle_code": rac_discount_order_item.oracle_code,
-                            }
-                        )
-                    elif concession_order_item:
-                        products.append(
-                            {
-                                "ledger_description": concession_order_item.description,
-                                "quantity": 1,
-                                "price_incl_tax": str(concession_order_item.amount),
-                                "oracle_code": concession_order_item.oracle_code,
-                            }
-                        )
-
-                    no_payment = False
-                    booking_reference = str(order_uuid)
-
-                    # Get the uuid for the order containing the original pass purchase
-                    renewed_from_order_item = OrderItem.objects.get(
-                        content_type=park_pass_content_type, object_id=park_pass.id
-                    )
-                    booking_reference_link = str(renewed_from_order_item.order.uuid)
-
-                    basket_params = {
-                        "products": products,
-                        "vouchers": [],
-                        "system": settings.PARKPASSES_PAYMENT_SYSTEM_ID,
-                        "custom_basket": True,
-                        "booking_reference": booking_reference,
-                        "booking_reference_link": booking_reference_link,
-                        "no_payment": no_payment,
+        if email_user is None:
+            raise EmailUser.DoesNotExist(
+                f"No email user found for user {park_pass.user}"
+            )
+
+        # Create a fake request session Id
+        request = utils_ledger_api_client.FakeRequestSessionObj()
+
+        # using email user assign the email user object to the fake request
+        request.user = email_user
+
+        # Payment Basket Lines
+        products = []
+        for item in [order_item, rac_discount_order_item, concession_order_item]:
+            if item:
+                products.append(
+                    {
+                        "ledger_description": item.description,
+                        "quantity": 1,
+                        "price_incl_tax": str(item.amount),
+                        "oracle_code": item.oracle_code,
                     }
+                )
 
-                    logger.info("basket_params: %s", basket_params)
+        no_payment = False
+        booking_reference = str(order_uuid)
 
-                    basket_user_id = request.user.id  # email user id for the customer
-                    utils_ledger_api_client.create_basket_session(
-                        request, basket_user_id, basket_params
-                    )
+        # The uuid of the order containing the original pass purchase
+        if renewed_from_order_item is None:
+            raise OrderItem.DoesNotExist(
+                f"No order item found for park pass {park_pass.pass_number}"
+            )
+        booking_reference_link = str(renewed_from_order_item.order.uuid)
+
+        basket_params = {
+            "products": products,
+            "vouchers": [],
+            "system": settings.PARKPASSES_PAYMENT_SYSTEM_ID,
+            "custom_basket": True,
+            "booking_reference": booking_reference,
+            "booking_reference_link": booking_reference_link,
+            "no_payment": no_payment,
+        }
+
+        logger.info("basket_params: %s", basket_params)
+
+        basket_user_id = request.user.id  # email user id for the customer
+        utils_ledger_api_client.create_basket_session(
+            request, basket_user_id, basket_params
+        )
 
-                    # fallback_url,  return_url,  return_preload_url all need to be set as we are
-                    # utilising the same funcationality as the payment checkout screen
-                    # sett all 3 values to the same.
-                    # return_preload_url is what send a completion ping back to the your application.
-
-                    return_preload_url = settings.SITE_URL + reverse(
-                        "pass-autorenewal-success-callback",
-                        kwargs={
-                            "id": str(new_park_pass.id),
-                            "uuid": str(order.uuid),
-                        },
-                    )
+        # fallback_url,  return_url,  return_preload_url all need to be set as we are
+        # utilising the same funcationality as the payment checkout screen
+        # sett all 3 values to the same.
+        # return_preload_url is what send a completion ping back to the your application.
+
+        return_preload_url = settings.SITE_URL + reverse(
+            "pass-autorenewal-success-callback",
+            kwargs={
+                "id": str(new_park_pass.id),
+                "uuid": str(order.uuid),
+            },
+        )
 
-                    logger.info("return_preload_url = " + str(return_preload_url))
-
-                    invoice_text = f"Park Passes Order: {order.uuid}"
-
-                    checkout_params = {
-                        "system": settings.PARKPASSES_PAYMENT_SYSTEM_ID,
-                        "fallback_url": return_preload_url,
-                        "return_url": return_preload_url,
-                        "return_preload_url": return_preload_url,
-                        "force_redirect": True,
-                        "proxy": False,
-                        "invoice_text": invoice_text,
-                        "session_type": "ledger_api",
-                        "basket_owner": park_pass.user,
-                        "response_type": "json",
-                    }
+        logger.info("return_preload_url = " + str(return_preload_url))
+
+        invoice_text = f"Park Passes Order: {order.uuid}"
+
+        checkout_params = {
+            "system": settings.PARKPASSES_PAYMENT_SYSTEM_ID,
+            "fallback_url": return_preload_url,
+            "return_url": return_preload_url,
+            "return_preload_url": return_preload_url,
+            "force_redirect": True,
+            "proxy": False,
+            "invoice_text": invoice_text,
+            "session_type": "ledger_api",
+            "basket_owner": park_pass.user,
+            "response_type": "json",
+        }
+
+        utils_ledger_api_client.create_checkout_session(request, checkout_params)
+
+        # We have to save the order before processing the payment because we will store the
+        # invoice reference number in the order when the code at the return_preload_url is called.
+        order.save()
+
+        # START - Send Automatic Payment Request to Ledger
+        # look at post info on payment screen an reuse
+        resp = utils_ledger_api_client.process_payment_with_token(
+            request, ledger_payment_token_id
+        )
+        logger.info(resp)
+        # END - Sent Automatic Payment Request to Ledger
+
+        order_item.order = order
+        order_item.save()
+
+        if rac_discount_order_item:
+            rac_discount_order_item.order = order
+            rac_discount_order_item.save()
+        elif concession_order_item:
+            concession_order_item.order = order
+            concession_order_item.save()
+
+        park_pass.renew_automatically = False
+        park_pass.save()
+
+        order.payment_confirmed = True
+        order.save()
+
+        new_park_pass.in_cart = False
+        new_park_pass.save()
+        new_park_pass.send_autorenew_success_notification_email()
+
+    def handle_failed_payment(self, park_pass, new_park_pass):
+        # For park passes that already had two failed attempts, that means this is the 3rd failed attempt
+        # We will disable automatic renewal and send a final fail email so the user can manually renew
+        if 2 == park_pass.failed_auto_renewal_attempts:
+            logger.info(
+                "Disabling automatic renewal for park pass %s",
+                park_pass.pass_number,
+            )
+            park_pass.renew_automatically = False
+            park_pass.save()
+            new_park_pass.delete()
+            park_pass.send_final_autorenewal_failure_notification_email()
+            return
+
+        logger.info(
+            "Sending autorenew failure notification email for park pass %s",
+            park_pass.pass_number,
+        )
+        park_pass.send_autorenew_failure_notification_email(
+            park_pass.failed_auto_renewal_attempts + 1
+        )
 
-                    utils_ledger_api_client.create_checkout_session(
-                        request, checkout_params
-                    )
+    def lock_park_pass(self, park_pass):
+        """Takes a postgres advisory lock on the pass returning False if another process holds it.
 
-                    # We have to save the order before processing the payment because we will store the
-                    # invoice reference number in the order when the code at the return_preload_url is called.
-                    order.save()
+        The lock belongs to the database session rather than a transaction as the order has
+        to be committed before the payment is processed (ledger calls the return_preload_url
+        which reads it) so select_for_update can't be used."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_try_advisory_lock(%s, %s)",
+                [AUTORENEWAL_ADVISORY_LOCK_NAMESPACE, park_pass.id],
+            )
+            return cursor.fetchone()[0]
 
-                    # START - Send Automatic Payment Request to Ledger
-                    # look at post info on payment screen an reuse
-                    resp = utils_ledger_api_client.process_payment_with_token(
-                        request, ledger_payment_token_id
-                    )
-                    logger.info(resp)
-                    # END - Sent Automatic Payment Request to Ledger
+    def unlock_park_pass(self, park_pass):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_advisory_unlock(%s, %s)",
+                [AUTORENEWAL_ADVISORY_LOCK_NAMESPACE, park_pass.id],
+            )
 
-                    order_item.order = order
-                    order_item.save()
+    def run_process_payment(self, park_pass, new_park_pass, *args):
+        """Processes the payment for the pass while holding a lock on it so that it can't be
+        charged twice if this command is run again before it finishes.
 
-                    if rac_discount_order_item:
-                        rac_discount_order_item.order = order
-                        rac_discount_order_item.save()
-                    elif concession_order_item:
-                        concession_order_item.order = order
-                        concession_order_item.save()
+        Returns the renewal attempt (saved before the lock is released so that other runs
+        see it) or None if the pass was skipped."""
+        if not self.lock_park_pass(park_pass):
+            logger.info(
+                f"Skipping park pass {park_pass} as it is being renewed by another process."
+            )
+            return None
+        try:
+            # Another run may have renewed the pass or attempted to since it was loaded
+            auto_renewal_attempts = PassAutoRenewalAttempt.objects.filter(
+                park_pass=park_pass
+            )
+            if (
+                not Pass.objects.filter(
+                    id=park_pass.id, renew_automatically=True
+                ).exists()
+                or auto_renewal_attempts.filter(auto_renewal_succeeded=True).exists()
+            ):
+                logger.info(f"Skipping park pass {park_pass} as it has been renewed.")
+                return None
+            park_pass.failed_auto_renewal_attempts = auto_renewal_attempts.filter(
+                auto_renewal_succeeded=False
+            ).count()
+            if park_pass.failed_auto_renewal_attempts >= 3:
+                logger.info(
+                    f"Skipping park pass {park_pass} as it has 3 failed renewal attempts."
+                )
+                return None
+
+            auto_renewal_succeeded = True
+            try:
+                self.process_payment(park_pass, new_park_pass, *args)
+            except Exception as e:
+                logger.info(f"{type(e).__name__}: {e}")
+                auto_renewal_succeeded = False
+                try:
+                    self.handle_failed_payment(park_pass, new_park_pass)
+                except Exception as e:
+                    logger.exception(
+                        f"Failed to handle the failed renewal of park pass {park_pass}: {e}"
+                    )
+            return PassAutoRenewalAttempt.objects.create(
+                park_pass=park_pass, auto_renewal_succeeded=auto_renewal_succeeded
+            )
+        finally:
+            self.unlock_park_pass(park_pass)
 
-                    park_pass.renew_automatically = False
-                    park_pass.save()
+    def run_process_payment_in_thread(self, *args):
+        try:
+            return self.run_process_payment(*args)
+        finally:
+            # Each thread has its own database connection
+            connection.close()
 
-                    PassAutoRenewalAttempt.objects.create(
-                        park_pass=park_pass,
-                        auto_renewal_succeeded=True,
-                    )
+    def handle(self, *args, **options):
+        if options["concurrency"] < 1:
+            raise CommandError("--concurrency must be at least 1")
 
-                    order.payment_confirmed = True
-                    order.save()
+        park_pass_content_type = ContentType.objects.get_for_model(Pass)
+        if options["clear"]:
+            self.clear_test_data(park_pass_content_type)
 
-                    new_park_pass.in_cart = False
-                    new_park_pass.save()
-                    new_park_pass.send_autorenew_success_notification_email()
+        today = timezone.now().date()
+        dbca_retailer_group = RetailerGroup.get_dbca_retailer_group()
 
-                except Exception as e:
-                    PassAutoRenewalAttempt.objects.create(
-                        park_pass=park_pass,
-                        auto_renewal_succeeded=False,
-                    )
+        passes = list(self.get_passes(today, dbca_retailer_group))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Found {len(passes)} park passes that have expired with autorenewal enabled, "
+                "have no successful renewal attempts and have less than 3 unsuccessful renewal attempts."
+            )
+        )
+        if not passes:
+            return
 
-                    logger.info(f"{type(e).__name__}: {e}")
-
-                    # For park passes that already had two failed attempts, that means this is the 3rd failed attempt
-                    # We will disable automatic renewal and send a final fail email so the user can manually renew
-                    if 2 == park_pass.failed_auto_renewal_attempts:
-                        logger.info(
-                            "Disabling automatic renewal for park pass %s",
-                            park_pass.pass_number,
-                        )
-                        park_pass.renew_automatically = False
-                        park_pass.save()
-                        new_park_pass.delete()
-                        park_pass.send_final_autorenewal_failure_notification_email()
-                        continue
-
-                    logger.info(
-                        "Sending autorenew failure notification email for park pass %s",
-                        park_pass.pass_number,
-                    )
-                    park_pass.send_autorenew_failure_notification_email(
-                        park_pass.failed_auto_renewal_attempts + 1
+        if options["test"]:
+            for park_pass in passes:
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"TEST: pretending to process automatic renewal of Pass: {park_pass}"
                     )
-                    # Send fail email
-        else:
-            self.stdout.write(
-                self.style.SUCCESS(
-                    f"Found {len(passes)} park passes that have expired with autorenewal enabled, have no successful\
-                         renewal attempts and have less than 3 unsuccessful renewal attempts."
                 )
+            return
+
+        started = time.monotonic()
+        renewal_passes = self.get_renewal_passes(passes, today)
+        passes = [park_pass for park_pass in passes if park_pass.id in renewal_passes]
+        renewed_from_order_items = self.get_renewed_from_order_items(
+            passes, park_pass_content_type
+        )
+        email_users = EmailUser.objects.in_bulk(
+            {park_pass.user for park_pass in passes if park_pass.user}
+        )
+
+        succeeded = 0
+        failed = 0
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+            futures = [
+                executor.submit(
+                    self.run_process_payment_in_thread,
+                    park_pass,
+                    renewal_passes[park_pass.id],
+                    renewed_from_order_items.get(park_pass.id),
+                    email_users.get(park_pass.user),
+                    park_pass_content_type,
+                    dbca_retailer_group,
+                )
+                for park_pass in passes
+            ]
+            for future in as_completed(futures):
+                attempt = future.result()
+                if attempt is None:
+                    continue
+                if attempt.auto_renewal_succeeded:
+                    succeeded += 1
+                else:
+                    failed += 1
+
+        elapsed = time.monotonic() - started
+        processed = succeeded + failed
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Processed {processed} automatic renewals ({succeeded} succeeded, {failed} failed, "
+                f"{len(passes) - processed} skipped) in {elapsed:.1f} seconds "
+                f"({processed / elapsed if elapsed else 0:.2f} per second)."
             )
+        )
@@ -0,0 +1,92 @@
+"""
+This management command processes the queued park pass pdf jobs. For each job the park pass pdf
+is generated and then emailed to the pass holder (the purchased email the first time a pass is
+processed and the updated email after that).
+
+Failed jobs are retried with an increasing delay until settings.PASS_PDF_JOB_MAX_ATTEMPTS is reached.
+
+Usage: ./manage.sh pass_process_pdf_jobs
+        (runs until stopped, this command should be started along side the web server)
+
+       ./manage.sh pass_process_pdf_jobs --once
+        (processes the jobs that are currently due and then exits)
+
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from parkpasses.components.passes.models import PassPdfJob
+
+logger = logging.getLogger(__name__)
+
+
+def run_job(job):
+    try:
+        return job.run()
+    finally:
+        # Each thread has its own database connection
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = "Generates the pdfs and sends the emails for queued park passes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Process the jobs that are currently due and then exit.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.PASS_PDF_JOB_BATCH_SIZE,
+            help="The number of jobs to claim at a time.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=max(settings.LIBREOFFICE_POOL_SIZE, 1),
+            help="The number of jobs to process at the same time.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=int,
+            default=settings.PASS_PDF_JOB_POLL_INTERVAL_SECONDS,
+            help="The number of seconds to wait before checking for new jobs.",
+        )
+
+    def handle(self, *args, **options):
+        succeeded = 0
+        failed = 0
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+            while True:
+                requeued = PassPdfJob.requeue_stale_jobs()
+                if requeued:
+                    logger.warning(f"Requeued {requeued} stale park pass pdf jobs.")
+
+                jobs = PassPdfJob.claim_jobs(options["batch_size"])
+                if not jobs:
+                    if options["once"]:
+                        break
+                    time.sleep(options["sleep"])
+                    continue
+
+                for job, job_succeeded in zip(jobs, executor.map(run_job, jobs)):
+                    if job_succeeded:
+                        succeeded += 1
+                        self.stdout.write(self.style.SUCCESS(f"Processed {job}."))
+                    else:
+                        failed += 1
+                        self.stdout.write(self.style.ERROR(f"Failed to process {job}."))
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Park pass pdf jobs processed: {succeeded} succeeded, {failed} failed."
+            )
+        )
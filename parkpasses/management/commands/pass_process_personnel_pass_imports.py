@@ -0,0 +1,76 @@
+"""
+This management command imports the uploaded personnel pass data files. The passes are
+created settings.PERSONNEL_PASS_IMPORT_CHUNK_SIZE rows at a time and their pdfs are
+queued for the pass_process_pdf_jobs management command.
+
+Usage: ./manage.sh pass_process_personnel_pass_imports
+        (runs until stopped, this command should be started along side the web server)
+
+       ./manage.sh pass_process_personnel_pass_imports --once
+        (processes the imports that are currently queued and then exits)
+
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from parkpasses.components.passes.models import PersonnelPassImport
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Imports the uploaded personnel pass data files."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Process the imports that are currently queued and then exit.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=int,
+            default=settings.PERSONNEL_PASS_IMPORT_POLL_INTERVAL_SECONDS,
+            help="The number of seconds to wait before checking for queued imports.",
+        )
+
+    def handle(self, *args, **options):
+        succeeded = 0
+        failed = 0
+        while True:
+            requeued = PersonnelPassImport.requeue_stale_imports()
+            if requeued:
+                logger.warning(f"Requeued {requeued} stale personnel pass imports.")
+
+            personnel_pass_import = PersonnelPassImport.claim_import()
+            if personnel_pass_import is None:
+                if options["once"]:
+                    break
+                time.sleep(options["sleep"])
+                continue
+
+            start = time.monotonic()
+            if personnel_pass_import.run():
+                succeeded += 1
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"Processed {personnel_pass_import} in {time.monotonic() - start:.1f} seconds: "
+                        f"{personnel_pass_import.park_passes_created} passes created, "
+                        f"{personnel_pass_import.park_passes_duplicates} duplicates, "
+                        f"{len(personnel_pass_import.error_list)} errors."
+                    )
+                )
+            else:
+                failed += 1
+                self.stdout.write(
+                    self.style.ERROR(f"Failed to process {personnel_pass_import}.")
+                )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Personnel pass imports processed: {succeeded} succeeded, {failed} failed."
+            )
+        )
@@ -0,0 +1,169 @@
+"""
+This management command regenerates the pdfs of existing park passes (for example after a pass template
+or a pass type's template image has been changed). No emails are sent to the pass holders.
+
+The passes are rendered across a pool of processes and the id of each pass that has been regenerated is
+written to a checkpoint file, so if the command is interrupted running it again with the same
+checkpoint file will carry on from where it stopped.
+
+Usage: ./manage.sh pass_regenerate_pdfs --pass-type HOLIDAY_PASS --status CU
+       ./manage.sh pass_regenerate_pdfs --created-after 2023-01-01 --created-before 2023-01-31 --processes 8
+       ./manage.sh pass_regenerate_pdfs --checkpoint-file /app/logs/regenerate.checkpoint
+
+"""
+import logging
+import multiprocessing
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+from parkpasses.components.passes.models import Pass
+
+logger = logging.getLogger(__name__)
+
+
+def regenerate_park_pass_pdf(pass_id):
+    try:
+        park_pass = Pass.objects.get(pk=pass_id)
+        park_pass.update_park_pass_pdf()
+    except Exception as e:
+        logger.exception(f"Failed to regenerate pdf for pass with id {pass_id}: {e}")
+        return pass_id, str(e)
+    return pass_id, None
+
+
+def get_status_filter(status):
+    today = timezone.now().date()
+    not_cancelled = ~Q(processing_status=Pass.CANCELLED)
+    status_filters = {
+        Pass.CANCELLED: Q(processing_status=Pass.CANCELLED),
+        Pass.FUTURE: not_cancelled & Q(date_start__gt=today),
+        Pass.CURRENT: not_cancelled & Q(date_start__lte=today, date_expiry__gt=today),
+        Pass.EXPIRED: not_cancelled & Q(date_expiry__lte=today),
+    }
+    return status_filters[status]
+
+
+class Command(BaseCommand):
+    help = "Regenerates the pdfs of existing park passes without sending any emails."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--pass-type",
+            action="append",
+            dest="pass_types",
+            help="Only regenerate passes of this pass type name (can be used more than once).",
+        )
+        parser.add_argument(
+            "--status",
+            choices=[Pass.FUTURE, Pass.CURRENT, Pass.EXPIRED, Pass.CANCELLED],
+            help="Only regenerate passes with this status.",
+        )
+        parser.add_argument(
+            "--created-after",
+            type=date.fromisoformat,
+            help="Only regenerate passes created on or after this date (YYYY-MM-DD).",
+        )
+        parser.add_argument(
+            "--created-before",
+            type=date.fromisoformat,
+            help="Only regenerate passes created on or before this date (YYYY-MM-DD).",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=multiprocessing.cpu_count(),
+            help="The number of processes to render the passes with.",
+        )
+        parser.add_argument(
+            "--checkpoint-file",
+            help="The file used to record which passes have been regenerated.",
+        )
+        parser.add_argument(
+            "--test",
+            action="store_true",
+            help="Adding the test flag will output how many passes would be regenerated without regenerating them.",
+        )
+
+    def get_pass_ids(self, options):
+        passes = Pass.objects.filter(in_cart=False)
+        if options["pass_types"]:
+            passes = passes.filter(
+                option__pricing_window__pass_type__name__in=options["pass_types"]
+            )
+        if options["status"]:
+            passes = passes.filter(get_status_filter(options["status"]))
+        if options["created_after"]:
+            passes = passes.filter(datetime_created__date__gte=options["created_after"])
+        if options["created_before"]:
+            passes = passes.filter(
+                datetime_created__date__lte=options["created_before"]
+            )
+        return list(passes.order_by("id").values_list("id", flat=True))
+
+    def read_checkpoint(self, checkpoint_file):
+        try:
+            with open(checkpoint_file) as f:
+                return {int(line) for line in f if line.strip()}
+        except FileNotFoundError:
+            return set()
+
+    def handle(self, *args, **options):
+        if options["processes"] < 1:
+            raise CommandError("--processes must be at least 1")
+
+        pass_ids = self.get_pass_ids(options)
+        checkpoint_file = options["checkpoint_file"]
+        if checkpoint_file:
+            completed_pass_ids = self.read_checkpoint(checkpoint_file)
+            pass_ids = [
+                pass_id for pass_id in pass_ids if pass_id not in completed_pass_ids
+            ]
+            self.stdout.write(
+                f"Skipping {len(completed_pass_ids)} passes listed in {checkpoint_file}."
+            )
+
+        self.stdout.write(f"Found {len(pass_ids)} park passes to regenerate.")
+        if options["test"] or not pass_ids:
+            return
+
+        # The worker processes must not share the parent's database connections
+        connections.close_all()
+
+        regenerated = 0
+        failed = 0
+        started = time.monotonic()
+        checkpoint = open(checkpoint_file, "a") if checkpoint_file else None
+        try:
+            with multiprocessing.Pool(processes=options["processes"]) as pool:
+                for pass_id, error in pool.imap_unordered(
+                    regenerate_park_pass_pdf, pass_ids, chunksize=4
+                ):
+                    if error:
+                        failed += 1
+                        self.stdout.write(
+                            self.style.ERROR(
+                                f"Failed to regenerate pass with id {pass_id}: {error}"
+                            )
+                        )
+                        continue
+                    regenerated += 1
+                    if checkpoint:
+                        checkpoint.write(f"{pass_id}\n")
+                        checkpoint.flush()
+        finally:
+            if checkpoint:
+                checkpoint.close()
+
+        elapsed = time.monotonic() - started
+        passes_per_second = regenerated / elapsed if elapsed else 0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Regenerated {regenerated} park pass pdfs ({failed} failed) in {elapsed:.1f} seconds "
+                f"({passes_per_second:.2f} passes/sec)."
+            )
+        )
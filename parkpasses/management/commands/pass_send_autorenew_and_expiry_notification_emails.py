@@ -12,6 +12,9 @@ from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 
+from parkpasses.components.emails.emails import BatchEmailSender
+from parkpasses.components.main.utils import log_communications
+from parkpasses.components.passes.emails import PassEmails
 from parkpasses.components.passes.models import Pass
 
 logger = logging.getLogger(__name__)
@@ -48,30 +51,43 @@ class Command(BaseCommand):
                 f"Found {len(passes_to_notify)} park passes that expire in {settings.PASS_REMINDER_DAYS_PRIOR} days."
             )
         )
-        if passes_to_notify.exists():
-
+        if options["test"]:
             for park_pass in passes_to_notify:
-                if options["test"]:
-                    if park_pass.renew_automatically:
-                        self.stdout.write(
-                            self.style.SUCCESS(
-                                f"TEST: pretending to call send_autorenew_notification_email on Pass: {park_pass}"
-                            )
-                        )
-                    else:
-                        self.stdout.write(
-                            self.style.SUCCESS(
-                                f"TEST: pretending to call send_expiry_notification_emails on Pass: {park_pass}"
-                            )
+                if park_pass.renew_automatically:
+                    self.stdout.write(
+                        self.style.SUCCESS(
+                            f"TEST: pretending to call send_autorenew_notification_email on Pass: {park_pass}"
                         )
+                    )
                 else:
-                    if park_pass.renew_automatically:
-                        park_pass.send_autorenew_notification_email()
-                        logger.info(
-                            f"Autorenew notification email sent for Pass: {park_pass}"
-                        )
-                    else:
-                        park_pass.send_expiry_notification_email()
-                        logger.info(
-                            f"Expiry notification email sent for Pass: {park_pass}"
+                    self.stdout.write(
+                        self.style.SUCCESS(
+                            f"TEST: pretending to call send_expiry_notification_emails on Pass: {park_pass}"
                         )
+                    )
+            return
+
+        batch = BatchEmailSender()
+        for park_pass in passes_to_notify:
+            try:
+                if park_pass.renew_automatically:
+                    PassEmails.send_pass_autorenew_notification_email(
+                        park_pass, batch=batch
+                    )
+                else:
+                    PassEmails.send_pass_expiry_notification_email(
+                        park_pass, batch=batch
+                    )
+            except Exception as e:
+                logger.exception(
+                    f"Unable to create the notification email for Pass: {park_pass}: {e}"
+                )
+
+        batch_messages = batch.send()
+        log_communications(batch_messages, "email")
+        sent = len([m for m in batch_messages if m.sent])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Sent {sent} of {len(batch_messages)} autorenew and expiry notification emails."
+            )
+        )
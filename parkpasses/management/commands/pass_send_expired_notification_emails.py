@@ -12,6 +12,9 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 from ledger_api_client.ledger_models import EmailUserRO as EmailUser
 
+from parkpasses.components.emails.emails import BatchEmailSender
+from parkpasses.components.main.utils import log_communications
+from parkpasses.components.passes.emails import PassEmails
 from parkpasses.components.passes.models import Pass
 
 logger = logging.getLogger(__name__)
@@ -38,19 +41,34 @@ class Command(BaseCommand):
             in_cart=False,
             date_expiry=today,
         )
-        if passes_that_expired_today.exists():
-            self.stdout.write(
-                self.style.SUCCESS(
-                    f"Found {len(passes_that_expired_today)} park passes that expired today."
-                )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Found {len(passes_that_expired_today)} park passes that expired today."
             )
+        )
+        if options["test"]:
             for park_pass in passes_that_expired_today:
-                if options["test"]:
-                    self.stdout.write(
-                        self.style.SUCCESS(
-                            f"TEST: pretending to call send_expired_notification_emails on Pass: {park_pass}"
-                        )
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"TEST: pretending to call send_expired_notification_emails on Pass: {park_pass}"
                     )
-                else:
-                    park_pass.send_expired_notification_email()
-                    logger.info(f"Expiry notification email sent for Pass: {park_pass}")
+                )
+            return
+
+        batch = BatchEmailSender()
+        for park_pass in passes_that_expired_today:
+            try:
+                PassEmails.send_pass_expired_notification_email(park_pass, batch=batch)
+            except Exception as e:
+                logger.exception(
+                    f"Unable to create the expired notification email for Pass: {park_pass}: {e}"
+                )
+
+        batch_messages = batch.send()
+        log_communications(batch_messages, "email")
+        sent = len([m for m in batch_messages if m.sent])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Sent {sent} of {len(batch_messages)} expired notification emails."
+            )
+        )
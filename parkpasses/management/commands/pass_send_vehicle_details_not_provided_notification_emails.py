@@ -15,6 +15,9 @@ from django.db.models.functions import Trim
 from django.utils import timezone
 from ledger_api_client.ledger_models import EmailUserRO as EmailUser
 
+from parkpasses.components.emails.emails import BatchEmailSender
+from parkpasses.components.main.utils import log_communications
+from parkpasses.components.passes.emails import PassEmails
 from parkpasses.components.passes.models import Pass
 
 logger = logging.getLogger(__name__)
@@ -71,27 +74,38 @@ class Command(BaseCommand):
                     ),
                 )
             )
-            if options["test"]:
-                self.stdout.write(
-                    self.style.SUCCESS(
-                        f"Found {len(passes)} "
-                        + f"park passes without any vehicle rego that are due to start on {pass_start_date}"
-                    )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Found {len(passes)} "
+                    + f"park passes without any vehicle rego that are due to start on {pass_start_date}"
                 )
-            for park_pass in passes:
-                if options["test"]:
+            )
+            if options["test"]:
+                for park_pass in passes:
                     self.stdout.write(
                         self.style.SUCCESS(
                             "TEST: pretending to call "
                             + f"send_vehicle_details_not_provided_notification_emails on Pass: {park_pass}"
                         )
                     )
-                else:
-                    park_pass.send_vehicle_details_not_provided_notification_emails()
-                    logger.info(
-                        f"Notification email sent to recipient of Pass: {park_pass}"
+                return
+
+            batch = BatchEmailSender()
+            for park_pass in passes:
+                try:
+                    PassEmails.send_pass_vehicle_details_not_yet_provided_notification_email(
+                        park_pass, batch=batch
                     )
-                    park_pass.send_vehicle_details_not_provided_notification_emails()
-                    logger.info(
-                        f"Notification email sent to purchaser of Pass: {park_pass}"
+                except Exception as e:
+                    logger.exception(
+                        f"Unable to create the vehicle details notification email for Pass: {park_pass}: {e}"
                     )
+
+            batch_messages = batch.send()
+            log_communications(batch_messages, "email")
+            sent = len([m for m in batch_messages if m.sent])
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Sent {sent} of {len(batch_messages)} vehicle details notification emails."
+                )
+            )
@@ -1,35 +1,120 @@
 """
 This management commands generates reports and invoices for each retailer for the previous month
 
+The sales for every retailer group are worked out up front with a single grouped query over the prices
+stored on each pass and turned into invoice lines by pass type, oracle code and price. The invoices and reports are
+then generated for several retailer groups at a time.
+
 Usage: ./manage.sh retailers_generate_monthly_invoices
         (this command should be run on the 1st day of every month by a cron job or task runner not manually)
 
+       ./manage.sh retailers_generate_monthly_invoices --concurrency 4
+
 """
 import logging
 import os
-import subprocess
 import uuid
-from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from decimal import Decimal
 from pathlib import Path
 
 from dateutil.relativedelta import relativedelta
 from django.conf import settings
-from django.contrib.contenttypes.models import ContentType
 from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count, F, Sum
 from django.utils import timezone
 from django.utils.text import slugify
 from docxtpl import DocxTemplate
 from ledger_api_client import utils as ledger_api_client_utils
 
 from parkpasses.components.cart.utils import CartUtils
+from parkpasses.components.main.pdf_converter import convert_to_pdf
+from parkpasses.components.passes.exceptions import NoOracleCodeFoundForCartItem
 from parkpasses.components.passes.models import Pass
+from parkpasses.components.passes.oracle_codes import OracleCodeResolver
 from parkpasses.components.reports.models import Report
-from parkpasses.components.retailers.models import RetailerGroup
+from parkpasses.components.retailers.models import RetailerGroup, RetailerGroupUser
 
 logger = logging.getLogger(__name__)
 
+REPORT_TEMPLATE_PATH = (
+    "parkpasses/management/templates/RetailerGroupReportTemplate.docx"
+)
+
+
+def get_sales_by_retailer_group(passes):
+    """Returns a dict of retailer group id to the retailer group's invoice lines and sales totals"""
+    rows = (
+        passes.values(
+            "sold_via",
+            "sold_via__district",
+            "option",
+            "park_group",
+            "option__pricing_window__pass_type__id",
+            "option__pricing_window__pass_type__display_name",
+            "price_paid",
+        )
+        .annotate(
+            quantity=Count("id"),
+            total_price_paid=Sum("price_paid"),
+            # The commission is based on the sales after concessions but before discount codes and vouchers
+            total_price_after_concession=Sum(
+                F("price_paid")
+                + F("discount_code_discount_amount")
+                + F("voucher_amount")
+            ),
+        )
+        .order_by(
+            "sold_via",
+            "option__pricing_window__pass_type__id",
+            "option",
+            "park_group",
+            "price_paid",
+        )
+    )
+
+    sales_by_retailer_group = {}
+    for row in rows:
+        sales = sales_by_retailer_group.setdefault(
+            row["sold_via"],
+            {
+                "pass_count": 0,
+                "lines": {},
+                "total_sales": Decimal(0.00),
+                "total_sales_by_pass_type": {},
+            },
+        )
+        pass_type = row["option__pricing_window__pass_type__display_name"]
+        oracle_code = OracleCodeResolver.resolve(
+            row["option"],
+            district_id=row["sold_via__district"],
+            park_group_id=row["park_group"],
+        )
+        # Options (and park groups) that share an oracle code and price share an invoice line
+        line_key = (pass_type, oracle_code, row["price_paid"])
+        if line_key not in sales["lines"]:
+            sales["lines"][line_key] = {
+                "pass_type": pass_type,
+                "oracle_code": oracle_code,
+                "quantity": 0,
+                "price_incl_tax": row["price_paid"],
+            }
+        sales["lines"][line_key]["quantity"] += row["quantity"]
+        sales["pass_count"] += row["quantity"]
+        sales["total_sales"] += row["total_price_after_concession"]
+        if pass_type not in sales["total_sales_by_pass_type"]:
+            sales["total_sales_by_pass_type"][pass_type] = {
+                "count": 0,
+                "total_sales": Decimal(0.00),
+            }
+        sales["total_sales_by_pass_type"][pass_type]["count"] += row["quantity"]
+        sales["total_sales_by_pass_type"][pass_type]["total_sales"] += row[
+            "total_price_paid"
+        ]
+    return sales_by_retailer_group
+
 
 class Command(BaseCommand):
     help = "Generates invoices for each retailer for the previous month"
@@ -40,13 +125,207 @@ class Command(BaseCommand):
             action="store_true",
             help="Add the test flag will output what emails would be sent without actually sending them.",
         )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=max(settings.LIBREOFFICE_POOL_SIZE, 1),
+            help="The number of retailer group invoices to generate at the same time.",
+        )
 
-    def handle(self, *args, **options):
-        organisation = settings.ORGANISATION
-        report_template_docx = DocxTemplate(
-            "parkpasses/management/templates/RetailerGroupReportTemplate.docx"
+    def populate_missing_stored_prices(self, passes):
+        # Passes purchased before the prices were stored (see the pass_backfill_stored_prices command)
+        for park_pass in passes.filter(price_paid__isnull=True):
+            park_pass.update_stored_prices()
+
+    def get_admin_users(self, retailer_groups):
+        admin_users = {}
+        # Ordered newest first so we use the same admin user as admin_users.first() would
+        for retailer_group_user in RetailerGroupUser.objects.filter(
+            retailer_group__in=retailer_groups, active=True, is_admin=True
+        ).order_by("-datetime_created"):
+            admin_users.setdefault(
+                retailer_group_user.retailer_group_id, retailer_group_user
+            )
+        return admin_users
+
+    def generate_invoice(
+        self,
+        retailer_group,
+        email_user,
+        sales,
+        first_day_of_previous_month,
+        last_day_of_previous_month,
+        today,
+    ):
+        invoice_uuid = uuid.uuid4()
+
+        ledger_order_lines = []
+        for line in sales["lines"].values():
+            if not line["oracle_code"]:
+                error_message = f"No oracle code found for {line['pass_type']} passes sold via {retailer_group}"
+                logger.critical(error_message)
+                raise NoOracleCodeFoundForCartItem(error_message)
+            ledger_description = CartUtils.get_pass_sales_description(line["pass_type"])
+            price_incl_tax = line["price_incl_tax"]
+            if settings.DEBUG:
+                # If in dev round the amounts so the payment gateway will work
+                price_incl_tax = int(price_incl_tax)
+                ledger_description += " (Price rounded for dev env)"
+
+            ledger_order_lines.append(
+                {
+                    "ledger_description": ledger_description,
+                    "quantity": line["quantity"],
+                    "price_incl_tax": str(price_incl_tax),
+                    "oracle_code": line["oracle_code"],
+                    "line_status": settings.PARKPASSES_LEDGER_DEFAULT_LINE_STATUS,
+                }
+            )
+
+        total_sales = sales["total_sales"].quantize(Decimal("0.01"))
+
+        if total_sales <= Decimal(0.00):
+            # No need to generate an invoice for this retailer group
+            return None
+
+        invoice_month = first_day_of_previous_month.strftime("%B")
+        invoice_year = first_day_of_previous_month.strftime("%Y")
+
+        commission_amount = (
+            Decimal(total_sales / 100).quantize(Decimal("0.01"))
+            * retailer_group.commission_percentage
+        )
+        commission_ledger_description = (
+            f"{retailer_group.commission_percentage}% "
+            f"Commission on Sales for the Month of {invoice_month} {invoice_year}"
         )
+        if settings.DEBUG:
+            # If in dev round the amounts so the payment gateway will work
+            commission_amount = int(commission_amount)
+            commission_ledger_description += " (Price rounded for dev env)"
+
+        ledger_order_lines.append(
+            {
+                "ledger_description": commission_ledger_description,
+                "quantity": 1,
+                "price_incl_tax": str(-abs(commission_amount)),
+                "oracle_code": retailer_group.commission_oracle_code,
+                "line_status": settings.PARKPASSES_LEDGER_DEFAULT_LINE_STATUS,
+            },
+        )
+        booking_reference = invoice_uuid
 
+        total_payable = Decimal(total_sales - commission_amount).quantize(
+            Decimal("0.01")
+        )
+
+        # Here we will generate the ledger invoices with Jason's new API
+        request = ledger_api_client_utils.FakeRequestSessionObj()
+        request.user = email_user
+
+        basket_params = {
+            "products": ledger_order_lines,
+            "vouchers": [],
+            "system": settings.PARKPASSES_PAYMENT_SYSTEM_ID,
+            "custom_basket": True,
+            "booking_reference": str(booking_reference),
+            "no_payment": True,
+            "organisation": retailer_group.ledger_organisation,
+        }
+
+        basket_hash = ledger_api_client_utils.create_basket_session(
+            request, request.user.id, basket_params
+        )
+        basket_hash = basket_hash.split("|")[0]
+        invoice_text = (
+            f"Park Pass Sales for the Month of {invoice_month} {invoice_year}"
+        )
+        return_preload_url = (
+            f"{settings.PARKPASSES_EXTERNAL_URL}"
+            f"/api/reports/ledger-api-retailer-invoice-success-callback/{invoice_uuid}"
+        )
+
+        future_invoice = ledger_api_client_utils.process_create_future_invoice(
+            basket_hash, invoice_text, return_preload_url
+        )
+
+        logger.info(future_invoice)
+
+        if 200 != future_invoice["status"]:
+            logger.error(
+                f"Failed to create future invoice for {retailer_group} with basket_hash "
+                f"{basket_hash}, invoice_text {invoice_text}, return_preload_url {return_preload_url}"
+            )
+            return None
+
+        data = future_invoice["data"]
+
+        order_number = data["order"]
+        basket_id = data["basket_id"]
+        invoice_reference = data["invoice"]
+
+        total_sales_by_pass_type_dict = sales["total_sales_by_pass_type"]
+        logger.info(f"sales by pass type dict: {total_sales_by_pass_type_dict}")
+
+        context = {
+            "organisation": settings.ORGANISATION,
+            "rg": retailer_group,
+            "total_sales_by_pass_type_dict": total_sales_by_pass_type_dict,
+            "date_report": first_day_of_previous_month,
+            "date_generated": today,
+            "commission_percentage": f"{retailer_group.commission_percentage}%",
+            "commission_amount": f"${commission_amount}",
+            "total_sales": f"${total_sales}",
+            "total_payable": f"${total_payable}",
+        }
+        # Each retailer group gets its own template object as they are rendered concurrently
+        report_template_docx = DocxTemplate(REPORT_TEMPLATE_PATH)
+        report_template_docx.render(context)
+        organisation_name = retailer_group.organisation["organisation_name"]
+        report_filename = f"Park Passes Report - {organisation_name} - {first_day_of_previous_month.date()} "
+        report_filename += f"{last_day_of_previous_month.date()}.docx"
+        report_path = f"{settings.RETAILER_GROUP_REPORT_ROOT}/{slugify(organisation_name)}/{report_filename}"
+        Path(
+            f"{settings.RETAILER_GROUP_REPORT_ROOT}/{slugify(organisation_name)}"
+        ).mkdir(parents=True, exist_ok=True)
+        report_template_docx.save(report_path)
+        report_pdf_path = os.path.splitext(report_path)[0] + ".pdf"
+        convert_to_pdf(report_path, report_pdf_path)
+
+        # If regenerating reports don't create a new report record for the same month and year
+        if Report.objects.filter(
+            retailer_group=retailer_group,
+            datetime_created__year=first_day_of_previous_month.year,
+            datetime_created__month=first_day_of_previous_month.month,
+        ).exists():
+            report = Report.objects.get(
+                retailer_group=retailer_group,
+                datetime_created__year=first_day_of_previous_month.year,
+                datetime_created__month=first_day_of_previous_month.month,
+            )
+        else:
+            report = Report.objects.create(
+                retailer_group=retailer_group,
+                uuid=invoice_uuid,
+                order_number=order_number,
+                basket_id=basket_id,
+                invoice_reference=invoice_reference,
+            )
+        report.report.name = report_pdf_path
+        report.save()
+
+        os.remove(report_path)
+
+        return report
+
+    def run_generate_invoice(self, *args):
+        try:
+            return self.generate_invoice(*args)
+        finally:
+            # Each thread has its own database connection
+            connection.close()
+
+    def handle(self, *args, **options):
         today = timezone.make_aware(
             datetime.combine(timezone.now(), datetime.min.time())
         )
@@ -68,234 +347,65 @@ class Command(BaseCommand):
             ledger_organisation=settings.PARKPASSES_DEFAULT_SOLD_VIA_ORGANISATION_ID
         )
 
-        for retailer_group in retailer_groups:
-            admin_users = retailer_group.retailer_group_users.filter(
-                active=True, is_admin=True
-            )
-            if 0 == admin_users.count():
-                logger.critical(
-                    f"Unable to generate monthly invoice for retailer group: {retailer_group}"
-                    " as there is no admin user to add to the invoice for this retailer group."
-                )
-                continue
-            retailer_group_user = admin_users.first()
-            email_user = retailer_group_user.emailuser
-            logger.info(email_user)  # TODO: remove this line
-            self.stdout.write(f"\tGenerating Invoice for {retailer_group}")
-            passes = Pass.objects.filter(
-                sold_via=retailer_group,
-                datetime_created__range=(
-                    first_day_of_previous_month,
-                    last_day_of_previous_month,
-                ),
-            ).order_by("datetime_created")
-
-            pass_count = passes.count()
-            self.stdout.write(f"\t -- Found {pass_count} Passes.\n\n")
-
-            if 0 == pass_count:
-                continue
-
-            invoice_uuid = uuid.uuid4()
-
-            pass_content_type = ContentType.objects.get_for_model(Pass)
-
-            MockRequest = namedtuple("MockRequest", ["user"])
-            request = MockRequest(user=email_user)
-
-            total_sales = Decimal(0.00)
-            ledger_order_lines = []
-            for park_pass in passes:
-                ledger_description = CartUtils.get_pass_purchase_description(park_pass)
-                price_incl_tax = park_pass.price_after_all_discounts
-                if settings.DEBUG:
-                    # If in dev round the amounts so the payment gateway will work
-                    price_incl_tax = int(price_incl_tax)
-                    ledger_description += " (Price rounded for dev env)"
-
-                ledger_order_lines.append(
-                    {
-                        "ledger_description": ledger_description,
-                        "quantity": 1,
-                        "price_incl_tax": str(price_incl_tax),
-                        "oracle_code": CartUtils.get_oracle_code(
-                            request, pass_content_type, park_pass.id
-                        ),
-                        "line_status": settings.PARKPASSES_LEDGER_DEFAULT_LINE_STATUS,
-                    }
-                )
-                total_sales += park_pass.price_after_concession_applied.quantize(
-                    Decimal("0.01")
-                )
-
-            total_sales = total_sales.quantize(Decimal("0.01"))
-
-            if total_sales <= Decimal(0.00):
-                # No need to generate an invoice for this retailer group
-                continue
-
-            invoice_month = first_day_of_previous_month.strftime("%B")
-            invoice_year = first_day_of_previous_month.strftime("%Y")
-
-            commission_amount = (
-                Decimal(total_sales / 100).quantize(Decimal("0.01"))
-                * retailer_group.commission_percentage
-            )
-            commission_ledger_description = (
-                f"{retailer_group.commission_percentage}% "
-                f"Commission on Sales for the Month of {invoice_month} {invoice_year}"
-            )
-            if settings.DEBUG:
-                # If in dev round the amounts so the payment gateway will work
-                commission_amount = int(commission_amount)
-                ledger_description += " (Price rounded for dev env)"
-                commission_ledger_description += " (Price rounded for dev env)"
-
-            ledger_order_lines.append(
-                {
-                    "ledger_description": commission_ledger_description,
-                    "quantity": 1,
-                    "price_incl_tax": str(-abs(commission_amount)),
-                    "oracle_code": retailer_group.commission_oracle_code,
-                    "line_status": settings.PARKPASSES_LEDGER_DEFAULT_LINE_STATUS,
-                },
-            )
-            booking_reference = invoice_uuid
-
-            total_payable = Decimal(total_sales - commission_amount).quantize(
-                Decimal("0.01")
-            )
-
-            # Here we will generate the ledger invoices with Jason's new API
-            request = ledger_api_client_utils.FakeRequestSessionObj()
-            request.user = email_user
-
-            basket_params = {
-                "products": ledger_order_lines,
-                "vouchers": [],
-                "system": settings.PARKPASSES_PAYMENT_SYSTEM_ID,
-                "custom_basket": True,
-                "booking_reference": str(booking_reference),
-                "no_payment": True,
-                "organisation": retailer_group.ledger_organisation,
-            }
-
-            basket_hash = ledger_api_client_utils.create_basket_session(
-                request, request.user.id, basket_params
-            )
-            basket_hash = basket_hash.split("|")[0]
-            invoice_text = (
-                f"Park Pass Sales for the Month of {invoice_month} {invoice_year}"
-            )
-            return_preload_url = (
-                f"{settings.PARKPASSES_EXTERNAL_URL}"
-                f"/api/reports/ledger-api-retailer-invoice-success-callback/{invoice_uuid}"
-            )
-
-            future_invoice = ledger_api_client_utils.process_create_future_invoice(
-                basket_hash, invoice_text, return_preload_url
-            )
-
-            logger.info(future_invoice)
+        passes = Pass.objects.filter(
+            sold_via__in=retailer_groups,
+            in_cart=False,
+            datetime_created__range=(
+                first_day_of_previous_month,
+                last_day_of_previous_month,
+            ),
+        )
+        self.populate_missing_stored_prices(passes)
+        sales_by_retailer_group = get_sales_by_retailer_group(passes)
+        admin_users = self.get_admin_users(retailer_groups)
+
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+            futures = {}
+            for retailer_group in retailer_groups:
+                if retailer_group.id not in admin_users:
+                    logger.critical(
+                        f"Unable to generate monthly invoice for retailer group: {retailer_group}"
+                        " as there is no admin user to add to the invoice for this retailer group."
+                    )
+                    continue
 
-            if 200 != future_invoice["status"]:
-                logger.error(
-                    f"Failed to create future invoice for {retailer_group} with basket_hash "
-                    f"{basket_hash}, invoice_text {invoice_text}, return_preload_url {return_preload_url}"
+                sales = sales_by_retailer_group.get(retailer_group.id)
+                pass_count = sales["pass_count"] if sales else 0
+                self.stdout.write(
+                    f"\tGenerating Invoice for {retailer_group}"
+                    f"\n\t -- Found {pass_count} Passes.\n\n"
                 )
-                continue
-
-            data = future_invoice["data"]
-
-            order_number = data["order"]
-            basket_id = data["basket_id"]
-            invoice_reference = data["invoice"]
-
-            passes_by_type = Pass.objects.filter(
-                sold_via=retailer_group,
-                datetime_created__range=(
+                if 0 == pass_count:
+                    continue
+
+                future = executor.submit(
+                    self.run_generate_invoice,
+                    retailer_group,
+                    admin_users[retailer_group.id].emailuser,
+                    sales,
                     first_day_of_previous_month,
                     last_day_of_previous_month,
-                ),
-            ).order_by("option__pricing_window__pass_type")
-
-            # We have to build a dict of pass types and their counts and total sales
-            # because getting the price after all discounts is either difficult or impossible
-            # to do with the django ORM or even pure SQL
-            total_sales_by_pass_type_dict = {}
-            for park_pass in passes_by_type:
-                pass_type = park_pass.option.pricing_window.pass_type.display_name
-                if pass_type not in total_sales_by_pass_type_dict:
-                    total_sales_by_pass_type_dict[pass_type] = {}
-                    total_sales_by_pass_type_dict[pass_type]["count"] = 0
-                    total_sales_by_pass_type_dict[pass_type]["total_sales"] = Decimal(
-                        0.00
-                    )
-                total_sales_by_pass_type_dict[pass_type]["count"] += 1
-                total_sales_by_pass_type_dict[pass_type][
-                    "total_sales"
-                ] += park_pass.price_after_all_discounts
-
-            logger.info(f"sales by pass type dict: {total_sales_by_pass_type_dict}")
-
-            context = {
-                "organisation": organisation,
-                "rg": retailer_group,
-                "total_sales_by_pass_type_dict": total_sales_by_pass_type_dict,
-                "date_report": first_day_of_previous_month,
-                "date_generated": today,
-                "commission_percentage": f"{retailer_group.commission_percentage}%",
-                "commission_amount": f"${commission_amount}",
-                "total_sales": f"${total_sales}",
-                "total_payable": f"${total_payable}",
-            }
-            report_template_docx.render(context)
-            organisation_name = retailer_group.organisation["organisation_name"]
-            report_filename = f"Park Passes Report - {organisation_name} - {first_day_of_previous_month.date()} "
-            report_filename += f"{last_day_of_previous_month.date()}.docx"
-            report_path = f"{settings.RETAILER_GROUP_REPORT_ROOT}/{slugify(organisation_name)}/{report_filename}"
-            Path(
-                f"{settings.RETAILER_GROUP_REPORT_ROOT}/{slugify(organisation_name)}"
-            ).mkdir(parents=True, exist_ok=True)
-            report_template_docx.save(report_path)
-            subprocess.run(
-                [
-                    "libreoffice",
-                    "--headless",
-                    "--convert-to",
-                    "pdf",
-                    report_path,
-                    "--outdir",
-                    f"{settings.RETAILER_GROUP_REPORT_ROOT}/{slugify(organisation_name)}",
-                ]
-            )
-
-            # If regenerating reports don't create a new report record for the same month and year
-            if Report.objects.filter(
-                retailer_group=retailer_group,
-                datetime_created__year=first_day_of_previous_month.year,
-                datetime_created__month=first_day_of_previous_month.month,
-            ).exists():
-                report = Report.objects.get(
-                    retailer_group=retailer_group,
-                    datetime_created__year=first_day_of_previous_month.year,
-                    datetime_created__month=first_day_of_previous_month.month,
-                )
-            else:
-                report = Report.objects.create(
-                    retailer_group=retailer_group,
-                    uuid=invoice_uuid,
-                    order_number=order_number,
-                    basket_id=basket_id,
-                    invoice_reference=invoice_reference,
-                )
-            report.report.name = report_path.replace("docx", "pdf")
-            report.save()
-
-            os.remove(report_path)
-
-            self.stdout.write(
-                self.style.SUCCESS(
-                    f"\tGenerated Report: {os.path.basename(report.report.name)}\n"
+                    today,
                 )
-            )
+                futures[future] = retailer_group
+
+            for future in as_completed(futures):
+                retailer_group = futures[future]
+                try:
+                    report = future.result()
+                except Exception as e:
+                    logger.exception(
+                        f"Failed to generate monthly invoice for retailer group: {retailer_group}"
+                    )
+                    self.stdout.write(
+                        self.style.ERROR(
+                            f"\tFailed to generate invoice for {retailer_group}: {e}\n"
+                        )
+                    )
+                    continue
+                if report:
+                    self.stdout.write(
+                        self.style.SUCCESS(
+                            f"\tGenerated Report: {os.path.basename(report.report.name)}\n"
+                        )
+                    )
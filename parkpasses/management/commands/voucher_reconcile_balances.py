@@ -0,0 +1,79 @@
+"""
+This management command recalculates the balance of every voucher from its amount and voucher
+transactions (in one aggregate query) and reports the vouchers whose stored balance has drifted
+from it.
+
+Usage: ./manage.sh voucher_reconcile_balances
+       ./manage.sh voucher_reconcile_balances --fix
+        (also replaces the stored balances that have drifted with the recalculated balances)
+
+"""
+import logging
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce
+
+from parkpasses.components.vouchers.models import Voucher
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Reports (and optionally fixes) vouchers whose stored balance doesn't match their transactions."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fix",
+            action="store_true",
+            help="Replace the stored balances that have drifted with the recalculated balances.",
+        )
+
+    def get_drifted_vouchers(self, vouchers):
+        return (
+            vouchers.annotate(
+                calculated_balance=F("amount")
+                + Coalesce(
+                    Sum(F("transactions__credit") - F("transactions__debit")),
+                    Value(Decimal("0.00")),
+                    output_field=DecimalField(max_digits=7, decimal_places=2),
+                )
+            )
+            .exclude(balance=F("calculated_balance"))
+            .order_by("id")
+            .values("id", "voucher_number", "balance", "calculated_balance")
+        )
+
+    def handle(self, *args, **options):
+        drifted_vouchers = list(self.get_drifted_vouchers(Voucher.objects.all()))
+        for drifted_voucher in drifted_vouchers:
+            logger.warning(
+                f"Voucher {drifted_voucher['voucher_number']} (id {drifted_voucher['id']}) has a stored "
+                f"balance of {drifted_voucher['balance']} but its transactions add up to a balance "
+                f"of {drifted_voucher['calculated_balance']}."
+            )
+        self.stdout.write(
+            f"Found {len(drifted_vouchers)} vouchers with drifted balances."
+        )
+
+        if not drifted_vouchers or not options["fix"]:
+            return
+
+        fixed = 0
+        with transaction.atomic():
+            voucher_ids = [
+                drifted_voucher["id"] for drifted_voucher in drifted_vouchers
+            ]
+            # Lock the vouchers and recalculate so a transaction saved in the meantime isn't lost
+            Voucher.lock_balances(voucher_ids)
+            for drifted_voucher in self.get_drifted_vouchers(
+                Voucher.objects.filter(id__in=voucher_ids)
+            ):
+                Voucher.objects.filter(pk=drifted_voucher["id"]).update(
+                    balance=drifted_voucher["calculated_balance"]
+                )
+                fixed += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Fixed the balance of {fixed} vouchers."))
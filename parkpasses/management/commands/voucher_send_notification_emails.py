@@ -11,6 +11,9 @@ import logging
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 
+from parkpasses.components.emails.emails import BatchEmailSender
+from parkpasses.components.main.utils import log_communications
+from parkpasses.components.vouchers.emails import VoucherEmails
 from parkpasses.components.vouchers.models import Voucher
 
 logger = logging.getLogger(__name__)
@@ -26,10 +29,40 @@ class Command(BaseCommand):
             help="Add the test flag will output what emails would be sent without actually sending them.",
         )
 
+    def send_batch(
+        self, batch, vouchers, sent_status, not_sent_status, failed_voucher_ids
+    ):
+        """Sends the batch and records whether each voucher's emails were delivered (the vouchers
+        whose emails couldn't be added to the batch were not delivered)"""
+        batch_messages = batch.send()
+        log_communications(batch_messages, "email")
+
+        delivered = {
+            voucher.id: voucher.id not in failed_voucher_ids for voucher in vouchers
+        }
+        for batch_message in batch_messages:
+            if not batch_message.sent:
+                delivered[batch_message.instance.id] = False
+        for voucher in vouchers:
+            if delivered[voucher.id]:
+                voucher.processing_status = sent_status
+                logger.info(
+                    f"Notification email sent for Voucher: {voucher}",
+                )
+            else:
+                voucher.processing_status = not_sent_status
+                logger.error(
+                    f"Unable to send notification email for Voucher: {voucher}",
+                )
+        Voucher.objects.bulk_update(vouchers, ["processing_status"])
+        return len([voucher_id for voucher_id, sent in delivered.items() if sent])
+
     def handle(self, *args, **options):
         """First: Attempt to resend any vouchers that haven't had success being sent to the purchaser"""
-        vouchers = Voucher.objects.filter(
-            processing_status__in=[Voucher.NEW, Voucher.NOT_DELIVERED_TO_PURCHASER],
+        vouchers = list(
+            Voucher.objects.filter(
+                processing_status__in=[Voucher.NEW, Voucher.NOT_DELIVERED_TO_PURCHASER],
+            )
         )
         if options["test"]:
             self.stdout.write(
@@ -37,28 +70,48 @@ class Command(BaseCommand):
                     f"Found {len(vouchers)} vouchers that still need to be sent to the purchaser"
                 )
             )
-        for voucher in vouchers:
-            if options["test"]:
+            for voucher in vouchers:
                 self.stdout.write(
                     self.style.SUCCESS(
                         f"TEST: pretending to call send_voucher_purchase_notification_email on Voucher: {voucher}"
                     )
                 )
-            else:
-                voucher.send_voucher_purchase_notification_email()
-                voucher.save()
-                logger.info(
-                    f"Notification email sent to recipient and purchser of Voucher: {voucher}",
+        elif vouchers:
+            batch = BatchEmailSender()
+            failed_voucher_ids = set()
+            for voucher in vouchers:
+                try:
+                    VoucherEmails.send_voucher_purchaser_purchased_notification_email(
+                        voucher, batch=batch
+                    )
+                except Exception as e:
+                    failed_voucher_ids.add(voucher.id)
+                    logger.exception(
+                        f"Unable to create the purchase notification email for Voucher: {voucher}: {e}"
+                    )
+            sent = self.send_batch(
+                batch,
+                vouchers,
+                Voucher.PURCHASER_NOTIFIED,
+                Voucher.NOT_DELIVERED_TO_PURCHASER,
+                failed_voucher_ids,
+            )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Sent purchase notification emails for {sent} of {len(vouchers)} vouchers."
                 )
+            )
 
         """ Second: Send any vouchers that to recipients that are due to be sent today """
         today = timezone.now().date()
-        vouchers = Voucher.objects.exclude(in_cart=True).filter(
-            datetime_to_email__date=today,
-            processing_status__in=[
-                Voucher.PURCHASER_NOTIFIED,
-                Voucher.NOT_DELIVERED_TO_RECIPIENT,
-            ],
+        vouchers = list(
+            Voucher.objects.exclude(in_cart=True).filter(
+                datetime_to_email__date=today,
+                processing_status__in=[
+                    Voucher.PURCHASER_NOTIFIED,
+                    Voucher.NOT_DELIVERED_TO_RECIPIENT,
+                ],
+            )
         )
         if options["test"]:
             self.stdout.write(
@@ -66,15 +119,42 @@ class Command(BaseCommand):
                     f"Found {len(vouchers)} vouchers that would be sent to their recipients today {today}"
                 )
             )
-        for voucher in vouchers:
-            if options["test"]:
+            for voucher in vouchers:
                 self.stdout.write(
                     self.style.SUCCESS(
                         f"TEST: pretending to call send_voucher_sent_notification_emails on Voucher: {voucher}"
                     )
                 )
-            else:
-                voucher.send_voucher_sent_notification_emails()
-                logger.info(
-                    f"Notification email sent to recipient and purchser of Voucher: {voucher}",
+        elif vouchers:
+            batch = BatchEmailSender()
+            failed_voucher_ids = set()
+            for voucher in vouchers:
+                try:
+                    VoucherEmails.send_voucher_recipient_notification_email(
+                        voucher, batch=batch
+                    )
+                except Exception as e:
+                    failed_voucher_ids.add(voucher.id)
+                    logger.exception(
+                        f"Unable to create the recipient notification email for Voucher: {voucher}: {e}"
+                    )
+                try:
+                    VoucherEmails.send_voucher_purchaser_sent_notification_email(
+                        voucher, batch=batch
+                    )
+                except Exception as e:
+                    logger.exception(
+                        f"Unable to create the sent notification email to the purchaser for Voucher: {voucher}: {e}"
+                    )
+            sent = self.send_batch(
+                batch,
+                vouchers,
+                Voucher.DELIVERED_TO_RECIPIENT,
+                Voucher.NOT_DELIVERED_TO_RECIPIENT,
+                failed_voucher_ids,
+            )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Sent notification emails to the recipients of {sent} of {len(vouchers)} vouchers."
                 )
+            )
@@ -0,0 +1,42 @@
+# Generated by Django 3.2.16 on 2023-02-09 10:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parkpasses', '0160_alter_passtype_oracle_code'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pass',
+            name='pdf_status',
+            field=models.CharField(blank=True, choices=[('PE', 'Pending'), ('GE', 'Generated'), ('FA', 'Failed')], max_length=2, null=True),
+        ),
+        migrations.CreateModel(
+            name='PassPdfJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('QU', 'Queued'), ('PR', 'Processing'), ('CO', 'Completed'), ('FA', 'Failed')], default='QU', max_length=2)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('datetime_created', models.DateTimeField(auto_now_add=True)),
+                ('datetime_updated', models.DateTimeField(auto_now=True)),
+                ('datetime_completed', models.DateTimeField(blank=True, null=True)),
+                ('park_pass', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='pdf_job', to='parkpasses.pass')),
+            ],
+            options={
+                'verbose_name': 'Pass PDF Job',
+                'verbose_name_plural': 'Pass PDF Jobs',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='passpdfjob',
+            index=models.Index(fields=['status', 'run_after'], name='parkpasses__status_a71747_idx'),
+        ),
+    ]
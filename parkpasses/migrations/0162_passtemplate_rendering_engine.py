@@ -0,0 +1,18 @@
+# Generated by Django 3.2.16 on 2023-02-10 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parkpasses', '0161_pass_pdf_status_passpdfjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='passtemplate',
+            name='rendering_engine',
+            field=models.CharField(choices=[('LO', 'LibreOffice (convert every pass)'), ('PM', 'PyMuPDF (compile template once then stamp every pass)')], default='LO', max_length=2),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.2.16 on 2023-02-14 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parkpasses', '0162_passtemplate_rendering_engine'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pass',
+            name='concession_discount_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=7, null=True),
+        ),
+        migrations.AddField(
+            model_name='pass',
+            name='discount_code_discount_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=7, null=True),
+        ),
+        migrations.AddField(
+            model_name='pass',
+            name='voucher_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=7, null=True),
+        ),
+        migrations.AddField(
+            model_name='pass',
+            name='price_paid',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=7, null=True),
+        ),
+        migrations.AddField(
+            model_name='pass',
+            name='gst_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=7, null=True),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.16 on 2023-02-21 09:41
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_codes_generated_field(apps, schema_editor):
+    DiscountCodeBatch = apps.get_model("parkpasses", "DiscountCodeBatch")
+    discount_code_batches = DiscountCodeBatch.objects.annotate(
+        discount_codes_count=Count("discount_codes")
+    )
+    for discount_code_batch in discount_code_batches:
+        discount_code_batch.codes_generated = discount_code_batch.discount_codes_count
+        discount_code_batch.save(update_fields=["codes_generated"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parkpasses', '0163_pass_stored_prices'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='discountcodebatch',
+            name='codes_to_generate',
+            field=models.PositiveIntegerField(),
+        ),
+        migrations.AddField(
+            model_name='discountcodebatch',
+            name='codes_generated',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='discountcodebatch',
+            name='generation_status',
+            field=models.CharField(choices=[('QU', 'Queued'), ('GE', 'Generating'), ('CO', 'Completed'), ('FA', 'Failed')], default='CO', max_length=2),
+        ),
+        migrations.AddField(
+            model_name='discountcodebatch',
+            name='generation_error',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.RunPython(populate_codes_generated_field, migrations.RunPython.noop),
+    ]
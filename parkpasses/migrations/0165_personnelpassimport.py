@@ -0,0 +1,37 @@
+# Generated by Django 3.2.16 on 2023-02-23 11:05
+
+import django.core.files.storage
+from django.db import migrations, models
+
+import parkpasses.components.passes.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parkpasses', '0164_discountcodebatch_generation_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PersonnelPassImport',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_by', models.IntegerField()),
+                ('personnel_data_file', models.FileField(max_length=500, storage=django.core.files.storage.FileSystemStorage(base_url='/protected_media', location='/home/oak/dev/parkpasses/park-passes/protected_media'), upload_to=parkpasses.components.passes.models.personnel_pass_import_file_path)),
+                ('status', models.CharField(choices=[('QU', 'Queued'), ('PR', 'Processing'), ('CO', 'Completed'), ('FA', 'Failed')], default='QU', max_length=2)),
+                ('data_row_count', models.PositiveIntegerField(default=0)),
+                ('rows_processed', models.PositiveIntegerField(default=0)),
+                ('park_passes_created', models.PositiveIntegerField(default=0)),
+                ('park_passes_duplicates', models.PositiveIntegerField(default=0)),
+                ('errors', models.TextField(blank=True, null=True)),
+                ('datetime_created', models.DateTimeField(auto_now_add=True)),
+                ('datetime_updated', models.DateTimeField(auto_now=True)),
+                ('datetime_completed', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Personnel Pass Import',
+                'verbose_name_plural': 'Personnel Pass Imports',
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.17 on 2023-03-06 10:12
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_voucher_balance_field(apps, schema_editor):
+    Voucher = apps.get_model("parkpasses", "Voucher")
+    VoucherTransaction = apps.get_model("parkpasses", "VoucherTransaction")
+    transactions_balance = (
+        VoucherTransaction.objects.filter(voucher=OuterRef("pk"))
+        .order_by()
+        .values("voucher")
+        .annotate(transactions_balance=Sum(F("credit") - F("debit")))
+        .values("transactions_balance")
+    )
+    Voucher.objects.update(
+        balance=F("amount")
+        + Coalesce(
+            Subquery(
+                transactions_balance,
+                output_field=DecimalField(max_digits=7, decimal_places=2),
+            ),
+            Value(Decimal("0.00")),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parkpasses', '0165_personnelpassimport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voucher',
+            name='balance',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), help_text='The amount of the voucher plus the credits less the debits of its transactions.             This is kept up to date as voucher transactions are saved and deleted.', max_digits=7),
+        ),
+        migrations.RunPython(populate_voucher_balance_field, migrations.RunPython.noop),
+    ]
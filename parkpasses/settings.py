@@ -94,6 +94,10 @@ MIDDLEWARE_CLASSES += [
 ]
 MIDDLEWARE = MIDDLEWARE_CLASSES
 MIDDLEWARE_CLASSES = None
+# First so that the queries run by the other middleware are recorded as well
+MIDDLEWARE.insert(
+    0, "parkpasses.components.main.middleware.QueryInstrumentationMiddleware"
+)
 
 SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
 
@@ -126,19 +130,45 @@ TEMPLATES[0]["DIRS"].append(
     os.path.join(BASE_DIR, "parkpasses", "components", "emails", "templates")
 )
 USE_DUMMY_CACHE = env("USE_DUMMY_CACHE", False)
+# When set the shared cache tier is kept in redis so it is shared between containers
+CACHE_REDIS_URL = env("CACHE_REDIS_URL", None)
+# The most seconds a value is kept in the memory of a process before being read from the shared tier again
+CACHE_L1_TIMEOUT = env("CACHE_L1_TIMEOUT", 10)
 if USE_DUMMY_CACHE:
     CACHES = {
         "default": {
             "BACKEND": "django.core.cache.backends.dummy.DummyCache",
         },
+        "shared": {
+            "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+        },
     }
 else:
-    CACHES = {
-        "default": {
+    if CACHE_REDIS_URL:
+        SHARED_CACHE = {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": CACHE_REDIS_URL,
+            "OPTIONS": {
+                "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            },
+        }
+    else:
+        SHARED_CACHE = {
             "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
             "LOCATION": os.path.join(BASE_DIR, "parkpasses", "cache"),
+        }
+    CACHES = {
+        "default": {
+            "BACKEND": "parkpasses.components.main.cache.TieredCache",
+            "OPTIONS": {
+                "L2": "shared",
+                "L1_TIMEOUT": CACHE_L1_TIMEOUT,
+            },
         },
+        "shared": SHARED_CACHE,
     }
+# Sessions are read from the shared tier directly so a change made by one process is seen by all of them
+SESSION_CACHE_ALIAS = "shared"
 
 STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 STATICFILES_DIRS.extend(
@@ -233,6 +263,8 @@ if CONSOLE_EMAIL_BACKEND:
     EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 
 CRON_EMAIL_FILE_NAME = "cron_email.log"
+# The number of cron tasks (see the cron_tasks management command) that can run at the same time
+CRON_TASKS_CONCURRENCY = env("CRON_TASKS_CONCURRENCY", 3)
 
 # Add a debug level logger for development
 if DEBUG:
@@ -355,6 +387,13 @@ CACHE_KEY_GROUP_IDS = "{}-{}-user-ids"
 
 CACHE_KEY_LEDGER_ORGANISATION = "ledger-organisation-{}"
 
+CACHE_KEY_ORACLE_CODES_VERSION = "oracle-codes-version"
+CACHE_KEY_PRICING_WINDOWS_VERSION = "pricing-windows-version"
+CACHE_KEY_POSTCODE_PARK_GROUPS_VERSION = "postcode-park-groups-version"
+
+CACHE_KEY_NAMESPACE_VERSION = "namespace-{}-version"
+CACHE_NAMESPACE_USER_PERMISSIONS = "user-{}-permissions"
+
 CACHE_SYSTEM_CHECK_FOR = 60  # 1 minute
 
 PROTECTED_MEDIA_ROOT = env(
@@ -446,9 +485,17 @@ PASS_TEMPLATE_DEFAULT_IMAGE_PATH = (
     f"{STATIC_ROOT}/parkpasses/img/default-pass-template-image.png"
 )
 
+PASS_TEMPLATE_COMPILED_ROOT = env(
+    "PASS_TEMPLATE_COMPILED_ROOT",
+    os.path.join(PROTECTED_MEDIA_ROOT, "parkpasses", "PassTemplate", "compiled"),
+)
+
 PASS_VEHICLE_REGO_REMINDER_DAYS_PRIOR = 7
 PASS_REMINDER_DAYS_PRIOR = 7
 
+# The number of automatic renewal payments that are processed at the same time
+PASS_AUTORENEWAL_CONCURRENCY = env("PASS_AUTORENEWAL_CONCURRENCY", 4)
+
 PRICING_WINDOW_DEFAULT_NAME = "Default"
 
 RAC_DISCOUNT_PERCENTAGE = env("RAC_DISCOUNT_PERCENTAGE", 50)
@@ -459,6 +506,89 @@ UNLIMITED_USES_TEXT = "Unlimited"
 
 USE_DUMMY_QR_CODE_DATA = env("USE_DUMMY_QR_CODE_DATA", True)
 
+""" ==================== LIBREOFFICE CONVERTER POOL ======================== """
+
+LIBREOFFICE_BINARY = env("LIBREOFFICE_BINARY", "libreoffice")
+# The number of long running soffice processes per python process (0 disables the pool)
+LIBREOFFICE_POOL_SIZE = env("LIBREOFFICE_POOL_SIZE", 2)
+LIBREOFFICE_STARTUP_TIMEOUT_SECONDS = env("LIBREOFFICE_STARTUP_TIMEOUT_SECONDS", 30)
+LIBREOFFICE_CONVERSION_TIMEOUT_SECONDS = env(
+    "LIBREOFFICE_CONVERSION_TIMEOUT_SECONDS", 60
+)
+# soffice leaks memory over time so each process is restarted after this many conversions
+LIBREOFFICE_RECYCLE_AFTER_CONVERSIONS = env(
+    "LIBREOFFICE_RECYCLE_AFTER_CONVERSIONS", 250
+)
+
+""" ==================== PASS PDF JOB QUEUE ======================== """
+
+PASS_PDF_JOB_MAX_ATTEMPTS = env("PASS_PDF_JOB_MAX_ATTEMPTS", 5)
+PASS_PDF_JOB_RETRY_DELAY_SECONDS = env("PASS_PDF_JOB_RETRY_DELAY_SECONDS", 60)
+# Jobs left in processing for longer than this are assumed to belong to a dead worker
+PASS_PDF_JOB_STALE_AFTER_SECONDS = env("PASS_PDF_JOB_STALE_AFTER_SECONDS", 60 * 15)
+PASS_PDF_JOB_BATCH_SIZE = env("PASS_PDF_JOB_BATCH_SIZE", 10)
+PASS_PDF_JOB_POLL_INTERVAL_SECONDS = env("PASS_PDF_JOB_POLL_INTERVAL_SECONDS", 5)
+
+""" ==================== QUERY INSTRUMENTATION ======================== """
+
+# Logs the queries, database time and render time of each request and adds a Server-Timing header
+QUERY_INSTRUMENTATION_ENABLED = env("QUERY_INSTRUMENTATION_ENABLED", False)
+# Raise QueryBudgetExceeded rather than log a warning when a view goes over its query_budget
+QUERY_BUDGET_RAISE = env("QUERY_BUDGET_RAISE", False)
+# The number of repeated queries included in each log line
+QUERY_INSTRUMENTATION_DUPLICATES_LOGGED = env(
+    "QUERY_INSTRUMENTATION_DUPLICATES_LOGGED", 5
+)
+
+""" ==================== PERSONNEL PASS IMPORTS ======================== """
+
+# The number of rows of a personnel pass data file checked and inserted at a time
+PERSONNEL_PASS_IMPORT_CHUNK_SIZE = env("PERSONNEL_PASS_IMPORT_CHUNK_SIZE", 500)
+# Imports left processing for longer than this are assumed to belong to a dead worker
+PERSONNEL_PASS_IMPORT_STALE_AFTER_SECONDS = env(
+    "PERSONNEL_PASS_IMPORT_STALE_AFTER_SECONDS", 60 * 15
+)
+PERSONNEL_PASS_IMPORT_POLL_INTERVAL_SECONDS = env(
+    "PERSONNEL_PASS_IMPORT_POLL_INTERVAL_SECONDS", 5
+)
+
+""" ==================== DISCOUNT CODE GENERATION ======================== """
+
+# The number of codes drawn, checked for uniqueness and inserted at a time
+DISCOUNT_CODE_GENERATION_BLOCK_SIZE = env("DISCOUNT_CODE_GENERATION_BLOCK_SIZE", 1000)
+# Batches that need more codes than this are generated by the discount_codes_generate_codes worker
+DISCOUNT_CODE_GENERATION_BACKGROUND_THRESHOLD = env(
+    "DISCOUNT_CODE_GENERATION_BACKGROUND_THRESHOLD", 1000
+)
+# Batches left generating for longer than this are assumed to belong to a dead worker
+DISCOUNT_CODE_GENERATION_STALE_AFTER_SECONDS = env(
+    "DISCOUNT_CODE_GENERATION_STALE_AFTER_SECONDS", 60 * 15
+)
+DISCOUNT_CODE_GENERATION_POLL_INTERVAL_SECONDS = env(
+    "DISCOUNT_CODE_GENERATION_POLL_INTERVAL_SECONDS", 5
+)
+
+""" ==================== EXPORTS ======================== """
+
+# The number of rows read from the database at a time when exporting to csv / xlsx
+EXPORT_CHUNK_SIZE = env("EXPORT_CHUNK_SIZE", 2000)
+# xlsx exports larger than this (in bytes) are written to disk rather than kept in memory
+EXPORT_XLSX_SPOOL_MAX_SIZE = env("EXPORT_XLSX_SPOOL_MAX_SIZE", 1024 * 1024 * 10)
+
+""" ==================== DATATABLES ======================== """
+
+# Tables the database planner estimates are larger than this are not counted exactly
+DATATABLES_EXACT_COUNT_THRESHOLD = env("DATATABLES_EXACT_COUNT_THRESHOLD", 100000)
+# The largest page a datatables list will return (including length=-1 "show all")
+DATATABLES_MAX_PAGE_SIZE = env("DATATABLES_MAX_PAGE_SIZE", 500)
+
+""" ==================== BATCH EMAILS ======================== """
+
+# The number of messages that are rendered at a time when sending emails in bulk
+EMAIL_BATCH_CHUNK_SIZE = env("EMAIL_BATCH_CHUNK_SIZE", 100)
+# The number of threads that render the messages
+EMAIL_BATCH_RENDER_WORKERS = env("EMAIL_BATCH_RENDER_WORKERS", 4)
+
 """ ==================== USER ACTIONS ======================== """
 
 
@@ -507,6 +637,7 @@ PARKPASSES_LEDGER_DEFAULT_LINE_STATUS = 1
 
 PARKPASSES_VOUCHER_PURCHASE_DESCRIPTION = "Voucher Purchase:"
 PARKPASSES_PASS_PURCHASE_DESCRIPTION = "Park Pass Purchase:"
+PARKPASSES_PASS_SALES_DESCRIPTION = "Park Pass Sales:"
 
 PARKPASSES_RAC_DISCOUNT_APPLIED_DESCRIPTION = "RAC Discount Applied:"
 PARKPASSES_CONCESSION_APPLIED_DESCRIPTION = "Concession Discount:"
@@ -13,3 +13,7 @@ os.environ.setdefault("BASE_DIR", BASE_DIR)
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "parkpasses.settings")
 application = get_wsgi_application()
+
+from parkpasses.components.parks.postcodes import PostcodeParkGroupIndex  # noqa: E402
+
+PostcodeParkGroupIndex.warm()
@@ -12,6 +12,15 @@ if [ $status -ne 0  ]; then
         exit $status
     fi
 
+    # Start the park pass pdf worker
+    python manage.py pass_process_pdf_jobs >> /app/logs/pass_process_pdf_jobs.log 2>&1 &
+
+    # Start the personnel pass import worker
+    python manage.py pass_process_personnel_pass_imports >> /app/logs/pass_process_personnel_pass_imports.log 2>&1 &
+
+    # Start the discount code generation worker
+    python manage.py discount_codes_generate_codes >> /app/logs/discount_codes_generate_codes.log 2>&1 &
+
     # Start the second process
     gunicorn parkpasses.wsgi --bind :8080 --config /app/gunicorn.ini
     status=$?